@@ -30,10 +30,64 @@ WS_BD_RANKING_CPF = "BD Ranking CPF"
 # Pipeline de ranking: orçamento global da chamada + TTL do cache externo.
 RANKING_PIPELINE_BUDGET_S = 9.5
 RANKING_CACHE_TTL_HOURS = 24
+# Cache local de ranking: LRU em processo + SQLite (DV_RANKING_SQLITE_PATH), ambos limitados.
+# Negativos (NÃO ELEGÍVEL, CPF sem registo) expiram cedo para não esconder mudanças no Risk3.
+RANKING_MEM_MAX_ENTRADAS = 5000
+RANKING_SQLITE_MAX_ENTRADAS = 100_000
+RANKING_NEGATIVO_TTL_S = 900.0
+# Janela dos percentis de latência por etapa do pipeline (_RANKING_METRICAS).
+RANKING_METRICAS_JANELA_S = 3600.0
+# Disjuntores por dependência (Risk3, Salesforce): falhas seguidas para abrir e resfriamento.
+RANKING_DISJUNTOR_FALHAS = 5
+RANKING_DISJUNTOR_RESFRIAMENTO_S = 30.0
+# Pré-busca especulativa ao editar o CPF (sem criar registos): validade do resultado,
+# threads dedicadas e espera máxima da classificação explícita por uma pré-busca em voo.
+RANKING_PREFETCH_TTL_S = 120.0
+RANKING_PREFETCH_MAX_WORKERS = 4
+RANKING_PREFETCH_ESPERA_S = 1.5
+# Espelho local de CPF → Ranking__c exportado pela Bulk API 2.0 (DV_RANKING_EXPORT_PATH):
+# hora local da exportação diária (delta por SystemModstamp), prazo do job e página de resultados.
+RANKING_EXPORT_HORA = 3
+RANKING_EXPORT_JOB_TIMEOUT_S = 900.0
+RANKING_EXPORT_PAGINA = 50_000
+# Exportação completa (substitui o índice e remove contas purgadas) a cada N dias.
+RANKING_EXPORT_COMPLETO_DIAS = 7
+# Ids por chamada do sObject Collections (limite da API para create/update/delete).
+SF_COLLECTIONS_MAX = 200
+# Cards da Recomendação: quantos por página e fragmentos HTML guardados em processo.
+RECOMENDACAO_CARDS_POR_PAGINA = 12
+RECOMENDACAO_CARDS_CACHE_MAX = 4096
+# Pipeline de imagens estáticas: caixa máxima em px de cada uso (2x o tamanho exibido,
+# para ecrãs densos) e qualidade WebP das fotografias.
+ASSET_LOGO_TOPO_PX = (600, 144)
+ASSET_FUNDO_PX = (1920, 1280)
+ASSET_FAVICON_PX = (64, 64)
+ASSET_PDF_LOGO_PX = (256, 256)
+ASSET_WEBP_QUALIDADE = 80
+# Fila de e-mail SMTP (thread dedicado): tentativas por mensagem, backoff base entre elas,
+# timeout de socket, sessão ociosa antes de fechar e estados/dead letter mantidos em memória.
+EMAIL_OUTBOX_TENTATIVAS = 4
+EMAIL_OUTBOX_BACKOFF_S = 2.0
+EMAIL_OUTBOX_TIMEOUT_S = 30.0
+EMAIL_OUTBOX_SESSAO_OCIOSA_S = 120.0
+EMAIL_OUTBOX_ESTADOS_MAX = 500
+EMAIL_OUTBOX_DEAD_LETTER_MAX = 100
+# Índice CPF → linha da aba BD Ranking CPF mantido em processo (recarga completa só após este TTL).
+RANKING_SHEETS_INDEX_TTL_S = 600.0
 RANKING_UI_POLL_FAST_S = 1.0
 RANKING_UI_POLL_SLOW_S = 2.0
 RANKING_UI_POLL_FAST_WINDOW_S = 90.0
 RANKING_DEBUG_LOG_MAX = 40
+# Com eventos de ranking ativos (DV_RANKING_EVENTOS), a SOQL do poll vira só rede de segurança.
+RANKING_EVENTOS_FALLBACK_POLL_S = 30.0
+# Com eventos ativos, o fragmento de espera só redesenha a este intervalo (o evento já
+# chegou ao mapa do processo; não há consulta a fazer a cada segundo).
+RANKING_UI_EVENTOS_RERUN_S = 5.0
+# Classificação em lote (classificar_ranking_cpf_lote): orçamento global, criações em paralelo
+# e tamanho máximo da cláusula IN por SOQL (a query vai na URL do GET REST).
+RANKING_LOTE_BUDGET_S = 180.0
+RANKING_LOTE_MAX_WORKERS = 4
+RANKING_LOTE_SOQL_IN_MAX_CHARS = 12000
 RANKING_SHEETS_COLS = (
     "CPF",
     "Ranking",
@@ -1299,7 +1353,8 @@ def resolver_taxa_financiamento_anual_pct(
 
 import logging
 import streamlit as st
-from typing import Any, Mapping
+from abc import ABC, abstractmethod
+from typing import Any, Callable, Iterable, Iterator, Mapping
 
 
 def _st_iframe_html_snippet(html: str, *, height: int = 0, width: int | None = None) -> None:
@@ -1312,13 +1367,27 @@ def _st_iframe_html_snippet(html: str, *, height: int = 0, width: int | None = N
         kw["width"] = int(width)
     st.iframe(html, **kw)
 import pandas as pd
+import numpy as np
 import re
 from streamlit_gsheets import GSheetsConnection
 import base64
 from datetime import datetime, date, timedelta, timezone
 import time
+import threading
+import csv
+import gzip
+import importlib.util
+import io
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from concurrent.futures import ALL_COMPLETED, FIRST_COMPLETED, Future, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from concurrent.futures import TimeoutError as FuturesTimeoutError
 import locale
+import heapq
+import queue
 import smtplib
+import uuid
 from email.mime.multipart import MIMEMultipart
 from email.mime.text import MIMEText
 from email.mime.application import MIMEApplication
@@ -1330,7 +1399,9 @@ import pytz
 import altair as alt
 import urllib.parse
 import html as html_std
+from types import MappingProxyType
 import jwt as jwt_lib
+from ranking_eventos import RankingNotificador, notificador_do_ambiente
 
 # Bloco [salesforce] no secrets.toml: USER / PASSWORD / TOKEN → variáveis SALESFORCE_* (mesma pasta, sem import circular)
 _SF_SECRETS_TOML_ALIAS: dict[str, str] = {
@@ -1410,17 +1481,715 @@ def _injetar_secrets_salesforce_no_env() -> None:
         pass
 
 
+# ---------------------------------------------------------------------------
+# Armazenamento (Google Sheets ou SQLite local) — mesma interface para o app
+# ---------------------------------------------------------------------------
+# Uma "aba" = uma tabela. DV_STORAGE_BACKEND=sqlite usa o ficheiro DV_SQLITE_PATH
+# (offline / benchmarks); DV_SQLITE_SYNC_SHEETS_S>0 reenvia ao Sheets, por ordem, as linhas
+# escritas localmente (anexar / upsert / excluir) — nunca substitui uma aba inteira do Sheets.
+_SQLITE_COLUNAS_INDEXADAS = ("CPF", "Email", "Identificador")
+# Sonda de alteração: modifiedTime da planilha no Drive (um pedido de metadados a cada
+# DV_REVISAO_PROBE_S). Uma mudança vinda de fora invalida todas as abas; as escritas do
+# próprio app só mudam a revisão da aba escrita.
+try:
+    _REVISAO_PROBE_S = max(0.0, float(os.environ.get("DV_REVISAO_PROBE_S") or 30))
+except ValueError:
+    _REVISAO_PROBE_S = 30.0
+
+
+class _BackendDados(ABC):
+    """Operações de persistência usadas pelo simulador (ler, anexar, upsert, excluir)."""
+
+    nome = "base"
+
+    @abstractmethod
+    def ler(self, aba: str, *, ttl: float | None = None) -> pd.DataFrame:
+        ...
+
+    def buscar(self, aba: str, coluna: str, valor: Any) -> list[dict[str, Any]]:
+        df = self.ler(aba)
+        if df is None or df.empty or coluna not in df.columns:
+            return []
+        alvo = str(valor).strip()
+        mask = df[coluna].astype(str).str.strip() == alvo
+        return df[mask].to_dict("records")
+
+    @abstractmethod
+    def anexar(
+        self,
+        aba: str,
+        linhas: list[Mapping[str, Any]],
+        *,
+        normalizar: Callable[[pd.DataFrame | None], pd.DataFrame] | None = None,
+    ) -> None:
+        ...
+
+    @abstractmethod
+    def upsert(
+        self,
+        aba: str,
+        chave: str,
+        linha: Mapping[str, Any],
+        *,
+        linha_planilha: int | None = None,
+        colunas: list[str] | None = None,
+    ) -> int | None:
+        """Atualiza a linha cuja coluna ``chave`` bate com ``linha[chave]``; senão anexa."""
+
+    @abstractmethod
+    def excluir(
+        self,
+        aba: str,
+        indice_linha: int,
+        *,
+        normalizar: Callable[[pd.DataFrame | None], pd.DataFrame] | None = None,
+    ) -> None:
+        """Remove a linha de dados na posição ``indice_linha`` da leitura (normalizada)."""
+
+    @abstractmethod
+    def excluir_registro(
+        self,
+        aba: str,
+        registro: Mapping[str, Any],
+        *,
+        normalizar: Callable[[pd.DataFrame | None], pd.DataFrame] | None = None,
+    ) -> None:
+        """Remove a primeira linha cujos valores batem com ``registro`` (colunas em comum)."""
+
+    @abstractmethod
+    def substituir(self, aba: str, df: pd.DataFrame) -> None:
+        ...
+
+    def revisao(self, aba: str) -> str | None:
+        """Marca barata de alteração da aba; None = desconhecida (ler por TTL)."""
+        return None
+
+
+class _BackendGSheets(_BackendDados):
+    """Google Sheets via st-gsheets-connection; escritas pontuais usam o worksheet gspread."""
+
+    nome = "gsheets"
+
+    def __init__(self, spreadsheet: str = ID_GERAL):
+        self.spreadsheet = spreadsheet
+        self._planilha_obj: Any | None = None
+        self._worksheets: dict[str, Any] = {}
+        # drive: último modifiedTime visto; base: revisão comum das abas; abas: revisão
+        # própria das abas que o app escreveu desde a última mudança externa.
+        self._revisoes: dict[str, Any] = {"em": 0.0, "drive": None, "base": None, "abas": {}}
+        self._revisoes_lock = threading.Lock()
+
+    @property
+    def conn(self) -> Any | None:
+        try:
+            return st.connection("gsheets", type=GSheetsConnection)
+        except Exception:
+            return None
+
+    def _planilha(self) -> Any | None:
+        """
+        Spreadsheet gspread reaproveitado (abrir custa uma chamada de metadados). Cliente
+        próprio pela API pública do gspread, com a mesma conta de serviço de
+        ``[connections.gsheets]``; planilha pública (sem conta de serviço) → None.
+        """
+        if self._planilha_obj is None:
+            try:
+                cred = dict(st.secrets["connections"]["gsheets"])
+            except Exception:
+                return None
+            if cred.get("type") != "service_account":
+                return None
+            import gspread
+
+            for k in ("spreadsheet", "worksheet"):
+                cred.pop(k, None)
+            cliente = gspread.service_account_from_dict(cred)
+            if re.match(r"https?://", str(self.spreadsheet)):
+                self._planilha_obj = cliente.open_by_url(self.spreadsheet)
+            else:
+                self._planilha_obj = cliente.open_by_key(str(self.spreadsheet))
+        return self._planilha_obj
+
+    def _sondar_modificacao(self) -> str | None:
+        try:
+            sh = self._planilha()
+            if sh is None:
+                return None
+            # get_lastUpdateTime consulta o Drive; a propriedade lastUpdateTime fica
+            # congelada no valor lido ao abrir a planilha.
+            return str(sh.get_lastUpdateTime())
+        except Exception:
+            _sf_logger.warning("Sheets: sonda de revisão indisponível; leituras seguem por TTL.")
+            return None
+
+    def _registrar_escrita(self, aba: str) -> None:
+        """
+        Depois de uma escrita do app: o novo modifiedTime passa a ser o conhecido e só a
+        aba escrita muda de revisão, para a próxima sonda não invalidar as restantes.
+        """
+        modificado = self._sondar_modificacao()
+        with self._revisoes_lock:
+            rev = self._revisoes
+            if modificado is None or rev["base"] is None:
+                return
+            rev["drive"] = modificado
+            rev["abas"][aba] = f"{rev['base']}+{modificado}"
+
+    def revisao(self, aba: str) -> str | None:
+        with self._revisoes_lock:
+            sondar = time.time() - self._revisoes["em"] >= _REVISAO_PROBE_S
+            if sondar:
+                # Reserva a sonda: as outras sessões seguem com a revisão atual.
+                self._revisoes["em"] = time.time()
+        if sondar:
+            modificado = self._sondar_modificacao()
+            with self._revisoes_lock:
+                rev = self._revisoes
+                if modificado is None:
+                    rev.update(drive=None, base=None, abas={})
+                elif modificado != rev["drive"]:
+                    rev.update(drive=modificado, base=modificado, abas={})
+        with self._revisoes_lock:
+            rev = self._revisoes
+            return rev["abas"].get(aba) or rev["base"]
+
+    def worksheet(self, aba: str) -> Any | None:
+        """Worksheet gspread da aba (só conta de serviço); senão None."""
+        if aba in self._worksheets:
+            return self._worksheets[aba]
+        try:
+            sh = self._planilha()
+            ws = sh.worksheet(aba) if sh is not None else None
+        except Exception:
+            _sf_logger.warning("Sheets: worksheet %r indisponível para escrita por intervalo.", aba)
+            return None
+        if ws is not None:
+            self._worksheets[aba] = ws
+        return ws
+
+    def ler(self, aba: str, *, ttl: float | None = None) -> pd.DataFrame:
+        conn = self.conn
+        if conn is None:
+            raise RuntimeError("Conexão gsheets indisponível.")
+        kw: dict[str, Any] = {"spreadsheet": self.spreadsheet, "worksheet": aba}
+        if ttl is not None:
+            kw["ttl"] = ttl
+        df = conn.read(**kw)
+        if df is None:
+            return pd.DataFrame()
+        df.columns = [str(c).strip() for c in df.columns]
+        return df
+
+    def substituir(self, aba: str, df: pd.DataFrame) -> None:
+        conn = self.conn
+        if conn is None:
+            raise RuntimeError("Conexão gsheets indisponível.")
+        conn.update(spreadsheet=self.spreadsheet, worksheet=aba, data=df)
+        self._registrar_escrita(aba)
+
+    def anexar(self, aba, linhas, *, normalizar=None) -> None:
+        linhas = [dict(x) for x in linhas]
+        if not linhas:
+            return
+        ws = self.worksheet(aba)
+        if ws is not None:
+            cabecalho = [str(c).strip() for c in ws.row_values(1)]
+            if cabecalho and all(k in cabecalho for ln in linhas for k in ln):
+                ws.append_rows(
+                    [[_valor_planilha(ln.get(c)) for c in cabecalho] for ln in linhas],
+                    value_input_option="USER_ENTERED",
+                    table_range="A1",
+                )
+                self._registrar_escrita(aba)
+                return
+        try:
+            df_ex = self.ler(aba, ttl=0)
+        except Exception:
+            df_ex = pd.DataFrame()
+        if normalizar is not None:
+            df_ex = normalizar(df_ex)
+        self.substituir(aba, pd.concat([df_ex, pd.DataFrame(linhas)], ignore_index=True))
+
+    def upsert(self, aba, chave, linha, *, linha_planilha=None, colunas=None) -> int | None:
+        ws = self.worksheet(aba)
+        if ws is None:
+            # Sem gspread (planilha pública): lê e regrava a aba inteira.
+            try:
+                df = self.ler(aba, ttl=0)
+            except Exception:
+                df = pd.DataFrame()
+            for col in linha:
+                if col not in df.columns:
+                    df[col] = ""
+            mask = df[chave].astype(str).str.strip() == str(linha[chave]).strip()
+            if mask.any():
+                for k, v in linha.items():
+                    df.loc[mask, k] = v
+            else:
+                df = pd.concat([df, pd.DataFrame([dict(linha)])], ignore_index=True)
+            self.substituir(aba, df)
+            return None
+        if colunas is None:
+            colunas = [str(c).strip() for c in ws.row_values(1)]
+        if not colunas:
+            colunas = list(linha.keys())
+            ws.update(f"A1:{_coluna_a1(len(colunas))}1", [colunas], value_input_option="RAW")
+        faltantes = [c for c in linha if c not in colunas]
+        if faltantes:
+            colunas = colunas + faltantes
+            ws.update(f"A1:{_coluna_a1(len(colunas))}1", [colunas], value_input_option="RAW")
+        alvo = str(linha[chave]).strip()
+        if linha_planilha is not None:
+            # Posição vinda de um índice em cache: confirma a chave antes de escrever
+            # (inserções, exclusões ou ordenação manuais deslocam as linhas).
+            atual = ws.cell(int(linha_planilha), colunas.index(chave) + 1).value
+            if str(atual or "").strip() != alvo:
+                linha_planilha = None
+        if linha_planilha is None:
+            col_vals = ws.col_values(colunas.index(chave) + 1)
+            for pos, v in enumerate(col_vals[1:], start=2):
+                if str(v).strip() == alvo:
+                    linha_planilha = pos
+                    break
+        valores = [_valor_planilha(linha.get(c, "")) for c in colunas]
+        if linha_planilha:
+            ws.update(
+                f"A{linha_planilha}:{_coluna_a1(len(colunas))}{linha_planilha}",
+                [valores],
+                value_input_option="RAW",
+            )
+            self._registrar_escrita(aba)
+            return int(linha_planilha)
+        resp = ws.append_row(valores, value_input_option="RAW", table_range="A1")
+        self._registrar_escrita(aba)
+        # updatedRange: "'Aba'!A15:I15" → linha 15
+        faixa = str(((resp or {}).get("updates") or {}).get("updatedRange") or "")
+        m = re.search(r"![A-Z]+(\d+)", faixa)
+        return int(m.group(1)) if m else None
+
+    def excluir(self, aba, indice_linha, *, normalizar=None) -> None:
+        df = self.ler(aba, ttl=0)
+        if normalizar is not None:
+            df = normalizar(df)
+        df = df.reset_index(drop=True)
+        if self.worksheet(aba) is not None:
+            # A posição na leitura normalizada não é a linha da planilha (linhas vazias
+            # descartadas, reordenação): localiza a linha pelo conteúdo antes de apagar.
+            self.excluir_registro(aba, df.iloc[int(indice_linha)].to_dict(), normalizar=normalizar)
+            return
+        df = df.drop(index=int(indice_linha)).reset_index(drop=True)
+        self.substituir(aba, df)
+
+    def excluir_registro(self, aba, registro, *, normalizar=None) -> None:
+        ws = self.worksheet(aba)
+        if ws is None:
+            raise RuntimeError("Exclusão por registo exige conta de serviço (gspread).")
+        valores = ws.get_all_values()
+        if not valores:
+            raise LookupError(f"Aba {aba!r} vazia.")
+        bruto = pd.DataFrame(valores[1:], columns=[str(c).strip() for c in valores[0]])
+        if normalizar is not None:
+            bruto = normalizar(bruto)
+        alvo = {str(c): _texto_celula(v) for c, v in registro.items() if str(c) in bruto.columns}
+        if not alvo:
+            raise LookupError(f"Nenhuma coluna do registo existe na aba {aba!r}.")
+        # normalizar não descarta nem reordena linhas: posição i ↔ linha i + 2 da planilha.
+        for pos, rec in enumerate(bruto.to_dict("records")):
+            if all(_texto_celula(rec.get(c)) == v for c, v in alvo.items()):
+                ws.delete_rows(pos + 2)
+                self._registrar_escrita(aba)
+                return
+        raise LookupError(f"Linha não encontrada na aba {aba!r} (alterada entretanto?).")
+
+
+def _valor_planilha(v: Any) -> Any:
+    """Valor serializável para a API do Sheets (NaN/None → vazio; datas → ISO)."""
+    if v is None or (isinstance(v, float) and v != v):
+        return ""
+    if isinstance(v, (datetime, date)):
+        return v.isoformat()
+    if hasattr(v, "item") and not isinstance(v, (str, bytes)):
+        try:
+            return v.item()
+        except Exception:
+            return str(v)
+    return v
+
+
+def _texto_celula(v: Any) -> str:
+    """Comparação célula a célula entre leituras tipadas (pandas) e texto cru do Sheets."""
+    v = _valor_planilha(v)
+    if isinstance(v, float) and v.is_integer():
+        v = int(v)
+    return str(v).strip()
+
+
+class _BackendSQLite(_BackendDados):
+    """
+    SQLite local: uma tabela por aba, índices em CPF/Email/Identificador e marca de alteração.
+    Com ``diario=True`` cada anexar/upsert/excluir fica também em ``_dv_sync_log`` para ser
+    reenviado ao Sheets linha a linha (substituir é só local: serve para semear).
+    """
+
+    nome = "sqlite"
+
+    def __init__(self, caminho: str | os.PathLike, *, diario: bool = False):
+        import sqlite3
+
+        self._sqlite3 = sqlite3
+        self.caminho = str(caminho)
+        self.diario = bool(diario)
+        self._local = threading.local()
+        self._lock = threading.RLock()
+        with self._lock, self._db() as db:
+            db.execute(
+                'CREATE TABLE IF NOT EXISTS "_dv_sync" ('
+                "aba TEXT PRIMARY KEY, alterado_em REAL, sincronizado_em REAL, "
+                "revisao INTEGER NOT NULL DEFAULT 0)"
+            )
+            db.execute(
+                'CREATE TABLE IF NOT EXISTS "_dv_sync_log" ('
+                "id INTEGER PRIMARY KEY AUTOINCREMENT, aba TEXT NOT NULL, op TEXT NOT NULL, "
+                "chave TEXT, dados TEXT NOT NULL)"
+            )
+
+    def _db(self):
+        db = getattr(self._local, "db", None)
+        if db is None:
+            db = self._sqlite3.connect(self.caminho, timeout=30, check_same_thread=False)
+            db.row_factory = self._sqlite3.Row
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=NORMAL")
+            self._local.db = db
+        return db
+
+    @staticmethod
+    def _q(nome: str) -> str:
+        return '"' + str(nome).replace('"', '""') + '"'
+
+    def _colunas(self, aba: str) -> list[str]:
+        rows = self._db().execute(f"PRAGMA table_info({self._q(aba)})").fetchall()
+        return [r["name"] for r in rows if r["name"] != "_dv_rowid"]
+
+    def _garantir_tabela(self, aba: str, colunas: list[str]) -> None:
+        db = self._db()
+        db.execute(
+            f"CREATE TABLE IF NOT EXISTS {self._q(aba)} "
+            "(_dv_rowid INTEGER PRIMARY KEY AUTOINCREMENT)"
+        )
+        existentes = set(self._colunas(aba))
+        for col in colunas:
+            if col not in existentes:
+                # Sem tipo declarado: o SQLite guarda números como números e texto como texto.
+                db.execute(f"ALTER TABLE {self._q(aba)} ADD COLUMN {self._q(col)}")
+                existentes.add(col)
+        for col in _SQLITE_COLUNAS_INDEXADAS:
+            if col in existentes:
+                db.execute(
+                    f"CREATE INDEX IF NOT EXISTS {self._q(f'ix_{aba}_{col}')} "
+                    f"ON {self._q(aba)} ({self._q(col)})"
+                )
+
+    def _marcar_alterada(self, aba: str) -> None:
+        self._db().execute(
+            'INSERT INTO "_dv_sync" (aba, alterado_em, revisao) VALUES (?, ?, 1) '
+            "ON CONFLICT(aba) DO UPDATE SET alterado_em = excluded.alterado_em, "
+            "revisao = revisao + 1",
+            (aba, time.time()),
+        )
+
+    def revisao(self, aba: str) -> str | None:
+        """Contador incrementado a cada escrita na aba (0 = nunca escrita)."""
+        row = self._db().execute(
+            'SELECT revisao FROM "_dv_sync" WHERE aba = ?', (aba,)
+        ).fetchone()
+        return str(int(row["revisao"])) if row is not None else "0"
+
+    def _registrar(self, aba: str, op: str, dados: Mapping[str, Any], chave: str | None = None) -> None:
+        """Entrada do diário de sincronização (chamar dentro da transação da escrita)."""
+        if not self.diario:
+            return
+        self._db().execute(
+            'INSERT INTO "_dv_sync_log" (aba, op, chave, dados) VALUES (?, ?, ?, ?)',
+            (aba, op, chave, json.dumps({k: _valor_planilha(v) for k, v in dados.items()}, default=str)),
+        )
+
+    def diario_pendente(self, limite: int = 500) -> list[dict[str, Any]]:
+        rows = self._db().execute(
+            'SELECT id, aba, op, chave, dados FROM "_dv_sync_log" ORDER BY id LIMIT ?',
+            (int(limite),),
+        ).fetchall()
+        return [
+            {"id": int(r["id"]), "aba": r["aba"], "op": r["op"], "chave": r["chave"], "dados": json.loads(r["dados"])}
+            for r in rows
+        ]
+
+    def diario_confirmar(self, entrada_id: int) -> None:
+        with self._lock, self._db() as db:
+            db.execute('DELETE FROM "_dv_sync_log" WHERE id = ?', (int(entrada_id),))
+
+    def ler(self, aba: str, *, ttl: float | None = None) -> pd.DataFrame:
+        cols = self._colunas(aba)
+        if not cols:
+            return pd.DataFrame()
+        sel = ", ".join(self._q(c) for c in cols)
+        rows = self._db().execute(
+            f"SELECT {sel} FROM {self._q(aba)} ORDER BY _dv_rowid"
+        ).fetchall()
+        return pd.DataFrame([tuple(r) for r in rows], columns=cols)
+
+    def buscar(self, aba: str, coluna: str, valor: Any) -> list[dict[str, Any]]:
+        if coluna not in self._colunas(aba):
+            return []
+        rows = self._db().execute(
+            f"SELECT * FROM {self._q(aba)} WHERE {self._q(coluna)} = ? ORDER BY _dv_rowid",
+            (valor,),
+        ).fetchall()
+        out = []
+        for r in rows:
+            d = dict(r)
+            d.pop("_dv_rowid", None)
+            out.append(d)
+        return out
+
+    def _inserir(self, aba: str, linha: Mapping[str, Any]) -> int:
+        cols = list(linha.keys())
+        self._garantir_tabela(aba, cols)
+        cur = self._db().execute(
+            f"INSERT INTO {self._q(aba)} ({', '.join(self._q(c) for c in cols)}) "
+            f"VALUES ({', '.join('?' for _ in cols)})",
+            [_valor_planilha(linha[c]) for c in cols],
+        )
+        return int(cur.lastrowid)
+
+    def anexar(self, aba, linhas, *, normalizar=None) -> None:
+        linhas = [dict(x) for x in linhas]
+        if not linhas:
+            return
+        with self._lock, self._db():
+            for ln in linhas:
+                self._inserir(aba, ln)
+                self._registrar(aba, "anexar", ln)
+            self._marcar_alterada(aba)
+
+    def upsert(self, aba, chave, linha, *, linha_planilha=None, colunas=None) -> int | None:
+        linha = dict(linha)
+        with self._lock, self._db() as db:
+            self._garantir_tabela(aba, list(linha.keys()))
+            sets = ", ".join(f"{self._q(c)} = ?" for c in linha)
+            row = db.execute(
+                f"SELECT _dv_rowid FROM {self._q(aba)} WHERE {self._q(chave)} = ? LIMIT 1",
+                (linha[chave],),
+            ).fetchone()
+            if row is not None:
+                db.execute(
+                    f"UPDATE {self._q(aba)} SET {sets} WHERE _dv_rowid = ?",
+                    [_valor_planilha(v) for v in linha.values()] + [row["_dv_rowid"]],
+                )
+                rid = int(row["_dv_rowid"])
+            else:
+                rid = self._inserir(aba, linha)
+            self._registrar(aba, "upsert", linha, chave)
+            self._marcar_alterada(aba)
+            return rid
+
+    def excluir(self, aba, indice_linha, *, normalizar=None) -> None:
+        with self._lock, self._db() as db:
+            row = db.execute(
+                f"SELECT * FROM {self._q(aba)} ORDER BY _dv_rowid LIMIT 1 OFFSET ?",
+                (int(indice_linha),),
+            ).fetchone()
+            if row is None:
+                raise IndexError(indice_linha)
+            db.execute(f"DELETE FROM {self._q(aba)} WHERE _dv_rowid = ?", (row["_dv_rowid"],))
+            registro = dict(row)
+            registro.pop("_dv_rowid", None)
+            self._registrar(aba, "excluir", registro)
+            self._marcar_alterada(aba)
+
+    def excluir_registro(self, aba, registro, *, normalizar=None) -> None:
+        cols = set(self._colunas(aba))
+        alvo = {str(c): _texto_celula(v) for c, v in registro.items() if str(c) in cols}
+        if not alvo:
+            raise LookupError(f"Nenhuma coluna do registo existe na aba {aba!r}.")
+        with self._lock, self._db() as db:
+            for r in db.execute(f"SELECT * FROM {self._q(aba)} ORDER BY _dv_rowid").fetchall():
+                if all(_texto_celula(r[c]) == v for c, v in alvo.items()):
+                    db.execute(f"DELETE FROM {self._q(aba)} WHERE _dv_rowid = ?", (r["_dv_rowid"],))
+                    self._registrar(aba, "excluir", alvo)
+                    self._marcar_alterada(aba)
+                    return
+        raise LookupError(f"Linha não encontrada na aba {aba!r}.")
+
+    def substituir(self, aba: str, df: pd.DataFrame) -> None:
+        cols = [str(c) for c in df.columns]
+        with self._lock, self._db() as db:
+            db.execute(f"DROP TABLE IF EXISTS {self._q(aba)}")
+            self._garantir_tabela(aba, cols)
+            if cols and len(df):
+                db.executemany(
+                    f"INSERT INTO {self._q(aba)} ({', '.join(self._q(c) for c in cols)}) "
+                    f"VALUES ({', '.join('?' for _ in cols)})",
+                    [[_valor_planilha(v) for v in rec] for rec in df.itertuples(index=False)],
+                )
+            self._marcar_alterada(aba)
+
+
+_BACKEND_DADOS: dict[str, Any] = {"backend": None, "chave": None}
+_BACKEND_DADOS_LOCK = threading.Lock()
+
+
+def _backend_dados() -> _BackendDados:
+    """Backend de armazenamento do processo (DV_STORAGE_BACKEND=gsheets|sqlite)."""
+    tipo = (os.environ.get("DV_STORAGE_BACKEND") or "gsheets").strip().lower()
+    caminho = (os.environ.get("DV_SQLITE_PATH") or "").strip() or str(
+        Path(__file__).resolve().parent / "dv_local.sqlite3"
+    )
+    chave = f"{tipo}|{caminho if tipo == 'sqlite' else ID_GERAL}"
+    with _BACKEND_DADOS_LOCK:
+        if _BACKEND_DADOS["backend"] is None or _BACKEND_DADOS["chave"] != chave:
+            if tipo == "sqlite":
+                _BACKEND_DADOS["backend"] = _BackendSQLite(caminho, diario=_sqlite_sync_intervalo_s() > 0)
+            else:
+                _BACKEND_DADOS["backend"] = _BackendGSheets(ID_GERAL)
+            _BACKEND_DADOS["chave"] = chave
+        backend = _BACKEND_DADOS["backend"]
+    if isinstance(backend, _BackendSQLite):
+        _iniciar_sync_sqlite_sheets(backend)
+    return backend
+
+
+def _revisoes_abas(abas: tuple[str, ...], ttl_s: float) -> tuple[str, ...]:
+    """
+    Chave de cache a partir das revisões das abas: inalterada → o cache continua válido
+    sem baixar nada. Aba sem sonda cai num balde de tempo de ``ttl_s`` (comportamento TTL).
+    """
+    backend = _backend_dados()
+    revs = [backend.nome]
+    for aba in abas:
+        try:
+            rev = backend.revisao(aba)
+        except Exception:
+            rev = None
+        revs.append(rev if rev is not None else f"t{int(time.time() // max(1.0, ttl_s))}")
+    return tuple(revs)
+
+
+def _sqlite_sync_intervalo_s() -> float:
+    try:
+        return max(0.0, float(os.environ.get("DV_SQLITE_SYNC_SHEETS_S") or 0))
+    except ValueError:
+        return 0.0
+
+
+def _sincronizar_backends(
+    origem: _BackendDados,
+    destino: _BackendDados,
+    abas: list[str] | None = None,
+) -> dict[str, Any]:
+    """
+    Sem ``abas`` (origem SQLite com diário): reenvia ao destino, por ordem, as escritas
+    locais pendentes — anexar, upsert por chave e exclusão por conteúdo —, parando na
+    primeira falha para não trocar a ordem. Com ``abas`` explícitas: cópia completa por
+    aba, só para semear o SQLite a partir do Sheets (nunca substitui abas do Sheets).
+    """
+    t0 = time.monotonic()
+    feitas: list[str] = []
+    erros: dict[str, str] = {}
+    if abas is None:
+        if not isinstance(origem, _BackendSQLite):
+            raise ValueError("Sincronização incremental exige origem SQLite.")
+        enviadas = 0
+        for ent in origem.diario_pendente():
+            aba = ent["aba"]
+            try:
+                if ent["op"] == "anexar":
+                    destino.anexar(aba, [ent["dados"]])
+                elif ent["op"] == "upsert":
+                    destino.upsert(aba, ent["chave"], ent["dados"])
+                elif ent["op"] == "excluir":
+                    destino.excluir_registro(aba, ent["dados"])
+            except LookupError as exc:
+                # Linha a excluir já não existe no destino: nada a fazer.
+                _sf_logger.info("Sync %s → %s: %s", origem.nome, destino.nome, exc)
+            except Exception as exc:  # noqa: BLE001
+                erros[aba] = str(exc)
+                _sf_logger.warning("Sync %s → %s falhou na aba %r: %s", origem.nome, destino.nome, aba, exc)
+                break
+            origem.diario_confirmar(ent["id"])
+            enviadas += 1
+            if aba not in feitas:
+                feitas.append(aba)
+        return {
+            "abas": feitas,
+            "linhas": enviadas,
+            "erros": erros,
+            "elapsed_s": round(time.monotonic() - t0, 3),
+        }
+    if isinstance(destino, _BackendGSheets):
+        raise ValueError("Cópia completa para o Sheets desativada: use o diário (abas=None).")
+    for aba in abas:
+        try:
+            destino.substituir(aba, origem.ler(aba, ttl=0))
+            feitas.append(aba)
+        except Exception as exc:  # noqa: BLE001
+            erros[aba] = str(exc)
+            _sf_logger.warning("Sync %s → %s falhou na aba %r: %s", origem.nome, destino.nome, aba, exc)
+    return {"abas": feitas, "erros": erros, "elapsed_s": round(time.monotonic() - t0, 3)}
+
+
+_SQLITE_SYNC_THREAD: dict[str, Any] = {"thread": None}
+
+
+def _iniciar_sync_sqlite_sheets(backend: _BackendSQLite) -> None:
+    """Thread daemon única que reenvia o diário do SQLite ao Sheets a cada DV_SQLITE_SYNC_SHEETS_S segundos."""
+    intervalo = _sqlite_sync_intervalo_s()
+    if intervalo <= 0 or not backend.diario:
+        return
+    with _BACKEND_DADOS_LOCK:
+        th = _SQLITE_SYNC_THREAD.get("thread")
+        if th is not None and th.is_alive():
+            return
+
+        def _loop() -> None:
+            destino = _BackendGSheets(ID_GERAL)
+            while True:
+                time.sleep(max(5.0, intervalo))
+                try:
+                    res = _sincronizar_backends(backend, destino)
+                    if res["abas"] or res["erros"]:
+                        _sf_logger.info("Sync SQLite → Sheets: %s", res)
+                except Exception:
+                    _sf_logger.exception("Sync SQLite → Sheets falhou")
+
+        th = threading.Thread(target=_loop, name="dv-sqlite-sync", daemon=True)
+        th.start()
+        _SQLITE_SYNC_THREAD["thread"] = th
+
+
 # ---------------------------------------------------------------------------
 # Salesforce (inlined — não depende do ficheiro ``salesforce_api.py`` no deploy)
 # ---------------------------------------------------------------------------
 try:
     from simple_salesforce import Salesforce, SalesforceAuthenticationFailed
+    from simple_salesforce.api import SFType
 except ImportError:  # pragma: no cover
     Salesforce = None  # type: ignore[misc, assignment]
     SalesforceAuthenticationFailed = Exception  # type: ignore[misc, assignment]
+    SFType = None  # type: ignore[misc, assignment]
+
+try:
+    import requests as _sf_requests
+    from requests.adapters import HTTPAdapter as _SfHTTPAdapter
+except ImportError:  # pragma: no cover
+    _sf_requests = None  # type: ignore[assignment]
+    _SfHTTPAdapter = None  # type: ignore[misc, assignment]
 
 _sf_logger = logging.getLogger(__name__)
-_SF_CLIENT_CACHE: dict[str, Any] = {"sf": None, "key": None}
+# Pool de clientes (espelho de salesforce_api): um login por credencial e processo,
+# sessão HTTP keep-alive partilhada entre threads, renovação única em INVALID_SESSION_ID.
+_SF_POOL_LOCK = threading.Lock()
+_SF_POOL: dict[str, dict[str, Any]] = {}
 
 
 def _sf_normalizar_cpf(cpf: str | None) -> str:
@@ -1433,6 +2202,126 @@ def _sf_normalizar_cpf(cpf: str | None) -> str:
     return digits
 
 
+def _sf_pool_ttl_sessao_s() -> float:
+    try:
+        return max(60.0, float(os.environ.get("SALESFORCE_SESSION_TTL_S") or 6600))
+    except ValueError:
+        return 6600.0
+
+
+def _sf_pool_sessao_http() -> Any | None:
+    """requests.Session com pool de conexões dimensionado para chamadas concorrentes."""
+    if _sf_requests is None:
+        return None
+    try:
+        maxsize = max(1, int(os.environ.get("SALESFORCE_POOL_MAXSIZE") or 16))
+    except ValueError:
+        maxsize = 16
+    sessao = _sf_requests.Session()
+    adapter = _SfHTTPAdapter(pool_connections=4, pool_maxsize=maxsize)
+    sessao.mount("https://", adapter)
+    sessao.mount("http://", adapter)
+    if _sf_fake_ativo():
+        from salesforce_fake import montar_transporte
+
+        montar_transporte(sessao)
+    return sessao
+
+
+def _sf_fake_ativo() -> bool:
+    """SALESFORCE_FAKE=1: org falso local (salesforce_fake.py) para benchmark/desenvolvimento."""
+    return (os.environ.get("SALESFORCE_FAKE") or "").strip().lower() in ("1", "true", "sim")
+
+
+def _sf_pool_login(entrada: dict[str, Any]) -> None:
+    username, password, token, domain = entrada["credenciais"]
+    kw: dict[str, Any] = {"username": username, "password": password, "domain": domain}
+    if token:
+        kw["security_token"] = token
+    if _sf_fake_ativo():
+        from salesforce_fake import SESSION_ID_FAKE, URL_BASE
+
+        kw = {"instance_url": URL_BASE, "session_id": SESSION_ID_FAKE}
+    if entrada.get("sessao_http") is not None:
+        kw["session"] = entrada["sessao_http"]
+    t0 = time.monotonic()
+    entrada["sf"] = Salesforce(**kw)
+    entrada["expira_em"] = time.time() + _sf_pool_ttl_sessao_s()
+    entrada["logins"] = int(entrada.get("logins") or 0) + 1
+    _sf_logger.info(
+        "Salesforce: sessão obtida para %s em %.0f ms", username, (time.monotonic() - t0) * 1000
+    )
+
+
+def _sf_pool_cliente(chave: str) -> Any:
+    """Cliente simple_salesforce atual da entrada; renova antes de expirar."""
+    entrada = _SF_POOL[chave]
+    if entrada.get("sf") is not None and time.time() < float(entrada.get("expira_em") or 0):
+        return entrada["sf"]
+    with entrada["lock"]:
+        if entrada.get("sf") is None or time.time() >= float(entrada.get("expira_em") or 0):
+            _sf_pool_login(entrada)
+        return entrada["sf"]
+
+
+def _sf_pool_renovar(chave: str, session_id_falho: str | None) -> None:
+    """Novo login só se ninguém renovou ainda (evita várias threads a logar em simultâneo)."""
+    entrada = _SF_POOL[chave]
+    with entrada["lock"]:
+        atual = getattr(entrada.get("sf"), "session_id", None)
+        if atual is None or atual == session_id_falho:
+            _sf_pool_login(entrada)
+
+
+def _sf_sessao_expirada(exc: BaseException) -> bool:
+    return type(exc).__name__ == "SalesforceExpiredSession" or "INVALID_SESSION_ID" in str(exc)
+
+
+class _SfClientePool:
+    """
+    Proxy sobre o cliente do pool: métodos que falham por sessão expirada renovam o
+    login e são repetidos uma vez; atributos simples vêm do cliente atual.
+    """
+
+    def __init__(self, chave: str, caminho: tuple[str, ...] = ()):
+        self._chave = chave
+        self._caminho = caminho
+
+    def _resolver(self) -> Any:
+        obj = _sf_pool_cliente(self._chave)
+        for nome in self._caminho:
+            obj = getattr(obj, nome)
+        return obj
+
+    def __getattr__(self, nome: str) -> Any:
+        if nome.startswith("__"):
+            raise AttributeError(nome)
+        alvo = getattr(self._resolver(), nome)
+        if SFType is not None and isinstance(alvo, SFType):
+            return _SfClientePool(self._chave, self._caminho + (nome,))
+        if not callable(alvo):
+            return alvo
+        chave = self._chave
+        pai = _SfClientePool(chave, self._caminho)
+
+        metodo = ".".join(self._caminho + (nome,))
+
+        def _chamar(*args: Any, **kwargs: Any) -> Any:
+            session_id = getattr(_SF_POOL[chave].get("sf"), "session_id", None)
+            _sf_api_contar(metodo)
+            try:
+                return alvo(*args, **kwargs)
+            except Exception as exc:
+                if not _sf_sessao_expirada(exc):
+                    raise
+                _sf_logger.info("Salesforce: sessão expirada; renovando e repetindo %s.", nome)
+                _sf_pool_renovar(chave, session_id)
+                _sf_api_contar(metodo)
+                return getattr(pai._resolver(), nome)(*args, **kwargs)
+
+        return _chamar
+
+
 def _sf_conectar_salesforce(verbose: bool = False) -> Any | None:
     _injetar_secrets_salesforce_no_env()
     if Salesforce is None:
@@ -1456,37 +2345,58 @@ def _sf_conectar_salesforce(verbose: bool = False) -> Any | None:
         return None
 
     cache_key = f"{username}|{domain}|{bool(token)}"
-    cached = _SF_CLIENT_CACHE.get("sf")
-    if cached is not None and _SF_CLIENT_CACHE.get("key") == cache_key:
-        return cached
-
+    with _SF_POOL_LOCK:
+        entrada = _SF_POOL.get(cache_key)
+        if entrada is None or entrada["credenciais"] != (username, password, token, domain):
+            entrada = {
+                "credenciais": (username, password, token, domain),
+                "lock": threading.Lock(),
+                "sessao_http": _sf_pool_sessao_http(),
+                "sf": None,
+                "expira_em": 0.0,
+                "logins": 0,
+            }
+            _SF_POOL[cache_key] = entrada
     try:
-        if token:
-            sf = Salesforce(
-                username=username,
-                password=password,
-                security_token=token,
-                domain=domain,
-            )
-        else:
-            sf = Salesforce(username=username, password=password, domain=domain)
-        _SF_CLIENT_CACHE["sf"] = sf
-        _SF_CLIENT_CACHE["key"] = cache_key
+        _sf_pool_cliente(cache_key)
         if verbose:
             _sf_logger.info("Salesforce: conectado como %s", username)
-        return sf
+        return _SfClientePool(cache_key)
     except SalesforceAuthenticationFailed as e:
-        _SF_CLIENT_CACHE["sf"] = None
-        _SF_CLIENT_CACHE["key"] = None
         _sf_logger.warning("Salesforce: falha de autenticação: %s", e)
         return None
     except Exception as e:
-        _SF_CLIENT_CACHE["sf"] = None
-        _SF_CLIENT_CACHE["key"] = None
         _sf_logger.warning("Salesforce: erro ao conectar: %s", e)
         return None
 
 
+# ---------------------------------------------------------------------------
+# Eventos de ranking (Change Data Capture / PushTopic) — acordam quem espera
+# ---------------------------------------------------------------------------
+# Notificador, transportes CometD / fake e variáveis DV_RANKING_EVENTOS* em
+# ranking_eventos.py (partilhado pelos dois simuladores); aqui só o do processo.
+_RANKING_NOTIFICADOR: dict[str, Any] = {"n": None}
+_RANKING_NOTIFICADOR_LOCK = threading.Lock()
+
+
+def _sf_renovar_sessao(sf: Any, session_id_falho: str | None) -> None:
+    """401 em chamadas HTTP diretas (CometD, Bulk): novo login no pool por trás de ``sf``."""
+    if isinstance(sf, _SfClientePool):
+        _sf_pool_renovar(sf._chave, session_id_falho)
+
+
+def _ranking_notificador() -> RankingNotificador:
+    """Notificador do processo; liga o transporte escolhido em DV_RANKING_EVENTOS na 1.ª chamada."""
+    with _RANKING_NOTIFICADOR_LOCK:
+        if _RANKING_NOTIFICADOR["n"] is None:
+            _RANKING_NOTIFICADOR["n"] = notificador_do_ambiente(
+                mapear_ranking=_sf_mapear_ranking_para_ui,
+                conectar=lambda: _sf_conectar_salesforce(verbose=False),
+                renovar=_sf_renovar_sessao,
+            )
+        return _RANKING_NOTIFICADOR["n"]
+
+
 def _sf_mapear_ranking_para_ui(valor: Any) -> str | None:
     if valor is None:
         return None
@@ -1712,171 +2622,990 @@ def _ranking_resultado(
     return out
 
 
-_RANKING_MEM_CACHE: dict[str, dict[str, Any]] = {}
-_SF_META_CACHE: dict[str, Any] = {}
+class _RankingCacheLRU:
+    """Camada 1: LRU + TTL em processo, limitada por max_entradas (get/put O(1))."""
+
+    def __init__(self, max_entradas: int):
+        self.max_entradas = max(1, int(max_entradas))
+        self._itens: OrderedDict[str, Mapping[str, Any]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, cpf: str) -> Mapping[str, Any] | None:
+        with self._lock:
+            item = self._itens.get(cpf)
+            if item is None:
+                return None
+            if float(item.get("expires_at_ts") or 0) < time.time():
+                del self._itens[cpf]
+                return None
+            self._itens.move_to_end(cpf)
+            return item
+
+    def put(self, cpf: str, item: Mapping[str, Any]) -> None:
+        with self._lock:
+            self._itens[cpf] = item
+            self._itens.move_to_end(cpf)
+            while len(self._itens) > self.max_entradas:
+                self._itens.popitem(last=False)
+
+    def remover(self, cpf: str) -> None:
+        with self._lock:
+            self._itens.pop(cpf, None)
+
+    def __len__(self) -> int:
+        return len(self._itens)
+
+
+class _RankingCacheSQLite:
+    """Camada 2: SQLite local (sobrevive a reinícios), limitada por max_entradas."""
+
+    _PODA_A_CADA = 256
+
+    def __init__(self, caminho: str | os.PathLike, max_entradas: int):
+        import sqlite3
+
+        self._sqlite3 = sqlite3
+        self.caminho = str(caminho)
+        self.max_entradas = max(1, int(max_entradas))
+        self._local = threading.local()
+        self._escritas = 0
+        with self._db() as db:
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS ranking_cache ("
+                "cpf TEXT PRIMARY KEY, payload TEXT NOT NULL, expira_em REAL NOT NULL, "
+                "gravado_em REAL NOT NULL)"
+            )
+            db.execute(
+                "CREATE INDEX IF NOT EXISTS ix_ranking_cache_gravado ON ranking_cache (gravado_em)"
+            )
 
+    def _db(self):
+        db = getattr(self._local, "db", None)
+        if db is None:
+            db = self._sqlite3.connect(self.caminho, timeout=5, check_same_thread=False)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=NORMAL")
+            self._local.db = db
+        return db
+
+    def get(self, cpf: str) -> dict[str, Any] | None:
+        row = (
+            self._db()
+            .execute(
+                "SELECT payload FROM ranking_cache WHERE cpf = ? AND expira_em >= ?",
+                (cpf, time.time()),
+            )
+            .fetchone()
+        )
+        return json.loads(row[0]) if row else None
+
+    def put(self, cpf: str, item: Mapping[str, Any]) -> None:
+        with self._db() as db:
+            db.execute(
+                "INSERT OR REPLACE INTO ranking_cache (cpf, payload, expira_em, gravado_em) "
+                "VALUES (?, ?, ?, ?)",
+                (
+                    cpf,
+                    json.dumps(dict(item), ensure_ascii=False, default=str),
+                    float(item.get("expires_at_ts") or 0),
+                    time.time(),
+                ),
+            )
+        self._escritas += 1
+        if self._escritas % self._PODA_A_CADA == 0:
+            self.podar()
+
+    def remover(self, cpf: str) -> None:
+        with self._db() as db:
+            db.execute("DELETE FROM ranking_cache WHERE cpf = ?", (cpf,))
+
+    def podar(self) -> None:
+        """Remove expirados e, acima do limite, os gravados há mais tempo."""
+        with self._db() as db:
+            db.execute("DELETE FROM ranking_cache WHERE expira_em < ?", (time.time(),))
+            db.execute(
+                "DELETE FROM ranking_cache WHERE cpf IN (SELECT cpf FROM ranking_cache "
+                "ORDER BY gravado_em DESC LIMIT -1 OFFSET ?)",
+                (self.max_entradas,),
+            )
 
-def _ranking_mem_get(cpf: str) -> dict[str, Any] | None:
-    hit = _RANKING_MEM_CACHE.get(cpf)
-    if not hit:
+
+_RANKING_CACHE_LRU = _RankingCacheLRU(RANKING_MEM_MAX_ENTRADAS)
+_RANKING_CACHE_SQLITE: dict[str, Any] = {"camada": None, "iniciado": False}
+_RANKING_CACHE_SQLITE_LOCK = threading.Lock()
+_RANKING_CACHE_STATS_LOCK = threading.Lock()
+_RANKING_CACHE_STATS: dict[str, dict[str, int]] = {
+    camada: {"hits": 0, "misses": 0}
+    for camada in ("memoria", "sqlite", "export", "planilha", "negativo")
+}
+_SF_META_CACHE: dict[Any, Any] = {}
+
+
+def _ranking_cache_sqlite() -> _RankingCacheSQLite | None:
+    """Camada SQLite do cache (DV_RANKING_SQLITE_PATH; «off» desliga)."""
+    with _RANKING_CACHE_SQLITE_LOCK:
+        if not _RANKING_CACHE_SQLITE["iniciado"]:
+            _RANKING_CACHE_SQLITE["iniciado"] = True
+            caminho = (os.environ.get("DV_RANKING_SQLITE_PATH") or "").strip() or str(
+                Path(__file__).resolve().parent / "dv_ranking_cache.sqlite3"
+            )
+            if caminho.lower() not in ("0", "off", "false"):
+                try:
+                    _RANKING_CACHE_SQLITE["camada"] = _RankingCacheSQLite(
+                        caminho, RANKING_SQLITE_MAX_ENTRADAS
+                    )
+                except Exception:
+                    _sf_logger.warning("Cache de ranking: SQLite indisponível em %s", caminho)
+        return _RANKING_CACHE_SQLITE["camada"]
+
+
+def _ranking_cache_contar(camada: str, hit: bool) -> None:
+    with _RANKING_CACHE_STATS_LOCK:
+        _RANKING_CACHE_STATS[camada]["hits" if hit else "misses"] += 1
+
+
+def _ranking_cache_estatisticas() -> dict[str, dict[str, Any]]:
+    """Hits/misses e taxa de acerto por camada (memória, SQLite, export, planilha, negativos)."""
+    with _RANKING_CACHE_STATS_LOCK:
+        out = {k: dict(v) for k, v in _RANKING_CACHE_STATS.items()}
+    for v in out.values():
+        total = v["hits"] + v["misses"]
+        v["taxa"] = round(v["hits"] / total, 3) if total else None
+    out["memoria"]["entradas"] = len(_RANKING_CACHE_LRU)
+    return out
+
+
+def _ranking_cache_negativo(payload: Mapping[str, Any]) -> bool:
+    """Resultados sem ranking útil que ainda assim poupam uma ida ao Salesforce."""
+    if payload.get("status") == "terminal":
+        return True
+    return payload.get("code") == "sem_registo" and not payload.get("account_id")
+
+
+def _ranking_cache_get(cpf: str) -> dict[str, Any] | None:
+    """
+    Memória do processo → referência da sessão → SQLite local. Devolve entradas
+    positivas e negativas (campo «negativo»); a planilha é consultada à parte.
+    """
+    item = _RANKING_CACHE_LRU.get(cpf)
+    _ranking_cache_contar("memoria", item is not None)
+    if item is None:
         try:
-            sess = getattr(st, "session_state", None)
-            if sess is not None:
-                bag = sess.get("_ranking_mem_cache") or {}
-                hit = bag.get(cpf)
+            bag = st.session_state.get("_ranking_mem_cache")
+            cand = bag.get(cpf) if bag else None
         except Exception:
-            hit = None
-    if not hit:
-        return None
-    exp = hit.get("expires_at_ts")
-    if exp is not None and time.time() > float(exp):
-        _RANKING_MEM_CACHE.pop(cpf, None)
+            cand = None
+        if cand is not None and float(cand.get("expires_at_ts") or 0) >= time.time():
+            item = cand
+            _RANKING_CACHE_LRU.put(cpf, item)
+    if item is None:
+        camada = _ranking_cache_sqlite()
+        if camada is not None:
+            try:
+                bruto = camada.get(cpf)
+            except Exception:
+                bruto = None
+            _ranking_cache_contar("sqlite", bruto is not None)
+            if bruto is not None:
+                item = MappingProxyType(bruto)
+                _RANKING_CACHE_LRU.put(cpf, item)
+    # «negativo»: fração das consultas locais respondidas por uma entrada negativa
+    # (miss = nada em cache ou entrada positiva).
+    _ranking_cache_contar("negativo", bool(item is not None and item.get("negativo")))
+    if item is None:
         return None
-    if hit.get("status") == "pending" or not hit.get("ranking"):
+    return dict(item)
+
+
+def _ranking_mem_get(cpf: str) -> dict[str, Any] | None:
+    """Entrada positiva (com ranking) das camadas locais do cache."""
+    hit = _ranking_cache_get(cpf)
+    if not hit or hit.get("negativo") or hit.get("status") == "pending" or not hit.get("ranking"):
         return None
-    return dict(hit)
+    return hit
 
 
 def _ranking_mem_put(cpf: str, payload: Mapping[str, Any]) -> None:
-    item = dict(payload)
-    item["expires_at_ts"] = time.time() + RANKING_CACHE_TTL_HOURS * 3600
-    _RANKING_MEM_CACHE[cpf] = item
+    """
+    Grava nas camadas locais. Positivos valem RANKING_CACHE_TTL_HOURS; terminais e CPFs
+    sem registo entram como negativos com RANKING_NEGATIVO_TTL_S.
+    """
+    negativo = _ranking_cache_negativo(payload)
+    if not negativo and (payload.get("status") == "pending" or not payload.get("ranking")):
+        return
+    ttl_s = RANKING_NEGATIVO_TTL_S if negativo else RANKING_CACHE_TTL_HOURS * 3600
+    item = MappingProxyType(
+        {**payload, "negativo": negativo, "expires_at_ts": time.time() + ttl_s}
+    )
+    _RANKING_CACHE_LRU.put(cpf, item)
+    camada = _ranking_cache_sqlite()
+    if camada is not None:
+        try:
+            camada.put(cpf, item)
+        except Exception:
+            _sf_logger.warning("Cache de ranking: falha ao gravar no SQLite", exc_info=True)
     try:
         sess = getattr(st, "session_state", None)
         if sess is not None:
-            bag = dict(sess.get("_ranking_mem_cache") or {})
+            # Referência para a mesma entrada imutável: sem copiar o saco a cada gravação.
+            bag = sess.get("_ranking_mem_cache")
+            if bag is None:
+                bag = sess["_ranking_mem_cache"] = {}
             bag[cpf] = item
-            sess["_ranking_mem_cache"] = bag
     except Exception:
         pass
 
 
-def _spreadsheet_id_geral() -> str:
-    m = re.search(r"/d/([a-zA-Z0-9-_]+)", str(ID_GERAL))
-    return m.group(1) if m else str(ID_GERAL).strip()
-
-
-def _ranking_sheets_conn():
-    """Retorna conexão GSheets quando disponível; senão None."""
+def _ranking_mem_remover(cpf: str) -> None:
+    """Tira o CPF das camadas locais (ex.: negativo «sem registo» depois de criar a conta)."""
+    _RANKING_CACHE_LRU.remover(cpf)
+    camada = _ranking_cache_sqlite()
+    if camada is not None:
+        try:
+            camada.remover(cpf)
+        except Exception:
+            _sf_logger.warning("Cache de ranking: falha ao remover do SQLite", exc_info=True)
     try:
-        return st.connection("gsheets", type=GSheetsConnection)
+        bag = st.session_state.get("_ranking_mem_cache")
+        if bag:
+            bag.pop(cpf, None)
     except Exception:
-        return None
+        pass
 
 
-def _ranking_sheets_read_index() -> dict[str, dict[str, Any]]:
-    """Índice CPF → linha da aba BD Ranking CPF (somente resolvidos válidos)."""
-    idx: dict[str, dict[str, Any]] = {}
-    conn = _ranking_sheets_conn()
-    if conn is None:
-        return idx
-    try:
-        df = conn.read(spreadsheet=ID_GERAL, worksheet=WS_BD_RANKING_CPF)
-    except Exception:
-        return idx
-    if df is None or getattr(df, "empty", True):
-        return idx
-    try:
-        df.columns = [str(c).strip() for c in df.columns]
-    except Exception:
-        return idx
-    agora = datetime.now(timezone.utc)
-    for _, row in df.iterrows():
-        cpf = _sf_normalizar_cpf(row.get("CPF"))
-        if len(cpf) != 11:
-            continue
-        status = str(row.get("Status") or "").strip().lower()
-        ranking = _sf_mapear_ranking_para_ui(row.get("Ranking"))
-        if status == "pending" or not ranking:
-            continue
-        exp_raw = row.get("ExpiresAt")
-        if exp_raw not in (None, ""):
-            try:
-                exp = datetime.fromisoformat(str(exp_raw).replace("Z", "+00:00"))
-                if exp.tzinfo is None:
-                    exp = exp.replace(tzinfo=timezone.utc)
-                if exp < agora:
-                    continue
-            except Exception:
-                pass
-        idx[cpf] = {
-            "cpf": cpf,
-            "ranking": ranking,
-            "status": "ok",
-            "source": str(row.get("Source") or "sheets"),
-            "account_id": str(row.get("AccountId") or "") or None,
-            "opportunity_id": str(row.get("OpportunityId") or "") or None,
-            "resolved_at": str(row.get("ResolvedAt") or "") or None,
-            "expires_at": str(row.get("ExpiresAt") or "") or None,
-        }
-    return idx
+def _sf_bulk_query(
+    sf: Any,
+    soql: str,
+    *,
+    operacao: str = "query",
+    timeout_s: float = RANKING_EXPORT_JOB_TIMEOUT_S,
+) -> Iterator[dict[str, str]]:
+    """
+    Bulk API 2.0 (jobs/query): cria o job, espera JobComplete com backoff e pagina os
+    resultados CSV pelo cabeçalho Sforce-Locator. Valores nulos chegam como "".
+    ``operacao="queryAll"`` inclui registos apagados (IsDeleted) e arquivados.
+    Um 401 renova a sessão do pool e repete o pedido uma vez.
+    """
+    import requests
 
+    base = str(sf.base_url).rstrip("/")
+    http = getattr(sf, "session", None) or requests
+
+    def _pedido(metodo: str, url: str, *, aceitar: str = "application/json", **kw: Any) -> Any:
+        for tentativa in (1, 2):
+            session_id = sf.session_id
+            resp = http.request(
+                metodo,
+                url,
+                headers={
+                    "Authorization": f"Bearer {session_id}",
+                    "Content-Type": "application/json",
+                    "Accept": aceitar,
+                },
+                **kw,
+            )
+            if resp.status_code != 401 or tentativa == 2:
+                break
+            _sf_logger.info("Bulk API: sessão expirada; renovando e repetindo o pedido.")
+            _sf_renovar_sessao(sf, session_id)
+        resp.raise_for_status()
+        return resp
+
+    _sf_api_contar("bulk_job")
+    resp = _pedido(
+        "POST",
+        f"{base}/jobs/query",
+        json={
+            "operation": operacao,
+            "query": soql,
+            "contentType": "CSV",
+            "columnDelimiter": "COMMA",
+            "lineEnding": "LF",
+        },
+        timeout=60,
+    )
+    job_id = str(resp.json()["id"])
+    limite = time.monotonic() + max(1.0, float(timeout_s))
+    espera = 0.5
+    while True:
+        _sf_api_contar("bulk_estado")
+        info = _pedido("GET", f"{base}/jobs/query/{job_id}", timeout=30).json()
+        estado = str(info.get("state") or "")
+        if estado == "JobComplete":
+            break
+        if estado in ("Failed", "Aborted"):
+            raise RuntimeError(
+                f"Job Bulk {job_id} terminou em {estado}: {info.get('errorMessage') or '-'}"
+            )
+        if time.monotonic() + espera > limite:
+            raise TimeoutError(f"Job Bulk {job_id} não concluiu em {timeout_s:.0f}s")
+        time.sleep(espera)
+        espera = min(30.0, espera * 2)
+    localizador: str | None = None
+    while True:
+        params: dict[str, Any] = {"maxRecords": RANKING_EXPORT_PAGINA}
+        if localizador:
+            params["locator"] = localizador
+        _sf_api_contar("bulk_resultados")
+        pagina = _pedido(
+            "GET",
+            f"{base}/jobs/query/{job_id}/results",
+            aceitar="text/csv",
+            params=params,
+            timeout=300,
+        )
+        pagina.encoding = "utf-8"
+        yield from csv.DictReader(io.StringIO(pagina.text))
+        localizador = pagina.headers.get("Sforce-Locator")
+        if not localizador or localizador == "null":
+            return
 
-def _ranking_sheets_upsert(payload: Mapping[str, Any]) -> bool:
-    """Upsert na aba BD Ranking CPF. Falha silenciosa (não bloqueia classificação)."""
-    cpf = _sf_normalizar_cpf(payload.get("cpf"))
-    if len(cpf) != 11:
-        return False
-    conn = _ranking_sheets_conn()
-    if conn is None:
-        return False
-    try:
-        try:
-            df = conn.read(spreadsheet=ID_GERAL, worksheet=WS_BD_RANKING_CPF)
-            if df is None or getattr(df, "empty", True):
-                df = pd.DataFrame(columns=list(RANKING_SHEETS_COLS))
-            else:
-                df.columns = [str(c).strip() for c in df.columns]
-                for col in RANKING_SHEETS_COLS:
-                    if col not in df.columns:
-                        df[col] = ""
-        except Exception:
-            df = pd.DataFrame(columns=list(RANKING_SHEETS_COLS))
-
-        agora = datetime.now(timezone.utc)
-        expires = agora + timedelta(hours=RANKING_CACHE_TTL_HOURS)
-        nova = {
-            "CPF": cpf,
-            "Ranking": payload.get("ranking") or "",
-            "Status": payload.get("status") or "",
-            "Source": payload.get("source") or "",
-            "AccountId": payload.get("account_id") or "",
-            "OpportunityId": payload.get("opportunity_id") or "",
-            "RequestedAt": payload.get("requested_at") or agora.isoformat(),
-            "ResolvedAt": payload.get("resolved_at") or "",
-            "ExpiresAt": expires.isoformat(),
-        }
-        mask = df["CPF"].astype(str).map(_sf_normalizar_cpf) == cpf
-        if mask.any():
-            for k, v in nova.items():
-                df.loc[mask, k] = v
-        else:
-            df = pd.concat([df, pd.DataFrame([nova])], ignore_index=True)
-        conn.update(spreadsheet=ID_GERAL, worksheet=WS_BD_RANKING_CPF, data=df)
-        return True
-    except Exception:
-        _sf_logger.exception("Falha ao upsert ranking na planilha")
-        return False
 
+def _ranking_export_watermark(valor: Any) -> str | None:
+    """SystemModstamp → literal SOQL em UTC truncado ao segundo (o delta usa >=)."""
+    m = re.match(r"(\d{4}-\d{2}-\d{2}T\d{2}:\d{2}:\d{2})", str(valor or ""))
+    return f"{m.group(1)}Z" if m else None
 
-def _risk3_sync_lookup(cpf: str, *, timeout_s: float) -> dict[str, Any]:
-    """Adaptador REST opcional. Sem URL/credencial → skipped_unconfigured."""
-    url = (os.environ.get("RISK3_SYNC_URL") or "").strip()
-    token = (os.environ.get("RISK3_SYNC_TOKEN") or "").strip()
-    if not url:
-        return {"status": "skipped_unconfigured", "ranking": None, "raw": None}
-    try:
-        import requests as _requests
 
-        headers = {"Accept": "application/json"}
-        if token:
-            headers["Authorization"] = f"Bearer {token}"
-        resp = _requests.get(
+class _RankingExportBulk:
+    """
+    Espelho local das contas pessoa física (CPF__c, Ranking__c, Ranking_Score__c, Id)
+    exportado pela Bulk API 2.0 para uma tabela CSV gzip e indexado em memória pelo
+    CPF normalizado. A primeira exportação é completa; as seguintes trazem só o delta
+    por SystemModstamp, via queryAll para que contas apagadas (IsDeleted, merges) saiam
+    do índice. A cada RANKING_EXPORT_COMPLETO_DIAS a exportação volta a ser completa e
+    substitui o índice (remove também as contas já purgadas da lixeira). Um thread
+    daemon carrega a tabela e agenda a exportação diária.
+    """
+
+    _COLUNAS = ("cpf", "account_id", "ranking_raw", "ranking_score", "system_modstamp")
+
+    def __init__(self, caminho: str) -> None:
+        self.caminho = caminho
+        self._lock = threading.Lock()
+        self._por_cpf: dict[str, dict[str, Any]] = {}
+        self._cpf_por_conta: dict[str, str] = {}
+        self._thread: threading.Thread | None = None
+        self._acordar = threading.Event()
+        self.carregado = False
+        self.watermark: str | None = None
+        self.executado_em: float | None = None
+        self.completo_em: float | None = None
+        self.ultimo_erro: str | None = None
+        self.falhas_seguidas = 0
+        self.linhas_ultima_exportacao = 0
+
+    def iniciar(self) -> None:
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(
+                    target=self._loop, name="dv-ranking-export", daemon=True
+                )
+                self._thread.start()
+
+    def get(self, cpf: str) -> dict[str, Any] | None:
+        with self._lock:
+            return self._por_cpf.get(cpf)
+
+    def _indexar(
+        self,
+        linha: Mapping[str, Any],
+        por_cpf: dict[str, dict[str, Any]] | None = None,
+        cpf_por_conta: dict[str, str] | None = None,
+    ) -> None:
+        """
+        Upsert por Account Id (chamar com o lock, ou sobre índices novos): conta que
+        mudou/perdeu o CPF ou foi apagada («apagada» na linha) sai do índice.
+        """
+        por_cpf = self._por_cpf if por_cpf is None else por_cpf
+        cpf_por_conta = self._cpf_por_conta if cpf_por_conta is None else cpf_por_conta
+        aid = str(linha.get("account_id") or "").strip()
+        cpf = _sf_normalizar_cpf(linha.get("cpf") or "")
+        anterior = cpf_por_conta.pop(aid, None) if aid else None
+        if anterior and (por_cpf.get(anterior) or {}).get("account_id") == aid:
+            del por_cpf[anterior]
+        if len(cpf) != 11 or not aid or linha.get("apagada"):
+            return
+        por_cpf[cpf] = {
+            "cpf": cpf,
+            "account_id": aid,
+            "ranking_raw": str(linha.get("ranking_raw") or "").strip() or None,
+            "ranking_score": str(linha.get("ranking_score") or "").strip() or None,
+            "system_modstamp": str(linha.get("system_modstamp") or "").strip() or None,
+        }
+        cpf_por_conta[aid] = cpf
+
+    def _carregar(self) -> None:
+        try:
+            with open(f"{self.caminho}.meta.json", encoding="utf-8") as f:
+                meta = json.load(f)
+            with gzip.open(self.caminho, "rt", encoding="utf-8", newline="") as f:
+                with self._lock:
+                    for linha in csv.DictReader(f):
+                        self._indexar(linha)
+            self.watermark = meta.get("watermark") or None
+            self.executado_em = meta.get("executado_em")
+            self.completo_em = meta.get("completo_em")
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError, csv.Error):
+            _sf_logger.warning(
+                "Export de ranking: tabela local ilegível em %s; nova exportação completa",
+                self.caminho,
+                exc_info=True,
+            )
+            with self._lock:
+                self._por_cpf.clear()
+                self._cpf_por_conta.clear()
+            self.watermark = None
+        self.carregado = True
+
+    def _gravar(self) -> None:
+        with self._lock:
+            linhas = list(self._por_cpf.values())
+        tmp = f"{self.caminho}.tmp"
+        with gzip.open(tmp, "wt", encoding="utf-8", newline="") as f:
+            w = csv.DictWriter(f, fieldnames=self._COLUNAS)
+            w.writeheader()
+            w.writerows(linhas)
+        os.replace(tmp, self.caminho)
+        meta = {
+            "watermark": self.watermark,
+            "executado_em": self.executado_em,
+            "completo_em": self.completo_em,
+            "linhas": len(linhas),
+        }
+        with open(f"{self.caminho}.meta.json.tmp", "w", encoding="utf-8") as f:
+            json.dump(meta, f)
+        os.replace(f"{self.caminho}.meta.json.tmp", f"{self.caminho}.meta.json")
+
+    def _completo_vencido(self) -> bool:
+        if not self.watermark or not self.completo_em:
+            return True
+        return time.time() - float(self.completo_em) >= RANKING_EXPORT_COMPLETO_DIAS * 86400
+
+    def exportar(self, sf: Any) -> int:
+        """
+        Exporta (completo ou delta) e regrava a tabela; devolve as linhas recebidas.
+        O completo monta índices novos e troca-os no fim: contas não vistas saem.
+        """
+        completo = self._completo_vencido()
+        campos = _sf_meta_filtrar_campos(
+            "Account",
+            ("Id", "CPF__c", "Ranking__c", "Ranking_Score__c", "SystemModstamp")
+            + (() if completo else ("IsDeleted",)),
+        )
+        onde = "IsPersonAccount = true"
+        if not completo:
+            onde += f" AND SystemModstamp >= {self.watermark}"
+        por_cpf: dict[str, dict[str, Any]] | None = {} if completo else None
+        cpf_por_conta: dict[str, str] | None = {} if completo else None
+        maior = None if completo else self.watermark
+        n = 0
+        for reg in _sf_bulk_query(
+            sf,
+            f"SELECT {', '.join(campos)} FROM Account WHERE {onde}",
+            operacao="query" if completo else "queryAll",
+        ):
+            linha = {
+                "cpf": reg.get("CPF__c"),
+                "account_id": reg.get("Id"),
+                "ranking_raw": reg.get("Ranking__c"),
+                "ranking_score": reg.get("Ranking_Score__c"),
+                "system_modstamp": reg.get("SystemModstamp"),
+                "apagada": str(reg.get("IsDeleted") or "").strip().lower() == "true",
+            }
+            if completo:
+                self._indexar(linha, por_cpf, cpf_por_conta)
+            else:
+                with self._lock:
+                    self._indexar(linha)
+            marca = _ranking_export_watermark(reg.get("SystemModstamp"))
+            if marca and (maior is None or marca > maior):
+                maior = marca
+            n += 1
+        agora = time.time()
+        if completo:
+            with self._lock:
+                self._por_cpf = por_cpf or {}
+                self._cpf_por_conta = cpf_por_conta or {}
+            self.completo_em = agora
+        self.watermark = maior
+        self.executado_em = agora
+        self.linhas_ultima_exportacao = n
+        self._gravar()
+        return n
+
+    def executar_agora(self) -> None:
+        _injetar_secrets_salesforce_no_env()
+        try:
+            sf = _sf_conectar_salesforce(verbose=False)
+            if sf is None:
+                raise ConnectionError("sem conexão com o Salesforce")
+            t0 = time.monotonic()
+            n = self.exportar(sf)
+            self.falhas_seguidas = 0
+            self.ultimo_erro = None
+            _sf_logger.info(
+                "Export de ranking: %s linhas em %.1fs (índice com %s CPFs)",
+                n,
+                time.monotonic() - t0,
+                len(self._por_cpf),
+            )
+        except Exception as exc:  # noqa: BLE001
+            self.falhas_seguidas += 1
+            self.ultimo_erro = str(exc)
+            _sf_logger.warning("Export de ranking: falha na exportação Bulk", exc_info=True)
+
+    def _espera_s(self) -> float:
+        """Já, se nunca exportou ou passou de 24 h; backoff em falhas; senão até RANKING_EXPORT_HORA."""
+        if self.falhas_seguidas:
+            return min(3600.0, 60.0 * (2 ** (self.falhas_seguidas - 1)))
+        if not self.executado_em or time.time() - float(self.executado_em) >= 86400:
+            return 0.0
+        agora = datetime.now()
+        alvo = agora.replace(hour=RANKING_EXPORT_HORA, minute=0, second=0, microsecond=0)
+        if alvo <= agora:
+            alvo += timedelta(days=1)
+        return (alvo - agora).total_seconds()
+
+    def _loop(self) -> None:
+        if not self.carregado:
+            self._carregar()
+        while True:
+            espera = self._espera_s()
+            if espera > 0:
+                self._acordar.wait(espera)
+                self._acordar.clear()
+            self.executar_agora()
+
+    def resumo(self) -> dict[str, Any]:
+        with self._lock:
+            n = len(self._por_cpf)
+        return {
+            "cpfs": n,
+            "watermark": self.watermark,
+            "executado_em": self.executado_em,
+            "linhas_ultima": self.linhas_ultima_exportacao,
+            "erro": self.ultimo_erro,
+        }
+
+
+_RANKING_EXPORT: dict[str, Any] = {"e": None, "iniciado": False}
+_RANKING_EXPORT_LOCK = threading.Lock()
+
+
+def _ranking_export_bulk() -> _RankingExportBulk | None:
+    """Espelho Bulk do processo (DV_RANKING_EXPORT_PATH; «off» desliga); inicia o agendador."""
+    with _RANKING_EXPORT_LOCK:
+        if not _RANKING_EXPORT["iniciado"]:
+            _RANKING_EXPORT["iniciado"] = True
+            caminho = (os.environ.get("DV_RANKING_EXPORT_PATH") or "").strip() or str(
+                Path(__file__).resolve().parent / "dv_ranking_export.csv.gz"
+            )
+            if caminho.lower() not in ("0", "off", "false"):
+                _RANKING_EXPORT["e"] = _RankingExportBulk(caminho)
+                _RANKING_EXPORT["e"].iniciar()
+        return _RANKING_EXPORT["e"]
+
+
+def _spreadsheet_id_geral() -> str:
+    m = re.search(r"/d/([a-zA-Z0-9-_]+)", str(ID_GERAL))
+    return m.group(1) if m else str(ID_GERAL).strip()
+
+
+# Índice de processo da aba BD Ranking CPF: carregado uma vez (TTL) e mantido
+# in-place pelos upserts. Guarda o número da linha de cada CPF para que o upsert
+# seja uma escrita de um único intervalo (A{n}:I{n}) em vez de regravar a aba.
+# _RANKING_SHEETS_IDX_LOCK só protege a troca/atualização do índice em memória; a
+# leitura da aba e as escritas correm fora dele (_CARGA_LOCK / _ESCRITA_LOCK), para
+# que as consultas concorrentes não esperem pela rede.
+_RANKING_SHEETS_IDX_LOCK = threading.RLock()
+_RANKING_SHEETS_CARGA_LOCK = threading.Lock()
+_RANKING_SHEETS_ESCRITA_LOCK = threading.Lock()
+# CPF → time.monotonic() do último upsert: uma carga iniciada antes não o sobrepõe.
+_RANKING_SHEETS_UPSERT_EM: dict[str, float] = {}
+_RANKING_SHEETS_IDX: dict[str, Any] = {
+    "carregado_em": 0.0,
+    "revisao": None,
+    "colunas": list(RANKING_SHEETS_COLS),
+    "linhas": {},
+    "row_numbers": {},
+}
+
+
+def _coluna_a1(n: int) -> str:
+    """1 → A, 27 → AA (notação A1 das planilhas)."""
+    letras = ""
+    while n > 0:
+        n, r = divmod(n - 1, 26)
+        letras = chr(65 + r) + letras
+    return letras
+
+
+def _ranking_sheets_parse_ts(valor: Any) -> float | None:
+    if valor in (None, ""):
+        return None
+    try:
+        dt = datetime.fromisoformat(str(valor).replace("Z", "+00:00"))
+    except (TypeError, ValueError):
+        return None
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    return dt.timestamp()
+
+
+def _ranking_sheets_parse_linha(row: Mapping[str, Any]) -> dict[str, Any] | None:
+    """Normaliza uma linha da aba (uma única vez, na carga do índice ou no upsert)."""
+    cpf = _sf_normalizar_cpf(row.get("CPF"))
+    if len(cpf) != 11:
+        return None
+
+    def _txt(col: str) -> str | None:
+        v = row.get(col)
+        if v is None or (isinstance(v, float) and v != v):
+            return None
+        return str(v).strip() or None
+
+    return {
+        "cpf": cpf,
+        "ranking": _sf_mapear_ranking_para_ui(row.get("Ranking")),
+        "status": str(_txt("Status") or "").lower(),
+        "source": _txt("Source") or "sheets",
+        "account_id": _txt("AccountId"),
+        "opportunity_id": _txt("OpportunityId"),
+        "resolved_at": _txt("ResolvedAt"),
+        "expires_at": _txt("ExpiresAt"),
+        "expires_at_ts": _ranking_sheets_parse_ts(row.get("ExpiresAt")),
+    }
+
+
+def _ranking_sheets_carregar_indice(*, force: bool = False) -> dict[str, Any]:
+    """
+    Carrega (ou reaproveita) o índice CPF → linha. Uma leitura completa por TTL, feita
+    por um único thread e fora do lock do índice: os outros seguem com o índice anterior
+    (só a primeira carga, sem índice nenhum, espera por ela).
+    """
+    with _RANKING_SHEETS_IDX_LOCK:
+        idade = time.time() - float(_RANKING_SHEETS_IDX["carregado_em"] or 0.0)
+        if not force and idade < RANKING_SHEETS_INDEX_TTL_S:
+            return _RANKING_SHEETS_IDX
+        revisao_atual = _RANKING_SHEETS_IDX["revisao"]
+        ja_carregado = bool(_RANKING_SHEETS_IDX["carregado_em"])
+    if not _RANKING_SHEETS_CARGA_LOCK.acquire(blocking=not ja_carregado or force):
+        return _RANKING_SHEETS_IDX
+    try:
+        with _RANKING_SHEETS_IDX_LOCK:
+            idade = time.time() - float(_RANKING_SHEETS_IDX["carregado_em"] or 0.0)
+            if not force and idade < RANKING_SHEETS_INDEX_TTL_S:
+                return _RANKING_SHEETS_IDX
+        backend = _backend_dados()
+        try:
+            revisao = backend.revisao(WS_BD_RANKING_CPF)
+        except Exception:
+            revisao = None
+        if not force and revisao is not None and revisao == revisao_atual and ja_carregado:
+            # Aba inalterada: só renova o carimbo, sem baixar a aba.
+            with _RANKING_SHEETS_IDX_LOCK:
+                _RANKING_SHEETS_IDX["carregado_em"] = time.time()
+            return _RANKING_SHEETS_IDX
+        t_leitura = time.monotonic()
+        try:
+            df = backend.ler(WS_BD_RANKING_CPF, ttl=0)
+        except Exception:
+            _sf_logger.warning("BD Ranking CPF: falha na leitura do índice; mantendo o anterior.")
+            return _RANKING_SHEETS_IDX
+        linhas: dict[str, dict[str, Any]] = {}
+        row_numbers: dict[str, int] = {}
+        colunas = list(RANKING_SHEETS_COLS)
+        if df is not None and not getattr(df, "empty", True):
+            colunas = [str(c).strip() for c in df.columns]
+            df.columns = colunas
+            # Linha 1 = cabeçalho; a i-ésima linha de dados está na linha i + 2.
+            for pos, row in enumerate(df.to_dict("records")):
+                item = _ranking_sheets_parse_linha(row)
+                if item is None:
+                    continue
+                linhas[item["cpf"]] = item
+                row_numbers[item["cpf"]] = pos + 2
+        with _RANKING_SHEETS_IDX_LOCK:
+            # Upserts concluídos durante a leitura podem não constar do que foi lido.
+            for cpf, t_upsert in _RANKING_SHEETS_UPSERT_EM.items():
+                if t_upsert < t_leitura:
+                    continue
+                if cpf in _RANKING_SHEETS_IDX["linhas"]:
+                    linhas[cpf] = _RANKING_SHEETS_IDX["linhas"][cpf]
+                if cpf in _RANKING_SHEETS_IDX["row_numbers"]:
+                    row_numbers[cpf] = _RANKING_SHEETS_IDX["row_numbers"][cpf]
+            _RANKING_SHEETS_UPSERT_EM.clear()
+            _RANKING_SHEETS_IDX.update(
+                {
+                    "carregado_em": time.time(),
+                    "revisao": revisao,
+                    "colunas": colunas,
+                    "linhas": linhas,
+                    "row_numbers": row_numbers,
+                }
+            )
+        return _RANKING_SHEETS_IDX
+    finally:
+        _RANKING_SHEETS_CARGA_LOCK.release()
+
+
+def _ranking_sheets_entrada_valida(item: Mapping[str, Any] | None) -> bool:
+    if not item or item.get("status") == "pending" or not item.get("ranking"):
+        return False
+    exp = item.get("expires_at_ts")
+    return exp is None or float(exp) >= time.time()
+
+
+def _ranking_sheets_lookup(cpf: str) -> dict[str, Any] | None:
+    """Consulta O(1) no índice em processo (sem rede enquanto o TTL estiver válido)."""
+    idx = _ranking_sheets_carregar_indice()
+    item = idx["linhas"].get(cpf)
+    valido = _ranking_sheets_entrada_valida(item)
+    _ranking_cache_contar("planilha", valido)
+    if not valido:
+        return None
+    out = dict(item)
+    out["status"] = "ok"
+    out.pop("expires_at_ts", None)
+    return out
+
+
+def _ranking_sheets_read_index() -> dict[str, dict[str, Any]]:
+    """Índice CPF → linha da aba BD Ranking CPF (somente resolvidos válidos)."""
+    idx = _ranking_sheets_carregar_indice()
+    out: dict[str, dict[str, Any]] = {}
+    for cpf, item in idx["linhas"].items():
+        if _ranking_sheets_entrada_valida(item):
+            hit = dict(item)
+            hit["status"] = "ok"
+            hit.pop("expires_at_ts", None)
+            out[cpf] = hit
+    return out
+
+
+def _ranking_sheets_upsert(payload: Mapping[str, Any]) -> bool:
+    """Upsert na aba BD Ranking CPF. Falha silenciosa (não bloqueia classificação)."""
+    cpf = _sf_normalizar_cpf(payload.get("cpf"))
+    if len(cpf) != 11:
+        return False
+    agora = datetime.now(timezone.utc)
+    expires = agora + timedelta(hours=RANKING_CACHE_TTL_HOURS)
+    nova = {
+        "CPF": cpf,
+        "Ranking": payload.get("ranking") or "",
+        "Status": payload.get("status") or "",
+        "Source": payload.get("source") or "",
+        "AccountId": payload.get("account_id") or "",
+        "OpportunityId": payload.get("opportunity_id") or "",
+        "RequestedAt": payload.get("requested_at") or agora.isoformat(),
+        "ResolvedAt": payload.get("resolved_at") or "",
+        "ExpiresAt": expires.isoformat(),
+    }
+    try:
+        idx = _ranking_sheets_carregar_indice()
+        # Escritas serializadas entre si (evita dois appends do mesmo CPF), mas fora do
+        # lock do índice: as consultas continuam a ser servidas durante a escrita.
+        with _RANKING_SHEETS_ESCRITA_LOCK:
+            with _RANKING_SHEETS_IDX_LOCK:
+                colunas = list(idx["colunas"])
+                linha_atual = idx["row_numbers"].get(cpf)
+            if any(c not in colunas for c in RANKING_SHEETS_COLS):
+                colunas = None
+            backend = _backend_dados()
+            linha = backend.upsert(
+                WS_BD_RANKING_CPF,
+                "CPF",
+                nova,
+                linha_planilha=linha_atual,
+                colunas=colunas,
+            )
+            item = _ranking_sheets_parse_linha(nova)
+            with _RANKING_SHEETS_IDX_LOCK:
+                if linha:
+                    idx["row_numbers"][cpf] = int(linha)
+                if not linha or (linha_atual and int(linha) != int(linha_atual)):
+                    # Regravação completa ou linha deslocada na planilha: as posições
+                    # em cache deixaram de valer; a próxima consulta recarrega o índice.
+                    idx["carregado_em"] = 0.0
+                if item is not None:
+                    idx["linhas"][cpf] = item
+                _RANKING_SHEETS_UPSERT_EM[cpf] = time.monotonic()
+        return True
+    except Exception:
+        _sf_logger.exception("Falha ao upsert ranking na planilha")
+        return False
+
+
+class _Disjuntor:
+    """
+    Disjuntor (circuit breaker) por dependência. Fechado: tudo passa. Após
+    RANKING_DISJUNTOR_FALHAS falhas seguidas abre e recusa chamadas durante o
+    resfriamento; depois fica meio-aberto e deixa passar uma única sonda — sucesso
+    fecha, falha reabre com resfriamento dobrado (até 10 min).
+
+    Também guarda as latências de sucesso: timeout_s() devolve um timeout adaptado
+    ao p95 observado em vez do teto fixo.
+    """
+
+    def __init__(
+        self,
+        nome: str,
+        *,
+        falhas_para_abrir: int = RANKING_DISJUNTOR_FALHAS,
+        resfriamento_s: float = RANKING_DISJUNTOR_RESFRIAMENTO_S,
+        timeout_min_s: float = 0.5,
+    ):
+        self.nome = nome
+        self.falhas_para_abrir = max(1, int(falhas_para_abrir))
+        self.resfriamento_base_s = float(resfriamento_s)
+        self.timeout_min_s = float(timeout_min_s)
+        self.estado = "fechado"
+        self.falhas_seguidas = 0
+        self._resfriamento_s = self.resfriamento_base_s
+        self._aberto_ate = 0.0
+        self._sonda_em_curso = False
+        self._latencias: deque = deque(maxlen=200)
+        self._lock = threading.Lock()
+
+    def permitir(self) -> bool:
+        with self._lock:
+            if self.estado == "fechado":
+                return True
+            if self.estado == "aberto" and time.monotonic() >= self._aberto_ate:
+                self.estado = "meio_aberto"
+                self._sonda_em_curso = False
+            if self.estado == "meio_aberto" and not self._sonda_em_curso:
+                self._sonda_em_curso = True
+                return True
+            return False
+
+    def sucesso(self, latencia_s: float | None = None) -> None:
+        with self._lock:
+            if latencia_s is not None:
+                self._latencias.append(float(latencia_s))
+            if self.estado != "fechado":
+                _sf_logger.info("Disjuntor %s: fechado após sonda bem-sucedida.", self.nome)
+            self.estado = "fechado"
+            self.falhas_seguidas = 0
+            self._resfriamento_s = self.resfriamento_base_s
+            self._sonda_em_curso = False
+
+    def liberar_sonda(self) -> None:
+        """Sonda autorizada que não chegou a chamar a dependência: não conta nem fecha."""
+        with self._lock:
+            self._sonda_em_curso = False
+
+    def falha(self) -> None:
+        with self._lock:
+            self.falhas_seguidas += 1
+            if self.estado == "meio_aberto":
+                self._resfriamento_s = min(600.0, self._resfriamento_s * 2)
+            elif self.falhas_seguidas < self.falhas_para_abrir:
+                return
+            self.estado = "aberto"
+            self._sonda_em_curso = False
+            self._aberto_ate = time.monotonic() + self._resfriamento_s
+            _sf_logger.warning(
+                "Disjuntor %s: aberto por %.0f s (%d falhas seguidas).",
+                self.nome,
+                self._resfriamento_s,
+                self.falhas_seguidas,
+            )
+
+    def timeout_s(self, teto_s: float) -> float:
+        """2 × p95 das latências recentes (mín. timeout_min_s), nunca acima do teto."""
+        teto = max(0.05, float(teto_s))
+        with self._lock:
+            amostras = list(self._latencias)
+        if len(amostras) < 20:
+            return teto
+        p95 = float(np.percentile(amostras, 95))
+        return min(teto, max(self.timeout_min_s, 2.0 * p95))
+
+    def resumo(self) -> dict[str, Any]:
+        with self._lock:
+            return {
+                "estado": self.estado,
+                "falhas_seguidas": self.falhas_seguidas,
+                "reabre_em_s": max(0.0, round(self._aberto_ate - time.monotonic(), 1))
+                if self.estado == "aberto"
+                else 0.0,
+                "amostras": len(self._latencias),
+            }
+
+
+_DISJUNTORES: dict[str, _Disjuntor] = {}
+_DISJUNTORES_LOCK = threading.Lock()
+
+
+def _disjuntor(nome: str) -> _Disjuntor:
+    with _DISJUNTORES_LOCK:
+        if nome not in _DISJUNTORES:
+            _DISJUNTORES[nome] = _Disjuntor(nome)
+        return _DISJUNTORES[nome]
+
+
+def _falha_de_dependencia(exc: BaseException) -> bool:
+    """Falhas que indicam dependência fora (rede, timeout, 5xx); erros de pedido não abrem o disjuntor."""
+    if _sf_requests is not None and isinstance(
+        exc, (_sf_requests.exceptions.ConnectionError, _sf_requests.exceptions.Timeout)
+    ):
+        return True
+    if isinstance(exc, (TimeoutError, ConnectionError)):
+        return True
+    texto = f"{type(exc).__name__} {exc}"
+    return any(
+        marca in texto
+        for marca in ("SalesforceGeneralError", "SERVER_UNAVAILABLE", " 500", " 502", " 503", " 504")
+    )
+
+
+_RISK3_SESSAO: dict[str, Any] = {"sessao": None}
+_RISK3_SESSAO_LOCK = threading.Lock()
+
+
+def _risk3_sessao_http() -> Any:
+    """requests.Session keep-alive do adaptador Risk3 (uma por processo)."""
+    with _RISK3_SESSAO_LOCK:
+        if _RISK3_SESSAO["sessao"] is None:
+            sessao = _sf_requests.Session()
+            adapter = _SfHTTPAdapter(pool_connections=2, pool_maxsize=16)
+            sessao.mount("https://", adapter)
+            sessao.mount("http://", adapter)
+            _RISK3_SESSAO["sessao"] = sessao
+        return _RISK3_SESSAO["sessao"]
+
+
+def _risk3_sync_lookup(cpf: str, *, timeout_s: float) -> dict[str, Any]:
+    """
+    Adaptador REST opcional. Sem URL/credencial → skipped_unconfigured; disjuntor
+    «risk3» aberto → skipped_breaker_open (sem pedido). Timeout adaptado ao p95.
+    """
+    url = (os.environ.get("RISK3_SYNC_URL") or "").strip()
+    token = (os.environ.get("RISK3_SYNC_TOKEN") or "").strip()
+    if not url:
+        return {"status": "skipped_unconfigured", "ranking": None, "raw": None}
+    disjuntor = _disjuntor("risk3")
+    if not disjuntor.permitir():
+        return {"status": "skipped_breaker_open", "ranking": None, "raw": None}
+    inicio = time.monotonic()
+    try:
+        headers = {"Accept": "application/json"}
+        if token:
+            headers["Authorization"] = f"Bearer {token}"
+        resp = _risk3_sessao_http().get(
             url,
             params={"cpf": cpf},
             headers=headers,
-            timeout=max(0.2, float(timeout_s)),
+            timeout=max(0.2, disjuntor.timeout_s(timeout_s)),
         )
+        if resp.status_code >= 500:
+            disjuntor.falha()
+        else:
+            disjuntor.sucesso(time.monotonic() - inicio)
         if resp.status_code >= 400:
             return {
                 "status": "error",
@@ -1894,12 +3623,123 @@ def _risk3_sync_lookup(cpf: str, *, timeout_s: float) -> dict[str, Any]:
             return {"status": "ok", "ranking": ranking, "raw": raw}
         return {"status": "empty", "ranking": None, "raw": raw}
     except Exception as exc:  # noqa: BLE001
+        if _falha_de_dependencia(exc):
+            disjuntor.falha()
+        else:
+            disjuntor.sucesso()
         return {"status": "error", "ranking": None, "raw": None, "message": str(exc)}
 
 
+# Metadados do org (campos válidos, RecordType PF, estágios ativos) persistidos em
+# disco com TTL: describe uma vez; arranques seguintes (novo deploy/processo) não
+# repetem describe. SALESFORCE_META_CACHE_PATH / SALESFORCE_META_CACHE_TTL_S.
+_SF_META_DISCO_LOCK = threading.Lock()
+_SF_META_DISCO: dict[str, Any] = {"carregado": False, "dados": {}}
+
+
+def _sf_meta_arquivo() -> Path:
+    bruto = (os.environ.get("SALESFORCE_META_CACHE_PATH") or "").strip()
+    return Path(bruto) if bruto else Path(__file__).resolve().parent / ".sf_meta_cache.json"
+
+
+def _sf_meta_ttl_s() -> float:
+    try:
+        return max(60.0, float(os.environ.get("SALESFORCE_META_CACHE_TTL_S") or 86400))
+    except ValueError:
+        return 86400.0
+
+
+def _sf_meta_org() -> str:
+    """Metadados variam por org: chave = usuário + domínio."""
+    return "|".join(
+        (os.environ.get(k) or "").strip().lower()
+        for k in ("SALESFORCE_USER", "SALESFORCE_DOMAIN")
+    )
+
+
+def _sf_meta_disco_get(nome: str) -> Any | None:
+    with _SF_META_DISCO_LOCK:
+        if not _SF_META_DISCO["carregado"]:
+            try:
+                _SF_META_DISCO["dados"] = json.loads(_sf_meta_arquivo().read_text("utf-8"))
+            except (OSError, ValueError):
+                _SF_META_DISCO["dados"] = {}
+            _SF_META_DISCO["carregado"] = True
+        item = (_SF_META_DISCO["dados"].get(_sf_meta_org()) or {}).get(nome)
+    if not isinstance(item, dict) or time.time() - float(item.get("em") or 0) > _sf_meta_ttl_s():
+        return None
+    return item.get("valor")
+
+
+def _sf_meta_disco_put(nome: str, valor: Any) -> None:
+    with _SF_META_DISCO_LOCK:
+        org = _SF_META_DISCO["dados"].setdefault(_sf_meta_org(), {})
+        org[nome] = {"valor": valor, "em": time.time()}
+        arquivo = _sf_meta_arquivo()
+        try:
+            tmp = arquivo.with_suffix(arquivo.suffix + ".tmp")
+            tmp.write_text(json.dumps(_SF_META_DISCO["dados"], ensure_ascii=False), "utf-8")
+            os.replace(tmp, arquivo)
+        except OSError:
+            _sf_logger.warning("Metadados Salesforce: não foi possível gravar %s", arquivo)
+
+
+def _sf_meta_disco_remover(nome: str) -> None:
+    with _SF_META_DISCO_LOCK:
+        org = _SF_META_DISCO["dados"].get(_sf_meta_org()) or {}
+        if org.pop(nome, None) is None:
+            return
+        arquivo = _sf_meta_arquivo()
+        try:
+            tmp = arquivo.with_suffix(arquivo.suffix + ".tmp")
+            tmp.write_text(json.dumps(_SF_META_DISCO["dados"], ensure_ascii=False), "utf-8")
+            os.replace(tmp, arquivo)
+        except OSError:
+            _sf_logger.warning("Metadados Salesforce: não foi possível gravar %s", arquivo)
+
+
+def _sf_meta_campos(sf: Any, sobject: str, *, forcar: bool = False) -> set[str]:
+    """Nomes de campos do sObject (describe uma vez por TTL, persistido em disco)."""
+    nome = f"campos:{sobject}"
+    cached = None if forcar else _sf_meta_disco_get(nome)
+    if cached is not None:
+        return set(cached)
+    desc = getattr(sf, sobject).describe()
+    campos = sorted(str(f.get("name")) for f in (desc.get("fields") or []) if f.get("name"))
+    _sf_meta_disco_put(nome, campos)
+    if sobject == "Opportunity":
+        stage = next((f for f in desc.get("fields") or [] if f.get("name") == "StageName"), None)
+        ativos = [
+            str(item.get("value"))
+            for item in ((stage or {}).get("picklistValues") or [])
+            if item.get("active", True) and item.get("value")
+        ]
+        _sf_meta_disco_put("estagios_ativos", ativos)
+    return set(campos)
+
+
+def _sf_meta_campos_conhecidos(sobject: str) -> set[str] | None:
+    """Campos do describe já persistido (sem rede); None se ainda não houve describe."""
+    cached = _sf_meta_disco_get(f"campos:{sobject}")
+    return set(cached) if cached is not None else None
+
+
+def _sf_meta_filtrar_campos(sobject: str, candidatos: Iterable[str]) -> list[str]:
+    """
+    Mantém só os candidatos que existem no org (todos, se o describe ainda não é
+    conhecido). Nomes de campo da API não diferenciam maiúsculas: compara casefold.
+    """
+    conhecidos = _sf_meta_campos_conhecidos(sobject)
+    if conhecidos is None:
+        return list(candidatos)
+    nomes = {c.casefold() for c in conhecidos}
+    return [c for c in candidatos if str(c).casefold() in nomes]
+
+
 def _sf_meta_record_type_id(sf: Any) -> str | None:
-    cached = _SF_META_CACHE.get("record_type_id")
+    cached = _SF_META_CACHE.get("record_type_id") or _sf_meta_disco_get("record_type_id")
     if cached:
+        _SF_META_CACHE["record_type_id"] = cached
         return str(cached)
     tipos = (
         sf.query(
@@ -1913,6 +3753,7 @@ def _sf_meta_record_type_id(sf: Any) -> str | None:
         return None
     rid = str(tipos[0]["Id"])
     _SF_META_CACHE["record_type_id"] = rid
+    _sf_meta_disco_put("record_type_id", rid)
     return rid
 
 
@@ -1922,20 +3763,10 @@ def _sf_meta_stage_name(sf: Any) -> str:
         return str(cached)
     stage_name = "Prospecting"
     try:
-        opp_desc = sf.Opportunity.describe()
-        stage_meta = next(
-            (
-                field
-                for field in (opp_desc.get("fields") or [])
-                if field.get("name") == "StageName"
-            ),
-            None,
-        )
-        active_stages = [
-            str(item.get("value"))
-            for item in ((stage_meta or {}).get("picklistValues") or [])
-            if item.get("active", True) and item.get("value")
-        ]
+        active_stages = _sf_meta_disco_get("estagios_ativos")
+        if active_stages is None:
+            _sf_meta_campos(sf, "Opportunity", forcar=True)
+            active_stages = _sf_meta_disco_get("estagios_ativos") or []
         if active_stages and stage_name not in active_stages:
             stage_name = active_stages[0]
     except Exception:
@@ -1944,16 +3775,74 @@ def _sf_meta_stage_name(sf: Any) -> str:
     return stage_name
 
 
+def _sf_soql_contas_com_oportunidades(
+    *,
+    cpfs: Iterable[str] = (),
+    account_ids: Iterable[str] = (),
+    limite_opps: int = 20,
+    limite: int | None = None,
+) -> str:
+    """
+    SOQL pai-filho: Account (por CPF, todas as variantes de máscara, e/ou por Id) com
+    subconsulta das Opportunities mais recentes. Uma ida ao Salesforce traz tudo o que
+    _sf_extrair_ranking_ui_de_opportunity precisa; serve um CPF ou um lote.
+    """
+    filtros: list[str] = []
+    cpfs = [c for c in cpfs if c]
+    ids = [str(i).strip() for i in account_ids if str(i or "").strip()]
+    if cpfs:
+        literais_cpf = ", ".join(_sf_literais_cpf(c) for c in cpfs)
+        filtros.append(f"CPF__c IN ({literais_cpf})")
+    if ids:
+        literais_ids = ", ".join(f"'{_sf_soql_escape_literal(i)}'" for i in ids)
+        filtros.append(f"Id IN ({literais_ids})")
+    if not filtros:
+        raise ValueError("Informe CPFs e/ou Account Ids.")
+    campos_conta = ", ".join(
+        _sf_meta_filtrar_campos("Account", ("Ranking__c", "Ranking_Score__c"))
+        or ["Ranking__c"]
+    )
+    campos_opp = ", ".join(
+        _sf_meta_filtrar_campos("Opportunity", ("Ranking__c", "Ranking_Score__c"))
+        or ["Ranking__c"]
+    )
+    soql = (
+        f"SELECT Id, Name, CPF__c, {campos_conta}, CreatedDate, "
+        f"(SELECT Id, Name, AccountId, {campos_opp}, CreatedDate "
+        f"FROM Opportunities ORDER BY CreatedDate DESC LIMIT {int(limite_opps)}) "
+        f"FROM Account WHERE {' OR '.join(filtros)} ORDER BY CreatedDate DESC"
+    )
+    if limite:
+        soql += f" LIMIT {int(limite)}"
+    return soql
+
+
+def _sf_oportunidades_da_conta(conta: Mapping[str, Any]) -> list[dict[str, Any]]:
+    """Opportunities da subconsulta, já com o bloco «Account» esperado pelo extrator."""
+    sub = conta.get("Opportunities")
+    recs = sub.get("records") if isinstance(sub, Mapping) else None
+    pai = {
+        "Name": conta.get("Name"),
+        "Ranking__c": conta.get("Ranking__c"),
+        "Ranking_Score__c": conta.get("Ranking_Score__c"),
+    }
+    out: list[dict[str, Any]] = []
+    for opp in recs or []:
+        item = dict(opp)
+        item.setdefault("AccountId", conta.get("Id"))
+        item["Account"] = pai
+        out.append(item)
+    return out
+
+
 def _sf_consultar_account_opp_consolidado(
-    sf: Any, cpf: str
+    sf: Any, cpf: str, *, timeout_s: float | None = None
 ) -> tuple[dict[str, Any] | None, dict[str, Any] | None, str | None]:
-    """Uma consulta Account; Opportunity só se a conta existir."""
-    literais = _sf_literais_cpf(cpf)
+    """Account + Opportunity mais recente numa única SOQL pai-filho."""
     contas = (
         sf.query(
-            "SELECT Id, Name, CPF__c, Ranking__c, Ranking_Score__c, CreatedDate "
-            f"FROM Account WHERE CPF__c IN ({literais}) "
-            "ORDER BY CreatedDate DESC LIMIT 5"
+            _sf_soql_contas_com_oportunidades(cpfs=[cpf], limite_opps=5, limite=5),
+            **({"timeout": timeout_s} if timeout_s else {}),
         ).get("records")
         or []
     )
@@ -1962,24 +3851,23 @@ def _sf_consultar_account_opp_consolidado(
     conta = contas[0] if contas else None
     if conta is None:
         return None, None, None
-    oportunidades = (
-        sf.query(
-            "SELECT Id, Name, AccountId, Ranking__c, Ranking_Score__c, "
-            "Account.Ranking__c, Account.Ranking_Score__c, CreatedDate "
-            f"FROM Opportunity WHERE AccountId = '{_sf_soql_escape_literal(str(conta['Id']))}' "
-            "ORDER BY CreatedDate DESC LIMIT 5"
-        ).get("records")
-        or []
-    )
+    oportunidades = _sf_oportunidades_da_conta(conta)
     oportunidade = oportunidades[0] if oportunidades else None
     return conta, oportunidade, None
 
 
 def _sf_warmup_meta(sf: Any | None = None) -> bool:
-    """Pré-aquece conexão + RecordType + StageName (fora do cronômetro do CPF)."""
+    """Pré-aquece conexão + metadados (campos, RecordType, StageName) fora do cronômetro do CPF.
+
+    Com o cache em disco válido, um arranque a quente não faz nenhum describe.
+    """
     client = sf or _sf_conectar_salesforce(verbose=False)
     if client is None:
         return False
+    try:
+        _sf_meta_campos(client, "Account")
+    except Exception:
+        _sf_logger.warning("Metadados Salesforce: describe de Account falhou", exc_info=True)
     _sf_meta_record_type_id(client)
     _sf_meta_stage_name(client)
     return True
@@ -2025,45 +3913,37 @@ def _sf_consultar_ranking_detalhado(
         return out
 
     try:
-        literais = _sf_literais_cpf(cpf)
-        logs.append(f"CPF={cpf} variantes SOQL ok.")
-
         acc_id = str(account_id or "").strip() or None
         conta = None
 
-        # 1) Account por Id (se ainda existir)
-        if acc_id:
-            recs = (
-                sf.query(
-                    "SELECT Id, Ranking__c, Ranking_Score__c, CPF__c FROM Account "
-                    f"WHERE Id = '{_sf_soql_escape_literal(acc_id)}' LIMIT 1"
-                ).get("records")
-                or []
-            )
-            logs.append(f"Account por Id={acc_id}: {len(recs)} registro(s).")
-            if recs:
-                conta = recs[0]
-            else:
-                logs.append("Account Id não encontrado (possível merge Risk3).")
-                acc_id = None
-
-        # 2) Account por CPF (fonte da verdade após merge)
+        # 1) Uma SOQL pai-filho: Account por Id (se ainda existir) ou por CPF,
+        #    cada uma com as suas Opportunities mais recentes.
         recs = (
             sf.query(
-                "SELECT Id, Ranking__c, Ranking_Score__c, CPF__c FROM Account "
-                f"WHERE CPF__c IN ({literais}) ORDER BY CreatedDate DESC LIMIT 5"
+                _sf_soql_contas_com_oportunidades(
+                    cpfs=[cpf], account_ids=[acc_id] if acc_id else (), limite=6
+                )
             ).get("records")
             or []
         )
-        logs.append(f"Account por CPF: {len(recs)} registro(s).")
-        if recs:
-            # Prefere a conta que já tem ranking; senão a mais recente.
+        por_cpf = [r for r in recs if _sf_normalizar_cpf(r.get("CPF__c")) == cpf]
+        por_id = next((r for r in recs if acc_id and str(r.get("Id")) == acc_id), None)
+        logs.append(
+            f"CPF={cpf}: {len(por_cpf)} Account(s) por CPF; "
+            f"Account por Id={'sim' if por_id else 'não'}."
+        )
+        if acc_id and por_id is None:
+            logs.append("Account Id não encontrado (possível merge Risk3).")
+            acc_id = None
+        conta = por_id
+        if por_cpf:
+            # CPF é a fonte da verdade após merge: prefere a conta que já tem ranking.
             escolhida = None
-            for rec in recs:
+            for rec in por_cpf:
                 if _sf_mapear_ranking_para_ui(rec.get("Ranking__c")):
                     escolhida = rec
                     break
-            conta = escolhida or recs[0]
+            conta = escolhida or por_cpf[0]
             acc_id = str(conta.get("Id") or "") or acc_id
 
         if conta:
@@ -2081,27 +3961,11 @@ def _sf_consultar_ranking_detalhado(
                 out["elapsed_ms"] = int((time.monotonic() - t0) * 1000)
                 return out
 
-        # 3) Opportunities por AccountId e também por CPF da conta
+        # 2) Opportunities da conta escolhida primeiro, depois as das demais contas do CPF
         opps: list[dict[str, Any]] = []
-        if acc_id:
-            opps.extend(
-                sf.query(
-                    "SELECT Id, Name, AccountId, Ranking__c, Ranking_Score__c, CreatedDate "
-                    "FROM Opportunity "
-                    f"WHERE AccountId = '{_sf_soql_escape_literal(acc_id)}' "
-                    "ORDER BY CreatedDate DESC LIMIT 20"
-                ).get("records")
-                or []
-            )
-        opps_cpf = (
-            sf.query(
-                "SELECT Id, Name, AccountId, Ranking__c, Ranking_Score__c, CreatedDate "
-                "FROM Opportunity "
-                f"WHERE Account.CPF__c IN ({literais}) "
-                "ORDER BY CreatedDate DESC LIMIT 20"
-            ).get("records")
-            or []
-        )
+        if conta:
+            opps.extend(_sf_oportunidades_da_conta(conta))
+        opps_cpf = [o for r in recs if r is not conta for o in _sf_oportunidades_da_conta(r)]
         seen_opp: set[str] = set()
         merged_opps: list[dict[str, Any]] = []
         for opp in list(opps) + list(opps_cpf):
@@ -2193,11 +4057,17 @@ def _sf_acionar_consultar_status_cpf(
     account_id: str,
     opportunity_id: str | None = None,
     bypass_risk3: bool = False,
+    timeout_s: float = 90.0,
 ) -> dict[str, Any]:
     """
     Aciona o mesmo botão da UI: Quick Action «Consultar Status CPF»
     (Account.Consultar_Status_CPF / Opportunity.Consultar_Status_CPFOP →
     Flow Consultar_Status_CPF_Serasa → Apex IntegracaoRisk3).
+
+    Cada rota aciona o Risk3 (consulta paga), por isso correm em sequência com um
+    prazo comum: a seguinte só é enviada quando a anterior falhou. A primeira com 2xx
+    fica memorizada por org (cache de metadados), para ser tentada primeiro nas
+    próximas chamadas.
     """
     import requests
 
@@ -2210,15 +4080,24 @@ def _sf_acionar_consultar_status_cpf(
     if sf is None:
         out["error"] = "sem_conexao"
         return out
+    deadline = time.monotonic() + max(1.0, float(timeout_s))
     headers = {
         "Authorization": f"Bearer {sf.session_id}",
         "Content-Type": "application/json",
     }
     base = str(sf.base_url).rstrip("/")
+    # Sessão keep-alive do pool (mesmas conexões TLS das consultas SOQL).
+    http = getattr(sf, "session", None) or requests
+    oid = str(opportunity_id or "").strip() or None
 
-    def _post(via: str, url: str, payload: dict[str, Any]) -> None:
+    def _post(via: str, url: str, payload: dict[str, Any]) -> bool:
+        restante = deadline - time.monotonic()
+        if restante <= 0:
+            out["attempts"].append({"via": via, "error": "prazo_esgotado"})
+            return False
+        _sf_api_contar(via)
         try:
-            resp = requests.post(url, headers=headers, json=payload, timeout=90)
+            resp = http.post(url, headers=headers, json=payload, timeout=restante)
             out["attempts"].append(
                 {
                     "via": via,
@@ -2226,42 +4105,34 @@ def _sf_acionar_consultar_status_cpf(
                     "body": (resp.text or "")[:600],
                 }
             )
-            if 200 <= int(resp.status_code) < 300:
-                out["ok"] = True
+            return 200 <= int(resp.status_code) < 300
         except Exception as exc:  # noqa: BLE001
             out["attempts"].append({"via": via, "error": str(exc)})
+            return False
 
-    _post(
-        "Account.Consultar_Status_CPF",
-        f"{base}/sobjects/Account/quickActions/Consultar_Status_CPF",
-        {"contextId": aid},
-    )
-    oid = str(opportunity_id or "").strip() or None
-    if oid:
-        _post(
-            "Opportunity.Consultar_Status_CPFOP",
-            f"{base}/sobjects/Opportunity/quickActions/Consultar_Status_CPFOP",
-            {"contextId": oid},
-        )
-    # Backend direto do botão (pode falhar por Apex Class Access).
-    try:
-        acc = (
-            sf.query(
-                "SELECT Id, Name, CPF__c, CNPJ__c, Id_Risk3__c, Ranking__c, "
-                "UltimaConsultaCPF__c, Regional__c, Regional_Comercial__c "
-                f"FROM Account WHERE Id = '{_sf_soql_escape_literal(aid)}' LIMIT 1"
-            ).get("records")
-            or [None]
-        )[0]
-        opp = None
-        if oid:
-            opp = (
+    def _apex_integracao_risk3() -> bool:
+        # Backend direto do botão (pode falhar por Apex Class Access).
+        try:
+            acc = (
                 sf.query(
-                    "SELECT Id, Name, AccountId, Ranking__c FROM Opportunity "
-                    f"WHERE Id = '{_sf_soql_escape_literal(oid)}' LIMIT 1"
+                    "SELECT Id, Name, CPF__c, CNPJ__c, Id_Risk3__c, Ranking__c, "
+                    "UltimaConsultaCPF__c, Regional__c, Regional_Comercial__c "
+                    f"FROM Account WHERE Id = '{_sf_soql_escape_literal(aid)}' LIMIT 1"
                 ).get("records")
                 or [None]
             )[0]
+            opp = None
+            if oid:
+                opp = (
+                    sf.query(
+                        "SELECT Id, Name, AccountId, Ranking__c FROM Opportunity "
+                        f"WHERE Id = '{_sf_soql_escape_literal(oid)}' LIMIT 1"
+                    ).get("records")
+                    or [None]
+                )[0]
+        except Exception as exc:  # noqa: BLE001
+            out["attempts"].append({"via": "Apex.IntegracaoRisk3", "error": str(exc)})
+            return False
         payload = {
             "inputs": [
                 {
@@ -2291,21 +4162,65 @@ def _sf_acionar_consultar_status_cpf(
                 }
             ]
         }
-        _post(
+        return _post(
             "Apex.IntegracaoRisk3",
             f"{base}/actions/custom/apex/IntegracaoRisk3",
             payload,
         )
-    except Exception as exc:  # noqa: BLE001
-        out["attempts"].append({"via": "Apex.IntegracaoRisk3", "error": str(exc)})
+
+    rotas: dict[str, Callable[[], bool]] = {
+        "Account.Consultar_Status_CPF": lambda: _post(
+            "Account.Consultar_Status_CPF",
+            f"{base}/sobjects/Account/quickActions/Consultar_Status_CPF",
+            {"contextId": aid},
+        ),
+    }
+    if oid:
+        rotas["Opportunity.Consultar_Status_CPFOP"] = lambda: _post(
+            "Opportunity.Consultar_Status_CPFOP",
+            f"{base}/sobjects/Opportunity/quickActions/Consultar_Status_CPFOP",
+            {"contextId": oid},
+        )
+    rotas["Apex.IntegracaoRisk3"] = _apex_integracao_risk3
+
+    chave_rota = ("rota_consultar_status_cpf", _sf_meta_org())
+    preferida = _SF_META_CACHE.get(chave_rota) or _sf_meta_disco_get("rota_consultar_status_cpf")
+    if preferida in rotas:
+        if rotas.pop(preferida)():
+            out.update(ok=True, via=preferida)
+            _SF_META_CACHE[chave_rota] = preferida
+            return out
+        # A rota memorizada deixou de funcionar: passa às restantes.
+        _SF_META_CACHE.pop(chave_rota, None)
+        _sf_meta_disco_remover("rota_consultar_status_cpf")
+
+    vencedora = _sf_correr_rotas(rotas, deadline)
+    if vencedora:
+        out.update(ok=True, via=vencedora)
+        _SF_META_CACHE[chave_rota] = vencedora
+        _sf_meta_disco_put("rota_consultar_status_cpf", vencedora)
     return out
 
 
-def _ranking_debug_append(linha: str) -> None:
-    """Acumula linhas de debug na sessão (máx. RANKING_DEBUG_LOG_MAX)."""
-    try:
-        bag = list(st.session_state.get("_sf_rank_debug_logs") or [])
-    except Exception:
+def _sf_correr_rotas(rotas: Mapping[str, Callable[[], bool]], deadline: float) -> str | None:
+    """
+    Tenta as rotas pela ordem, uma de cada vez, até ``deadline`` (monotónico); devolve
+    a primeira que retornar True (ou None). Nunca há duas rotas em voo: uma resposta
+    lenta não dispara outra consulta Risk3 para o mesmo CPF.
+    """
+    for via, fn in rotas.items():
+        if time.monotonic() >= deadline:
+            return None
+        if fn():
+            return via
+    return None
+
+
+def _ranking_debug_append(linha: str) -> None:
+    """Acumula linhas de debug na sessão (máx. RANKING_DEBUG_LOG_MAX)."""
+    try:
+        bag = list(st.session_state.get("_sf_rank_debug_logs") or [])
+    except Exception:
         return
     ts = datetime.now().strftime("%H:%M:%S")
     bag.append(f"[{ts}] {linha}")
@@ -2322,6 +4237,32 @@ def _ranking_debug_render(detalhe: Mapping[str, Any] | None = None) -> None:
             f"account_id={pending.get('account_id')!r} | "
             f"opportunity_id={pending.get('opportunity_id')!r}"
         )
+        resumo = _RANKING_METRICAS.resumo()
+        if resumo:
+            st.caption(
+                "latência p95 (ms): "
+                + " | ".join(f"{k}={v['p95']} (n={v['n']})" for k, v in resumo.items())
+            )
+        st.caption(
+            "disjuntores: "
+            + " | ".join(
+                f"{nome}={d.resumo()['estado']}" for nome, d in sorted(_DISJUNTORES.items())
+            )
+        )
+        _espelho = _ranking_export_bulk()
+        if _espelho is not None:
+            _exp = _espelho.resumo()
+            st.caption(
+                f"export Bulk: cpfs={_exp['cpfs']} | watermark={_exp['watermark']!r} | "
+                f"últimas linhas={_exp['linhas_ultima']} | erro={_exp['erro']!r}"
+            )
+        st.caption(
+            "cache: "
+            + " | ".join(
+                f"{camada}={v['hits']}/{v['hits'] + v['misses']}"
+                for camada, v in _ranking_cache_estatisticas().items()
+            )
+        )
         if detalhe:
             st.caption(
                 f"última consulta: code={detalhe.get('code')!r} | "
@@ -2355,21 +4296,23 @@ def _ranking_debug_render(detalhe: Mapping[str, Any] | None = None) -> None:
 
 def _sf_ler_rankings_lote_por_accounts(
     account_ids: list[str],
+    *,
+    propagar_erros: bool = False,
 ) -> dict[str, dict[str, Any]]:
-    """Uma SOQL para vários Account Ids (+ Opportunities) — poll em lote."""
+    """Uma SOQL pai-filho para vários Account Ids (+ Opportunities) — poll em lote."""
     ids = [str(i).strip() for i in account_ids if str(i).strip()]
     if not ids:
         return {}
     sf = _sf_conectar_salesforce(verbose=False)
     if sf is None:
+        if propagar_erros:
+            raise RuntimeError("sem conexão Salesforce")
         return {}
-    literais = ", ".join(f"'{_sf_soql_escape_literal(i)}'" for i in ids)
     out: dict[str, dict[str, Any]] = {}
     try:
         recs = (
-            sf.query(
-                "SELECT Id, Ranking__c, Ranking_Score__c FROM Account "
-                f"WHERE Id IN ({literais})"
+            sf.query_all(
+                _sf_soql_contas_com_oportunidades(account_ids=ids, limite_opps=5)
             ).get("records")
             or []
         )
@@ -2381,42 +4324,27 @@ def _sf_ler_rankings_lote_por_accounts(
                 "raw": raw,
                 "score": rec.get("Ranking_Score__c"),
             }
-        # Ranking pode chegar primeiro na Opportunity criada pela automação.
-        opps = (
-            sf.query(
-                "SELECT Id, AccountId, Ranking__c, Ranking_Score__c FROM Opportunity "
-                f"WHERE AccountId IN ({literais}) ORDER BY CreatedDate DESC"
-            ).get("records")
-            or []
-        )
-        for opp in opps:
-            acc = str(opp.get("AccountId") or "")
-            if not acc:
-                continue
-            rk = _sf_mapear_ranking_para_ui(opp.get("Ranking__c"))
-            if not rk:
+            if out[rid]["ranking"]:
                 continue
-            atual = out.get(acc) or {}
-            if not atual.get("ranking"):
-                out[acc] = {
-                    "ranking": rk,
-                    "raw": opp.get("Ranking__c"),
-                    "score": opp.get("Ranking_Score__c"),
-                    "from_opportunity": True,
-                }
+            # Ranking pode chegar primeiro na Opportunity criada pela automação.
+            for opp in _sf_oportunidades_da_conta(rec):
+                rk = _sf_mapear_ranking_para_ui(opp.get("Ranking__c"))
+                if rk:
+                    out[rid] = {
+                        "ranking": rk,
+                        "raw": opp.get("Ranking__c"),
+                        "score": opp.get("Ranking_Score__c"),
+                        "from_opportunity": True,
+                    }
+                    break
     except Exception:
+        if propagar_erros:
+            raise
         _sf_logger.exception("Falha SOQL lote de rankings")
         return out
     return out
 
 
-def _sf_poll_ui_interval(decorrido_s: float) -> float:
-    """1 s nos primeiros 10 s; depois 2 s."""
-    if decorrido_s <= RANKING_UI_POLL_FAST_WINDOW_S:
-        return RANKING_UI_POLL_FAST_S
-    return RANKING_UI_POLL_SLOW_S
-
-
 def _sf_poll_ui_config() -> tuple[float, float]:
     """Teto total e intervalo base (segundos) do polling automático da interface."""
     try:
@@ -2428,6 +4356,212 @@ def _sf_poll_ui_config() -> tuple[float, float]:
     return maximo, RANKING_UI_POLL_FAST_S
 
 
+class _RankingPollerLote:
+    """
+    Poller único do processo para contas à espera do Risk3: junta as Account Ids
+    pendentes de todas as sessões e faz uma SOQL em lote por ciclo. Resultados vão
+    para o RankingNotificador (mapa partilhado), lido pelas sessões sem rede.
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._pendentes: dict[str, dict[str, Any]] = {}
+        self._thread: threading.Thread | None = None
+        self._acordar = threading.Event()
+        self.ciclos = 0
+        self.consultas = 0
+        self.falhas_seguidas = 0
+
+    def registrar(
+        self,
+        account_id: str | None,
+        *,
+        cpf: str | None = None,
+        opportunity_id: str | None = None,
+        sessao: str | None = None,
+    ) -> None:
+        aid = str(account_id or "").strip()
+        if not aid:
+            return
+        with self._lock:
+            atual = self._pendentes.get(aid)
+            if atual is None:
+                atual = self._pendentes[aid] = {
+                    "cpf": cpf,
+                    "opportunity_id": opportunity_id,
+                    "desde": time.monotonic(),
+                    "sessoes": set(),
+                }
+                self._acordar.set()
+            if sessao:
+                atual["sessoes"].add(sessao)
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(
+                    target=self._loop, name="dv-ranking-poller", daemon=True
+                )
+                self._thread.start()
+
+    def cancelar(self, account_id: str | None, *, sessao: str | None = None) -> None:
+        """A sessão deixa de aguardar a conta; sai do lote quando ninguém mais espera."""
+        aid = str(account_id or "").strip()
+        with self._lock:
+            atual = self._pendentes.get(aid)
+            if atual is None:
+                return
+            atual["sessoes"].discard(sessao)
+            if not atual["sessoes"]:
+                del self._pendentes[aid]
+
+    def monitorando(self, account_id: str | None) -> bool:
+        with self._lock:
+            return str(account_id or "").strip() in self._pendentes
+
+    def _intervalo(self) -> float:
+        """Rápido enquanto há contas recentes; espaça com a idade; backoff em falhas."""
+        if self.falhas_seguidas:
+            return min(60.0, RANKING_UI_POLL_SLOW_S * (2 ** self.falhas_seguidas))
+        if _ranking_notificador().ativo:
+            return RANKING_EVENTOS_FALLBACK_POLL_S
+        with self._lock:
+            idades = [time.monotonic() - p["desde"] for p in self._pendentes.values()]
+        if not idades:
+            return RANKING_UI_POLL_SLOW_S
+        mais_nova = min(idades)
+        if mais_nova <= RANKING_UI_POLL_FAST_WINDOW_S:
+            return RANKING_UI_POLL_FAST_S
+        return min(10.0, RANKING_UI_POLL_SLOW_S * (1 + mais_nova // RANKING_UI_POLL_FAST_WINDOW_S))
+
+    def _loop(self) -> None:
+        maximo, _ = _sf_poll_ui_config()
+        while True:
+            with self._lock:
+                # Limpa antes do instantâneo: um registrar() depois dele volta a acordar.
+                self._acordar.clear()
+                agora = time.monotonic()
+                for aid in [a for a, p in self._pendentes.items() if agora - p["desde"] > maximo]:
+                    self._pendentes.pop(aid, None)
+                ids = list(self._pendentes)
+                if not ids:
+                    self._thread = None
+                    return
+            self.ciclos += 1
+            try:
+                resolvidos: dict[str, dict[str, Any]] = {}
+                for lote in _ranking_lote_fatiar_in(ids, lambda i: f"'{i}'"):
+                    resolvidos.update(
+                        _sf_ler_rankings_lote_por_accounts(lote, propagar_erros=True)
+                    )
+                    self.consultas += 1
+                self.falhas_seguidas = 0
+            except Exception as exc:  # noqa: BLE001
+                self.falhas_seguidas = min(self.falhas_seguidas + 1, 6)
+                _sf_logger.warning("Poller de ranking: falha no ciclo (%s).", exc)
+                resolvidos = {}
+            notificador = _ranking_notificador()
+            for aid, info in resolvidos.items():
+                if not info.get("ranking"):
+                    continue
+                with self._lock:
+                    pend = self._pendentes.pop(aid, None) or {}
+                notificador.publicar(
+                    {
+                        "account_id": aid,
+                        "opportunity_id": pend.get("opportunity_id"),
+                        "cpf": pend.get("cpf"),
+                        "ranking": info["ranking"],
+                        "ranking_raw": info.get("raw"),
+                        "origem": "poller_lote",
+                    }
+                )
+            self._acordar.wait(self._intervalo())
+
+
+_RANKING_POLLER: dict[str, Any] = {"p": None}
+
+
+def _ranking_poller() -> _RankingPollerLote:
+    with _RANKING_NOTIFICADOR_LOCK:
+        if _RANKING_POLLER["p"] is None:
+            _RANKING_POLLER["p"] = _RankingPollerLote()
+        return _RANKING_POLLER["p"]
+
+
+def _ranking_poller_sessao() -> str:
+    """Identificador da sessão Streamlit junto do poller (quem espera cada conta)."""
+    return st.session_state.setdefault("_dv_ranking_poller_sessao", uuid.uuid4().hex)
+
+
+def _sf_id_duplicado(erros: Any) -> str | None:
+    """Id do registo existente num erro DUPLICATES_DETECTED (duplicateResult.matchRecords)."""
+    for item in erros if isinstance(erros, list) else []:
+        dup = (item or {}).get("duplicateResult") or {}
+        for mr in dup.get("matchResults") or []:
+            for rec in mr.get("matchRecords") or []:
+                rid = ((rec or {}).get("record") or {}).get("Id")
+                if rid:
+                    return str(rid)
+    return None
+
+
+def _sf_criar_conta_opp_grafo(
+    sf: Any,
+    cpf_mascarado: str,
+    payload_conta: Mapping[str, Any],
+    payload_opp: Mapping[str, Any],
+) -> dict[str, Any]:
+    """
+    Account + Opportunity num único pedido Composite Graph (tudo ou nada); a
+    Opportunity referencia a conta por «@{conta.id}». A conta vai sempre por POST:
+    um upsert por CPF__c gravaria o nome/e-mail provisórios por cima de um cliente
+    real. CPF já existente faz o grafo falhar e o chamador reaproveita a conta pelo
+    erro de duplicado (_sf_id_duplicado) ou pela consulta por CPF.
+
+    Devolve account_id/opportunity_id/account_created/opportunity_created, ou
+    «erros_conta» (corpo do erro do nó da conta) quando o grafo falha.
+    """
+    base = "/services/data/v{}/sobjects".format(
+        str(getattr(sf, "sf_version", "59.0") or "59.0")
+    )
+    no_conta = {
+        "method": "POST",
+        "url": f"{base}/Account",
+        "referenceId": "conta",
+        "body": dict(payload_conta),
+    }
+    grafo = {
+        "graphs": [
+            {
+                "graphId": "ranking",
+                "compositeRequest": [
+                    no_conta,
+                    {
+                        "method": "POST",
+                        "url": f"{base}/Opportunity",
+                        "referenceId": "oportunidade",
+                        "body": {**payload_opp, "AccountId": "@{conta.id}"},
+                    },
+                ],
+            }
+        ]
+    }
+    resp = sf.restful("composite/graph", method="POST", json=grafo) or {}
+    g = ((resp.get("graphs") or [{}])[0]) or {}
+    nos = {
+        str(n.get("referenceId")): n
+        for n in ((g.get("graphResponse") or {}).get("compositeResponse") or [])
+    }
+    if not g.get("isSuccessful"):
+        return {"erros_conta": (nos.get("conta") or {}).get("body")}
+    corpo_conta = (nos.get("conta") or {}).get("body") or {}
+    corpo_opp = (nos.get("oportunidade") or {}).get("body") or {}
+    return {
+        "account_id": str(corpo_conta.get("id") or "") or None,
+        "account_created": bool(corpo_conta.get("id")),
+        "opportunity_id": str(corpo_opp.get("id") or "") or None,
+        "opportunity_created": bool(corpo_opp.get("id")),
+    }
+
+
 def _sf_criar_account_opp_rapido(
     sf: Any,
     cpf: str,
@@ -2436,7 +4570,11 @@ def _sf_criar_account_opp_rapido(
     oportunidade: dict[str, Any] | None,
     deadline: float,
 ) -> dict[str, Any]:
-    """Cria Account/Opportunity ausentes sem polling bloqueante."""
+    """
+    Cria Account/Opportunity ausentes sem polling bloqueante. CPF frio (sem conta):
+    um só pedido Composite Graph; só se o grafo falhar (ex.: CPF duplicado sem
+    External ID) cai no caminho sequencial com recuperação do duplicado.
+    """
     import secrets
     import string
 
@@ -2447,6 +4585,13 @@ def _sf_criar_account_opp_rapido(
     account_created = False
     opportunity_created = False
 
+    def _payload_opp() -> dict[str, Any]:
+        return {
+            "Name": f"Classificacao Ranking {cpf_mascarado}"[:120],
+            "StageName": _sf_meta_stage_name(sf),
+            "CloseDate": (date.today() + timedelta(days=30)).isoformat(),
+        }
+
     if account_id is None:
         if time.monotonic() > deadline:
             return {
@@ -2479,40 +4624,37 @@ def _sf_criar_account_opp_rapido(
             "PersonEmail": email,
             "Unidade_de_negocio__c": "Direcional",
         }
-        try:
-            criado = sf.Account.create(payload_conta)
-            account_id = str(criado.get("id") or "").strip() or None
-            account_created = bool(account_id)
-        except Exception as exc_criar:
-            recuperadas = (
-                sf.query(
-                    "SELECT Id FROM Account "
-                    f"WHERE CPF__c IN ({literais}) LIMIT 2"
-                ).get("records")
-                or []
-            )
-            if len(recuperadas) == 1:
-                account_id = str(recuperadas[0]["Id"])
-            else:
-                match_id = None
-                content = getattr(exc_criar, "content", None)
-                if isinstance(content, list):
-                    for item in content:
-                        dup = (item or {}).get("duplicateResult") or {}
-                        for mr in dup.get("matchResults") or []:
-                            for rec in mr.get("matchRecords") or []:
-                                rid = ((rec or {}).get("record") or {}).get("Id")
-                                if rid:
-                                    match_id = str(rid)
-                                    break
-                            if match_id:
-                                break
-                        if match_id:
-                            break
-                if match_id:
-                    account_id = match_id
+        erros_conta: Any = None
+        if opportunity_id is None:
+            try:
+                grafo = _sf_criar_conta_opp_grafo(sf, cpf_mascarado, payload_conta, _payload_opp())
+            except Exception as exc_grafo:  # noqa: BLE001
+                _sf_logger.warning("Composite Graph indisponível (%s); criação sequencial.", exc_grafo)
+                grafo = {}
+            if grafo.get("account_id") and grafo.get("opportunity_id"):
+                return {"error": None, **grafo}
+            erros_conta = grafo.get("erros_conta")
+            # Duplicado já identificado pelo grafo: reutiliza a conta sem nova tentativa.
+            account_id = _sf_id_duplicado(erros_conta)
+        if account_id is None:
+            try:
+                criado = sf.Account.create(payload_conta)
+                account_id = str(criado.get("id") or "").strip() or None
+                account_created = bool(account_id)
+            except Exception as exc_criar:
+                recuperadas = (
+                    sf.query(
+                        "SELECT Id FROM Account "
+                        f"WHERE CPF__c IN ({literais}) LIMIT 2"
+                    ).get("records")
+                    or []
+                )
+                if len(recuperadas) == 1:
+                    account_id = str(recuperadas[0]["Id"])
                 else:
-                    raise
+                    account_id = _sf_id_duplicado(getattr(exc_criar, "content", None))
+                    if not account_id:
+                        raise
 
     if not account_id:
         return {
@@ -2529,14 +4671,7 @@ def _sf_criar_account_opp_rapido(
                 "opportunity_id": None,
                 "account_created": account_created,
             }
-        stage_name = _sf_meta_stage_name(sf)
-        payload_opp = {
-            "AccountId": account_id,
-            "Name": f"Classificacao Ranking {cpf_mascarado}"[:120],
-            "StageName": stage_name,
-            "CloseDate": (date.today() + timedelta(days=30)).isoformat(),
-        }
-        criado = sf.Opportunity.create(payload_opp)
+        criado = sf.Opportunity.create({"AccountId": account_id, **_payload_opp()})
         opportunity_id = str(criado.get("id") or "").strip() or None
         opportunity_created = bool(opportunity_id)
 
@@ -2549,125 +4684,587 @@ def _sf_criar_account_opp_rapido(
     }
 
 
-def _sf_cleanup_teste_ranking(
-    account_id: str,
-    *,
-    only_diresimulator: bool = True,
+def _sf_collections_delete(
+    sf: Any, ids: list[str], *, all_or_none: bool = False
+) -> list[dict[str, Any]]:
+    """
+    sObject Collections DELETE (composite/sobjects?ids=...): até SF_COLLECTIONS_MAX ids por
+    chamada, apagados na ordem dada. Devolve um resultado {id, success, errors} por Id.
+    """
+    resultados: list[dict[str, Any]] = []
+    for i in range(0, len(ids), SF_COLLECTIONS_MAX):
+        fatia = ids[i : i + SF_COLLECTIONS_MAX]
+        resp = sf.restful(
+            "composite/sobjects",
+            params={"ids": ",".join(fatia), "allOrNone": str(bool(all_or_none)).lower()},
+            method="DELETE",
+        )
+        resultados.extend(resp if isinstance(resp, list) else [])
+    return resultados
+
+
+def _sf_cleanup_plano(
+    sf: Any, account_ids: list[str], *, only_diresimulator: bool
 ) -> dict[str, Any]:
     """
-    Exclui objetos de teste na ordem:
-    RelacionamentoComprador__c → Opportunity → Account.
+    Plano de exclusão em lote, filhos primeiro: RelacionamentoComprador__c (pela conta e
+    pelas oportunidades) → Opportunity → Account. SOQL com IN fatiado, não por registo.
     """
-    sf = _sf_conectar_salesforce(verbose=False)
-    if sf is None:
-        return {"ok": False, "error": "sem_conexao"}
-    acc_id = str(account_id or "").strip()
-    if not acc_id:
-        return {"ok": False, "error": "account_id_vazio"}
-    try:
-        contas = (
-            sf.query(
+    ids = list(dict.fromkeys(str(a or "").strip() for a in account_ids if str(a or "").strip()))
+    literal = lambda i: f"'{_sf_soql_escape_literal(i)}'"  # noqa: E731
+    contas: list[dict[str, Any]] = []
+    for lote in _ranking_lote_fatiar_in(ids, literal):
+        contas.extend(
+            sf.query_all(
                 "SELECT Id, Name, FirstName FROM Account "
-                f"WHERE Id = '{_sf_soql_escape_literal(acc_id)}' LIMIT 1"
+                f"WHERE Id IN ({', '.join(map(literal, lote))})"
             ).get("records")
             or []
         )
-        if not contas:
-            return {"ok": True, "already_gone": True}
-        nome = str(contas[0].get("Name") or "")
-        first = str(contas[0].get("FirstName") or "")
-        if only_diresimulator and (
-            first.strip().casefold() != "diresimulator"
-            and not nome.strip().casefold().startswith("diresimulator")
-        ):
-            return {"ok": False, "error": "conta_nao_e_teste", "name": nome}
-
-        apagados_rel = 0
-        # 1) Relacionamentos com comprador
-        for campo in ("AccountId", "BuyerId", "BuyerAccountId", "Conta__c"):
-            try:
-                rels = (
-                    sf.query(
-                        "SELECT Id FROM RelacionamentoComprador__c "
-                        f"WHERE {campo} = '{_sf_soql_escape_literal(acc_id)}' LIMIT 100"
-                    ).get("records")
-                    or []
-                )
-            except Exception:
-                continue
-            for rel in rels:
-                sf.RelacionamentoComprador__c.delete(str(rel["Id"]))
-                apagados_rel += 1
-
-        # 2) Opportunities
-        opps = (
-            sf.query(
-                "SELECT Id FROM Opportunity "
-                f"WHERE AccountId = '{_sf_soql_escape_literal(acc_id)}' LIMIT 50"
+    plano: dict[str, Any] = {
+        "ausentes": sorted(set(ids) - {str(c["Id"]) for c in contas}),
+        "nao_teste": [],
+        "contas": [],
+        "oportunidades": [],
+        "relacionamentos": [],
+        "conta_da_oportunidade": {},
+    }
+    for conta in contas:
+        nome = str(conta.get("Name") or "").strip().casefold()
+        first = str(conta.get("FirstName") or "").strip().casefold()
+        if only_diresimulator and first != "diresimulator" and not nome.startswith("diresimulator"):
+            plano["nao_teste"].append({"id": conta["Id"], "name": conta.get("Name")})
+        else:
+            plano["contas"].append(str(conta["Id"]))
+    for lote in _ranking_lote_fatiar_in(plano["contas"], literal):
+        for r in (
+            sf.query_all(
+                "SELECT Id, AccountId FROM Opportunity "
+                f"WHERE AccountId IN ({', '.join(map(literal, lote))})"
             ).get("records")
             or []
-        )
-        apagados_opp = 0
-        for opp in opps:
-            # relacionamentos ligados à opportunity, se houver
-            try:
-                rels_opp = (
-                    sf.query(
+        ):
+            plano["oportunidades"].append(str(r["Id"]))
+            plano["conta_da_oportunidade"][str(r["Id"])] = str(r.get("AccountId") or "")
+    rels: dict[str, None] = {}
+    for campo, alvos in (
+        ("AccountId", plano["contas"]),
+        ("BuyerId", plano["contas"]),
+        ("BuyerAccountId", plano["contas"]),
+        ("Conta__c", plano["contas"]),
+        ("OpportunityId", plano["oportunidades"]),
+    ):
+        try:
+            for lote in _ranking_lote_fatiar_in(alvos, literal):
+                for r in (
+                    sf.query_all(
                         "SELECT Id FROM RelacionamentoComprador__c "
-                        f"WHERE OpportunityId = '{_sf_soql_escape_literal(opp['Id'])}' "
-                        "LIMIT 50"
+                        f"WHERE {campo} IN ({', '.join(map(literal, lote))})"
                     ).get("records")
                     or []
-                )
-                for rel in rels_opp:
-                    sf.RelacionamentoComprador__c.delete(str(rel["Id"]))
-                    apagados_rel += 1
-            except Exception:
-                pass
-            sf.Opportunity.delete(str(opp["Id"]))
-            apagados_opp += 1
+                ):
+                    rels[str(r["Id"])] = None
+        except Exception:
+            # Campo inexistente neste org: a consulta falha e tenta-se o próximo.
+            continue
+    plano["relacionamentos"] = list(rels)
+    return plano
 
-        restam_opp = (
-            sf.query(
-                "SELECT Id FROM Opportunity "
-                f"WHERE AccountId = '{_sf_soql_escape_literal(acc_id)}' LIMIT 1"
-            ).get("records")
-            or []
-        )
-        if restam_opp:
-            return {
-                "ok": False,
-                "error": "opportunity_ainda_existe",
-                "opportunity_id": restam_opp[0]["Id"],
-                "deleted_rels": apagados_rel,
-                "deleted_opps": apagados_opp,
-            }
 
-        # 3) Account
-        sf.Account.delete(acc_id)
-        restam_acc = (
-            sf.query(
-                "SELECT Id FROM Account "
-                f"WHERE Id = '{_sf_soql_escape_literal(acc_id)}' LIMIT 1"
-            ).get("records")
-            or []
-        )
-        if restam_acc:
-            return {
-                "ok": False,
-                "error": "account_ainda_existe",
-                "deleted_rels": apagados_rel,
-                "deleted_opps": apagados_opp,
-            }
-        return {
+def _sf_cleanup_teste_ranking_lote(
+    account_ids: list[str],
+    *,
+    only_diresimulator: bool = True,
+    dry_run: bool = False,
+) -> dict[str, Any]:
+    """
+    Exclui contas de teste e dependentes via sObject Collections (200 Ids por chamada),
+    filhos primeiro. Com dry_run, só devolve o plano. O relatório traz contagens,
+    falhas por Id, chamadas à API e vazão (registos/s).
+    """
+    t0 = time.monotonic()
+    chamadas: dict[str, int] = {}
+    tok = _SF_API_CHAMADAS_CTX.set(chamadas)
+    try:
+        sf = _sf_conectar_salesforce(verbose=False)
+        if sf is None:
+            return {"ok": False, "error": "sem_conexao"}
+        plano = _sf_cleanup_plano(sf, account_ids, only_diresimulator=only_diresimulator)
+        relatorio: dict[str, Any] = {
             "ok": True,
-            "deleted_rels": apagados_rel,
-            "deleted_opps": apagados_opp,
-            "deleted_account": True,
+            "dry_run": bool(dry_run),
+            "plano": plano,
+            "apagados": {"relacionamentos": 0, "oportunidades": 0, "contas": 0},
+            "falhas": [],
         }
+        if not dry_run:
+            for etapa in ("relacionamentos", "oportunidades", "contas"):
+                alvo = plano[etapa]
+                if etapa == "contas":
+                    # Conta cuja oportunidade não saiu fica, para não apagar em cascata às cegas.
+                    presas = {
+                        plano["conta_da_oportunidade"].get(f["id"])
+                        for f in relatorio["falhas"]
+                        if f["etapa"] == "oportunidades"
+                    }
+                    alvo = [a for a in alvo if a not in presas]
+                for res in _sf_collections_delete(sf, alvo):
+                    if res.get("success"):
+                        relatorio["apagados"][etapa] += 1
+                    else:
+                        relatorio["falhas"].append(
+                            {"etapa": etapa, "id": res.get("id"), "errors": res.get("errors")}
+                        )
+            relatorio["ok"] = not relatorio["falhas"]
     except Exception as exc:  # noqa: BLE001
         _sf_logger.exception("Falha no cleanup de teste")
         return {"ok": False, "error": str(exc)}
+    finally:
+        _SF_API_CHAMADAS_CTX.reset(tok)
+    decorrido = time.monotonic() - t0
+    total = sum(relatorio["apagados"].values()) if not dry_run else sum(
+        len(plano[k]) for k in ("relacionamentos", "oportunidades", "contas")
+    )
+    relatorio["chamadas_api"] = sum(chamadas.values())
+    relatorio["chamadas_por_metodo"] = chamadas
+    relatorio["elapsed_s"] = round(decorrido, 3)
+    relatorio["registros_por_s"] = round(total / decorrido, 1) if decorrido > 0 else None
+    _sf_logger.info(
+        "Cleanup de teste%s: %s registos, %s chamadas, %.2fs",
+        " (simulação)" if dry_run else "",
+        total,
+        relatorio["chamadas_api"],
+        decorrido,
+    )
+    return relatorio
+
+
+def _sf_cleanup_teste_ranking(
+    account_id: str,
+    *,
+    only_diresimulator: bool = True,
+    dry_run: bool = False,
+) -> dict[str, Any]:
+    """
+    Exclui objetos de teste na ordem:
+    RelacionamentoComprador__c → Opportunity → Account (ver _sf_cleanup_teste_ranking_lote).
+    """
+    acc_id = str(account_id or "").strip()
+    if not acc_id:
+        return {"ok": False, "error": "account_id_vazio"}
+    rel = _sf_cleanup_teste_ranking_lote(
+        [acc_id], only_diresimulator=only_diresimulator, dry_run=dry_run
+    )
+    plano = rel.get("plano")
+    if plano is None:
+        return rel
+    if plano["ausentes"]:
+        return {"ok": True, "already_gone": True}
+    if plano["nao_teste"]:
+        return {"ok": False, "error": "conta_nao_e_teste", "name": plano["nao_teste"][0]["name"]}
+    if dry_run:
+        return rel
+    apagados = rel["apagados"]
+    out = {
+        "ok": rel["ok"],
+        "deleted_rels": apagados["relacionamentos"],
+        "deleted_opps": apagados["oportunidades"],
+        "deleted_account": apagados["contas"] == 1,
+    }
+    for falha in rel["falhas"]:
+        if falha["etapa"] == "oportunidades":
+            return {**out, "ok": False, "error": "opportunity_ainda_existe", "opportunity_id": falha["id"]}
+    if not out["deleted_account"]:
+        return {**out, "ok": False, "error": "account_ainda_existe"}
+    return out
+
+
+# Métricas do pipeline de ranking: spans por etapa (duração + resultado), histogramas
+# cumulativos desde o arranque, percentis em janela deslizante por processo e chamadas à
+# API Salesforce por CPF. Exportação em texto Prometheus (DV_RANKING_METRICAS_PROM) e/ou
+# JSON lines (DV_RANKING_METRICAS_JSONL).
+_RANKING_METRICAS_BUCKETS_MS = (10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+_RANKING_METRICAS_BUCKETS_API = (0, 1, 2, 3, 5, 8, 13, 21)
+_RANKING_SPANS_CTX: ContextVar[list[dict[str, Any]] | None] = ContextVar(
+    "dv_ranking_spans", default=None
+)
+_SF_API_CHAMADAS_CTX: ContextVar[dict[str, int] | None] = ContextVar(
+    "dv_sf_api_chamadas", default=None
+)
+
+
+class _RankingMetricas:
+    """
+    Histogramas Prometheus cumulativos (contadores por bucket, nunca descem) e amostras
+    (instante, valor) em deques com janela, das quais saem os percentis de resumo().
+    """
+
+    def __init__(self, janela_s: float, max_amostras: int = 5000):
+        self.janela_s = float(janela_s)
+        self.max_amostras = int(max_amostras)
+        self._etapas: dict[tuple[str, str], deque] = {}
+        self._api_total: dict[str, int] = {}
+        self._hist_etapas: dict[tuple[str, str], dict[str, Any]] = {}
+        self._hist_api = self._histograma_novo(_RANKING_METRICAS_BUCKETS_API)
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _histograma_novo(buckets: Iterable[float]) -> dict[str, Any]:
+        limites = tuple(buckets)
+        return {"limites": limites, "contagens": [0] * len(limites), "n": 0, "soma": 0.0}
+
+    @staticmethod
+    def _histograma_observar(hist: dict[str, Any], valor: float) -> None:
+        for i, le in enumerate(hist["limites"]):
+            if valor <= le:
+                hist["contagens"][i] += 1
+        hist["n"] += 1
+        hist["soma"] += valor
+
+    def _podar(self, amostras: deque) -> None:
+        limite = time.time() - self.janela_s
+        while amostras and amostras[0][0] < limite:
+            amostras.popleft()
+
+    def registrar(self, etapa: str, resultado: str, ms: float) -> None:
+        with self._lock:
+            amostras = self._etapas.setdefault(
+                (etapa, resultado), deque(maxlen=self.max_amostras)
+            )
+            amostras.append((time.time(), float(ms)))
+            hist = self._hist_etapas.get((etapa, resultado))
+            if hist is None:
+                hist = self._histograma_novo(_RANKING_METRICAS_BUCKETS_MS)
+                self._hist_etapas[(etapa, resultado)] = hist
+            self._histograma_observar(hist, float(ms))
+
+    def registrar_api(self, metodo: str) -> None:
+        with self._lock:
+            self._api_total[metodo] = self._api_total.get(metodo, 0) + 1
+
+    def registrar_chamadas_cpf(self, n: int) -> None:
+        with self._lock:
+            self._histograma_observar(self._hist_api, float(n))
+
+    def resumo(self) -> dict[str, dict[str, Any]]:
+        """n, p50, p95 e máximo (ms) por «etapa/resultado» dentro da janela."""
+        out: dict[str, dict[str, Any]] = {}
+        with self._lock:
+            for (etapa, resultado), amostras in sorted(self._etapas.items()):
+                self._podar(amostras)
+                if not amostras:
+                    continue
+                valores = np.fromiter((v for _, v in amostras), dtype=float)
+                out[f"{etapa}/{resultado}"] = {
+                    "n": int(valores.size),
+                    "p50": round(float(np.percentile(valores, 50)), 1),
+                    "p95": round(float(np.percentile(valores, 95)), 1),
+                    "max": round(float(valores.max()), 1),
+                }
+        return out
+
+    @staticmethod
+    def _histograma(nome: str, rotulos: str, hist: Mapping[str, Any]) -> list[str]:
+        linhas = [
+            f'{nome}_bucket{{{rotulos}le="{le}"}} {n}'
+            for le, n in zip(hist["limites"], hist["contagens"])
+        ]
+        linhas.append(f'{nome}_bucket{{{rotulos}le="+Inf"}} {hist["n"]}')
+        sufixo = f"{{{rotulos.rstrip(',')}}}" if rotulos else ""
+        linhas.append(f"{nome}_sum{sufixo} {round(hist['soma'], 3)}")
+        linhas.append(f"{nome}_count{sufixo} {hist['n']}")
+        return linhas
+
+    def prometheus(self) -> str:
+        linhas = [
+            "# HELP dv_ranking_etapa_ms Duração das etapas do pipeline de ranking (desde o arranque).",
+            "# TYPE dv_ranking_etapa_ms histogram",
+        ]
+        with self._lock:
+            for (etapa, resultado), hist in sorted(self._hist_etapas.items()):
+                linhas += self._histograma(
+                    "dv_ranking_etapa_ms", f'etapa="{etapa}",resultado="{resultado}",', hist
+                )
+            linhas += [
+                "# HELP dv_ranking_sf_api_chamadas_por_cpf Chamadas à API Salesforce por classificação.",
+                "# TYPE dv_ranking_sf_api_chamadas_por_cpf histogram",
+            ]
+            linhas += self._histograma("dv_ranking_sf_api_chamadas_por_cpf", "", self._hist_api)
+            linhas += [
+                "# HELP dv_salesforce_api_chamadas_total Chamadas à API Salesforce desde o arranque.",
+                "# TYPE dv_salesforce_api_chamadas_total counter",
+            ]
+            linhas += [
+                f'dv_salesforce_api_chamadas_total{{metodo="{m}"}} {n}'
+                for m, n in sorted(self._api_total.items())
+            ]
+        linhas += [
+            "# HELP dv_ranking_etapa_janela_ms Percentis da duração das etapas na janela deslizante.",
+            "# TYPE dv_ranking_etapa_janela_ms gauge",
+        ]
+        for chave, r in self.resumo().items():
+            etapa, resultado = chave.split("/", 1)
+            for quantil, campo in (("0.5", "p50"), ("0.95", "p95"), ("1", "max")):
+                linhas.append(
+                    f'dv_ranking_etapa_janela_ms{{etapa="{etapa}",resultado="{resultado}",'
+                    f'quantil="{quantil}"}} {r[campo]}'
+                )
+        return "\n".join(linhas) + "\n"
+
+
+_RANKING_METRICAS = _RankingMetricas(RANKING_METRICAS_JANELA_S)
+_RANKING_METRICAS_EXPORT: dict[str, Any] = {"prom_em": 0.0, "lock": threading.Lock()}
+
+
+def _sf_api_contar(metodo: str) -> None:
+    """Conta uma chamada à API (total do processo e, se houver, do CPF em curso)."""
+    _RANKING_METRICAS.registrar_api(metodo)
+    chamadas = _SF_API_CHAMADAS_CTX.get()
+    if chamadas is not None:
+        chamadas[metodo] = chamadas.get(metodo, 0) + 1
+
+
+@contextmanager
+def _ranking_span(etapa: str) -> Iterator[dict[str, Any]]:
+    """Mede uma etapa; o chamador marca sp["resultado"] (hit, miss, ok, erro, ...)."""
+    sp: dict[str, Any] = {"etapa": etapa, "resultado": "ok"}
+    inicio = time.perf_counter()
+    try:
+        yield sp
+    except BaseException:
+        sp["resultado"] = "erro"
+        raise
+    finally:
+        sp["ms"] = round((time.perf_counter() - inicio) * 1000, 1)
+        _RANKING_METRICAS.registrar(etapa, str(sp["resultado"]), sp["ms"])
+        spans = _RANKING_SPANS_CTX.get()
+        if spans is not None:
+            spans.append(sp)
+
+
+def ranking_metricas_prometheus() -> str:
+    """Métricas do pipeline de ranking no formato de texto do Prometheus."""
+    return _RANKING_METRICAS.prometheus()
+
+
+def _ranking_metricas_exportar(res: Mapping[str, Any]) -> None:
+    """JSON lines: uma linha por classificação. Prometheus: ficheiro reescrito a cada 15 s."""
+    caminho_jsonl = (os.environ.get("DV_RANKING_METRICAS_JSONL") or "").strip()
+    caminho_prom = (os.environ.get("DV_RANKING_METRICAS_PROM") or "").strip()
+    try:
+        if caminho_jsonl:
+            linha = {
+                "ts": datetime.now(timezone.utc).isoformat(),
+                "cpf_masked": res.get("cpf_masked"),
+                "status": res.get("status"),
+                "source": res.get("source"),
+                "elapsed_seconds": res.get("elapsed_seconds"),
+                "sf_api_calls": res.get("sf_api_calls"),
+                "spans": res.get("spans"),
+            }
+            with _RANKING_METRICAS_EXPORT["lock"], open(caminho_jsonl, "a", encoding="utf-8") as f:
+                f.write(json.dumps(linha, ensure_ascii=False) + "\n")
+        if caminho_prom and time.time() - _RANKING_METRICAS_EXPORT["prom_em"] >= 15.0:
+            _RANKING_METRICAS_EXPORT["prom_em"] = time.time()
+            tmp = f"{caminho_prom}.tmp"
+            with open(tmp, "w", encoding="utf-8") as f:
+                f.write(ranking_metricas_prometheus())
+            os.replace(tmp, caminho_prom)
+    except OSError:
+        _sf_logger.warning("Métricas de ranking: falha ao exportar", exc_info=True)
+
+
+def _ranking_pipeline_medido(cpf: str, **kwargs: Any) -> dict[str, Any]:
+    """Executa o pipeline com spans e contador de API por CPF anexados ao resultado."""
+    spans: list[dict[str, Any]] = []
+    chamadas: dict[str, int] = {}
+    tok_spans = _RANKING_SPANS_CTX.set(spans)
+    tok_api = _SF_API_CHAMADAS_CTX.set(chamadas)
+    try:
+        res = _ranking_pipeline_executar(cpf, **kwargs)
+    finally:
+        _RANKING_SPANS_CTX.reset(tok_spans)
+        _SF_API_CHAMADAS_CTX.reset(tok_api)
+    res["spans"] = spans
+    res["sf_api_calls"] = sum(chamadas.values())
+    res["sf_api_calls_por_metodo"] = chamadas
+    _RANKING_METRICAS.registrar(
+        "total", str(res.get("status")), float(res.get("elapsed_seconds") or 0) * 1000
+    )
+    _RANKING_METRICAS.registrar_chamadas_cpf(res["sf_api_calls"])
+    _ranking_metricas_exportar(res)
+    return res
+
+
+class _SingleFlight:
+    """
+    Coalescência por chave: a primeira chamada (líder) executa; as concorrentes com a
+    mesma chave aguardam o mesmo Future, com timeout próprio. Um voo mais velho que
+    idade_max_s é tratado como preso e a próxima chamada assume como novo líder.
+    """
+
+    def __init__(self) -> None:
+        self._voos: dict[Any, tuple[Future, float]] = {}
+        self._lock = threading.Lock()
+
+    def executar(
+        self,
+        chave: Any,
+        fn: Callable[[], Any],
+        *,
+        timeout_s: float,
+        idade_max_s: float,
+    ) -> tuple[Any, bool]:
+        """Devolve (resultado, coalescido). Seguidores levantam FuturesTimeoutError."""
+        agora = time.monotonic()
+        with self._lock:
+            voo = self._voos.get(chave)
+            lider = voo is None or voo[0].done() or agora - voo[1] > idade_max_s
+            if lider:
+                fut: Future = Future()
+                self._voos[chave] = (fut, agora)
+            else:
+                fut = voo[0]
+        if not lider:
+            return fut.result(timeout=max(0.0, float(timeout_s))), True
+        try:
+            res = fn()
+        except BaseException as exc:
+            fut.set_exception(exc)
+            raise
+        else:
+            fut.set_result(res)
+            return res, False
+        finally:
+            with self._lock:
+                if self._voos.get(chave, (None,))[0] is fut:
+                    del self._voos[chave]
+
+    def em_voo(self) -> int:
+        with self._lock:
+            return len(self._voos)
+
+
+# Um voo por (CPF, create_if_missing, bypass_cache) no pipeline e um por CPF na criação de Account/Opp:
+# duas abas/corretores no mesmo CPF partilham a mesma consulta e nunca criam em duplicado.
+_RANKING_SINGLE_FLIGHT = _SingleFlight()
+
+
+def _ranking_resultado_salesforce(
+    cpf: str,
+    ranking: str,
+    account_id: str | None,
+    opportunity_id: str | None,
+    t0: float,
+) -> dict[str, Any]:
+    """Resultado para ranking já presente no Salesforce (grava caches se não for terminal)."""
+    status = "terminal" if ranking in ("NÃO ELEGÍVEL", "INFORMAÇÃO NÃO DISPONÍVEL") else "ok"
+    payload = _ranking_resultado(
+        status=status,
+        ranking=ranking,
+        source="salesforce",
+        cpf=cpf,
+        account_id=account_id,
+        opportunity_id=opportunity_id,
+        elapsed_seconds=time.monotonic() - t0,
+        message="Ranking já presente no Salesforce.",
+    )
+    _ranking_mem_put(cpf, payload)
+    if status == "ok":
+        _ranking_sheets_upsert(payload)
+    return payload
+
+
+def _ranking_criar_pendente(
+    sf: Any,
+    cpf: str,
+    *,
+    conta: Mapping[str, Any] | None,
+    oportunidade: Mapping[str, Any] | None,
+    deadline: float,
+    t0: float,
+) -> dict[str, Any]:
+    """
+    Cria Account/Opportunity ausentes, aciona «Consultar Status CPF» e devolve pendente.
+    Seguidores coalescidos na criação só devolvem o pendente: o líder aciona o botão
+    e grava na planilha.
+    """
+    coalescido = False
+    with _ranking_span("criar") as sp:
+        try:
+            criado, coalescido = _RANKING_SINGLE_FLIGHT.executar(
+                ("criar", cpf),
+                lambda: _sf_criar_account_opp_rapido(
+                    sf,
+                    cpf,
+                    conta=conta,
+                    oportunidade=oportunidade,
+                    deadline=deadline,
+                ),
+                timeout_s=deadline - time.monotonic(),
+                idade_max_s=2 * RANKING_PIPELINE_BUDGET_S,
+            )
+            sp["resultado"] = "coalescido" if coalescido else "ok"
+        except FuturesTimeoutError:
+            criado = {"error": "Criação simultânea do mesmo CPF não concluiu no orçamento."}
+        if criado.get("error"):
+            sp["resultado"] = "erro"
+    if criado.get("error"):
+        return _ranking_resultado(
+            status="error",
+            code="erro_criar",
+            cpf=cpf,
+            account_id=criado.get("account_id"),
+            opportunity_id=criado.get("opportunity_id"),
+            account_created=bool(criado.get("account_created")),
+            opportunity_created=bool(criado.get("opportunity_created")),
+            elapsed_seconds=time.monotonic() - t0,
+            message=str(criado["error"]),
+        )
+    payload = _ranking_resultado(
+        status="pending",
+        code="sem_ranking",
+        cpf=cpf,
+        account_id=criado.get("account_id"),
+        opportunity_id=criado.get("opportunity_id"),
+        account_created=bool(criado.get("account_created")),
+        opportunity_created=bool(criado.get("opportunity_created")),
+        elapsed_seconds=time.monotonic() - t0,
+        message=(
+            "Conta/oportunidade prontas; Ranking__c ainda pendente no Risk3."
+        ),
+        source="salesforce_create",
+    )
+    if coalescido:
+        payload["coalesced"] = True
+        return payload
+    # O CPF passou a existir: um negativo «sem registo» (ex.: da pré-busca) deixa de valer.
+    _ranking_mem_remover(cpf)
+    # Aciona o botão oficial «Consultar Status CPF» (best-effort).
+    try:
+        with _ranking_span("botao") as sp:
+            btn = _sf_acionar_consultar_status_cpf(
+                timeout_s=deadline - time.monotonic(),
+                account_id=str(criado.get("account_id") or ""),
+                opportunity_id=(
+                    str(criado.get("opportunity_id"))
+                    if criado.get("opportunity_id")
+                    else None
+                ),
+            )
+            sp["resultado"] = "ok" if btn.get("ok") else "falha"
+        payload["button_consultar_status_cpf"] = {
+            "ok": bool(btn.get("ok")),
+            "via": btn.get("via"),
+            "attempts": btn.get("attempts") or [],
+        }
+    except Exception as exc_btn:  # noqa: BLE001
+        payload["button_consultar_status_cpf"] = {
+            "ok": False,
+            "error": str(exc_btn),
+        }
+    _ranking_sheets_upsert(payload)
+    return payload
 
 
 def classificar_ranking_cpf_pipeline(
@@ -2679,9 +5276,58 @@ def classificar_ranking_cpf_pipeline(
 ) -> dict[str, Any]:
     """
     Pipeline ordenado por velocidade, com orçamento global (~9,5 s):
-    memória → planilha (24 h) → Risk3 sync (opcional) → SOQL → criar+pendente.
+    memória → espelho Bulk → planilha (24 h) → Risk3 sync (opcional) → SOQL → criar+pendente.
+
+    Chamadas simultâneas para o mesmo CPF (e mesmos create_if_missing / bypass_cache) são coalescidas:
+    só uma percorre o pipeline; as demais esperam o resultado até ao próprio orçamento.
     """
     t0 = time.monotonic()
+    cpf = _sf_normalizar_cpf(cpf_11)
+    if len(cpf) != 11 or not _sf_cpf_valido(cpf):
+        return _ranking_pipeline_executar(
+            cpf_11,
+            bypass_cache=bypass_cache,
+            create_if_missing=create_if_missing,
+            budget_s=budget_s,
+        )
+    orcamento = max(0.5, float(budget_s))
+    try:
+        res, coalescido = _RANKING_SINGLE_FLIGHT.executar(
+            ("pipeline", cpf, bool(create_if_missing), bool(bypass_cache)),
+            lambda: _ranking_pipeline_medido(
+                cpf,
+                bypass_cache=bypass_cache,
+                create_if_missing=create_if_missing,
+                budget_s=orcamento,
+            ),
+            timeout_s=orcamento,
+            idade_max_s=2 * orcamento,
+        )
+    except FuturesTimeoutError:
+        return _ranking_resultado(
+            status="error",
+            code="timeout",
+            cpf=cpf,
+            elapsed_seconds=time.monotonic() - t0,
+            message="Consulta simultânea do mesmo CPF não concluiu no orçamento.",
+        )
+    if not coalescido:
+        return res
+    out = dict(res)
+    out["coalesced"] = True
+    out["elapsed_seconds"] = round(time.monotonic() - t0, 3)
+    return out
+
+
+def _ranking_pipeline_executar(
+    cpf_11: str,
+    *,
+    bypass_cache: bool,
+    create_if_missing: bool,
+    budget_s: float,
+) -> dict[str, Any]:
+    """Corpo do pipeline (sem coalescência); ver classificar_ranking_cpf_pipeline."""
+    t0 = time.monotonic()
     deadline = t0 + max(0.5, float(budget_s))
     cpf = _sf_normalizar_cpf(cpf_11)
     if len(cpf) != 11:
@@ -2701,10 +5347,26 @@ def classificar_ranking_cpf_pipeline(
             message="CPF inválido (dígitos verificadores).",
         )
 
-    # 1) Memória da sessão
+    # 1) Camadas locais (memória → SQLite), inclusive negativos de TTL curto
     if not bypass_cache:
-        mem = _ranking_mem_get(cpf)
-        if mem and mem.get("ranking"):
+        with _ranking_span("memoria") as sp:
+            mem = _ranking_cache_get(cpf)
+            sp["resultado"] = "hit" if mem else "miss"
+        if mem and mem.get("negativo"):
+            if mem.get("status") == "terminal" or not create_if_missing:
+                return _ranking_resultado(
+                    status=str(mem.get("status")),
+                    code=mem.get("code"),
+                    ranking=mem.get("ranking"),
+                    source="memory",
+                    cpf=cpf,
+                    account_id=mem.get("account_id"),
+                    opportunity_id=mem.get("opportunity_id"),
+                    elapsed_seconds=time.monotonic() - t0,
+                    message="Resultado negativo em cache local (TTL curto).",
+                )
+            mem = None
+        if mem and mem.get("status") != "pending" and mem.get("ranking"):
             return _ranking_resultado(
                 status="ok",
                 ranking=str(mem["ranking"]),
@@ -2716,30 +5378,61 @@ def classificar_ranking_cpf_pipeline(
                 message="Ranking em memória local.",
             )
 
-    # 2) Planilha externa (TTL 24 h)
-    if not bypass_cache and time.monotonic() < deadline:
-        try:
-            sheets_idx = _ranking_sheets_read_index()
-            hit = sheets_idx.get(cpf)
-            if hit and hit.get("ranking"):
-                _ranking_mem_put(cpf, hit)
-                return _ranking_resultado(
-                    status="ok",
-                    ranking=str(hit["ranking"]),
-                    source="sheets",
+    # 1b) Espelho local da exportação Bulk (sem rede)
+    if not bypass_cache:
+        espelho = _ranking_export_bulk()
+        if espelho is not None:
+            with _ranking_span("export") as sp:
+                linha = espelho.get(cpf)
+                ranking = _sf_mapear_ranking_para_ui(linha.get("ranking_raw")) if linha else None
+                sp["resultado"] = "hit" if ranking else "miss"
+            _ranking_cache_contar("export", bool(ranking))
+            if linha and ranking:
+                payload = _ranking_resultado(
+                    status=(
+                        "terminal"
+                        if ranking in ("NÃO ELEGÍVEL", "INFORMAÇÃO NÃO DISPONÍVEL")
+                        else "ok"
+                    ),
+                    ranking=ranking,
+                    source="bulk_export",
                     cpf=cpf,
-                    account_id=hit.get("account_id"),
-                    opportunity_id=hit.get("opportunity_id"),
+                    account_id=linha.get("account_id"),
                     elapsed_seconds=time.monotonic() - t0,
-                    message="Ranking na base externa (válido por 24 h).",
+                    message="Ranking no espelho local da exportação Bulk do Salesforce.",
                 )
-        except Exception:
-            _sf_logger.exception("Falha ao ler cache de ranking na planilha")
+                _ranking_mem_put(cpf, payload)
+                return payload
+
+    # 2) Planilha externa (TTL 24 h)
+    if not bypass_cache and time.monotonic() < deadline:
+        hit = None
+        with _ranking_span("planilha") as sp:
+            try:
+                hit = _ranking_sheets_lookup(cpf)
+                sp["resultado"] = "hit" if hit and hit.get("ranking") else "miss"
+            except Exception:
+                sp["resultado"] = "erro"
+                _sf_logger.exception("Falha ao ler cache de ranking na planilha")
+        if hit and hit.get("ranking"):
+            _ranking_mem_put(cpf, hit)
+            return _ranking_resultado(
+                status="ok",
+                ranking=str(hit["ranking"]),
+                source="sheets",
+                cpf=cpf,
+                account_id=hit.get("account_id"),
+                opportunity_id=hit.get("opportunity_id"),
+                elapsed_seconds=time.monotonic() - t0,
+                message="Ranking na base externa (válido por 24 h).",
+            )
 
     # 3) API síncrona Risk3 (opcional)
     restante = deadline - time.monotonic()
     if restante > 0.3:
-        sync = _risk3_sync_lookup(cpf, timeout_s=min(2.0, restante - 0.1))
+        with _ranking_span("risk3") as sp:
+            sync = _risk3_sync_lookup(cpf, timeout_s=min(2.0, restante - 0.1))
+            sp["resultado"] = str(sync.get("status") or "erro")
         if sync.get("status") == "ok" and sync.get("ranking"):
             payload = _ranking_resultado(
                 status="ok",
@@ -2753,10 +5446,17 @@ def classificar_ranking_cpf_pipeline(
             _ranking_sheets_upsert(payload)
             return payload
 
-    # 4) SOQL ao vivo consolidado
+    # 4) SOQL ao vivo consolidado (com o disjuntor «salesforce» aberto, degrada já)
+    disjuntor = _disjuntor("salesforce")
+    if not disjuntor.permitir():
+        return _ranking_degradado(cpf, t0)
     _injetar_secrets_salesforce_no_env()
-    sf = _sf_conectar_salesforce(verbose=False)
+    with _ranking_span("conexao") as sp:
+        sf = _sf_conectar_salesforce(verbose=False)
+        sp["resultado"] = "ok" if sf is not None else "erro"
     if sf is None:
+        # Credenciais ausentes ou inválidas são configuração, não indisponibilidade.
+        disjuntor.liberar_sonda()
         return _ranking_resultado(
             status="error",
             code="sem_conexao",
@@ -2765,6 +5465,8 @@ def classificar_ranking_cpf_pipeline(
             message="Não foi possível conectar ao Salesforce.",
         )
     if time.monotonic() > deadline:
+        # Sem pedido feito: liberta a sonda meio-aberta, se for o caso.
+        disjuntor.liberar_sonda()
         return _ranking_resultado(
             status="error",
             code="timeout",
@@ -2773,7 +5475,13 @@ def classificar_ranking_cpf_pipeline(
             message="Tempo esgotado antes da consulta Salesforce.",
         )
     try:
-        conta, oportunidade, err_amb = _sf_consultar_account_opp_consolidado(sf, cpf)
+        with _ranking_span("soql") as sp:
+            inicio_soql = time.monotonic()
+            conta, oportunidade, err_amb = _sf_consultar_account_opp_consolidado(
+                sf, cpf, timeout_s=disjuntor.timeout_s(deadline - inicio_soql)
+            )
+            disjuntor.sucesso(time.monotonic() - inicio_soql)
+            sp["resultado"] = "ambiguo" if err_amb else ("hit" if conta else "miss")
         if err_amb:
             return _ranking_resultado(
                 status="error",
@@ -2791,32 +5499,16 @@ def classificar_ranking_cpf_pipeline(
             }
         )
         ranking = info.get("ranking_exibir")
-        account_id = str(conta.get("Id")) if conta else None
-        opportunity_id = str(oportunidade.get("Id")) if oportunidade else None
-        if ranking:
-            status = (
-                "terminal"
-                if ranking in ("NÃO ELEGÍVEL", "INFORMAÇÃO NÃO DISPONÍVEL")
-                else "ok"
-            )
-            payload = _ranking_resultado(
-                status=status,
-                ranking=str(ranking),
-                source="salesforce",
-                cpf=cpf,
-                account_id=account_id,
-                opportunity_id=opportunity_id,
-                elapsed_seconds=time.monotonic() - t0,
-                message="Ranking já presente no Salesforce.",
+        account_id = str(conta.get("Id")) if conta else None
+        opportunity_id = str(oportunidade.get("Id")) if oportunidade else None
+        if ranking:
+            return _ranking_resultado_salesforce(
+                cpf, str(ranking), account_id, opportunity_id, t0
             )
-            if status == "ok":
-                _ranking_mem_put(cpf, payload)
-                _ranking_sheets_upsert(payload)
-            return payload
 
         # 5) Criação otimizada + pendente (sem poll bloqueante)
         if not create_if_missing:
-            return _ranking_resultado(
+            payload = _ranking_resultado(
                 status="pending",
                 code="sem_registo",
                 cpf=cpf,
@@ -2825,62 +5517,18 @@ def classificar_ranking_cpf_pipeline(
                 elapsed_seconds=time.monotonic() - t0,
                 message="CPF sem ranking e criação desabilitada nesta chamada.",
             )
-        criado = _sf_criar_account_opp_rapido(
-            sf,
-            cpf,
-            conta=conta,
-            oportunidade=oportunidade,
-            deadline=deadline,
-        )
-        if criado.get("error"):
-            return _ranking_resultado(
-                status="error",
-                code="erro_criar",
-                cpf=cpf,
-                account_id=criado.get("account_id"),
-                opportunity_id=criado.get("opportunity_id"),
-                account_created=bool(criado.get("account_created")),
-                opportunity_created=bool(criado.get("opportunity_created")),
-                elapsed_seconds=time.monotonic() - t0,
-                message=str(criado["error"]),
-            )
-        payload = _ranking_resultado(
-            status="pending",
-            code="sem_ranking",
-            cpf=cpf,
-            account_id=criado.get("account_id"),
-            opportunity_id=criado.get("opportunity_id"),
-            account_created=bool(criado.get("account_created")),
-            opportunity_created=bool(criado.get("opportunity_created")),
-            elapsed_seconds=time.monotonic() - t0,
-            message=(
-                "Conta/oportunidade prontas; Ranking__c ainda pendente no Risk3."
-            ),
-            source="salesforce_create",
+            # Só o CPF sem Account vira negativo (ver _ranking_cache_negativo).
+            _ranking_mem_put(cpf, payload)
+            return payload
+        return _ranking_criar_pendente(
+            sf, cpf, conta=conta, oportunidade=oportunidade, deadline=deadline, t0=t0
         )
-        # Aciona o botão oficial «Consultar Status CPF» (best-effort).
-        try:
-            btn = _sf_acionar_consultar_status_cpf(
-                account_id=str(criado.get("account_id") or ""),
-                opportunity_id=(
-                    str(criado.get("opportunity_id"))
-                    if criado.get("opportunity_id")
-                    else None
-                ),
-            )
-            payload["button_consultar_status_cpf"] = {
-                "ok": bool(btn.get("ok")),
-                "attempts": btn.get("attempts") or [],
-            }
-        except Exception as exc_btn:  # noqa: BLE001
-            payload["button_consultar_status_cpf"] = {
-                "ok": False,
-                "error": str(exc_btn),
-            }
-        _ranking_sheets_upsert(payload)
-        return payload
     except Exception as exc:  # noqa: BLE001
         _sf_logger.exception("Falha no pipeline de ranking")
+        if _falha_de_dependencia(exc):
+            disjuntor.falha()
+            return _ranking_degradado(cpf, t0)
+        disjuntor.sucesso()
         return _ranking_resultado(
             status="error",
             code="erro_sf",
@@ -2890,15 +5538,497 @@ def classificar_ranking_cpf_pipeline(
         )
 
 
+def _ranking_degradado(cpf: str, t0: float) -> dict[str, Any]:
+    """Salesforce indisponível: ranking em cache (mesmo com bypass_cache) ou pendente."""
+    hit, fonte = _ranking_mem_get(cpf), "memory"
+    if not hit:
+        try:
+            hit, fonte = _ranking_sheets_lookup(cpf), "sheets"
+        except Exception:
+            hit = None
+    extras = {"degradado": True, "disjuntor": _disjuntor("salesforce").resumo()}
+    if hit and hit.get("ranking"):
+        return _ranking_resultado(
+            status="ok",
+            ranking=str(hit["ranking"]),
+            source=fonte,
+            cpf=cpf,
+            account_id=hit.get("account_id"),
+            opportunity_id=hit.get("opportunity_id"),
+            elapsed_seconds=time.monotonic() - t0,
+            message="Salesforce indisponível; ranking em cache.",
+            extras=extras,
+        )
+    return _ranking_resultado(
+        status="pending",
+        code="sf_indisponivel",
+        cpf=cpf,
+        elapsed_seconds=time.monotonic() - t0,
+        message="Salesforce indisponível no momento; tente novamente em instantes.",
+        extras=extras,
+    )
+
+
+def _ranking_lote_normalizar(cpfs: Iterable[Any]) -> tuple[list[str], list[str], int]:
+    """
+    Normaliza em bloco, remove duplicados (mantendo a ordem) e valida os dígitos
+    verificadores de todos os CPFs de uma vez. Devolve (válidos, inválidos, duplicados).
+    """
+    serie = pd.Series(list(cpfs), dtype=object).fillna("").astype(str)
+    serie = serie.str.replace(r"[^0-9]", "", regex=True)
+    # Mesmo critério de _sf_normalizar_cpf: 10 dígitos = zero à esquerda omitido.
+    serie = serie.where(serie.str.len() != 10, serie.str.zfill(11))
+    serie = serie[serie != ""]
+    n_antes = len(serie)
+    serie = serie.drop_duplicates().reset_index(drop=True)
+    duplicados = n_antes - len(serie)
+    ok_len = serie.str.len().eq(11).to_numpy()
+    validos = np.zeros(len(serie), dtype=bool)
+    if ok_len.any():
+        bloco = "".join(serie[ok_len].tolist()).encode("ascii")
+        d = (np.frombuffer(bloco, dtype=np.uint8) - 48).astype(np.int64).reshape(-1, 11)
+        dv1 = (d[:, :9] @ np.arange(10, 1, -1)) * 10 % 11
+        dv1[dv1 == 10] = 0
+        dv2 = (d[:, :10] @ np.arange(11, 1, -1)) * 10 % 11
+        dv2[dv2 == 10] = 0
+        repetido = (d == d[:, :1]).all(axis=1)
+        validos[ok_len] = (dv1 == d[:, 9]) & (dv2 == d[:, 10]) & ~repetido
+    lista = serie.tolist()
+    return (
+        [c for c, v in zip(lista, validos) if v],
+        [c for c, v in zip(lista, validos) if not v],
+        duplicados,
+    )
+
+
+def _ranking_lote_fatiar_in(
+    itens: list[str],
+    literal: Callable[[str], str],
+    max_chars: int = RANKING_LOTE_SOQL_IN_MAX_CHARS,
+) -> Iterator[list[str]]:
+    """Agrupa itens para que a lista IN (...) de cada SOQL caiba em ``max_chars``."""
+    lote: list[str] = []
+    tamanho = 0
+    for item in itens:
+        n = len(literal(item)) + 2
+        if lote and tamanho + n > max_chars:
+            yield lote
+            lote, tamanho = [], 0
+        lote.append(item)
+        tamanho += n
+    if lote:
+        yield lote
+
+
+def _sf_lote_contas_por_cpf(sf: Any, cpfs: list[str]) -> dict[str, list[dict[str, Any]]]:
+    """Accounts (com Opportunities aninhadas) de vários CPFs numa única SOQL pai-filho."""
+    recs = (
+        sf.query_all(_sf_soql_contas_com_oportunidades(cpfs=cpfs, limite_opps=5)).get("records")
+        or []
+    )
+    out: dict[str, list[dict[str, Any]]] = {}
+    for rec in recs:
+        out.setdefault(_sf_normalizar_cpf(rec.get("CPF__c")), []).append(rec)
+    return out
+
+
+def classificar_ranking_cpf_lote(
+    cpfs: Iterable[Any],
+    *,
+    bypass_cache: bool = False,
+    create_if_missing: bool = True,
+    budget_s: float = RANKING_LOTE_BUDGET_S,
+    max_workers: int = RANKING_LOTE_MAX_WORKERS,
+    stats: dict[str, Any] | None = None,
+) -> Iterator[dict[str, Any]]:
+    """
+    Classificação de listas de CPFs (pré-classificação de leads). Gerador: cada
+    resultado (mesmo formato de classificar_ranking_cpf_pipeline) sai assim que resolve.
+
+    Etapas: validação vetorizada → memória/planilha em bloco → Risk3 sync (se
+    configurado, em paralelo) → SOQL em lotes IN → criações num pool limitado.
+    ``stats`` (opcional) é atualizado in-place com as contagens por etapa.
+    """
+    t0 = time.monotonic()
+    deadline = t0 + max(1.0, float(budget_s))
+    st_ = stats if stats is not None else {}
+    st_.update(
+        {
+            "total": 0,
+            "duplicados": 0,
+            "invalidos": 0,
+            "memory": 0,
+            "sheets": 0,
+            "risk3_sync": 0,
+            "salesforce": 0,
+            "pending": 0,
+            "created": 0,
+            "errors": 0,
+            "timeout": 0,
+            "soql_queries": 0,
+            "elapsed_s": 0.0,
+        }
+    )
+    entrada = list(cpfs)
+    st_["total"] = len(entrada)
+    validos, invalidos, st_["duplicados"] = _ranking_lote_normalizar(entrada)
+
+    def _emitir(res: dict[str, Any], etapa: str | None = None) -> dict[str, Any]:
+        if etapa:
+            st_[etapa] = int(st_.get(etapa) or 0) + 1
+        if res.get("status") == "pending":
+            st_["pending"] += 1
+        elif res.get("status") == "error":
+            st_["errors"] += 1
+        st_["elapsed_s"] = round(time.monotonic() - t0, 3)
+        return res
+
+    for cpf in invalidos:
+        st_["invalidos"] += 1
+        yield _emitir(
+            _ranking_resultado(
+                status="error",
+                code="cpf_incompleto" if len(cpf) != 11 else "cpf_invalido",
+                cpf=cpf,
+                elapsed_seconds=time.monotonic() - t0,
+                message="CPF inválido (dígitos verificadores).",
+            )
+        )
+
+    # 1) Caches: memória do processo e índice da planilha (uma carga para o lote todo).
+    faltam: list[str] = []
+    if bypass_cache:
+        faltam = list(validos)
+    else:
+        try:
+            _ranking_sheets_carregar_indice()
+        except Exception:
+            _sf_logger.exception("Lote: falha ao carregar índice da planilha")
+        for cpf in validos:
+            entrada = _ranking_cache_get(cpf)
+            if entrada and entrada.get("negativo") and entrada.get("status") == "terminal":
+                yield _emitir(
+                    _ranking_resultado(
+                        status="terminal",
+                        ranking=entrada.get("ranking"),
+                        source="memory",
+                        cpf=cpf,
+                        account_id=entrada.get("account_id"),
+                        opportunity_id=entrada.get("opportunity_id"),
+                        elapsed_seconds=time.monotonic() - t0,
+                        message="Resultado terminal em cache local (TTL curto).",
+                    ),
+                    "memory",
+                )
+                continue
+            hit, fonte = entrada, "memory"
+            if hit and (hit.get("negativo") or hit.get("status") == "pending"):
+                hit = None
+            if not hit:
+                hit, fonte = _ranking_sheets_lookup(cpf), "sheets"
+                if hit:
+                    _ranking_mem_put(cpf, hit)
+            if hit and hit.get("ranking"):
+                yield _emitir(
+                    _ranking_resultado(
+                        status="ok",
+                        ranking=str(hit["ranking"]),
+                        source=fonte,
+                        cpf=cpf,
+                        account_id=hit.get("account_id"),
+                        opportunity_id=hit.get("opportunity_id"),
+                        elapsed_seconds=time.monotonic() - t0,
+                        message="Ranking em cache.",
+                    ),
+                    fonte,
+                )
+            else:
+                faltam.append(cpf)
+
+    if not faltam:
+        return
+
+    executor = ThreadPoolExecutor(
+        max_workers=max(1, int(max_workers)), thread_name_prefix="dv-ranking-lote"
+    )
+    criacoes: dict[Any, str] = {}
+    try:
+        # 2) Risk3 síncrono (opcional), em paralelo no mesmo pool.
+        if (os.environ.get("RISK3_SYNC_URL") or "").strip() and deadline - time.monotonic() > 0.5:
+            futs = {
+                executor.submit(
+                    _risk3_sync_lookup,
+                    cpf,
+                    timeout_s=min(2.0, max(0.2, deadline - time.monotonic() - 0.1)),
+                ): cpf
+                for cpf in faltam
+            }
+            feitos, _ = wait(futs, timeout=max(0.0, deadline - time.monotonic()))
+            resolvidos: set[str] = set()
+            for fut in feitos:
+                cpf = futs[fut]
+                sync = fut.result() if not fut.exception() else {}
+                if sync.get("status") == "ok" and sync.get("ranking"):
+                    payload = _ranking_resultado(
+                        status="ok",
+                        ranking=str(sync["ranking"]),
+                        source="risk3_sync",
+                        cpf=cpf,
+                        elapsed_seconds=time.monotonic() - t0,
+                        message="Ranking via API síncrona Risk3.",
+                    )
+                    _ranking_mem_put(cpf, payload)
+                    _ranking_sheets_upsert(payload)
+                    resolvidos.add(cpf)
+                    yield _emitir(payload, "risk3_sync")
+            faltam = [c for c in faltam if c not in resolvidos]
+
+        # 3) SOQL pai-filho em lotes IN (Account por CPF + Opportunities aninhadas).
+        _injetar_secrets_salesforce_no_env()
+        sf = _sf_conectar_salesforce(verbose=False) if faltam else None
+        if faltam and sf is None:
+            for cpf in faltam:
+                yield _emitir(
+                    _ranking_resultado(
+                        status="error",
+                        code="sem_conexao",
+                        cpf=cpf,
+                        elapsed_seconds=time.monotonic() - t0,
+                        message="Não foi possível conectar ao Salesforce.",
+                    )
+                )
+            return
+
+        def _drenar(bloquear: bool) -> Iterator[dict[str, Any]]:
+            if not criacoes:
+                return
+            timeout = max(0.0, deadline - time.monotonic()) if bloquear else 0
+            feitos, _ = wait(
+                list(criacoes),
+                timeout=timeout,
+                return_when=ALL_COMPLETED if bloquear else FIRST_COMPLETED,
+            )
+            for fut in feitos:
+                cpf = criacoes.pop(fut)
+                try:
+                    res = fut.result()
+                except Exception as exc:  # noqa: BLE001
+                    res = _ranking_resultado(
+                        status="error",
+                        code="erro_criar",
+                        cpf=cpf,
+                        elapsed_seconds=time.monotonic() - t0,
+                        message=str(exc),
+                    )
+                if res.get("account_created") or res.get("opportunity_created"):
+                    st_["created"] += 1
+                yield _emitir(res)
+
+        pendentes_soql: dict[str, None] = dict.fromkeys(faltam)
+        for lote in _ranking_lote_fatiar_in(faltam, _sf_literais_cpf):
+            if time.monotonic() >= deadline:
+                break
+            try:
+                contas = _sf_lote_contas_por_cpf(sf, lote)
+                st_["soql_queries"] += 1
+            except Exception as exc:  # noqa: BLE001
+                _sf_logger.exception("Lote: falha SOQL")
+                for cpf in lote:
+                    pendentes_soql.pop(cpf, None)
+                    yield _emitir(
+                        _ranking_resultado(
+                            status="error",
+                            code="erro_sf",
+                            cpf=cpf,
+                            elapsed_seconds=time.monotonic() - t0,
+                            message=str(exc),
+                        )
+                    )
+                continue
+            for cpf in lote:
+                pendentes_soql.pop(cpf, None)
+                regs = contas.get(cpf) or []
+                if len(regs) > 1:
+                    yield _emitir(
+                        _ranking_resultado(
+                            status="error",
+                            code="ambiguo",
+                            cpf=cpf,
+                            elapsed_seconds=time.monotonic() - t0,
+                            message=f"CPF ambíguo: {len(regs)} contas encontradas.",
+                        )
+                    )
+                    continue
+                conta = regs[0] if regs else None
+                opps_conta = _sf_oportunidades_da_conta(conta) if conta else []
+                oportunidade = opps_conta[0] if opps_conta else None
+                info = _sf_extrair_ranking_ui_de_opportunity(
+                    oportunidade
+                    or {"Account": conta or {}, "Ranking__c": None, "Ranking_Score__c": None}
+                )
+                account_id = str(conta.get("Id")) if conta else None
+                opportunity_id = str(oportunidade.get("Id")) if oportunidade else None
+                if info.get("ranking_exibir"):
+                    yield _emitir(
+                        _ranking_resultado_salesforce(
+                            cpf, str(info["ranking_exibir"]), account_id, opportunity_id, t0
+                        ),
+                        "salesforce",
+                    )
+                elif not create_if_missing:
+                    yield _emitir(
+                        _ranking_resultado(
+                            status="pending",
+                            code="sem_registo",
+                            cpf=cpf,
+                            account_id=account_id,
+                            opportunity_id=opportunity_id,
+                            elapsed_seconds=time.monotonic() - t0,
+                            message="CPF sem ranking e criação desabilitada nesta chamada.",
+                        )
+                    )
+                else:
+                    # 4) Criação + botão no pool; cada CPF com orçamento próprio dentro do global.
+                    fut = executor.submit(
+                        _ranking_criar_pendente,
+                        sf,
+                        cpf,
+                        conta=conta,
+                        oportunidade=oportunidade,
+                        deadline=min(deadline, time.monotonic() + RANKING_PIPELINE_BUDGET_S),
+                        t0=t0,
+                    )
+                    criacoes[fut] = cpf
+            yield from _drenar(bloquear=False)
+
+        yield from _drenar(bloquear=True)
+        for fut, cpf in list(criacoes.items()):
+            fut.cancel()
+            pendentes_soql[cpf] = None
+        criacoes.clear()
+        for cpf in pendentes_soql:
+            st_["timeout"] += 1
+            yield _emitir(
+                _ranking_resultado(
+                    status="error",
+                    code="timeout",
+                    cpf=cpf,
+                    elapsed_seconds=time.monotonic() - t0,
+                    message="Orçamento do lote esgotado antes de resolver este CPF.",
+                )
+            )
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+        st_["elapsed_s"] = round(time.monotonic() - t0, 3)
+
+
+_RANKING_PREFETCH: dict[str, tuple[Future, float]] = {}
+_RANKING_PREFETCH_LOCK = threading.Lock()
+_RANKING_PREFETCH_EXECUTOR: dict[str, Any] = {"e": None}
+
+
+def _ranking_prefetch_executor() -> ThreadPoolExecutor:
+    with _RANKING_PREFETCH_LOCK:
+        if _RANKING_PREFETCH_EXECUTOR["e"] is None:
+            _RANKING_PREFETCH_EXECUTOR["e"] = ThreadPoolExecutor(
+                max_workers=RANKING_PREFETCH_MAX_WORKERS,
+                thread_name_prefix="dv-ranking-prefetch",
+            )
+        return _RANKING_PREFETCH_EXECUTOR["e"]
+
+
+def _ranking_prefetch_iniciar(cpf_11: str) -> tuple[Future, float] | None:
+    """
+    Pré-busca especulativa num worker: a mesma leitura ao vivo do Salesforce que a
+    classificação explícita faz (bypass_cache, sem criar registos), para o clique a
+    reaproveitar. Só CPFs com dígitos verificadores válidos; uma pré-busca viva por
+    CPF no processo (outra sessão com o mesmo CPF recebe o mesmo voo).
+    """
+    cpf = _sf_normalizar_cpf(cpf_11)
+    if len(cpf) != 11 or not _sf_cpf_valido(cpf):
+        return None
+    agora = time.monotonic()
+    with _RANKING_PREFETCH_LOCK:
+        for chave, (fut, t0) in list(_RANKING_PREFETCH.items()):
+            if fut.done() and agora - t0 > RANKING_PREFETCH_TTL_S:
+                del _RANKING_PREFETCH[chave]
+        if cpf in _RANKING_PREFETCH:
+            return _RANKING_PREFETCH[cpf]
+    try:
+        fut = _ranking_prefetch_executor().submit(
+            classificar_ranking_cpf_pipeline, cpf, bypass_cache=True, create_if_missing=False
+        )
+    except RuntimeError:
+        _sf_logger.warning("Pré-busca de ranking: executor indisponível", exc_info=True)
+        return None
+    with _RANKING_PREFETCH_LOCK:
+        _RANKING_PREFETCH[cpf] = (fut, agora)
+    _sf_logger.info("Pré-busca de ranking iniciada para %s", _sf_cpf_mascarado_br(cpf))
+    return fut, agora
+
+
+def _ranking_prefetch_resultado(cpf_11: str, *, espera_s: float = 0.0) -> dict[str, Any] | None:
+    """
+    Resultado da pré-busca do CPF guardado na sessão (aguarda até espera_s se ainda em
+    voo) e consome-o: o clique seguinte volta a ler o Salesforce. None se não houver.
+    """
+    cpf = _sf_normalizar_cpf(cpf_11)
+    try:
+        pre = st.session_state.get("_dv_sf_prefetch_cpf")
+    except Exception:
+        pre = None
+    if not isinstance(pre, dict) or pre.get("cpf") != cpf:
+        return None
+    if time.monotonic() - float(pre.get("t0") or 0) > RANKING_PREFETCH_TTL_S:
+        st.session_state.pop("_dv_sf_prefetch_cpf", None)
+        return None
+    # O worker não tem contexto de script: a sessão guarda o Future do voo e lê-o aqui.
+    try:
+        res = pre["futuro"].result(timeout=max(0.0, float(espera_s)))
+    except FuturesTimeoutError:
+        return None
+    except Exception:
+        _sf_logger.warning("Pré-busca de ranking: falha no CPF", exc_info=True)
+        res = None
+    st.session_state.pop("_dv_sf_prefetch_cpf", None)
+    return res if isinstance(res, dict) else None
+
+
+def _dv_sf_cpf_classificar_clientes_on_change() -> None:
+    """Enter/blur no CPF: valida os dígitos verificadores e dispara a pré-busca do ranking."""
+    cpf_d = _sf_normalizar_cpf(st.session_state.get("cpf_classificar_clientes_sf") or "")
+    if not _sf_cpf_valido(cpf_d):
+        return
+    _injetar_secrets_salesforce_no_env()
+    voo = _ranking_prefetch_iniciar(cpf_d)
+    if voo is not None:
+        st.session_state["_dv_sf_prefetch_cpf"] = {"cpf": cpf_d, "t0": voo[1], "futuro": voo[0]}
+
+
+# Fontes do pipeline que leram o Salesforce nesta chamada (sem passar por cache).
+_RANKING_FONTES_AO_VIVO = ("salesforce", "risk3_sync")
+
+
 def _sf_classificar_criando_ausentes(cpf_11: str) -> tuple[dict[str, Any] | None, str | None]:
     """
     Compatível com a UI antiga: cria ausentes e devolve imediatamente.
     Sem polling bloqueante (Risk3 é acompanhado em background na interface).
+    Se a pré-busca guardada na sessão já leu o ranking ao vivo no Salesforce, devolve-o
+    sem nova SOQL; qualquer outro resultado (cache, pendente, erro) segue o caminho normal.
     """
-    res = classificar_ranking_cpf_pipeline(
-        cpf_11, bypass_cache=True, create_if_missing=True
-    )
-    if res.get("status") == "error" and res.get("code") in (
+    res = _ranking_prefetch_resultado(cpf_11, espera_s=RANKING_PREFETCH_ESPERA_S)
+    if (
+        not res
+        or res.get("status") not in ("ok", "terminal")
+        or not res.get("ranking")
+        or res.get("source") not in _RANKING_FONTES_AO_VIVO
+    ):
+        res = classificar_ranking_cpf_pipeline(
+            cpf_11, bypass_cache=True, create_if_missing=True
+        )
+    else:
+        _sf_logger.info("Classificação servida pela pré-busca (%s)", res.get("source") or "-")
+    if res.get("status") in ("error", "pending") and res.get("code") in (
         "cpf_incompleto",
         "cpf_invalido",
         "sem_conexao",
@@ -2906,6 +6036,7 @@ def _sf_classificar_criando_ausentes(cpf_11: str) -> tuple[dict[str, Any] | None
         "erro_criar",
         "erro_sf",
         "timeout",
+        "sf_indisponivel",
     ):
         return None, str(res.get("message") or "Falha ao classificar CPF.")
     # Mantém chaves esperadas pelos callers antigos.
@@ -2936,6 +6067,8 @@ def _lookup_ranking_salesforce_cached(cpf11: str) -> tuple[str | None, str | Non
     code = str(res.get("code") or res.get("status") or "sem_registo")
     if code in ("ok", "terminal"):
         return None, "sem_registo"
+    if code == "sf_indisponivel":
+        return None, "sem_conexao"
     return None, code if code != "pending" else "sem_registo"
 
 
@@ -4005,12 +7138,12 @@ def gravar_nova_linha_home_banner(
 ) -> tuple[bool, str]:
     """Anexa linha na aba BD Home Banners (Título e Descrição alimentam o popup da miniatura)."""
     try:
-        conn = st.connection("gsheets", type=GSheetsConnection)
-        df_raw = conn.read(spreadsheet=ID_GERAL, worksheet="BD Home Banners")
-        df_ex = normalizar_df_home_banners(df_raw)
+        backend = _backend_dados()
+        df_ex = normalizar_df_home_banners(backend.ler("BD Home Banners", ttl=0))
         ordens = pd.to_numeric(df_ex["Ordem"], errors="coerce")
         prox = int(ordens.max()) + 1 if len(df_ex) and ordens.notna().any() else len(df_ex) + 1
-        nova = pd.DataFrame(
+        backend.anexar(
+            "BD Home Banners",
             [
                 {
                     "Ordem": prox,
@@ -4021,10 +7154,9 @@ def gravar_nova_linha_home_banner(
                     "Descricao": (descricao or "").strip(),
                     "Chave_Campanha": (chave_campanha or "").strip(),
                 }
-            ]
+            ],
+            normalizar=normalizar_df_home_banners,
         )
-        df_final = pd.concat([df_ex, nova], ignore_index=True)
-        conn.update(spreadsheet=ID_GERAL, worksheet="BD Home Banners", data=df_final)
         return True, ""
     except Exception as e:
         return False, str(e)
@@ -4037,12 +7169,12 @@ def gravar_nova_linha_campanha_texto(
     chave_campanha: str = "",
 ) -> tuple[bool, str]:
     try:
-        conn = st.connection("gsheets", type=GSheetsConnection)
-        df_raw = conn.read(spreadsheet=ID_GERAL, worksheet=_WS_CAMPANHAS_TEXTO)
-        df_ex = normalizar_df_campanhas_texto(df_raw)
+        backend = _backend_dados()
+        df_ex = normalizar_df_campanhas_texto(backend.ler(_WS_CAMPANHAS_TEXTO, ttl=0))
         ordens = pd.to_numeric(df_ex["Ordem"], errors="coerce")
         prox = int(ordens.max()) + 1 if len(df_ex) and ordens.notna().any() else len(df_ex) + 1
-        nova = pd.DataFrame(
+        backend.anexar(
+            _WS_CAMPANHAS_TEXTO,
             [
                 {
                     "Ordem": prox,
@@ -4051,10 +7183,9 @@ def gravar_nova_linha_campanha_texto(
                     "Ativo": "SIM",
                     "Chave_Campanha": (chave_campanha or "").strip(),
                 }
-            ]
+            ],
+            normalizar=normalizar_df_campanhas_texto,
         )
-        df_final = pd.concat([df_ex, nova], ignore_index=True)
-        conn.update(spreadsheet=ID_GERAL, worksheet=_WS_CAMPANHAS_TEXTO, data=df_final)
         return True, ""
     except Exception as e:
         return False, str(e)
@@ -4062,17 +7193,14 @@ def gravar_nova_linha_campanha_texto(
 
 def excluir_linha_campanha_texto(indice_linha: int) -> tuple[bool, str]:
     try:
-        conn = st.connection("gsheets", type=GSheetsConnection)
-        df_raw = conn.read(spreadsheet=ID_GERAL, worksheet=_WS_CAMPANHAS_TEXTO)
-        df_ex = normalizar_df_campanhas_texto(df_raw)
-        df_ex = df_ex.reset_index(drop=True)
+        backend = _backend_dados()
+        df_ex = normalizar_df_campanhas_texto(backend.ler(_WS_CAMPANHAS_TEXTO, ttl=0))
         n = len(df_ex)
         if n == 0:
             return False, "A planilha de texto das campanhas está vazia."
         if indice_linha < 0 or indice_linha >= n:
             return False, "Linha inválida."
-        df_new = df_ex.drop(index=indice_linha).reset_index(drop=True)
-        conn.update(spreadsheet=ID_GERAL, worksheet=_WS_CAMPANHAS_TEXTO, data=df_new)
+        backend.excluir(_WS_CAMPANHAS_TEXTO, indice_linha, normalizar=normalizar_df_campanhas_texto)
         return True, ""
     except Exception as e:
         return False, str(e)
@@ -4081,17 +7209,14 @@ def excluir_linha_campanha_texto(indice_linha: int) -> tuple[bool, str]:
 def excluir_linha_home_banner(indice_linha: int) -> tuple[bool, str]:
     """Remove uma linha da aba BD Home Banners pelo índice (0 = primeira linha de dados na leitura normalizada)."""
     try:
-        conn = st.connection("gsheets", type=GSheetsConnection)
-        df_raw = conn.read(spreadsheet=ID_GERAL, worksheet="BD Home Banners")
-        df_ex = normalizar_df_home_banners(df_raw)
-        df_ex = df_ex.reset_index(drop=True)
+        backend = _backend_dados()
+        df_ex = normalizar_df_home_banners(backend.ler("BD Home Banners", ttl=0))
         n = len(df_ex)
         if n == 0:
             return False, "A planilha de banners está vazia."
         if indice_linha < 0 or indice_linha >= n:
             return False, "Linha inválida."
-        df_new = df_ex.drop(index=indice_linha).reset_index(drop=True)
-        conn.update(spreadsheet=ID_GERAL, worksheet="BD Home Banners", data=df_new)
+        backend.excluir("BD Home Banners", indice_linha, normalizar=normalizar_df_home_banners)
         return True, ""
     except Exception as e:
         return False, str(e)
@@ -4236,10 +7361,206 @@ def _render_login_section(df_logins: pd.DataFrame, cookie_manager=None) -> None:
                 st.rerun()
 
 
-@st.cache_data(ttl=300, show_spinner=False)
+_ABAS_REFERENCIA = (
+    "POLITICAS",
+    "BD Politicas",
+    "BD Políticas",
+    "BD Financiamentos",
+    "BD Estoque Filtrada",
+    "BD Premissas",
+    "PREMISSAS",
+)
+_ABAS_EDITAVEIS = ("BD Home Banners", _WS_CAMPANHAS_TEXTO, "BD Logins")
+_DADOS_SISTEMA_TTL_S = 300.0
+
+
+@st.cache_resource(max_entries=2, show_spinner=False)
+def _carregar_tabelas_referencia(revisoes: tuple[str, ...]) -> dict[str, Any]:
+    """
+    Estoque, financiamentos, políticas e premissas: uma instância por processo.
+    cache_resource não faz pickle por chamada (cache_data despicklava os oito frames
+    a cada rerun de cada sessão); as sessões recebem vistas em carregar_dados_sistema.
+    ``revisoes`` (ver _revisoes_abas) só muda quando alguma aba muda.
+    """
+    backend = _backend_dados()
+    def limpar_moeda(val): return safe_float_convert(val)
+
+    # 1. POLITICAS (Pro Soluto - comparador)
+    df_politicas = pd.DataFrame()
+    for ws_pol in ("POLITICAS", "BD Politicas", "BD Políticas"):
+        try:
+            df_politicas = backend.ler(ws_pol, ttl=0)
+            df_politicas.columns = [str(c).strip() for c in df_politicas.columns]
+            if not df_politicas.empty:
+                break
+        except Exception:
+            continue
+
+    # 2. FINANCIAMENTOS
+    try:
+        df_finan = backend.ler("BD Financiamentos", ttl=0)
+        df_finan.columns = [str(c).strip() for c in df_finan.columns]
+        for col in df_finan.columns: df_finan[col] = df_finan[col].apply(limpar_moeda)
+    except: 
+        df_finan = pd.DataFrame()
+
+    # 3. ESTOQUE
+    try:
+        # Tenta carregar os dados
+        df_raw = backend.ler("BD Estoque Filtrada", ttl=0)
+        df_raw.columns = [str(c).strip() for c in df_raw.columns]
+        
+        # --- CORREÇÃO: VERIFICAR COLUNA DE VALOR DE VENDA ---
+        # Se a coluna 'Valor de Venda' não existir (pois pode não ter propagado ou estar em outra aba),
+        # usamos 'Valor Comercial Mínimo' como fallback para garantir que o estoque seja encontrado.
+        col_valor_venda = 'Valor de Venda'
+        if 'Valor de Venda' not in df_raw.columns:
+            if 'Valor Comercial Mínimo' in df_raw.columns:
+                col_valor_venda = 'Valor Comercial Mínimo'
+        
+        mapa_estoque = {
+            'Nome do Empreendimento': 'Empreendimento',
+            col_valor_venda: 'Valor de Venda', # Usa a coluna detectada
+            'Status da unidade': 'Status',
+            'Identificador': 'Identificador',
+            'Bairro': 'Bairro',
+            'Valor de Avaliação Bancária': 'Valor de Avaliação Bancária', 
+            'PS EmCash': 'PS_EmCash',
+            'PS Diamante': 'PS_Diamante',
+            'PS Ouro': 'PS_Ouro',
+            'PS Prata': 'PS_Prata',
+            'PS Bronze': 'PS_Bronze',
+            'PS Aço': 'PS_Aco',
+            'Previsão de expedição do habite-se': 'Data Entrega', # Alterado para Previsão de expedição do habite-se
+            'Área privativa total': 'Area',
+            'Tipo Planta/Área': 'Tipologia',
+            'Endereço': 'Endereco',
+            'Folga Volta ao Caixa': 'Volta_Caixa_Ref' # Mapeamento corrigido
+        }
+        
+        # Garantir correspondência mesmo com espaços
+        # Normalizar colunas do raw para sem espaços nas pontas
+        df_raw.columns = [c.strip() for c in df_raw.columns]
+        
+        # Ajustar chaves do mapa para bater com colunas limpas
+        mapa_ajustado = {}
+        for k, v in mapa_estoque.items():
+            if k.strip() in df_raw.columns:
+                mapa_ajustado[k.strip()] = v
+        
+        df_estoque = df_raw.rename(columns=mapa_ajustado)
+        
+        # Garantir colunas essenciais
+        if 'Valor de Venda' not in df_estoque.columns: df_estoque['Valor de Venda'] = 0.0
+        if 'Valor de Avaliação Bancária' not in df_estoque.columns: df_estoque['Valor de Avaliação Bancária'] = df_estoque['Valor de Venda']
+        if 'Status' not in df_estoque.columns: df_estoque['Status'] = 'Disponível'
+        if 'Empreendimento' not in df_estoque.columns: df_estoque['Empreendimento'] = 'N/A'
+        if 'Data Entrega' not in df_estoque.columns: df_estoque['Data Entrega'] = ''
+        if 'Area' not in df_estoque.columns: df_estoque['Area'] = ''
+        if 'Tipologia' not in df_estoque.columns: df_estoque['Tipologia'] = ''
+        if 'Endereco' not in df_estoque.columns: df_estoque['Endereco'] = ''
+        if 'Volta_Caixa_Ref' not in df_estoque.columns: df_estoque['Volta_Caixa_Ref'] = 0.0 # Garantir coluna nova
+        
+        # Conversões numéricas
+        df_estoque['Valor de Venda'] = df_estoque['Valor de Venda'].apply(limpar_moeda)
+        df_estoque['Valor de Avaliação Bancária'] = df_estoque['Valor de Avaliação Bancária'].apply(limpar_moeda)
+        df_estoque['Volta_Caixa_Ref'] = df_estoque['Volta_Caixa_Ref'].apply(limpar_moeda) # Converter nova coluna
+        
+        # Limpar colunas de PS
+        cols_ps = ['PS_EmCash', 'PS_Diamante', 'PS_Ouro', 'PS_Prata', 'PS_Bronze', 'PS_Aco']
+        for c in cols_ps:
+            if c in df_estoque.columns:
+                df_estoque[c] = df_estoque[c].apply(limpar_moeda)
+            else:
+                df_estoque[c] = 0.0
+        
+        # Tratamento de Status (NÃO FILTRA MAIS)
+        if 'Status' in df_estoque.columns:
+             df_estoque['Status'] = df_estoque['Status'].astype(str).str.strip()
+
+        # Filtros básicos (Mantendo apenas valor > 1000)
+        df_estoque = df_estoque[(df_estoque['Valor de Venda'] > 1000)].copy()
+        if 'Empreendimento' in df_estoque.columns:
+             df_estoque = df_estoque[df_estoque['Empreendimento'].notnull()]
+        
+        if 'Identificador' not in df_estoque.columns: 
+            df_estoque['Identificador'] = df_estoque.index.astype(str)
+        if 'Bairro' not in df_estoque.columns: 
+            df_estoque['Bairro'] = 'Rio de Janeiro'
+
+        # Extração de Bloco/Andar/Apto para ordenação
+        def extrair_dados_unid(id_unid, tipo):
+            try:
+                s = str(id_unid)
+                p, sx = (s.split('-')[0], s.split('-')[-1]) if '-' in s else (s, s)
+                np_val = re.sub(r'\D', '', p)
+                ns_val = re.sub(r'\D', '', sx)
+                if tipo == 'andar': return int(ns_val)//100 if ns_val else 0
+                if tipo == 'bloco': return int(np_val) if np_val else 1
+                if tipo == 'apto': return int(ns_val) if ns_val else 0
+            except: return 0 if tipo != 'bloco' else 1
+        df_estoque['Andar'] = df_estoque['Identificador'].apply(lambda x: extrair_dados_unid(x, 'andar'))
+        df_estoque['Bloco_Sort'] = df_estoque['Identificador'].apply(lambda x: extrair_dados_unid(x, 'bloco'))
+        df_estoque['Apto_Sort'] = df_estoque['Identificador'].apply(lambda x: extrair_dados_unid(x, 'apto'))
+        
+        if 'Empreendimento' in df_estoque.columns:
+            df_estoque['Empreendimento'] = df_estoque['Empreendimento'].astype(str).str.strip()
+        if 'Bairro' in df_estoque.columns:
+            df_estoque['Bairro'] = df_estoque['Bairro'].astype(str).str.strip()
+                                                              
+    except: 
+        df_estoque = pd.DataFrame(columns=['Empreendimento', 'Valor de Venda', 'Status', 'Identificador', 'Bairro', 'Valor de Avaliação Bancária'])
+
+    premissas_dict = dict(DEFAULT_PREMISSAS)
+    for ws_prem in ("BD Premissas", "PREMISSAS"):
+        try:
+            df_pr = backend.ler(ws_prem, ttl=0)
+            if df_pr is None or df_pr.empty:
+                continue
+            premissas_dict = premissas_from_dataframe(df_pr)
+            break
+        except Exception:
+            continue
+
+    return {
+        "finan": df_finan,
+        "estoque": df_estoque,
+        "politicas": df_politicas,
+        "premissas": MappingProxyType(premissas_dict),
+    }
+
+
+@st.cache_data(max_entries=4, show_spinner=False)
+def _carregar_tabelas_editaveis(
+    revisoes: tuple[str, ...],
+) -> tuple[pd.DataFrame, pd.DataFrame, pd.DataFrame]:
+    """Logins, banners e textos de campanhas (pequenas; limpas por st.cache_data.clear() após gravação)."""
+    backend = _backend_dados()
+    try:
+        df_hb_raw = backend.ler("BD Home Banners", ttl=0)
+        df_home_banners = normalizar_df_home_banners(df_hb_raw)
+    except Exception:
+        df_home_banners = pd.DataFrame(columns=list(_COLS_HOME_BANNERS))
+
+    try:
+        df_ct_raw = backend.ler(_WS_CAMPANHAS_TEXTO, ttl=0)
+        df_campanhas_texto = normalizar_df_campanhas_texto(df_ct_raw)
+    except Exception:
+        df_campanhas_texto = pd.DataFrame(columns=list(_COLS_CAMPANHAS_TEXTO))
+
+    try:
+        df_logins_raw = backend.ler("BD Logins", ttl=0)
+        df_logins = _normalizar_df_logins(df_logins_raw)
+    except Exception:
+        df_logins = pd.DataFrame()
+
+    return df_logins, df_home_banners, df_campanhas_texto
+
+
 def carregar_dados_sistema():
     try:
-        if "connections" not in st.secrets:
+        backend = _backend_dados()
+        if isinstance(backend, _BackendGSheets) and "connections" not in st.secrets:
             return (
                 pd.DataFrame(),
                 pd.DataFrame(),
@@ -4250,173 +7571,27 @@ def carregar_dados_sistema():
                 dict(DEFAULT_PREMISSAS),
                 pd.DataFrame(columns=list(_COLS_CAMPANHAS_TEXTO)),
             )
-        conn = st.connection("gsheets", type=GSheetsConnection)
-        def limpar_moeda(val): return safe_float_convert(val)
-
+        ref = _carregar_tabelas_referencia(
+            _revisoes_abas(_ABAS_REFERENCIA, _DADOS_SISTEMA_TTL_S)
+        )
+        # Vistas rasas: colunas novas ficam na sessão, mas os dados são os do processo —
+        # quem altera valores copia antes (ver df_estoque.copy() no simulador).
+        vistas = (
+            ref["finan"].copy(deep=False),
+            ref["estoque"].copy(deep=False),
+            ref["politicas"].copy(deep=False),
+        )
+        df_logins, df_home_banners, df_campanhas_texto = _carregar_tabelas_editaveis(
+            _revisoes_abas(_ABAS_EDITAVEIS, _DADOS_SISTEMA_TTL_S)
+        )
         # Histórico em BD Simulações não é mais carregado na UI (gravação no resumo mantida)
         df_cadastros = pd.DataFrame()
-
-        # 1. POLITICAS (Pro Soluto - comparador)
-        df_politicas = pd.DataFrame()
-        for ws_pol in ("POLITICAS", "BD Politicas", "BD Políticas"):
-            try:
-                df_politicas = conn.read(spreadsheet=ID_GERAL, worksheet=ws_pol)
-                df_politicas.columns = [str(c).strip() for c in df_politicas.columns]
-                if not df_politicas.empty:
-                    break
-            except Exception:
-                continue
-
-        # 2. FINANCIAMENTOS
-        try:
-            df_finan = conn.read(spreadsheet=ID_GERAL, worksheet="BD Financiamentos")
-            df_finan.columns = [str(c).strip() for c in df_finan.columns]
-            for col in df_finan.columns: df_finan[col] = df_finan[col].apply(limpar_moeda)
-        except: 
-            df_finan = pd.DataFrame()
-
-        # 3. ESTOQUE
-        try:
-            # Tenta carregar os dados
-            df_raw = conn.read(spreadsheet=ID_GERAL, worksheet="BD Estoque Filtrada")
-            df_raw.columns = [str(c).strip() for c in df_raw.columns]
-            
-            # --- CORREÇÃO: VERIFICAR COLUNA DE VALOR DE VENDA ---
-            # Se a coluna 'Valor de Venda' não existir (pois pode não ter propagado ou estar em outra aba),
-            # usamos 'Valor Comercial Mínimo' como fallback para garantir que o estoque seja encontrado.
-            col_valor_venda = 'Valor de Venda'
-            if 'Valor de Venda' not in df_raw.columns:
-                if 'Valor Comercial Mínimo' in df_raw.columns:
-                    col_valor_venda = 'Valor Comercial Mínimo'
-            
-            mapa_estoque = {
-                'Nome do Empreendimento': 'Empreendimento',
-                col_valor_venda: 'Valor de Venda', # Usa a coluna detectada
-                'Status da unidade': 'Status',
-                'Identificador': 'Identificador',
-                'Bairro': 'Bairro',
-                'Valor de Avaliação Bancária': 'Valor de Avaliação Bancária', 
-                'PS EmCash': 'PS_EmCash',
-                'PS Diamante': 'PS_Diamante',
-                'PS Ouro': 'PS_Ouro',
-                'PS Prata': 'PS_Prata',
-                'PS Bronze': 'PS_Bronze',
-                'PS Aço': 'PS_Aco',
-                'Previsão de expedição do habite-se': 'Data Entrega', # Alterado para Previsão de expedição do habite-se
-                'Área privativa total': 'Area',
-                'Tipo Planta/Área': 'Tipologia',
-                'Endereço': 'Endereco',
-                'Folga Volta ao Caixa': 'Volta_Caixa_Ref' # Mapeamento corrigido
-            }
-            
-            # Garantir correspondência mesmo com espaços
-            # Normalizar colunas do raw para sem espaços nas pontas
-            df_raw.columns = [c.strip() for c in df_raw.columns]
-            
-            # Ajustar chaves do mapa para bater com colunas limpas
-            mapa_ajustado = {}
-            for k, v in mapa_estoque.items():
-                if k.strip() in df_raw.columns:
-                    mapa_ajustado[k.strip()] = v
-            
-            df_estoque = df_raw.rename(columns=mapa_ajustado)
-            
-            # Garantir colunas essenciais
-            if 'Valor de Venda' not in df_estoque.columns: df_estoque['Valor de Venda'] = 0.0
-            if 'Valor de Avaliação Bancária' not in df_estoque.columns: df_estoque['Valor de Avaliação Bancária'] = df_estoque['Valor de Venda']
-            if 'Status' not in df_estoque.columns: df_estoque['Status'] = 'Disponível'
-            if 'Empreendimento' not in df_estoque.columns: df_estoque['Empreendimento'] = 'N/A'
-            if 'Data Entrega' not in df_estoque.columns: df_estoque['Data Entrega'] = ''
-            if 'Area' not in df_estoque.columns: df_estoque['Area'] = ''
-            if 'Tipologia' not in df_estoque.columns: df_estoque['Tipologia'] = ''
-            if 'Endereco' not in df_estoque.columns: df_estoque['Endereco'] = ''
-            if 'Volta_Caixa_Ref' not in df_estoque.columns: df_estoque['Volta_Caixa_Ref'] = 0.0 # Garantir coluna nova
-            
-            # Conversões numéricas
-            df_estoque['Valor de Venda'] = df_estoque['Valor de Venda'].apply(limpar_moeda)
-            df_estoque['Valor de Avaliação Bancária'] = df_estoque['Valor de Avaliação Bancária'].apply(limpar_moeda)
-            df_estoque['Volta_Caixa_Ref'] = df_estoque['Volta_Caixa_Ref'].apply(limpar_moeda) # Converter nova coluna
-            
-            # Limpar colunas de PS
-            cols_ps = ['PS_EmCash', 'PS_Diamante', 'PS_Ouro', 'PS_Prata', 'PS_Bronze', 'PS_Aco']
-            for c in cols_ps:
-                if c in df_estoque.columns:
-                    df_estoque[c] = df_estoque[c].apply(limpar_moeda)
-                else:
-                    df_estoque[c] = 0.0
-            
-            # Tratamento de Status (NÃO FILTRA MAIS)
-            if 'Status' in df_estoque.columns:
-                 df_estoque['Status'] = df_estoque['Status'].astype(str).str.strip()
-
-            # Filtros básicos (Mantendo apenas valor > 1000)
-            df_estoque = df_estoque[(df_estoque['Valor de Venda'] > 1000)].copy()
-            if 'Empreendimento' in df_estoque.columns:
-                 df_estoque = df_estoque[df_estoque['Empreendimento'].notnull()]
-            
-            if 'Identificador' not in df_estoque.columns: 
-                df_estoque['Identificador'] = df_estoque.index.astype(str)
-            if 'Bairro' not in df_estoque.columns: 
-                df_estoque['Bairro'] = 'Rio de Janeiro'
-
-            # Extração de Bloco/Andar/Apto para ordenação
-            def extrair_dados_unid(id_unid, tipo):
-                try:
-                    s = str(id_unid)
-                    p, sx = (s.split('-')[0], s.split('-')[-1]) if '-' in s else (s, s)
-                    np_val = re.sub(r'\D', '', p)
-                    ns_val = re.sub(r'\D', '', sx)
-                    if tipo == 'andar': return int(ns_val)//100 if ns_val else 0
-                    if tipo == 'bloco': return int(np_val) if np_val else 1
-                    if tipo == 'apto': return int(ns_val) if ns_val else 0
-                except: return 0 if tipo != 'bloco' else 1
-            df_estoque['Andar'] = df_estoque['Identificador'].apply(lambda x: extrair_dados_unid(x, 'andar'))
-            df_estoque['Bloco_Sort'] = df_estoque['Identificador'].apply(lambda x: extrair_dados_unid(x, 'bloco'))
-            df_estoque['Apto_Sort'] = df_estoque['Identificador'].apply(lambda x: extrair_dados_unid(x, 'apto'))
-            
-            if 'Empreendimento' in df_estoque.columns:
-                df_estoque['Empreendimento'] = df_estoque['Empreendimento'].astype(str).str.strip()
-            if 'Bairro' in df_estoque.columns:
-                df_estoque['Bairro'] = df_estoque['Bairro'].astype(str).str.strip()
-                                                                  
-        except: 
-            df_estoque = pd.DataFrame(columns=['Empreendimento', 'Valor de Venda', 'Status', 'Identificador', 'Bairro', 'Valor de Avaliação Bancária'])
-
-        premissas_dict = dict(DEFAULT_PREMISSAS)
-        for ws_prem in ("BD Premissas", "PREMISSAS"):
-            try:
-                df_pr = conn.read(spreadsheet=ID_GERAL, worksheet=ws_prem)
-                premissas_dict = premissas_from_dataframe(df_pr)
-                break
-            except Exception:
-                continue
-
-        try:
-            df_hb_raw = conn.read(spreadsheet=ID_GERAL, worksheet="BD Home Banners")
-            df_home_banners = normalizar_df_home_banners(df_hb_raw)
-        except Exception:
-            df_home_banners = pd.DataFrame(columns=list(_COLS_HOME_BANNERS))
-
-        try:
-            df_ct_raw = conn.read(spreadsheet=ID_GERAL, worksheet=_WS_CAMPANHAS_TEXTO)
-            df_campanhas_texto = normalizar_df_campanhas_texto(df_ct_raw)
-        except Exception:
-            df_campanhas_texto = pd.DataFrame(columns=list(_COLS_CAMPANHAS_TEXTO))
-
-        try:
-            df_logins_raw = conn.read(spreadsheet=ID_GERAL, worksheet="BD Logins")
-            df_logins = _normalizar_df_logins(df_logins_raw)
-        except Exception:
-            df_logins = pd.DataFrame()
-
         return (
-            df_finan,
-            df_estoque,
-            df_politicas,
+            *vistas,
             df_logins,
             df_cadastros,
             df_home_banners,
-            premissas_dict,
+            dict(ref["premissas"]),
             df_campanhas_texto,
         )
     except Exception as e:
@@ -4671,6 +7846,77 @@ def ids_unidades_recomendadas_empreendimento(
     return {str(x).strip() for x in cand["Identificador"].unique() if x is not None and str(x).strip() != ""}
 
 
+_RECOMENDACAO_CARDS_HTML: "OrderedDict[str, str]" = OrderedDict()
+_RECOMENDACAO_CARDS_LOCK = threading.Lock()
+
+
+def _recomendacao_card_html(row: Mapping[str, Any], label: str, css_badge: str) -> str:
+    """
+    Fragmento HTML de um card da Recomendação, guardado por (Empreendimento, Identificador,
+    perfil, preço e métricas calculadas): entre reruns só os cards novos passam por fmt_br.
+    """
+    def _num(v: Any) -> Any:
+        try:
+            return round(float(v or 0), 2)
+        except (TypeError, ValueError):
+            return str(v)
+
+    chave = "\x1f".join(
+        str(x)
+        for x in (
+            row["Empreendimento"],
+            row["Identificador"],
+            label,
+            css_badge,
+            _num(row["Valor de Venda"]),
+            _num(row["Valor de Avaliação Bancária"]),
+            _num(row.get("Lucro_Recomendacao", 0)),
+            _num(row.get("VCX_Usado_Fechamento", 0)),
+            _num(row.get("VCX_Preservado", 0)),
+        )
+    )
+    with _RECOMENDACAO_CARDS_LOCK:
+        html = _RECOMENDACAO_CARDS_HTML.get(chave)
+        if html is not None:
+            _RECOMENDACAO_CARDS_HTML.move_to_end(chave)
+            return html
+
+    emp_name = row['Empreendimento']
+    unid_name = row['Identificador']
+    val_fmt = fmt_br(row['Valor de Venda'])
+    aval_fmt = fmt_br(row['Valor de Avaliação Bancária'])
+    lucro_fmt = fmt_br(float(row.get("Lucro_Recomendacao", 0) or 0))
+    vcx_usado_fmt = fmt_br(float(row.get("VCX_Usado_Fechamento", 0) or 0))
+    vcx_pres_fmt = fmt_br(float(row.get("VCX_Preservado", 0) or 0))
+    html = f"""
+                         <div class="card-item">
+                            <div class="recommendation-card" style="border-top: 4px solid {COR_AZUL_ESC}; height: 100%; justify-content: flex-start;">
+                                <span style="color:#111111; opacity:0.95;">Perfil</span><br>
+                                <div style="margin-top:5px; margin-bottom:15px;"><span class="{css_badge}">{label}</span></div>
+                                <b style="color:#111111;">{emp_name}</b><br>
+                                <div style="color:#111111; text-align:center; border-top:1px solid #eee; padding-top:10px; width:100%;">
+                                    <b>Unidade: {unid_name}</b>
+                                </div>
+                                <div style="margin: 10px 0; width: 100%;">
+                                    <div style="color:#111111;">Avaliação</div>
+                                    <div style="font-weight:bold; color:#111111;">{reais_streamlit_html(aval_fmt)}</div>
+                                    <div style="color:#111111; margin-top:5px;">Valor de venda</div>
+                                    <div class="price-tag" style="margin-top:0;">{reais_streamlit_html(val_fmt)}</div>
+                                    <div style="color:#111111; margin-top:8px;">Lucro recomendado</div>
+                                    <div style="font-weight:800; color:#111111;">{reais_streamlit_html(lucro_fmt)}</div>
+                                    <div style="color:#111111; opacity:0.75; margin-top:5px;">
+                                      VCX usado: {reais_streamlit_html(vcx_usado_fmt)} | VCX preservado: {reais_streamlit_html(vcx_pres_fmt)}
+                                    </div>
+                                </div>
+                            </div>
+                         </div>"""
+    with _RECOMENDACAO_CARDS_LOCK:
+        _RECOMENDACAO_CARDS_HTML[chave] = html
+        while len(_RECOMENDACAO_CARDS_HTML) > RECOMENDACAO_CARDS_CACHE_MAX:
+            _RECOMENDACAO_CARDS_HTML.popitem(last=False)
+    return html
+
+
 _DIR_SIM_APP = Path(__file__).resolve().parent
 
 
@@ -4690,18 +7936,71 @@ def _resolver_imagem_fundo_local(nome: str) -> Path | None:
     return None
 
 
+def _asset_mime(p: Path) -> str:
+    return "image/jpeg" if p.suffix.lower() in (".jpg", ".jpeg") else "image/png"
+
+
+def _asset_reduzido(p: Path, caixa: tuple[int, int], formato: str = "webp") -> tuple[bytes, str]:
+    """
+    Redimensiona (sem ampliar) para caber em ``caixa`` e recodifica: WebP (sem perdas se a
+    origem for PNG, para o logo manter as arestas) ou PNG otimizado. Sem Pillow/WebP, ou se o
+    resultado não ficar menor, devolve o ficheiro original.
+    """
+    raw = p.read_bytes()
+    if Image is None:
+        return raw, _asset_mime(p)
+    try:
+        with Image.open(io.BytesIO(raw)) as im:
+            im.load()
+            im.thumbnail(caixa, Image.LANCZOS)
+            if im.mode not in ("RGB", "RGBA", "L", "LA"):
+                im = im.convert("RGBA")
+            out, mime = io.BytesIO(), "image/webp"
+            try:
+                if formato != "webp":
+                    raise KeyError(formato)
+                if _asset_mime(p) == "image/png":
+                    im.save(out, "WEBP", lossless=True, quality=100, method=4)
+                else:
+                    im.save(out, "WEBP", quality=ASSET_WEBP_QUALIDADE, method=6)
+            except (KeyError, OSError):
+                # Pillow compilado sem libwebp (ou PNG pedido): PNG otimizado.
+                out, mime = io.BytesIO(), "image/png"
+                im.save(out, "PNG", optimize=True)
+    except Exception:
+        _sf_logger.warning("Assets: falha ao reduzir %s; usa o original", p, exc_info=True)
+        return raw, _asset_mime(p)
+    dados = out.getvalue()
+    if len(dados) >= len(raw):
+        return raw, _asset_mime(p)
+    return dados, mime
+
+
+@st.cache_resource(max_entries=16, show_spinner=False)
+def _asset_versao(caminho: str, versao: tuple[int, int], caixa: tuple[int, int], formato: str) -> tuple[bytes, str]:
+    """
+    Bytes reduzidos e data-URL base64, codificados uma vez por processo e versão do
+    ficheiro (mtime, tamanho); os reruns só reutilizam a string.
+    """
+    dados, mime = _asset_reduzido(Path(caminho), caixa, formato)
+    return dados, f"data:{mime};base64,{base64.b64encode(dados).decode('ascii')}"
+
+
+def _asset(p: Path | None, caixa: tuple[int, int], formato: str = "webp") -> tuple[bytes, str] | None:
+    if p is None:
+        return None
+    try:
+        info = p.stat()
+        return _asset_versao(str(p), (info.st_mtime_ns, info.st_size), caixa, formato)
+    except OSError:
+        return None
+
+
 def _css_url_fundo_simulador() -> str:
-    """Imagem local (ficha Vendas RJ); senão fallback neutro."""
-    p = _resolver_imagem_fundo_local(FUNDO_CADASTRO_ARQUIVO)
-    if p and p.is_file():
-        try:
-            raw = p.read_bytes()
-            suf = p.suffix.lower()
-            mime = "image/jpeg" if suf in (".jpg", ".jpeg") else "image/png"
-            b64 = base64.b64encode(raw).decode("ascii")
-            return f"data:{mime};base64,{b64}"
-        except OSError:
-            pass
+    """Imagem local (ficha Vendas RJ) reduzida em data-URL; senão fallback neutro."""
+    asset = _asset(_resolver_imagem_fundo_local(FUNDO_CADASTRO_ARQUIVO), ASSET_FUNDO_PX)
+    if asset:
+        return asset[1]
     return (
         "https://images.unsplash.com/photo-1486406146926-c627a92ad1ab"
         "?auto=format&fit=crop&w=1920&q=80"
@@ -4722,45 +8021,26 @@ def _resolver_png_raiz(nome: str) -> Path | None:
 def _page_icon_streamlit():
     """Ícone da aba: 502.57_LOGO D_COR_V3F.png (ficha), senão favicon.png legado, senão URL."""
     p = _resolver_png_raiz(FAVICON_ARQUIVO)
-    if p is not None and Image:
-        try:
-            return Image.open(p)
-        except Exception:
-            return str(p)
-    if p is not None:
-        return str(p)
-    if os.path.exists("favicon.png") and Image:
+    if p is None and os.path.exists("favicon.png"):
+        p = Path("favicon.png")
+    if p is None:
+        return URL_FAVICON_RESERVA
+    asset = _asset(p, ASSET_FAVICON_PX, "png")
+    if asset and Image:
         try:
-            return Image.open("favicon.png")
+            return Image.open(io.BytesIO(asset[0]))
         except Exception:
             pass
-    return URL_FAVICON_RESERVA
+    return str(p)
 
 
 def _src_logo_topo_header() -> str:
-    """Logo do cabeçalho: 502.57_LOGO DIRECIONAL_V2F-01.png em data-URL; senão legado; senão URL."""
+    """Logo do cabeçalho: 502.57_LOGO DIRECIONAL_V2F-01.png reduzido em data-URL; senão legado; senão URL."""
     p = _resolver_png_raiz(LOGO_TOPO_ARQUIVO)
-    if p and p.is_file():
-        try:
-            suf = p.suffix.lower()
-            mime = (
-                "image/png"
-                if suf == ".png"
-                else "image/jpeg"
-                if suf in (".jpg", ".jpeg")
-                else "image/png"
-            )
-            b64 = base64.b64encode(p.read_bytes()).decode("ascii")
-            return f"data:{mime};base64,{b64}"
-        except OSError:
-            pass
-    if os.path.exists("favicon.png"):
-        try:
-            with open("favicon.png", "rb") as f:
-                return f"data:image/png;base64,{base64.b64encode(f.read()).decode()}"
-        except OSError:
-            pass
-    return URL_LOGO_DIRECIONAL_BIG
+    if p is None and os.path.exists("favicon.png"):
+        p = Path("favicon.png")
+    asset = _asset(p, ASSET_LOGO_TOPO_PX)
+    return asset[1] if asset else URL_LOGO_DIRECIONAL_BIG
 
 
 def configurar_layout():
@@ -7284,244 +10564,455 @@ def _html_cartao_resumo_secao(titulo: str, corpo_html: str) -> str:
     )
 
 
+# Cache dos bytes do PDF de resumo: o mesmo resumo sai para download, e-mail do cliente e
+# e-mail do corretor. Chave = sha256 dos campos de «d» que o PDF lê + volta ao caixa +
+# versão do modelo + data do dia (usada quando d não traz data_simulacao).
+# Subir _PDF_RESUMO_VERSAO sempre que o layout ou os textos do PDF mudarem.
+_PDF_RESUMO_VERSAO = "resumo-v2"
+_PDF_RESUMO_CAMPOS = (
+    "nome", "cpf", "renda", "ranking", "politica", "imovel_valor", "outros_descontos",
+    "outros_descontos_motivo", "empreendimento_nome", "unidade_id", "unid_entrega", "unid_area",
+    "unid_tipo", "unid_endereco", "unid_bairro", "finan_usado", "prazo_financiamento",
+    "sistema_amortizacao", "parcela_financiamento", "fgts_sub_usado", "ps_usado",
+    "tipo_fluxo_pro_soluto", "ps_parcelas", "ps_com_carencia", "ps_maior_valor", "ps_menor_valor",
+    "ato_final", "ato_30", "ato_60", "ato_90", "anual_1", "anual_2", "anual_3", "entrada_total",
+    "corretor_nome", "data_simulacao",
+)
+_PDF_CACHE_MAX_BYTES = 32 * 1024 * 1024
+
+
+class _CacheBytesLRU:
+    """LRU em processo limitado pelo total de bytes guardados (não pelo número de entradas)."""
+
+    def __init__(self, max_bytes: int) -> None:
+        self.max_bytes = max(1, int(max_bytes))
+        self._itens: "OrderedDict[str, bytes]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, chave: str) -> bytes | None:
+        with self._lock:
+            valor = self._itens.get(chave)
+            if valor is None:
+                self.misses += 1
+                return None
+            self._itens.move_to_end(chave)
+            self.hits += 1
+            return valor
+
+    def put(self, chave: str, valor: bytes) -> None:
+        if len(valor) > self.max_bytes:
+            return
+        with self._lock:
+            antigo = self._itens.pop(chave, None)
+            if antigo is not None:
+                self.bytes -= len(antigo)
+            self._itens[chave] = valor
+            self.bytes += len(valor)
+            while self.bytes > self.max_bytes:
+                _, saiu = self._itens.popitem(last=False)
+                self.bytes -= len(saiu)
+
+
+_PDF_RESUMO_CACHE = _CacheBytesLRU(_PDF_CACHE_MAX_BYTES)
+
+
+def _pdf_resumo_chave(d, volta_caixa_val) -> str:
+    try:
+        vc = round(max(0.0, float(volta_caixa_val or 0)), 2)
+    except (TypeError, ValueError):
+        vc = 0.0
+    base = {
+        "campos": {k: d.get(k) for k in _PDF_RESUMO_CAMPOS},
+        "vc": vc,
+        "versao": _PDF_RESUMO_VERSAO,
+        "dia": date.today().isoformat(),
+    }
+    bruto = json.dumps(base, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(bruto.encode("utf-8")).hexdigest()
+
+
 def gerar_resumo_pdf(d, volta_caixa_val: float = 0.0):
+    """Bytes do PDF de resumo, servidos do cache quando o mesmo resumo já foi gerado."""
     if not PDF_ENABLED:
         return None
+    chave = _pdf_resumo_chave(d, volta_caixa_val)
+    pdf_bytes = _PDF_RESUMO_CACHE.get(chave)
+    if pdf_bytes is None:
+        pdf_bytes = _gerar_resumo_pdf_fpdf(d, volta_caixa_val)
+        if pdf_bytes:
+            _PDF_RESUMO_CACHE.put(chave, pdf_bytes)
+    return pdf_bytes
+
+
+# Recursos estáticos do resumo (cores convertidas, bytes do logo), montados uma vez por
+# processo: gerar um resumo só preenche o texto variável sobre esse «molde».
+_PDF_RECURSOS: dict[str, Any] = {}
+_PDF_RECURSOS_LOCK = threading.Lock()
+# Reemissão em lote: resumos por tarefa enviada ao pool de processos.
+_PDF_LOTE_BLOCO = 64
+
+
+def _pdf_recursos() -> dict[str, Any]:
+    with _PDF_RECURSOS_LOCK:
+        if not _PDF_RECURSOS:
+            caminho = None
+            _p_fav = _resolver_png_raiz(FAVICON_ARQUIVO)
+            if _p_fav and _p_fav.is_file():
+                caminho = str(_p_fav)
+            elif os.path.exists("favicon.png"):
+                caminho = "favicon.png"
+            logo = None
+            if caminho:
+                try:
+                    logo = _asset_reduzido(Path(caminho), ASSET_PDF_LOGO_PX, "png")[0]
+                except OSError:
+                    logo = None
+            _PDF_RECURSOS.update(
+                {
+                    "azul": _hex_para_rgb_uint8(COR_AZUL_ESC),
+                    "vermelho": (227, 6, 19),
+                    "branco": (255, 255, 255),
+                    "logo_caminho": caminho,
+                    "logo_bytes": logo,
+                }
+            )
+        return _PDF_RECURSOS
 
-    try:
+
+def _pdf_logo(pdf, rec: dict[str, Any]) -> None:
+    """Logo a partir dos bytes em memória (fpdf2); PyFPDF 1.x só aceita caminho e cai para ele."""
+    if rec.get("logo_bytes"):
         try:
-            vc_apl = max(0.0, float(volta_caixa_val or 0))
-        except (TypeError, ValueError):
-            vc_apl = 0.0
-        v_total = max(0.0, float(d.get("imovel_valor", 0) or 0))
+            pdf.image(io.BytesIO(rec["logo_bytes"]), pdf.l_margin, 8, 10)
+            return
+        except Exception:
+            rec["logo_bytes"] = None
+    if rec.get("logo_caminho"):
         try:
-            outros_pdf = max(0.0, float(d.get("outros_descontos", 0) or 0))
-        except (TypeError, ValueError):
-            outros_pdf = 0.0
-        v_prop = max(0.0, v_total - vc_apl - outros_pdf)
-        _pol_pdf = str(d.get("politica", "Direcional") or "Direcional").strip()
-        _pol_pdf_label = "Emcash" if _politica_emcash(_pol_pdf) else "Direcional"
+            pdf.image(rec["logo_caminho"], pdf.l_margin, 8, 10)
+        except Exception:
+            pass
 
-        pdf = FPDF()
-        pdf.add_page()
 
-        # Margens
-        pdf.set_margins(12, 12, 12)
-        pdf.set_auto_page_break(auto=True, margin=12)
+def _pdf_novo_documento():
+    pdf = FPDF()
+    pdf.set_margins(12, 12, 12)
+    pdf.set_auto_page_break(auto=True, margin=12)
+    return pdf
+
+
+def _pdf_bytes(pdf) -> bytes:
+    # PyFPDF: output(dest="S") devolve str; fpdf2 pode devolver bytes. Latin-1 é o esperado pelo PDF bruto.
+    out = pdf.output(dest="S")
+    if isinstance(out, (bytes, bytearray)):
+        return bytes(out)
+    return out.encode("latin-1", errors="replace")
+
 
-        largura_util = pdf.w - pdf.l_margin - pdf.r_margin
+def _pdf_desenhar_resumo(pdf, d, volta_caixa_val: float = 0.0) -> None:
+    """Desenha um resumo a partir da página corrente de «pdf» (pode haver vários por documento)."""
+    rec = _pdf_recursos()
+    try:
+        vc_apl = max(0.0, float(volta_caixa_val or 0))
+    except (TypeError, ValueError):
+        vc_apl = 0.0
+    v_total = max(0.0, float(d.get("imovel_valor", 0) or 0))
+    try:
+        outros_pdf = max(0.0, float(d.get("outros_descontos", 0) or 0))
+    except (TypeError, ValueError):
+        outros_pdf = 0.0
+    v_prop = max(0.0, v_total - vc_apl - outros_pdf)
+    _pol_pdf = str(d.get("politica", "Direcional") or "Direcional").strip()
+    _pol_pdf_label = "Emcash" if _politica_emcash(_pol_pdf) else "Direcional"
+
+    largura_util = pdf.w - pdf.l_margin - pdf.r_margin
+
+    AZUL = rec["azul"]
+    VERMELHO = rec["vermelho"]
+    BRANCO = rec["branco"]
+
+    # Barra superior; o título começa na margem superior em todas as páginas do documento.
+    pdf.set_y(pdf.t_margin)
+    pdf.set_fill_color(*AZUL)
+    pdf.rect(0, 0, pdf.w, 3, 'F')
+
+    # Logo (mesmo ficheiro do favicon da página)
+    _pdf_logo(pdf, rec)
+
+    # Título
+    pdf.ln(8)
+    pdf.set_text_color(*AZUL)
+    _nome_topo_pdf = (d.get("nome") or "").strip()
+    if _nome_topo_pdf:
+        pdf.set_font("Helvetica", 'B', 12)
+        pdf.cell(0, 6, _pdf_text_seguro(_nome_topo_pdf), ln=True, align='C')
+        pdf.ln(2)
+    pdf.set_font("Helvetica", 'B', 20)
+    pdf.cell(0, 10, _pdf_text_seguro("Resumo da simulação - Direcional"), ln=True, align='C')
 
-        AZUL = _hex_para_rgb_uint8(COR_AZUL_ESC)
-        VERMELHO = (227, 6, 19)
-        BRANCO = (255, 255, 255)
-        FUNDO_SECAO = (248, 250, 252)
+    pdf.set_font("Helvetica", '', 9)
+    pdf.cell(0, 5, _pdf_text_seguro("Simulador imobiliário Direcional"), ln=True, align='C')
+    pdf.ln(6)
 
-        # Barra superior
+    # Helpers
+    def secao(titulo):
         pdf.set_fill_color(*AZUL)
-        pdf.rect(0, 0, pdf.w, 3, 'F')
-
-        # Logo (mesmo ficheiro do favicon da página)
-        _ico_pdf = None
-        _p_fav = _resolver_png_raiz(FAVICON_ARQUIVO)
-        if _p_fav and _p_fav.is_file():
-            _ico_pdf = str(_p_fav)
-        elif os.path.exists("favicon.png"):
-            _ico_pdf = "favicon.png"
-        if _ico_pdf:
-            try:
-                pdf.image(_ico_pdf, pdf.l_margin, 8, 10)
-            except Exception:
-                pass
+        pdf.set_text_color(*BRANCO)
+        pdf.set_font("Helvetica", 'B', 10)
+        pdf.cell(largura_util, 7, _pdf_text_seguro(f"  {titulo}"), ln=True, fill=True)
+        pdf.ln(2)
 
-        # Título
-        pdf.ln(8)
+    def linha(label, valor, destaque=False):
+        label = _pdf_text_seguro(label)
+        valor = _pdf_text_seguro(valor)
         pdf.set_text_color(*AZUL)
-        _nome_topo_pdf = (d.get("nome") or "").strip()
-        if _nome_topo_pdf:
-            pdf.set_font("Helvetica", 'B', 12)
-            pdf.cell(0, 6, _pdf_text_seguro(_nome_topo_pdf), ln=True, align='C')
-            pdf.ln(2)
-        pdf.set_font("Helvetica", 'B', 20)
-        pdf.cell(0, 10, _pdf_text_seguro("Resumo da simulação - Direcional"), ln=True, align='C')
-
-        pdf.set_font("Helvetica", '', 9)
-        pdf.cell(0, 5, _pdf_text_seguro("Simulador imobiliário Direcional"), ln=True, align='C')
-        pdf.ln(6)
-
-        # Helpers
-        def secao(titulo):
-            pdf.set_fill_color(*AZUL)
-            pdf.set_text_color(*BRANCO)
-            pdf.set_font("Helvetica", 'B', 10)
-            pdf.cell(largura_util, 7, _pdf_text_seguro(f"  {titulo}"), ln=True, fill=True)
-            pdf.ln(2)
-
-        def linha(label, valor, destaque=False):
-            label = _pdf_text_seguro(label)
-            valor = _pdf_text_seguro(valor)
-            pdf.set_text_color(*AZUL)
-            pdf.set_font("Helvetica", '', 10)
-            pdf.cell(largura_util * 0.6, 6, label)
-
-            if destaque:
-                pdf.set_text_color(*VERMELHO)
-                pdf.set_font("Helvetica", 'B', 10)
-            else:
-                pdf.set_font("Helvetica", 'B', 10)
-
-            pdf.cell(largura_util * 0.4, 6, valor, ln=True, align='R')
-            pdf.set_draw_color(235, 238, 242)
-            pdf.line(pdf.l_margin, pdf.get_y(), pdf.l_margin + largura_util, pdf.get_y())
-
-        # ===============================
-        # CONTEÚDO (alinhado ao texto WhatsApp / resumo na tela)
-        # ===============================
-        secao("Renda")
-        linha("Renda familiar total", f"R$ {fmt_br(d.get('renda', 0))}")
-        _cpf_pdf_d = re.sub(r"\D", "", str(d.get("cpf") or ""))
-        if len(_cpf_pdf_d) == 11:
-            linha("CPF", _sf_cpf_mascarado_br(_cpf_pdf_d))
-        elif str(d.get("cpf") or "").strip():
-            linha("CPF", _pdf_text_seguro(str(d.get("cpf") or "").strip()))
-        _rank_pdf_s = str(d.get("ranking") or "").strip()
-        if _rank_pdf_s:
-            linha("Ranking do cliente", _pdf_text_seguro(_rank_pdf_s))
+        pdf.set_font("Helvetica", '', 10)
+        pdf.cell(largura_util * 0.6, 6, label)
 
-        pdf.ln(2)
-        secao("Dados do imóvel")
-        linha("Empreendimento", _pdf_text_seguro(d.get("empreendimento_nome")))
-        linha("Unidade", _pdf_text_seguro(d.get("unidade_id")))
-        linha("Valor de venda (lista)", f"R$ {fmt_br(v_total)}", True)
-        _desc_pdf = vc_apl + outros_pdf
-        if _desc_pdf > 0.009:
-            linha("Descontos Concedidos", f"R$ {fmt_br(_desc_pdf)}")
-        _mot_pdf = str(d.get("outros_descontos_motivo") or "").strip()
-        if outros_pdf > 0.009 and _mot_pdf:
-            pdf.set_font("Helvetica", "", 9)
-            pdf.set_text_color(70, 80, 95)
-            pdf.multi_cell(
-                largura_util,
-                4,
-                _pdf_text_seguro(f"Origem dos outros descontos: {_mot_pdf}"),
-                ln=True,
-            )
-            pdf.ln(1)
-            pdf.set_text_color(*AZUL)
-        linha("Valor final da unidade", f"R$ {fmt_br(v_prop)}", True)
-        if d.get("unid_entrega"):
-            linha("Previsão de entrega", _pdf_text_seguro(d.get("unid_entrega")))
-        if d.get("unid_area"):
-            linha("Área privativa", _pdf_text_seguro(f"{d.get('unid_area')} m²"))
-        if d.get("unid_tipo"):
-            linha("Tipologia", _pdf_text_seguro(d.get("unid_tipo")))
-        if d.get("unid_endereco") and d.get("unid_bairro"):
-            linha(
-                "Localização",
-                _pdf_text_seguro(f"{d.get('unid_endereco')} - {d.get('unid_bairro')}"),
-            )
+        if destaque:
+            pdf.set_text_color(*VERMELHO)
+            pdf.set_font("Helvetica", 'B', 10)
+        else:
+            pdf.set_font("Helvetica", 'B', 10)
 
-        pdf.ln(2)
-        secao("Financiamento")
-        linha("Financiamento utilizado", f"R$ {fmt_br(d.get('finan_usado', 0))}")
-        prazo = d.get('prazo_financiamento', 360)
+        pdf.cell(largura_util * 0.4, 6, valor, ln=True, align='R')
+        pdf.set_draw_color(235, 238, 242)
+        pdf.line(pdf.l_margin, pdf.get_y(), pdf.l_margin + largura_util, pdf.get_y())
+
+    # ===============================
+    # CONTEÚDO (alinhado ao texto WhatsApp / resumo na tela)
+    # ===============================
+    secao("Renda")
+    linha("Renda familiar total", f"R$ {fmt_br(d.get('renda', 0))}")
+    _cpf_pdf_d = re.sub(r"\D", "", str(d.get("cpf") or ""))
+    if len(_cpf_pdf_d) == 11:
+        linha("CPF", _sf_cpf_mascarado_br(_cpf_pdf_d))
+    elif str(d.get("cpf") or "").strip():
+        linha("CPF", _pdf_text_seguro(str(d.get("cpf") or "").strip()))
+    _rank_pdf_s = str(d.get("ranking") or "").strip()
+    if _rank_pdf_s:
+        linha("Ranking do cliente", _pdf_text_seguro(_rank_pdf_s))
+
+    pdf.ln(2)
+    secao("Dados do imóvel")
+    linha("Empreendimento", _pdf_text_seguro(d.get("empreendimento_nome")))
+    linha("Unidade", _pdf_text_seguro(d.get("unidade_id")))
+    linha("Valor de venda (lista)", f"R$ {fmt_br(v_total)}", True)
+    _desc_pdf = vc_apl + outros_pdf
+    if _desc_pdf > 0.009:
+        linha("Descontos Concedidos", f"R$ {fmt_br(_desc_pdf)}")
+    _mot_pdf = str(d.get("outros_descontos_motivo") or "").strip()
+    if outros_pdf > 0.009 and _mot_pdf:
+        pdf.set_font("Helvetica", "", 9)
+        pdf.set_text_color(70, 80, 95)
+        pdf.multi_cell(
+            largura_util,
+            4,
+            _pdf_text_seguro(f"Origem dos outros descontos: {_mot_pdf}"),
+            ln=True,
+        )
+        pdf.ln(1)
+        pdf.set_text_color(*AZUL)
+    linha("Valor final da unidade", f"R$ {fmt_br(v_prop)}", True)
+    if d.get("unid_entrega"):
+        linha("Previsão de entrega", _pdf_text_seguro(d.get("unid_entrega")))
+    if d.get("unid_area"):
+        linha("Área privativa", _pdf_text_seguro(f"{d.get('unid_area')} m²"))
+    if d.get("unid_tipo"):
+        linha("Tipologia", _pdf_text_seguro(d.get("unid_tipo")))
+    if d.get("unid_endereco") and d.get("unid_bairro"):
         linha(
-            "Sistema de amortização e prazo",
-            f"{nome_sistema_amortizacao_completo(str(d.get('sistema_amortizacao', 'SAC')))} - {prazo} meses",
+            "Localização",
+            _pdf_text_seguro(f"{d.get('unid_endereco')} - {d.get('unid_bairro')}"),
         )
-        linha("Parcela estimada do financiamento", f"R$ {fmt_br(d.get('parcela_financiamento', 0))}")
-        linha("FGTS + subsídio", f"R$ {fmt_br(d.get('fgts_sub_usado', 0))}")
 
-        pdf.ln(2)
-        secao("Entrada e Pro Soluto")
-        if _politica_emcash(d.get("politica")):
-            linha(
-                "Política de Pro Soluto",
-                _pdf_text_seguro(f"{_pol_pdf_label} ({_EMCASH_NOTA_PARCELAS})"),
-            )
-        else:
-            linha("Política de Pro Soluto", _pdf_text_seguro(_pol_pdf_label))
+    pdf.ln(2)
+    secao("Financiamento")
+    linha("Financiamento utilizado", f"R$ {fmt_br(d.get('finan_usado', 0))}")
+    prazo = d.get('prazo_financiamento', 360)
+    linha(
+        "Sistema de amortização e prazo",
+        f"{nome_sistema_amortizacao_completo(str(d.get('sistema_amortizacao', 'SAC')))} - {prazo} meses",
+    )
+    linha("Parcela estimada do financiamento", f"R$ {fmt_br(d.get('parcela_financiamento', 0))}")
+    linha("FGTS + subsídio", f"R$ {fmt_br(d.get('fgts_sub_usado', 0))}")
+
+    pdf.ln(2)
+    secao("Entrada e Pro Soluto")
+    if _politica_emcash(d.get("politica")):
         linha(
-            "Valor do Pro Soluto",
-            f"R$ {fmt_br(d.get('ps_usado', 0))}",
+            "Política de Pro Soluto",
+            _pdf_text_seguro(f"{_pol_pdf_label} ({_EMCASH_NOTA_PARCELAS})"),
         )
+    else:
+        linha("Política de Pro Soluto", _pdf_text_seguro(_pol_pdf_label))
+    linha(
+        "Valor do Pro Soluto",
+        f"R$ {fmt_br(d.get('ps_usado', 0))}",
+    )
+    linha(
+        "Tipo de fluxo",
+        _pdf_text_seguro(d.get("tipo_fluxo_pro_soluto", "Linear")),
+    )
+    linha("Quantidade de parcelas", _pdf_text_seguro(d.get("ps_parcelas")))
+    linha("Pro Soluto corrigido (com carência)", f"R$ {fmt_br(d.get('ps_com_carencia', 0))}")
+    linha("Maior valor de parcela", f"R$ {fmt_br(d.get('ps_maior_valor', 0))}")
+    linha("Menor valor de parcela", f"R$ {fmt_br(d.get('ps_menor_valor', 0))}")
+    linha("Ato 1 (Entrada Imediata)", f"R$ {fmt_br(d.get('ato_final', 0))}")
+    if _politica_emcash(d.get("politica")):
+        linha("Ato 30", f"R$ {fmt_br(d.get('ato_30', 0))}")
+        linha("Ato 60", f"R$ {fmt_br(d.get('ato_60', 0))}")
+    else:
+        linha("Ato 30", f"R$ {fmt_br(d.get('ato_30', 0))}")
+        linha("Ato 60", f"R$ {fmt_br(d.get('ato_60', 0))}")
+        linha("Ato 90", f"R$ {fmt_br(d.get('ato_90', 0))}")
+    for _idx_anual in range(1, 4):
         linha(
-            "Tipo de fluxo",
-            _pdf_text_seguro(d.get("tipo_fluxo_pro_soluto", "Linear")),
-        )
-        linha("Quantidade de parcelas", _pdf_text_seguro(d.get("ps_parcelas")))
-        linha("Pro Soluto corrigido (com carência)", f"R$ {fmt_br(d.get('ps_com_carencia', 0))}")
-        linha("Maior valor de parcela", f"R$ {fmt_br(d.get('ps_maior_valor', 0))}")
-        linha("Menor valor de parcela", f"R$ {fmt_br(d.get('ps_menor_valor', 0))}")
-        linha("Ato 1 (Entrada Imediata)", f"R$ {fmt_br(d.get('ato_final', 0))}")
-        if _politica_emcash(d.get("politica")):
-            linha("Ato 30", f"R$ {fmt_br(d.get('ato_30', 0))}")
-            linha("Ato 60", f"R$ {fmt_br(d.get('ato_60', 0))}")
-        else:
-            linha("Ato 30", f"R$ {fmt_br(d.get('ato_30', 0))}")
-            linha("Ato 60", f"R$ {fmt_br(d.get('ato_60', 0))}")
-            linha("Ato 90", f"R$ {fmt_br(d.get('ato_90', 0))}")
-        for _idx_anual in range(1, 4):
-            linha(
-                f"Anual {_idx_anual}",
-                f"R$ {fmt_br(d.get(f'anual_{_idx_anual}', 0))}",
-            )
-        _ent_ps = (
-            float(d.get('entrada_total', 0) or 0)
-            + float(d.get('ps_usado', 0) or 0)
-            + sum(float(d.get(f"anual_{i}", 0) or 0) for i in range(1, 4))
-        )
-        linha("Entrada total (atos, anuais e Pro Soluto)", f"R$ {fmt_br(_ent_ps)}", True)
-
-        # ===============================
-        # RODAPÉ (DADOS CORRETOR)
-        # ===============================
-        pdf.ln(4)
-
-        cn = (d.get("corretor_nome") or "").strip()
-        if cn:
-            pdf.set_font("Helvetica", 'B', 9)
-            pdf.set_text_color(*AZUL)
-            pdf.cell(0, 5, _pdf_text_seguro("Consultor"), ln=True, align='L')
-            pdf.set_font("Helvetica", 'B', 10)
-            pdf.cell(0, 6, _pdf_text_seguro(cn), ln=True)
+            f"Anual {_idx_anual}",
+            f"R$ {fmt_br(d.get(f'anual_{_idx_anual}', 0))}",
+        )
+    _ent_ps = (
+        float(d.get('entrada_total', 0) or 0)
+        + float(d.get('ps_usado', 0) or 0)
+        + sum(float(d.get(f"anual_{i}", 0) or 0) for i in range(1, 4))
+    )
+    linha("Entrada total (atos, anuais e Pro Soluto)", f"R$ {fmt_br(_ent_ps)}", True)
 
-        pdf.ln(2)
+    # ===============================
+    # RODAPÉ (DADOS CORRETOR)
+    # ===============================
+    pdf.ln(4)
 
-        # Aviso Legal e Data
-        pdf.set_font("Helvetica", 'I', 7)
-        pdf.set_text_color(100, 100, 100)
-        pdf.cell(
-            0,
-            4,
-            _pdf_text_seguro(
-                f"Simulação em {d.get('data_simulacao', date.today().strftime('%d/%m/%Y'))}. "
-                "Sujeito a análise de crédito e alteração de tabela sem aviso prévio."
-            ),
-            ln=True,
-            align='C'
-        )
-        pdf.cell(0, 4, _pdf_text_seguro("Direcional Engenharia - Rio de Janeiro"), ln=True, align='C')
+    cn = (d.get("corretor_nome") or "").strip()
+    if cn:
+        pdf.set_font("Helvetica", 'B', 9)
+        pdf.set_text_color(*AZUL)
+        pdf.cell(0, 5, _pdf_text_seguro("Consultor"), ln=True, align='L')
+        pdf.set_font("Helvetica", 'B', 10)
+        pdf.cell(0, 6, _pdf_text_seguro(cn), ln=True)
+
+    pdf.ln(2)
+
+    # Aviso Legal e Data
+    pdf.set_font("Helvetica", 'I', 7)
+    pdf.set_text_color(100, 100, 100)
+    pdf.cell(
+        0,
+        4,
+        _pdf_text_seguro(
+            f"Simulação em {d.get('data_simulacao', date.today().strftime('%d/%m/%Y'))}. "
+            "Sujeito a análise de crédito e alteração de tabela sem aviso prévio."
+        ),
+        ln=True,
+        align='C'
+    )
+    pdf.cell(0, 4, _pdf_text_seguro("Direcional Engenharia - Rio de Janeiro"), ln=True, align='C')
 
-        # PyFPDF: output(dest="S") devolve str; fpdf2 pode devolver bytes. Latin-1 é o esperado pelo PDF bruto.
-        out = pdf.output(dest="S")
-        if isinstance(out, (bytes, bytearray)):
-            return bytes(out)
-        return out.encode("latin-1", errors="replace")
 
+def _gerar_resumo_pdf_fpdf(d, volta_caixa_val: float = 0.0):
+    try:
+        pdf = _pdf_novo_documento()
+        pdf.add_page()
+        _pdf_desenhar_resumo(pdf, d, volta_caixa_val)
+        return _pdf_bytes(pdf)
     except Exception:
         logging.getLogger(__name__).exception("Falha em gerar_resumo_pdf")
         return None
 
-def enviar_email_smtp(destinatario, nome_cliente, pdf_bytes, dados_cliente, tipo='cliente'):
-    if "email" not in st.secrets: return False, "Configuracoes de e-mail nao encontradas."
-    import urllib.parse
-    
+
+def _pdf_lote_renderizar(itens: list[tuple[dict, float]], mesclar: bool):
+    """Tarefa do lote (roda no processo filho): PDFs separados ou um documento com todos."""
+    if not mesclar:
+        return [_gerar_resumo_pdf_fpdf(d, vc) for d, vc in itens]
+    pdf = _pdf_novo_documento()
+    for d, vc in itens:
+        pdf.add_page()
+        _pdf_desenhar_resumo(pdf, d, vc)
+    return _pdf_bytes(pdf)
+
+
+def _pdf_concatenar(partes: list[bytes]) -> bytes:
+    from pypdf import PdfReader, PdfWriter
+
+    escritor = PdfWriter()
+    for parte in partes:
+        escritor.append(PdfReader(io.BytesIO(parte)))
+    buf = io.BytesIO()
+    escritor.write(buf)
+    return buf.getvalue()
+
+
+def gerar_resumos_pdf_lote(
+    simulacoes: list,
+    *,
+    mesclar: bool = False,
+    processos: int | None = None,
+    tamanho_bloco: int = _PDF_LOTE_BLOCO,
+):
+    """
+    Reemissão em massa de resumos. Cada item é «d» (volta ao caixa lida de
+    volta_caixa_aplicado) ou (d, volta_caixa_val). Sem mesclar devolve a lista de bytes
+    (None nos que falharem); com mesclar, um único PDF com todos os resumos, em ordem.
+
+    Blocos de tamanho_bloco vão para um ProcessPoolExecutor com contexto «spawn»
+    (processos=1 roda no próprio processo): os filhos importam este módulo pelo nome
+    (pdf_lote.renderizar) em vez de herdar por fork as threads do servidor. O PDF mesclado
+    em paralelo junta os blocos com pypdf; sem pypdf instalado, é desenhado num só
+    documento neste processo.
+
+    Ponto de entrada para scripts e jobs de reemissão (ex.: python -c "import
+    diresimulator as dv; dv.gerar_resumos_pdf_lote(...)"); não chamar a partir de uma
+    sessão Streamlit, onde cada filho teria de reimportar o app inteiro.
+    """
+    itens: list[tuple[dict, float]] = []
+    for item in simulacoes:
+        d, vc = item if isinstance(item, tuple) else (item, item.get("volta_caixa_aplicado"))
+        try:
+            vc = float(vc or 0)
+        except (TypeError, ValueError):
+            vc = 0.0
+        itens.append((dict(d), vc))
+    if not PDF_ENABLED or not itens:
+        return None if mesclar else [None] * len(itens)
+    bloco = max(1, int(tamanho_bloco))
+    if mesclar and importlib.util.find_spec("pypdf") is None:
+        bloco = len(itens)
+    blocos = [itens[i : i + bloco] for i in range(0, len(itens), bloco)]
     try:
-        smtp_server = st.secrets["email"]["smtp_server"].strip()
-        smtp_port = int(st.secrets["email"]["smtp_port"])
-        sender_email = st.secrets["email"]["sender_email"].strip()
-        sender_password = st.secrets["email"]["sender_password"].strip().replace(" ", "")
-    except Exception as e: return False, f"Erro config: {e}"
+        if len(blocos) == 1 or processos == 1:
+            partes = [_pdf_lote_renderizar(b, mesclar) for b in blocos]
+        else:
+            import multiprocessing
+
+            from pdf_lote import renderizar
+
+            # __name__ é «__main__» quando o app corre como script; os filhos importam pelo ficheiro.
+            modulo = Path(__file__).stem
+            with ProcessPoolExecutor(
+                max_workers=processos or os.cpu_count(),
+                mp_context=multiprocessing.get_context("spawn"),
+            ) as pool:
+                partes = list(
+                    pool.map(
+                        renderizar,
+                        [modulo] * len(blocos),
+                        blocos,
+                        [mesclar] * len(blocos),
+                    )
+                )
+    except Exception:
+        logging.getLogger(__name__).exception("Falha na geração de resumos PDF em lote")
+        return None if mesclar else [None] * len(itens)
+    if not mesclar:
+        return [pdf for parte in partes for pdf in parte]
+    return partes[0] if len(partes) == 1 else _pdf_concatenar(partes)
+
+
+def _email_montar_mensagem(destinatario, nome_cliente, pdf_bytes, dados_cliente, tipo, sender_email):
+    import urllib.parse
 
     msg = MIMEMultipart('alternative')
     msg['From'] = sender_email; msg['To'] = destinatario
@@ -7814,13 +11305,316 @@ def enviar_email_smtp(destinatario, nome_cliente, pdf_bytes, dados_cliente, tipo
         part = MIMEApplication(pdf_bytes, Name=_pdf_name)
         part['Content-Disposition'] = f'attachment; filename="{_pdf_name}"'
         msg.attach(part)
+    return msg
+
+
+def _email_config_smtp() -> tuple[dict[str, Any] | None, str]:
+    """Lê ``[email]`` dos secrets no thread do script; o worker da fila recebe uma cópia."""
+    if "email" not in st.secrets:
+        return None, "Configuracoes de e-mail nao encontradas."
     try:
-        server = smtplib.SMTP(smtp_server, smtp_port); server.ehlo(); server.starttls(); server.ehlo()
-        server.login(sender_email, sender_password); server.sendmail(sender_email, destinatario, msg.as_string()); server.quit()
+        sec = st.secrets["email"]
+        cfg = {
+            "servidor": str(sec["smtp_server"]).strip(),
+            "porta": int(sec["smtp_port"]),
+            "remetente": str(sec["sender_email"]).strip(),
+            # Sem senha não há LOGIN e starttls = false dispensa TLS (ex.: sink SMTP local).
+            "senha": str(sec.get("sender_password", "") or "").strip().replace(" ", ""),
+            "starttls": str(sec.get("starttls", True)).strip().lower() not in ("0", "false", "nao", "não", "off"),
+        }
+    except Exception as e:
+        return None, f"Erro config: {e}"
+    return cfg, ""
+
+
+def _email_mascarado(endereco: Any) -> str:
+    """``fulano@dominio.com`` → ``fu***@dominio.com`` (logs e dead letter em disco)."""
+    local, arroba, dominio = str(endereco or "").strip().partition("@")
+    return f"{local[:2]}***{arroba}{dominio}" if local else ""
+
+
+class _EmailOutbox:
+    """
+    Fila de envio SMTP servida por um thread daemon com uma sessão autenticada reutilizada
+    entre mensagens (NOOP antes de reaproveitar; fecha após EMAIL_OUTBOX_SESSAO_OCIOSA_S sem
+    tráfego). Falhas transitórias voltam à fila com um "não antes de" (backoff exponencial),
+    sem parar as outras mensagens; autenticação recusada, respostas 5xx ou tentativas
+    esgotadas levam a mensagem para a dead letter (memória e, se configurado, um ficheiro
+    JSON Lines sem o corpo, sem o anexo e com o destinatário mascarado).
+    """
+
+    def __init__(self, caminho_dead_letter: str | None) -> None:
+        self.caminho_dead_letter = caminho_dead_letter
+        self._fila: queue.Queue[str] = queue.Queue()
+        self._lock = threading.Lock()
+        self._mensagens: OrderedDict[str, dict[str, Any]] = OrderedDict()
+        self._conteudos: dict[str, tuple[dict[str, Any], str]] = {}
+        self._concluidas: dict[str, threading.Event] = {}
+        # (instante monotónico a partir do qual repetir, id); só o thread da fila mexe aqui.
+        self._adiadas: list[tuple[float, str]] = []
+        self._thread: threading.Thread | None = None
+        self._smtp: smtplib.SMTP | None = None
+        self._smtp_chave: tuple[Any, ...] | None = None
+        self.dead_letter: deque[dict[str, Any]] = deque(maxlen=EMAIL_OUTBOX_DEAD_LETTER_MAX)
+        self.enviados = 0
+        self.conexoes = 0
+
+    def iniciar(self) -> None:
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._loop, name="dv-email-outbox", daemon=True)
+                self._thread.start()
+
+    def enfileirar(self, cfg: Mapping[str, Any], destinatario: str, msg: MIMEMultipart) -> str:
+        mid = uuid.uuid4().hex
+        agora = time.time()
+        with self._lock:
+            self._mensagens[mid] = {
+                "id": mid,
+                "destinatario": destinatario,
+                "assunto": str(msg["Subject"] or ""),
+                "estado": "na_fila",
+                "tentativas": 0,
+                "erro": None,
+                "criado_em": agora,
+                "atualizado_em": agora,
+            }
+            self._conteudos[mid] = (dict(cfg), msg.as_string())
+            self._concluidas[mid] = threading.Event()
+            self._podar()
+        self._fila.put(mid)
+        self.iniciar()
+        return mid
+
+    def estado(self, mid: str | None) -> dict[str, Any] | None:
+        with self._lock:
+            reg = self._mensagens.get(mid or "")
+            return dict(reg) if reg else None
+
+    def aguardar(self, mid: str, timeout_s: float | None = None) -> dict[str, Any] | None:
+        with self._lock:
+            evt = self._concluidas.get(mid)
+        if evt is not None:
+            evt.wait(timeout_s)
+        return self.estado(mid)
+
+    def resumo(self) -> dict[str, Any]:
+        with self._lock:
+            return {
+                "na_fila": self._fila.qsize() + len(self._adiadas),
+                "adiadas": len(self._adiadas),
+                "enviados": self.enviados,
+                "dead_letter": len(self.dead_letter),
+                "conexoes": self.conexoes,
+                "sessao_aberta": self._smtp is not None,
+            }
+
+    def _podar(self) -> None:
+        """Descarta estados antigos já concluídos (chamar com o lock)."""
+        excesso = len(self._mensagens) - EMAIL_OUTBOX_ESTADOS_MAX
+        for mid in list(self._mensagens):
+            if excesso <= 0:
+                break
+            if mid not in self._conteudos:
+                del self._mensagens[mid]
+                self._concluidas.pop(mid, None)
+                excesso -= 1
+
+    def _atualizar(self, mid: str, **campos: Any) -> None:
+        with self._lock:
+            reg = self._mensagens.get(mid)
+            if reg is not None:
+                reg.update(campos, atualizado_em=time.time())
+
+    def _loop(self) -> None:
+        while True:
+            agora = time.monotonic()
+            while self._adiadas and self._adiadas[0][0] <= agora:
+                self._fila.put(heapq.heappop(self._adiadas)[1])
+            espera = EMAIL_OUTBOX_SESSAO_OCIOSA_S
+            if self._adiadas:
+                espera = min(espera, self._adiadas[0][0] - agora)
+            try:
+                mid = self._fila.get(timeout=espera)
+            except queue.Empty:
+                if not self._adiadas:
+                    self._fechar()
+                continue
+            try:
+                self._processar(mid)
+            except Exception:
+                _sf_logger.exception("Fila de e-mail: falha inesperada ao processar %s", mid)
+                self._concluir(mid, "Erro envio: falha interna da fila de e-mail.")
+
+    def _sessao(self, cfg: Mapping[str, Any]) -> smtplib.SMTP:
+        chave = (cfg["servidor"], cfg["porta"], cfg["remetente"], cfg["senha"], cfg["starttls"])
+        if self._smtp is not None and self._smtp_chave == chave:
+            try:
+                if self._smtp.noop()[0] == 250:
+                    return self._smtp
+            except (smtplib.SMTPException, OSError):
+                pass
+        self._fechar()
+        smtp = smtplib.SMTP(cfg["servidor"], cfg["porta"], timeout=EMAIL_OUTBOX_TIMEOUT_S)
+        try:
+            smtp.ehlo()
+            if cfg["starttls"]:
+                smtp.starttls()
+                smtp.ehlo()
+            if cfg["senha"]:
+                smtp.login(cfg["remetente"], cfg["senha"])
+        except BaseException:
+            smtp.close()
+            raise
+        self._smtp, self._smtp_chave = smtp, chave
+        self.conexoes += 1
+        return smtp
+
+    def _fechar(self) -> None:
+        smtp, self._smtp, self._smtp_chave = self._smtp, None, None
+        if smtp is None:
+            return
+        try:
+            smtp.quit()
+        except (smtplib.SMTPException, OSError):
+            smtp.close()
+
+    def _processar(self, mid: str) -> None:
+        """Uma tentativa; falha transitória reagenda a mensagem em vez de dormir no thread."""
+        with self._lock:
+            cfg, texto = self._conteudos[mid]
+            destinatario = self._mensagens[mid]["destinatario"]
+            tentativa = int(self._mensagens[mid]["tentativas"]) + 1
+        self._atualizar(mid, estado="enviando", tentativas=tentativa)
+        try:
+            self._sessao(cfg).sendmail(cfg["remetente"], [destinatario], texto)
+            self._concluir(mid, None)
+            return
+        except smtplib.SMTPAuthenticationError:
+            self._fechar()
+            self._concluir(mid, "Erro de Autenticacao (535). Verifique Senha de App.")
+            return
+        except smtplib.SMTPRecipientsRefused as e:
+            self._concluir(mid, f"Erro envio: destinatário recusado ({', '.join(e.recipients)})")
+            return
+        except smtplib.SMTPResponseException as e:
+            erro = f"Erro envio: {e}"
+            if 500 <= int(e.smtp_code or 0) < 600:
+                self._concluir(mid, erro)
+                return
+        except (smtplib.SMTPException, OSError) as e:
+            self._fechar()
+            erro = f"Erro envio: {e}"
+        if tentativa >= EMAIL_OUTBOX_TENTATIVAS:
+            self._concluir(mid, erro)
+            return
+        self._atualizar(mid, estado="na_fila", erro=erro)
+        quando = time.monotonic() + EMAIL_OUTBOX_BACKOFF_S * (2 ** (tentativa - 1))
+        heapq.heappush(self._adiadas, (quando, mid))
+
+    def _concluir(self, mid: str, erro: str | None) -> None:
+        with self._lock:
+            self._conteudos.pop(mid, None)
+            reg = self._mensagens.get(mid)
+            if reg is not None:
+                reg.update(estado="falhou" if erro else "enviado", erro=erro, atualizado_em=time.time())
+            if erro is None:
+                self.enviados += 1
+            elif reg is not None:
+                self.dead_letter.append(dict(reg))
+            evt = self._concluidas.get(mid)
+        if evt is not None:
+            evt.set()
+        if erro is None or reg is None:
+            return
+        registro = dict(reg, destinatario=_email_mascarado(reg.get("destinatario")))
+        _sf_logger.warning(
+            "Fila de e-mail: %s para %s foi para a dead letter após %s tentativa(s): %s",
+            mid,
+            registro["destinatario"],
+            registro.get("tentativas"),
+            erro,
+        )
+        if self.caminho_dead_letter:
+            try:
+                with open(self.caminho_dead_letter, "a", encoding="utf-8") as f:
+                    f.write(json.dumps(registro, ensure_ascii=False) + "\n")
+            except OSError:
+                _sf_logger.warning("Fila de e-mail: dead letter não gravada em %s", self.caminho_dead_letter)
+
+
+_EMAIL_OUTBOX: _EmailOutbox | None = None
+_EMAIL_OUTBOX_LOCK = threading.Lock()
+
+
+def _email_outbox() -> _EmailOutbox:
+    global _EMAIL_OUTBOX
+    with _EMAIL_OUTBOX_LOCK:
+        if _EMAIL_OUTBOX is None:
+            caminho = (os.environ.get("DV_EMAIL_DEAD_LETTER_PATH") or "").strip() or str(
+                Path(__file__).resolve().parent / "dv_email_dead_letter.jsonl"
+            )
+            _EMAIL_OUTBOX = _EmailOutbox(None if caminho.lower() in ("0", "off", "false") else caminho)
+        return _EMAIL_OUTBOX
+
+
+def _email_resultado(reg: Mapping[str, Any] | None) -> tuple[bool | None, str]:
+    """(True/False, texto) para envio concluído; (None, texto) enquanto a mensagem está na fila."""
+    estado = (reg or {}).get("estado")
+    if estado == "enviado":
         return True, "E-mail enviado com sucesso!"
-    except smtplib.SMTPAuthenticationError:
-        return False, "Erro de Autenticacao (535). Verifique Senha de App."
-    except Exception as e: return False, f"Erro envio: {e}"
+    if estado == "falhou":
+        return False, str(reg.get("erro") or "Erro envio.")
+    if reg and int(reg.get("tentativas") or 0) > 1:
+        return None, f"E-mail na fila de envio (tentativa {reg['tentativas']} de {EMAIL_OUTBOX_TENTATIVAS})."
+    return None, "E-mail na fila de envio."
+
+
+def enfileirar_email_smtp(destinatario, nome_cliente, pdf_bytes, dados_cliente, tipo='cliente'):
+    """Monta a mensagem no thread do script e entrega-a à fila; devolve (ok, texto, id da mensagem)."""
+    cfg, erro = _email_config_smtp()
+    if cfg is None:
+        return False, erro, None
+    msg = _email_montar_mensagem(destinatario, nome_cliente, pdf_bytes, dados_cliente, tipo, cfg["remetente"])
+    mid = _email_outbox().enfileirar(cfg, destinatario, msg)
+    return True, "E-mail na fila de envio.", mid
+
+
+def enviar_email_smtp(destinatario, nome_cliente, pdf_bytes, dados_cliente, tipo='cliente', espera_s=None):
+    """Envio síncrono sobre a fila: espera o resultado final (ou ``espera_s``) e devolve (ok, texto)."""
+    ok, texto, mid = enfileirar_email_smtp(destinatario, nome_cliente, pdf_bytes, dados_cliente, tipo=tipo)
+    if not ok:
+        return False, texto
+    ok, texto = _email_resultado(_email_outbox().aguardar(mid, espera_s))
+    return bool(ok), texto
+
+
+def _dv_email_estado_render(mid: str) -> None:
+    ok, texto = _email_resultado(_email_outbox().estado(mid))
+    if ok:
+        st.success(texto)
+    elif ok is False:
+        _dv_alerta_vermelho_texto(texto)
+    else:
+        st.info(texto)
+        st.button("Atualizar estado do envio", key=f"dv_email_estado_{mid}")
+
+
+def _dv_email_notificar_pendentes() -> None:
+    """Toast para envios em segundo plano (cópia do corretor) concluídos desde a última execução."""
+    pendentes = st.session_state.get("_dv_email_pendentes") or []
+    if not pendentes:
+        return
+    restantes = []
+    for mid in pendentes:
+        ok, texto = _email_resultado(_email_outbox().estado(mid))
+        if ok:
+            st.toast("Documento PDF enviado para o seu e-mail com sucesso.", icon="📧")
+        elif ok is False:
+            st.toast(f"Falha no envio automático: {texto}", icon="⚠️")
+        elif _email_outbox().estado(mid) is not None:
+            restantes.append(mid)
+    st.session_state["_dv_email_pendentes"] = restantes
 
 
 try:
@@ -7867,7 +11661,7 @@ def show_export_dialog(d):
     )
     if st.button("Enviar e-mail para o cliente", use_container_width=True, key="export_dialog_btn_email"):
         if email and "@" in email:
-            sucesso, msg = enviar_email_smtp(
+            sucesso, msg, _mid_email = enfileirar_email_smtp(
                 email,
                 d.get("nome", "Cliente"),
                 pdf_data,
@@ -7875,11 +11669,14 @@ def show_export_dialog(d):
                 tipo="cliente",
             )
             if sucesso:
-                st.success(msg)
+                st.session_state["_dv_email_cliente_id"] = _mid_email
             else:
                 _dv_alerta_vermelho_texto(str(msg))
         else:
             _dv_alerta_vermelho_texto("E-mail inválido")
+    _mid_email_cli = st.session_state.get("_dv_email_cliente_id")
+    if _mid_email_cli and (_email_outbox().estado(_mid_email_cli) or {}).get("destinatario") == email:
+        _dv_email_estado_render(_mid_email_cli)
 
     st.markdown("---")
     st.markdown("**3. WhatsApp**")
@@ -7989,6 +11786,7 @@ def aba_simulador_automacao(
             "CPF - Classificar Clientes (opcional) (CPF)",
             key="cpf_classificar_clientes_sf",
             placeholder="000.000.000-00",
+            on_change=_dv_sf_cpf_classificar_clientes_on_change,
         )
         cpf_digits = _sf_normalizar_cpf(st.session_state.get("cpf_classificar_clientes_sf") or "")
         rank_opts = ["DIAMANTE", "OURO", "PRATA", "BRONZE", "AÇO"]
@@ -8004,7 +11802,17 @@ def aba_simulador_automacao(
             _poll_max, _ = _sf_poll_ui_config()
             _poll_t0 = float(_sf_pending.get("t0") or time.monotonic())
             _poll_decorrido = max(0.0, time.monotonic() - _poll_t0)
-            _poll_int = _sf_poll_ui_interval(_poll_decorrido)
+            _notificador = _ranking_notificador()
+            # Poller único do processo: uma SOQL em lote por ciclo para todas as sessões;
+            # o fragmento lê o mapa partilhado (sem rede) a cada 1 s, ou a cada
+            # RANKING_UI_EVENTOS_RERUN_S com eventos de ranking ativos.
+            _ranking_poller().registrar(
+                _sf_pending.get("account_id"),
+                cpf=cpf_digits,
+                opportunity_id=_sf_pending.get("opportunity_id"),
+                sessao=_ranking_poller_sessao(),
+            )
+            _poll_int = RANKING_UI_EVENTOS_RERUN_S if _notificador.ativo else RANKING_UI_POLL_FAST_S
 
             def _aplicar_ranking_resolvido(_rk: str, _det: Mapping[str, Any]) -> None:
                 if _rk in rank_opts:
@@ -8052,11 +11860,43 @@ def aba_simulador_automacao(
                         return
                     t0p = float(pending_now.get("t0") or time.monotonic())
                     decorrido = max(0.0, time.monotonic() - t0p)
-                    det = _sf_consultar_ranking_detalhado(
+                    evento = _notificador.ultimo(
+                        pending_now.get("account_id"),
+                        pending_now.get("opportunity_id"),
                         cpf_digits,
-                        account_id=pending_now.get("account_id"),
-                        opportunity_id=pending_now.get("opportunity_id"),
+                        desde=float(pending_now.get("t0_epoch") or 0.0),
                     )
+                    ultima_soql = float(pending_now.get("ultima_soql") or 0.0)
+                    if evento and evento.get("ranking"):
+                        det = {
+                            "ranking": evento["ranking"],
+                            "raw": evento.get("ranking_raw"),
+                            "code": "ok",
+                            "account_id": evento.get("account_id")
+                            or pending_now.get("account_id"),
+                            "opportunity_id": evento.get("opportunity_id")
+                            or pending_now.get("opportunity_id"),
+                            "account_ranking_raw": evento.get("ranking_raw"),
+                            "opportunities": [],
+                            "elapsed_ms": 0,
+                            "logs": [f"Evento {evento.get('origem') or '-'}"],
+                            "error": None,
+                        }
+                    elif (
+                        _notificador.ativo
+                        or _ranking_poller().monitorando(pending_now.get("account_id"))
+                    ) and time.monotonic() - ultima_soql < RANKING_EVENTOS_FALLBACK_POLL_S:
+                        # Consulta detalhada só como rede de segurança (merge de contas no Risk3).
+                        det = dict(st.session_state.get("_sf_rank_last_detail") or {})
+                        det.setdefault("code", "sem_ranking")
+                    else:
+                        det = _sf_consultar_ranking_detalhado(
+                            cpf_digits,
+                            account_id=pending_now.get("account_id"),
+                            opportunity_id=pending_now.get("opportunity_id"),
+                        )
+                        pending_now = {**pending_now, "ultima_soql": time.monotonic()}
+                        st.session_state["_sf_pending"] = pending_now
                     st.session_state["_sf_rank_last_detail"] = det
                     _ranking_debug_append(
                         f"poll code={det.get('code')} ranking={det.get('ranking')!r} "
@@ -8068,6 +11908,9 @@ def aba_simulador_automacao(
                     if det.get("account_id") and det.get("account_id") != pending_now.get(
                         "account_id"
                     ):
+                        _ranking_poller().cancelar(
+                            pending_now.get("account_id"), sessao=_ranking_poller_sessao()
+                        )
                         pending_now = dict(pending_now)
                         pending_now["account_id"] = det.get("account_id")
                         if det.get("opportunity_id"):
@@ -8076,12 +11919,21 @@ def aba_simulador_automacao(
                         _ranking_debug_append(
                             f"Account Id atualizado após merge: {det.get('account_id')}"
                         )
+                        _ranking_poller().registrar(
+                            det.get("account_id"),
+                            cpf=cpf_digits,
+                            opportunity_id=pending_now.get("opportunity_id"),
+                            sessao=_ranking_poller_sessao(),
+                        )
 
                     rk = det.get("ranking")
+                    if _notificador.ativo:
+                        _modo_espera = "Aguardando o evento de classificação do Salesforce."
+                    else:
+                        _modo_espera = f"Verificação a cada {int(_poll_int)}s."
                     st.info(
                         "Classificação em andamento no Salesforce (Risk3). "
-                        f"Consulta a cada {int(_sf_poll_ui_interval(decorrido))}s. "
-                        f"Tempo decorrido: {int(decorrido)}s."
+                        f"{_modo_espera} Tempo decorrido: {int(decorrido)}s."
                     )
                     _ranking_debug_render(det)
 
@@ -8118,6 +11970,9 @@ def aba_simulador_automacao(
                             key=f"sf_parar_poll_{cpf_digits}",
                             use_container_width=True,
                         ) or decorrido >= _poll_max:
+                            _ranking_poller().cancelar(
+                                pending_now.get("account_id"), sessao=_ranking_poller_sessao()
+                            )
                             st.session_state.pop("_sf_pending", None)
                             _ranking_debug_append(
                                 f"Poll encerrado decorrido={int(decorrido)}s"
@@ -8162,6 +12017,9 @@ def aba_simulador_automacao(
                         key=f"sf_parar_poll_{cpf_digits}",
                         use_container_width=True,
                     ) or _poll_decorrido >= _poll_max:
+                        _ranking_poller().cancelar(
+                            _sf_pending.get("account_id"), sessao=_ranking_poller_sessao()
+                        )
                         st.session_state.pop("_sf_pending", None)
                         st.info(
                             "A classificação ainda pode estar em processamento no Risk3. "
@@ -8219,6 +12077,8 @@ def aba_simulador_automacao(
                         "a automação de Ranking do Salesforce."
                     ),
                 ):
+                    # Eventos de ranking valem a partir do acionamento (antes dele são antigos).
+                    _novo_t0_epoch = time.time()
                     with st.spinner(
                         "Criando registros ausentes e aguardando a classificação..."
                     ):
@@ -8260,6 +12120,7 @@ def aba_simulador_automacao(
                                 "account_id": _novo_resultado.get("account_id"),
                                 "opportunity_id": _novo_resultado.get("opportunity_id"),
                                 "t0": time.monotonic(),
+                                "t0_epoch": _novo_t0_epoch,
                             }
                             _btn_info = _novo_resultado.get(
                                 "button_consultar_status_cpf"
@@ -8688,7 +12549,7 @@ def aba_simulador_automacao(
                         ["Lucro_Recomendacao", "Valor de Venda", "Empreendimento", "Identificador"],
                         ascending=[False, False, True, True],
                     )
-                    for _, row in df_u.iterrows():
+                    for row in df_u.to_dict("records"):
                         final_cards.append({"label": label, "row": row, "css": css_class})
 
                 add_cards_group(label_rec, cand_rec, css_rec)
@@ -8696,42 +12557,30 @@ def aba_simulador_automacao(
                 if not final_cards:
                     st.info("Ajuste o filtro de empreendimento ou os valores aprovados para ver sugestões de unidades.")
                 else:
+                    # Só a página visível vai para o navegador; os fragmentos vêm do cache por card.
+                    _n_cards = len(final_cards)
+                    _n_pag = max(1, -(-_n_cards // RECOMENDACAO_CARDS_POR_PAGINA))
+                    _pag = 1
+                    if _n_pag > 1:
+                        _emp_rec_slug = hashlib.sha1(str(emp_rec).encode("utf-8", errors="replace")).hexdigest()[:10]
+
+                        def _fmt_pag_cards(p: int) -> str:
+                            ini = (p - 1) * RECOMENDACAO_CARDS_POR_PAGINA + 1
+                            fim = min(_n_cards, p * RECOMENDACAO_CARDS_POR_PAGINA)
+                            return f"Página {p} de {_n_pag} (unidades {ini}–{fim} de {_n_cards})"
+
+                        _pag = st.selectbox(
+                            "Página das recomendações: (lista)",
+                            options=list(range(1, _n_pag + 1)),
+                            format_func=_fmt_pag_cards,
+                            key=f"rec_cards_pag_{_emp_rec_slug}_{_n_cards}",
+                        )
+                    _ini_pag = (int(_pag) - 1) * RECOMENDACAO_CARDS_POR_PAGINA
                     cards_html = """<div class="recommendation-cards-outer"><div class="scrolling-wrapper">"""
-                    
-                    for card in final_cards:
-                         row = card['row']
-                         emp_name = row['Empreendimento']
-                         unid_name = row['Identificador']
-                         val_fmt = fmt_br(row['Valor de Venda'])
-                         aval_fmt = fmt_br(row['Valor de Avaliação Bancária'])
-                         lucro_fmt = fmt_br(float(row.get("Lucro_Recomendacao", 0) or 0))
-                         vcx_usado_fmt = fmt_br(float(row.get("VCX_Usado_Fechamento", 0) or 0))
-                         vcx_pres_fmt = fmt_br(float(row.get("VCX_Preservado", 0) or 0))
-                         label = card['label']
-                         css_badge = card['css']
-                         
-                         cards_html += f"""
-                         <div class="card-item">
-                            <div class="recommendation-card" style="border-top: 4px solid {COR_AZUL_ESC}; height: 100%; justify-content: flex-start;">
-                                <span style="color:#111111; opacity:0.95;">Perfil</span><br>
-                                <div style="margin-top:5px; margin-bottom:15px;"><span class="{css_badge}">{label}</span></div>
-                                <b style="color:#111111;">{emp_name}</b><br>
-                                <div style="color:#111111; text-align:center; border-top:1px solid #eee; padding-top:10px; width:100%;">
-                                    <b>Unidade: {unid_name}</b>
-                                </div>
-                                <div style="margin: 10px 0; width: 100%;">
-                                    <div style="color:#111111;">Avaliação</div>
-                                    <div style="font-weight:bold; color:#111111;">{reais_streamlit_html(aval_fmt)}</div>
-                                    <div style="color:#111111; margin-top:5px;">Valor de venda</div>
-                                    <div class="price-tag" style="margin-top:0;">{reais_streamlit_html(val_fmt)}</div>
-                                    <div style="color:#111111; margin-top:8px;">Lucro recomendado</div>
-                                    <div style="font-weight:800; color:#111111;">{reais_streamlit_html(lucro_fmt)}</div>
-                                    <div style="color:#111111; opacity:0.75; margin-top:5px;">
-                                      VCX usado: {reais_streamlit_html(vcx_usado_fmt)} | VCX preservado: {reais_streamlit_html(vcx_pres_fmt)}
-                                    </div>
-                                </div>
-                            </div>
-                         </div>"""
+                    cards_html += "".join(
+                        _recomendacao_card_html(card["row"], card["label"], card["css"])
+                        for card in final_cards[_ini_pag : _ini_pag + RECOMENDACAO_CARDS_POR_PAGINA]
+                    )
                     cards_html += "</div></div>"
                     st.markdown(cards_html, unsafe_allow_html=True)
 
@@ -9995,21 +13844,22 @@ def aba_simulador_automacao(
         if st.button("Concluir e salvar simulação", type="primary", use_container_width=True):
             broker_email = st.session_state.get('user_email')
             if broker_email:
-                with st.spinner("Gerando documento PDF e enviando para o seu e-mail..."):
+                with st.spinner("Gerando documento PDF para o seu e-mail..."):
                     _vc_save = texto_moeda_para_float(st.session_state.get("volta_caixa_key"))
                     pdf_bytes_auto = gerar_resumo_pdf(d, volta_caixa_val=_vc_save)
                     if pdf_bytes_auto:
-                        sucesso_email, msg_email = enviar_email_smtp(
+                        sucesso_email, msg_email, _mid_email = enfileirar_email_smtp(
                             broker_email,
                             d.get("nome", "Cliente"),
                             pdf_bytes_auto,
                             {**d, "volta_caixa_aplicado": _vc_save},
                             tipo="corretor",
                         )
-                        if sucesso_email: st.toast("Documento PDF enviado para o seu e-mail com sucesso.", icon="📧")
+                        if sucesso_email:
+                            st.session_state.setdefault("_dv_email_pendentes", []).append(_mid_email)
+                            st.toast("Documento PDF na fila de envio para o seu e-mail.", icon="📧")
                         else: st.toast(f"Falha no envio automático: {msg_email}", icon="⚠️")
             try:
-                conn_save = st.connection("gsheets", type=GSheetsConnection)
                 aba_destino = 'BD Simulações' 
                 rendas_ind = d.get('rendas_lista', [])
                 while len(rendas_ind) < 4: rendas_ind.append(0.0)
@@ -10049,12 +13899,8 @@ def aba_simulador_automacao(
                     "Quantidade Parcelas Pro Soluto": d.get('ps_parcelas', 0),
                     "Volta ao Caixa": st.session_state.get('volta_caixa_key', 0.0) # Adicionado ao salvamento
                 }
-                df_novo = pd.DataFrame([nova_linha])
-                try:
-                    df_existente = conn_save.read(spreadsheet=ID_GERAL, worksheet=aba_destino)
-                    df_final_save = pd.concat([df_existente, df_novo], ignore_index=True)
-                except: df_final_save = df_novo
-                conn_save.update(spreadsheet=ID_GERAL, worksheet=aba_destino, data=df_final_save)
+                # Uma linha anexada (append_rows) em vez de ler e regravar a aba inteira.
+                _backend_dados().anexar(aba_destino, [nova_linha])
                 st.cache_data.clear()
                 st.markdown(f'<div class="custom-alert">Registro salvo na aba Simulações da base de dados.</div>', unsafe_allow_html=True); time.sleep(2); st.session_state.dados_cliente = {}; st.session_state.passo_simulacao = 'sim'; scroll_to_top(); st.rerun()
             except Exception as e:
@@ -10282,6 +14128,13 @@ def main():
             _dv_clear_auth_cookies()
             st.rerun()
 
+    # Cópias de e-mail enviadas em segundo plano: avisa quando a fila conclui.
+    _frag_email = getattr(st, "fragment", None)
+    if callable(_frag_email) and st.session_state.get("_dv_email_pendentes"):
+        _frag_email(run_every=timedelta(seconds=2))(_dv_email_notificar_pendentes)()
+    else:
+        _dv_email_notificar_pendentes()
+
     logo_src = html_std.escape(_src_logo_topo_header(), quote=True)
     st.markdown(
         f'''<header class="header-container" role="banner">
@@ -0,0 +1,18 @@
+# -*- coding: utf-8 -*-
+"""
+Tarefa dos processos de gerar_resumos_pdf_lote (diresimulator / simulador_fluxo_novo).
+
+O pool usa o contexto «spawn»: cada filho começa limpo e importa o simulador pelo
+nome, em vez de herdar por fork as threads e locks do processo pai. Este módulo é
+a referência importável que o pickle do pool consegue resolver nos filhos.
+"""
+
+from __future__ import annotations
+
+import importlib
+from typing import Any
+
+
+def renderizar(modulo: str, itens: list[tuple[dict, float]], mesclar: bool) -> Any:
+    """Desenha um bloco do lote com o _pdf_lote_renderizar do simulador ``modulo``."""
+    return importlib.import_module(modulo)._pdf_lote_renderizar(itens, mesclar)
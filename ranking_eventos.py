@@ -0,0 +1,320 @@
+# -*- coding: utf-8 -*-
+"""
+Eventos de ranking (Change Data Capture / PushTopic) — acordam quem espera.
+
+Partilhado por diresimulator e simulador_fluxo_novo: cada simulador guarda um
+notificador por processo (notificador_do_ambiente) e passa as funções do seu pool
+Salesforce (conectar / renovar sessão) e do mapeamento do ranking para a UI.
+
+Variáveis de ambiente:
+
+  DV_RANKING_EVENTOS  "cometd" (Streaming API do Salesforce), "fake" (broker local
+    em processo, para testes e benchmarks) ou vazio (desligado: só polling).
+  DV_RANKING_EVENTOS_FAKE_LATENCIA_S  atraso de entrega do broker falso (padrão 0).
+  SALESFORCE_RANKING_CANAIS  canais CometD separados por vírgula. Padrão: CDC de
+    Account e Opportunity. PushTopic: "/topic/<Nome>" com Id, AccountId, Ranking__c, CPF__c.
+"""
+
+from __future__ import annotations
+
+import logging
+import os
+import re
+import threading
+import time
+from typing import Any, Callable, Mapping
+
+try:
+    import requests as _requests
+except ImportError:  # pragma: no cover
+    _requests = None  # type: ignore[assignment]
+
+_logger = logging.getLogger(__name__)
+
+EVENTOS_MAX = 5000
+CANAIS_PADRAO = "/data/AccountChangeEvent,/data/OpportunityChangeEvent"
+
+
+def _cpf_digitos(cpf: Any) -> str:
+    digits = re.sub(r"\D", "", str(cpf or "").strip())
+    if len(digits) == 10:
+        digits = digits.zfill(11)
+    return digits
+
+
+class RankingNotificador:
+    """Último evento de ranking por chave (Account Id, Opportunity Id, CPF) e espera sem polling."""
+
+    def __init__(self, mapear_ranking: Callable[[Any], str | None] | None = None) -> None:
+        self._cond = threading.Condition()
+        self._eventos: dict[str, dict[str, Any]] = {}
+        self._mapear_ranking = mapear_ranking
+        self.transporte: Any | None = None
+        self.publicados = 0
+
+    @property
+    def ativo(self) -> bool:
+        """True quando há transporte conectado (eventos chegam sem consulta)."""
+        return bool(getattr(self.transporte, "conectado", False))
+
+    def publicar(self, evento: Mapping[str, Any]) -> None:
+        item = dict(evento)
+        item.setdefault("recebido_em", time.time())
+        if not item.get("ranking") and self._mapear_ranking is not None:
+            item["ranking"] = self._mapear_ranking(item.get("ranking_raw"))
+        chaves = [
+            str(item.get(k) or "").strip() for k in ("account_id", "opportunity_id", "cpf")
+        ]
+        with self._cond:
+            for chave in chaves:
+                if chave:
+                    self._eventos[chave] = item
+            self.publicados += 1
+            if len(self._eventos) > EVENTOS_MAX:
+                antigos = sorted(self._eventos, key=lambda c: self._eventos[c]["recebido_em"])
+                for chave in antigos[: len(antigos) // 5]:
+                    self._eventos.pop(chave, None)
+            self._cond.notify_all()
+
+    def _ultimo(self, chaves: tuple[Any, ...], desde: float) -> dict[str, Any] | None:
+        achados = [self._eventos.get(str(c).strip()) for c in chaves if c]
+        validos = [e for e in achados if e and float(e["recebido_em"]) >= desde]
+        return dict(max(validos, key=lambda e: e["recebido_em"])) if validos else None
+
+    def ultimo(self, *chaves: Any, desde: float = 0.0) -> dict[str, Any] | None:
+        """Evento mais recente para qualquer das chaves (epoch ``desde`` filtra os antigos)."""
+        with self._cond:
+            return self._ultimo(chaves, desde)
+
+    def aguardar(self, *chaves: Any, timeout: float, desde: float = 0.0) -> dict[str, Any] | None:
+        """Bloqueia até chegar evento para alguma chave ou ``timeout`` segundos."""
+        fim = time.monotonic() + max(0.0, float(timeout))
+        with self._cond:
+            while True:
+                ev = self._ultimo(chaves, desde)
+                if ev is not None:
+                    return ev
+                restante = fim - time.monotonic()
+                if restante <= 0:
+                    return None
+                self._cond.wait(restante)
+
+
+def eventos_de_mensagem(msg: Mapping[str, Any]) -> list[dict[str, Any]]:
+    """Converte uma mensagem Bayeux (CDC ou PushTopic) em eventos de ranking."""
+    data = msg.get("data") or {}
+    canal = str(msg.get("channel") or "")
+    out: list[dict[str, Any]] = []
+    sobject = data.get("sobject")
+    payload = data.get("payload")
+    if isinstance(sobject, Mapping):
+        sid = str(sobject.get("Id") or "")
+        e_opp = sid.startswith("006")
+        out.append(
+            {
+                "account_id": sobject.get("AccountId") if e_opp else sid,
+                "opportunity_id": sid if e_opp else None,
+                "cpf": _cpf_digitos(sobject.get("CPF__c")) or None,
+                "ranking_raw": sobject.get("Ranking__c"),
+                "origem": canal,
+            }
+        )
+    elif isinstance(payload, Mapping):
+        header = payload.get("ChangeEventHeader") or {}
+        entidade = str(header.get("entityName") or "")
+        for rid in header.get("recordIds") or []:
+            out.append(
+                {
+                    "account_id": rid if entidade == "Account" else payload.get("AccountId"),
+                    "opportunity_id": rid if entidade == "Opportunity" else None,
+                    "cpf": _cpf_digitos(payload.get("CPF__c")) or None,
+                    "ranking_raw": payload.get("Ranking__c"),
+                    "origem": canal,
+                }
+            )
+    return [e for e in out if str(e.get("ranking_raw") or "").strip()]
+
+
+class TransporteEventosFake:
+    """Broker local em processo: publicar() entrega ao notificador após ``latencia_s``."""
+
+    def __init__(self, notificador: RankingNotificador, latencia_s: float = 0.0):
+        self.notificador = notificador
+        self.latencia_s = max(0.0, float(latencia_s))
+        self.conectado = False
+
+    def iniciar(self) -> None:
+        self.conectado = True
+
+    def parar(self) -> None:
+        self.conectado = False
+
+    def publicar(self, evento: Mapping[str, Any]) -> None:
+        if self.latencia_s <= 0:
+            self.notificador.publicar(evento)
+            return
+        t = threading.Timer(self.latencia_s, self.notificador.publicar, args=(dict(evento),))
+        t.daemon = True
+        t.start()
+
+
+class TransporteCometD:
+    """
+    Streaming API (Bayeux long-polling) sobre a sessão HTTP do pool Salesforce.
+
+    ``conectar()`` devolve o cliente do pool (ou None); ``renovar(sf, session_id)`` é
+    chamado num 401 para que o próximo handshake use uma sessão nova.
+    """
+
+    def __init__(
+        self,
+        notificador: RankingNotificador,
+        canais: list[str],
+        *,
+        conectar: Callable[[], Any | None],
+        renovar: Callable[[Any, str | None], None] | None = None,
+    ):
+        self.notificador = notificador
+        self.canais = canais
+        self.conectar = conectar
+        self.renovar = renovar
+        self.conectado = False
+        self._parar = threading.Event()
+        self._thread: threading.Thread | None = None
+
+    def iniciar(self) -> None:
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._parar.clear()
+        self._thread = threading.Thread(target=self._loop, name="dv-ranking-cometd", daemon=True)
+        self._thread.start()
+
+    def parar(self) -> None:
+        self._parar.set()
+        self.conectado = False
+
+    def _post(self, sf: Any, url: str, mensagens: list[dict[str, Any]], timeout: float) -> list[dict[str, Any]]:
+        http = getattr(sf, "session", None) or _requests
+        session_id = sf.session_id
+        resp = http.post(
+            url,
+            json=mensagens,
+            headers={
+                "Authorization": f"Bearer {session_id}",
+                "Content-Type": "application/json",
+            },
+            timeout=timeout,
+        )
+        if resp.status_code == 401:
+            if self.renovar is not None:
+                self.renovar(sf, session_id)
+            raise RuntimeError("INVALID_SESSION_ID")
+        resp.raise_for_status()
+        return resp.json() or []
+
+    def _loop(self) -> None:
+        espera = 1.0
+        while not self._parar.is_set():
+            try:
+                self._sessao()
+                espera = 1.0
+            except Exception as exc:  # noqa: BLE001
+                self.conectado = False
+                _logger.warning(
+                    "Eventos de ranking: CometD interrompido (%s); nova tentativa em %.0f s.",
+                    exc,
+                    espera,
+                )
+                self._parar.wait(espera)
+                espera = min(60.0, espera * 2)
+
+    def _sessao(self) -> None:
+        sf = self.conectar()
+        if sf is None:
+            raise RuntimeError("sem conexão Salesforce")
+        url = f"https://{sf.sf_instance}/cometd/{sf.sf_version}"
+        hs = self._post(
+            sf,
+            url,
+            [
+                {
+                    "channel": "/meta/handshake",
+                    "version": "1.0",
+                    "supportedConnectionTypes": ["long-polling"],
+                    "ext": {"replay": True},
+                }
+            ],
+            30,
+        )
+        if not hs or not hs[0].get("successful"):
+            raise RuntimeError(f"handshake recusado: {hs[:1]}")
+        client_id = hs[0]["clientId"]
+        resp = self._post(
+            sf,
+            url,
+            [
+                {
+                    "channel": "/meta/subscribe",
+                    "clientId": client_id,
+                    "subscription": canal,
+                    "ext": {"replay": {canal: -1}},
+                }
+                for canal in self.canais
+            ],
+            30,
+        )
+        falhas = [m for m in resp if m.get("channel") == "/meta/subscribe" and not m.get("successful")]
+        if falhas:
+            raise RuntimeError(f"subscribe recusado: {falhas[0].get('error')}")
+        self.conectado = True
+        _logger.info("Eventos de ranking: inscrito em %s.", ", ".join(self.canais))
+        while not self._parar.is_set():
+            msgs = self._post(
+                sf,
+                url,
+                [
+                    {
+                        "channel": "/meta/connect",
+                        "clientId": client_id,
+                        "connectionType": "long-polling",
+                    }
+                ],
+                130,
+            )
+            for msg in msgs:
+                if msg.get("channel") == "/meta/connect":
+                    if not msg.get("successful"):
+                        # 403::Unknown client etc.: novo handshake no laço externo.
+                        raise RuntimeError(msg.get("error") or "connect recusado")
+                    continue
+                for ev in eventos_de_mensagem(msg):
+                    self.notificador.publicar(ev)
+
+
+def notificador_do_ambiente(
+    *,
+    mapear_ranking: Callable[[Any], str | None] | None,
+    conectar: Callable[[], Any | None],
+    renovar: Callable[[Any, str | None], None] | None = None,
+) -> RankingNotificador:
+    """Notificador novo com o transporte escolhido em DV_RANKING_EVENTOS, já iniciado."""
+    notificador = RankingNotificador(mapear_ranking)
+    modo = (os.environ.get("DV_RANKING_EVENTOS") or "").strip().lower()
+    if modo == "fake":
+        try:
+            latencia = float(os.environ.get("DV_RANKING_EVENTOS_FAKE_LATENCIA_S") or 0)
+        except ValueError:
+            latencia = 0.0
+        notificador.transporte = TransporteEventosFake(notificador, latencia)
+    elif modo == "cometd":
+        canais = [
+            c.strip()
+            for c in (os.environ.get("SALESFORCE_RANKING_CANAIS") or CANAIS_PADRAO).split(",")
+            if c.strip()
+        ]
+        notificador.transporte = TransporteCometD(
+            notificador, canais, conectar=conectar, renovar=renovar
+        )
+    if notificador.transporte is not None:
+        notificador.transporte.iniciar()
+    return notificador
@@ -10,6 +10,10 @@ injetada por diresimulator antes das consultas):
   SALESFORCE_TOKEN (opcional - Security Token separado),
   SALESFORCE_CPF_FIELD, SALESFORCE_RANKING_FIELD.
 
+  Pool de clientes: SALESFORCE_DOMAIN (login|test), SALESFORCE_SESSION_TTL_S
+  (validade assumida da sessão, padrão 6600 s) e SALESFORCE_POOL_MAXSIZE
+  (conexões keep-alive por host, padrão 16).
+
 Requisito: pip install simple-salesforce
 """
 
@@ -18,15 +22,26 @@ from __future__ import annotations
 import logging
 import os
 import re
+import threading
+import time
 from typing import Any, Optional
 
 logger = logging.getLogger(__name__)
 
 try:
     from simple_salesforce import Salesforce, SalesforceAuthenticationFailed
+    from simple_salesforce.api import SFType
 except ImportError:  # pragma: no cover
     Salesforce = None  # type: ignore[misc, assignment]
     SalesforceAuthenticationFailed = Exception  # type: ignore[misc, assignment]
+    SFType = None  # type: ignore[misc, assignment]
+
+try:
+    import requests
+    from requests.adapters import HTTPAdapter
+except ImportError:  # pragma: no cover
+    requests = None  # type: ignore[assignment]
+    HTTPAdapter = None  # type: ignore[misc, assignment]
 
 
 def normalizar_cpf(cpf: str | None) -> str:
@@ -40,6 +55,7 @@ _SALESFORCE_TOML_ALIAS: dict[str, str] = {
     "USER": "SALESFORCE_USER",
     "PASSWORD": "SALESFORCE_PASSWORD",
     "TOKEN": "SALESFORCE_TOKEN",
+    "DOMAIN": "SALESFORCE_DOMAIN",
     "CPF_FIELD": "SALESFORCE_CPF_FIELD",
     "RANKING_FIELD": "SALESFORCE_RANKING_FIELD",
 }
@@ -53,9 +69,132 @@ def chave_env_desde_salesforce_toml(k: str) -> str:
     return _SALESFORCE_TOML_ALIAS.get(k0.upper(), k0)
 
 
+# ---------------------------------------------------------------------------
+# Pool de clientes: um login por credencial e processo, sessão HTTP keep-alive
+# partilhada entre threads, renovação única em INVALID_SESSION_ID.
+# ---------------------------------------------------------------------------
+_SF_POOL_LOCK = threading.Lock()
+_SF_POOL: dict[str, dict[str, Any]] = {}
+
+
+def _sf_pool_ttl_sessao_s() -> float:
+    try:
+        return max(60.0, float(os.environ.get("SALESFORCE_SESSION_TTL_S") or 6600))
+    except ValueError:
+        return 6600.0
+
+
+def _sf_pool_sessao_http() -> Any | None:
+    """requests.Session com pool de conexões dimensionado para chamadas concorrentes."""
+    if requests is None:
+        return None
+    try:
+        maxsize = max(1, int(os.environ.get("SALESFORCE_POOL_MAXSIZE") or 16))
+    except ValueError:
+        maxsize = 16
+    sessao = requests.Session()
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=maxsize)
+    sessao.mount("https://", adapter)
+    sessao.mount("http://", adapter)
+    return sessao
+
+
+def _sf_pool_dominio() -> str:
+    domain = (os.environ.get("SALESFORCE_DOMAIN") or "login").strip().lower()
+    if domain in ("sandbox", "test", "dev"):
+        return "test"
+    if domain in ("prod", "production", "login"):
+        return "login"
+    return domain
+
+
+def _sf_pool_login(entrada: dict[str, Any]) -> None:
+    """Login SOAP reaproveitando a sessão HTTP da entrada (mesmas conexões TCP/TLS)."""
+    username, password, token, domain = entrada["credenciais"]
+    kw: dict[str, Any] = {"username": username, "password": password, "domain": domain}
+    if token:
+        kw["security_token"] = token
+    if entrada.get("sessao_http") is not None:
+        kw["session"] = entrada["sessao_http"]
+    t0 = time.monotonic()
+    entrada["sf"] = Salesforce(**kw)
+    entrada["expira_em"] = time.time() + _sf_pool_ttl_sessao_s()
+    entrada["logins"] = int(entrada.get("logins") or 0) + 1
+    logger.info(
+        "Salesforce: sessão obtida para %s em %.0f ms", username, (time.monotonic() - t0) * 1000
+    )
+
+
+def _sf_pool_cliente(chave: str) -> Any:
+    """Cliente simple_salesforce atual da entrada; renova antes de expirar."""
+    entrada = _SF_POOL[chave]
+    if entrada.get("sf") is not None and time.time() < float(entrada.get("expira_em") or 0):
+        return entrada["sf"]
+    with entrada["lock"]:
+        if entrada.get("sf") is None or time.time() >= float(entrada.get("expira_em") or 0):
+            _sf_pool_login(entrada)
+        return entrada["sf"]
+
+
+def _sf_pool_renovar(chave: str, session_id_falho: str | None) -> None:
+    """Novo login só se ninguém renovou ainda (evita várias threads a logar em simultâneo)."""
+    entrada = _SF_POOL[chave]
+    with entrada["lock"]:
+        atual = getattr(entrada.get("sf"), "session_id", None)
+        if atual is None or atual == session_id_falho:
+            _sf_pool_login(entrada)
+
+
+def _sf_sessao_expirada(exc: BaseException) -> bool:
+    return type(exc).__name__ == "SalesforceExpiredSession" or "INVALID_SESSION_ID" in str(exc)
+
+
+class ClienteSalesforcePool:
+    """
+    Proxy sobre o cliente do pool. Métodos (query, restful, Account.create, …) que
+    falham por sessão expirada renovam o login e são repetidos uma única vez.
+    Atributos simples (session_id, sf_instance, headers, …) vêm do cliente atual.
+    """
+
+    def __init__(self, chave: str, caminho: tuple[str, ...] = ()):
+        self._chave = chave
+        self._caminho = caminho
+
+    def _resolver(self) -> Any:
+        obj = _sf_pool_cliente(self._chave)
+        for nome in self._caminho:
+            obj = getattr(obj, nome)
+        return obj
+
+    def __getattr__(self, nome: str) -> Any:
+        if nome.startswith("__"):
+            raise AttributeError(nome)
+        alvo = getattr(self._resolver(), nome)
+        if SFType is not None and isinstance(alvo, SFType):
+            return ClienteSalesforcePool(self._chave, self._caminho + (nome,))
+        if not callable(alvo):
+            return alvo
+        chave = self._chave
+        pai = ClienteSalesforcePool(chave, self._caminho)
+
+        def _chamar(*args: Any, **kwargs: Any) -> Any:
+            session_id = getattr(_SF_POOL[chave].get("sf"), "session_id", None)
+            try:
+                return alvo(*args, **kwargs)
+            except Exception as exc:
+                if not _sf_sessao_expirada(exc):
+                    raise
+                logger.info("Salesforce: sessão expirada; renovando e repetindo %s.", nome)
+                _sf_pool_renovar(chave, session_id)
+                return getattr(pai._resolver(), nome)(*args, **kwargs)
+
+        return _chamar
+
+
 def conectar_salesforce(verbose: bool = False) -> Optional[Any]:
     """
-    Conexão username/password (+ token opcional), domain login.
+    Cliente do pool (username/password + token opcional). O login acontece uma vez
+    por credencial e processo; chamadas seguintes reaproveitam sessão e conexões.
     """
     if Salesforce is None:
         if verbose:
@@ -71,19 +210,25 @@ def conectar_salesforce(verbose: bool = False) -> Optional[Any]:
             logger.info("Salesforce: SALESFORCE_USER ou SALESFORCE_PASSWORD ausentes.")
         return None
 
+    domain = _sf_pool_dominio()
+    chave = f"{username}|{domain}|{bool(token)}"
+    with _SF_POOL_LOCK:
+        entrada = _SF_POOL.get(chave)
+        if entrada is None or entrada["credenciais"] != (username, password, token, domain):
+            entrada = {
+                "credenciais": (username, password, token, domain),
+                "lock": threading.Lock(),
+                "sessao_http": _sf_pool_sessao_http(),
+                "sf": None,
+                "expira_em": 0.0,
+                "logins": 0,
+            }
+            _SF_POOL[chave] = entrada
     try:
-        if token:
-            sf = Salesforce(
-                username=username,
-                password=password,
-                security_token=token,
-                domain="login",
-            )
-        else:
-            sf = Salesforce(username=username, password=password, domain="login")
+        _sf_pool_cliente(chave)
         if verbose:
             logger.info("Salesforce: conectado como %s", username)
-        return sf
+        return ClienteSalesforcePool(chave)
     except SalesforceAuthenticationFailed as e:
         logger.warning("Salesforce: falha de autenticação: %s", e)
         return None
@@ -92,6 +237,19 @@ def conectar_salesforce(verbose: bool = False) -> Optional[Any]:
         return None
 
 
+def limpar_pool_salesforce() -> None:
+    """Descarta sessões e conexões do pool (troca de credenciais, testes)."""
+    with _SF_POOL_LOCK:
+        for entrada in _SF_POOL.values():
+            sessao = entrada.get("sessao_http")
+            if sessao is not None:
+                try:
+                    sessao.close()
+                except Exception:
+                    pass
+        _SF_POOL.clear()
+
+
 def mapear_ranking_salesforce_para_ui(valor: Any) -> Optional[str]:
     """
     Converte valor vindo do Salesforce (picklist/texto) para uma das opções do simulador.
@@ -0,0 +1,1112 @@
+# -*- coding: utf-8 -*-
+"""
+Salesforce falso, local, para medir o fluxo de ranking sem um org real.
+
+Fala o subconjunto da API REST que o simulador usa: SOQL (SELECT com campos do
+pai «Account.X», subconsulta de filhos, WHERE com AND/OR/IN/=/!=, ORDER BY, LIMIT),
+criar/atualizar/apagar/ler sObject, upsert por External ID (CPF__c), Composite
+Graph, sObject Collections DELETE, jobs de query da Bulk API 2.0 (resultados CSV paginados por Sforce-Locator),
+describe, quick actions e ações Apex/Flow.
+O Ranking__c das contas é preenchido com atraso depois do acionamento do Risk3
+(quick action «Consultar Status CPF» ou Apex IntegracaoRisk3), como no org.
+
+Dois modos de uso:
+
+  * Transporte requests (sem rede): montar_transporte(sessao) monta o adaptador em
+    URL_BASE; com SALESFORCE_FAKE=1 o pool de clientes de diresimulator faz isso
+    sozinho e dispensa o login.
+  * Servidor HTTP: python salesforce_fake.py servir --porta 8787 (para curl/outras
+    linguagens; o simple_salesforce exige https, por isso usa o transporte).
+
+Benchmark: python salesforce_fake.py bench --cpfs 200 --concorrencia 16
+  executa classificar_ranking_cpf_pipeline em N CPFs concorrentes, acompanha os
+  pendentes pelo poller em lote e reporta vazão, p50/p99 e chamadas à API.
+
+Configuração do fake por variáveis de ambiente (ou argumentos do CLI):
+  SALESFORCE_FAKE_LATENCIA_MS   "min,max" por pedido (padrão "20,60")
+  SALESFORCE_FAKE_TAXA_ERRO     fração de respostas 503 (padrão 0)
+  SALESFORCE_FAKE_ATRASO_RANKING_S  atraso até Ranking__c aparecer (padrão 3)
+"""
+
+from __future__ import annotations
+
+import argparse
+import csv
+import hashlib
+import io
+import itertools
+import json
+import os
+import random
+import re
+import threading
+import time
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Iterable, Mapping, Optional
+from urllib.parse import parse_qs, unquote, urlsplit
+
+try:
+    import requests
+    from requests.adapters import BaseAdapter
+    from requests.structures import CaseInsensitiveDict
+except ImportError:  # pragma: no cover
+    requests = None  # type: ignore[assignment]
+    BaseAdapter = object  # type: ignore[misc, assignment]
+    CaseInsensitiveDict = dict  # type: ignore[misc, assignment]
+
+URL_BASE = "https://fake-salesforce.local"
+SESSION_ID_FAKE = "00Dfake!sessao"
+RANKINGS_RISK3 = ("DIAMANTE", "OURO", "PRATA", "BRONZE", "AÇO", "NÃO ELEGÍVEL")
+
+_PREFIXOS_ID = {
+    "Account": "001",
+    "Opportunity": "006",
+    "RecordType": "012",
+    "RelacionamentoComprador__c": "a0X",
+}
+# Relação filho (nome da subconsulta) → (sObject filho, campo de ligação).
+_RELACOES_FILHAS = {
+    ("Account", "Opportunities"): ("Opportunity", "AccountId"),
+}
+# Relação pai (prefixo «Account.» num campo) → (sObject pai, campo de ligação).
+_RELACOES_PAI = {
+    ("Opportunity", "Account"): ("Account", "AccountId"),
+}
+_CAMPOS = {
+    "Account": (
+        "Id", "Name", "FirstName", "LastName", "Salutation", "RecordTypeId", "CPF__c",
+        "CNPJ__c", "Id_Risk3__c", "Ranking__c", "Ranking_Score__c", "UltimaConsultaCPF__c",
+        "Regional__c", "Regional_Comercial__c", "AccountSource", "TelefoneAdicional__c",
+        "Email_Adicional__c", "PersonEmail", "Unidade_de_negocio__c", "IsPersonAccount",
+        "IsDeleted", "CreatedDate", "SystemModstamp",
+    ),
+    "Opportunity": (
+        "Id", "Name", "AccountId", "StageName", "CloseDate", "IDOportunidade__c",
+        "Ranking__c", "Ranking_Score__c", "CreatedDate", "SystemModstamp",
+    ),
+    "RecordType": ("Id", "Name", "DeveloperName", "SobjectType", "IsActive", "IsPersonType"),
+    "RelacionamentoComprador__c": (
+        "Id", "Name", "Conta__c", "Comprador__c", "OpportunityId", "CreatedDate",
+    ),
+}
+_ESTAGIOS = ("Prospecting", "Qualification", "Closed Won", "Closed Lost")
+_EXTERNOS = {("Account", "CPF__c")}
+# Jobs Bulk 2.0 ficam «InProgress» por este tempo antes de JobComplete (força o poll do cliente).
+_ATRASO_JOB_BULK_S = 0.2
+
+
+class ErroFake(Exception):
+    """Erro devolvido ao cliente no formato da API ([{errorCode, message}])."""
+
+    def __init__(self, status: int, codigo: str, mensagem: str, extra: Mapping[str, Any] | None = None):
+        super().__init__(mensagem)
+        self.status = status
+        self.corpo = [{"errorCode": codigo, "message": mensagem, **dict(extra or {})}]
+
+
+# ---------------------------------------------------------------------------
+# SOQL: tokenizador + parser descendente recursivo do subconjunto usado.
+# ---------------------------------------------------------------------------
+_TOKEN_RE = re.compile(
+    r"\s*(?:(?P<str>'(?:\\.|[^'\\])*')|(?P<op>!=|<=|>=|=|<|>|\(|\)|,)"
+    r"|(?P<dt>\d{4}-\d{2}-\d{2}T\d{2}:\d{2}:\d{2}(?:\.\d+)?(?:Z|[+-]\d{2}:?\d{2}))"
+    r"|(?P<num>-?\d+(?:\.\d+)?)|(?P<id>[A-Za-z_][A-Za-z0-9_.]*))"
+)
+
+
+def _tokenizar(soql: str) -> list[tuple[str, Any]]:
+    tokens: list[tuple[str, Any]] = []
+    pos = 0
+    texto = soql.strip()
+    while pos < len(texto):
+        m = _TOKEN_RE.match(texto, pos)
+        if not m or m.end() == pos:
+            raise ErroFake(400, "MALFORMED_QUERY", f"Token inesperado em: {texto[pos:pos + 30]!r}")
+        pos = m.end()
+        if m.group("str") is not None:
+            tokens.append(("str", re.sub(r"\\(.)", r"\1", m.group("str")[1:-1])))
+        elif m.group("op") is not None:
+            tokens.append(("op", m.group("op")))
+        elif m.group("dt") is not None:
+            # Literal datetime → mesmo formato UTC dos registos (comparação como texto).
+            dt = datetime.fromisoformat(m.group("dt").replace("Z", "+00:00"))
+            tokens.append(("str", _iso_utc(dt)))
+        elif m.group("num") is not None:
+            num = m.group("num")
+            tokens.append(("num", float(num) if "." in num else int(num)))
+        elif m.group("id") is not None:
+            tokens.append(("id", m.group("id")))
+    return tokens
+
+
+@dataclass
+class _Consulta:
+    campos: list[str]
+    subconsultas: list["_Consulta"]
+    sobject: str
+    onde: Any = None
+    ordem: list[tuple[str, bool]] = field(default_factory=list)
+    limite: Optional[int] = None
+
+
+class _ParserSOQL:
+    def __init__(self, tokens: list[tuple[str, Any]]):
+        self.tokens = tokens
+        self.i = 0
+
+    def _ver(self) -> tuple[str, Any] | None:
+        return self.tokens[self.i] if self.i < len(self.tokens) else None
+
+    def _palavra(self, *palavras: str) -> bool:
+        tok = self._ver()
+        if tok and tok[0] == "id" and str(tok[1]).upper() in palavras:
+            self.i += 1
+            return True
+        return False
+
+    def _esperar(self, tipo: str, valor: Any = None) -> Any:
+        tok = self._ver()
+        if tok is None or tok[0] != tipo or (
+            valor is not None and str(tok[1]).upper() != str(valor).upper()
+        ):
+            raise ErroFake(400, "MALFORMED_QUERY", f"Esperado {valor or tipo}, obtido {tok!r}")
+        self.i += 1
+        return tok[1]
+
+    def consulta(self) -> _Consulta:
+        self._esperar("id", "SELECT")
+        campos: list[str] = []
+        subs: list[_Consulta] = []
+        while True:
+            if self._ver() == ("op", "("):
+                self.i += 1
+                subs.append(self.consulta())
+                self._esperar("op", ")")
+            else:
+                campos.append(self._esperar("id"))
+            if self._ver() == ("op", ","):
+                self.i += 1
+                continue
+            break
+        self._esperar("id", "FROM")
+        q = _Consulta(campos=campos, subconsultas=subs, sobject=self._esperar("id"))
+        if self._palavra("WHERE"):
+            q.onde = self._ou()
+        if self._palavra("ORDER"):
+            self._esperar("id", "BY")
+            while True:
+                campo = self._esperar("id")
+                desc = self._palavra("DESC")
+                if not desc:
+                    self._palavra("ASC")
+                if self._palavra("NULLS"):
+                    self._palavra("FIRST", "LAST")
+                q.ordem.append((campo, desc))
+                if self._ver() == ("op", ","):
+                    self.i += 1
+                    continue
+                break
+        if self._palavra("LIMIT"):
+            q.limite = int(self._esperar("num"))
+        return q
+
+    def _ou(self) -> Any:
+        termos = [self._e()]
+        while self._palavra("OR"):
+            termos.append(self._e())
+        return ("or", termos) if len(termos) > 1 else termos[0]
+
+    def _e(self) -> Any:
+        termos = [self._fator()]
+        while self._palavra("AND"):
+            termos.append(self._fator())
+        return ("and", termos) if len(termos) > 1 else termos[0]
+
+    def _fator(self) -> Any:
+        if self._palavra("NOT"):
+            return ("not", self._fator())
+        if self._ver() == ("op", "("):
+            self.i += 1
+            expr = self._ou()
+            self._esperar("op", ")")
+            return expr
+        campo = self._esperar("id")
+        if self._palavra("IN"):
+            self._esperar("op", "(")
+            valores = [self._valor()]
+            while self._ver() == ("op", ","):
+                self.i += 1
+                valores.append(self._valor())
+            self._esperar("op", ")")
+            return ("in", campo, valores)
+        if self._palavra("LIKE"):
+            return ("like", campo, self._valor())
+        op = self._esperar("op")
+        return ("cmp", campo, op, self._valor())
+
+    def _valor(self) -> Any:
+        tipo, valor = self.tokens[self.i]
+        self.i += 1
+        if tipo == "id":
+            baixo = str(valor).lower()
+            if baixo in ("true", "false"):
+                return baixo == "true"
+            if baixo == "null":
+                return None
+        return valor
+
+
+def _comparar(a: Any, op: str, b: Any) -> bool:
+    if op == "=":
+        return a == b
+    if op == "!=":
+        return a != b
+    if a is None or b is None:
+        return False
+    return {"<": a < b, ">": a > b, "<=": a <= b, ">=": a >= b}[op]
+
+
+# ---------------------------------------------------------------------------
+# Org falso
+# ---------------------------------------------------------------------------
+@dataclass
+class ConfigFake:
+    latencia_ms: tuple[float, float] = (20.0, 60.0)
+    taxa_erro: float = 0.0
+    atraso_ranking_s: float = 3.0
+    # Rotas de acionamento do Risk3 que respondem 400 (ex.: {"apex"} simula Apex Class Access).
+    rotas_indisponiveis: frozenset[str] = frozenset()
+    semente: Optional[int] = None
+
+    @classmethod
+    def do_ambiente(cls) -> "ConfigFake":
+        def _f(nome: str, padrao: float) -> float:
+            try:
+                return float(os.environ.get(nome) or padrao)
+            except ValueError:
+                return padrao
+
+        lat = (os.environ.get("SALESFORCE_FAKE_LATENCIA_MS") or "20,60").split(",")
+        try:
+            lat_min, lat_max = float(lat[0]), float(lat[-1])
+        except ValueError:
+            lat_min, lat_max = 20.0, 60.0
+        return cls(
+            latencia_ms=(lat_min, max(lat_min, lat_max)),
+            taxa_erro=_f("SALESFORCE_FAKE_TAXA_ERRO", 0.0),
+            atraso_ranking_s=_f("SALESFORCE_FAKE_ATRASO_RANKING_S", 3.0),
+        )
+
+
+def ranking_para_cpf(cpf: str) -> str:
+    """Ranking determinístico por CPF (o mesmo CPF recebe sempre o mesmo resultado)."""
+    digitos = re.sub(r"\D", "", str(cpf or ""))
+    h = int(hashlib.sha256(digitos.encode("ascii")).hexdigest()[:8], 16)
+    return RANKINGS_RISK3[h % len(RANKINGS_RISK3)]
+
+
+def _iso_utc(dt: datetime) -> str:
+    return dt.astimezone(timezone.utc).strftime("%Y-%m-%dT%H:%M:%S.%f")[:-3] + "+0000"
+
+
+def _agora_iso() -> str:
+    return _iso_utc(datetime.now(timezone.utc))
+
+
+@dataclass
+class RespostaBruta:
+    """Corpo não JSON (ex.: CSV da Bulk API) com cabeçalhos próprios."""
+
+    texto: str
+    tipo: str = "text/csv"
+    cabecalhos: dict[str, str] = field(default_factory=dict)
+
+
+class FakeSalesforce:
+    """Estado do org falso (thread-safe) e despacho dos pedidos REST."""
+
+    def __init__(self, config: ConfigFake | None = None):
+        self.config = config or ConfigFake()
+        self._rng = random.Random(self.config.semente)
+        self._lock = threading.RLock()
+        self._dados: dict[str, dict[str, dict[str, Any]]] = {s: {} for s in _CAMPOS}
+        # Lixeira: registos apagados (IsDeleted=true), visíveis só a jobs queryAll.
+        self._lixeira: dict[str, dict[str, dict[str, Any]]] = {s: {} for s in _CAMPOS}
+        self._seq = itertools.count(1)
+        self.chamadas: dict[str, int] = {}
+        self._jobs: dict[str, dict[str, Any]] = {}
+        self.record_type_pf = self._inserir(
+            "RecordType",
+            {
+                "Name": "Cliente Pessoa Física",
+                "DeveloperName": "ClientePessoaFisica",
+                "SobjectType": "Account",
+                "IsActive": True,
+                "IsPersonType": True,
+            },
+        )["Id"]
+
+    # --- estado -----------------------------------------------------------
+    def _novo_id(self, sobject: str) -> str:
+        return f"{_PREFIXOS_ID.get(sobject, 'a00')}FAKE{next(self._seq):011d}"
+
+    def _inserir(self, sobject: str, valores: Mapping[str, Any]) -> dict[str, Any]:
+        agora = _agora_iso()
+        rec = {c: None for c in _CAMPOS[sobject]}
+        rec.update(valores)
+        rec["Id"] = self._novo_id(sobject)
+        rec["CreatedDate"] = rec["SystemModstamp"] = agora
+        if "IsDeleted" in rec:
+            rec["IsDeleted"] = False
+        if sobject == "Account":
+            rec["IsPersonAccount"] = rec.get("RecordTypeId") == getattr(self, "record_type_pf", None)
+        if sobject == "Account" and not rec.get("Name"):
+            rec["Name"] = " ".join(
+                str(v) for v in (rec.get("FirstName"), rec.get("LastName")) if v
+            ) or None
+        self._dados[sobject][rec["Id"]] = rec
+        return rec
+
+    def semear_conta(
+        self, cpf: str, *, ranking: str | None = None, com_oportunidade: bool = True
+    ) -> str:
+        """Cria uma conta (e oportunidade) já existente no org; ranking opcional."""
+        digitos = re.sub(r"\D", "", cpf)
+        mascarado = f"{digitos[:3]}.{digitos[3:6]}.{digitos[6:9]}-{digitos[9:]}"
+        with self._lock:
+            conta = self._inserir(
+                "Account",
+                {"FirstName": "Semente", "LastName": digitos, "CPF__c": mascarado,
+                 "RecordTypeId": self.record_type_pf, "Ranking__c": ranking},
+            )
+            if com_oportunidade:
+                self._inserir(
+                    "Opportunity",
+                    {"AccountId": conta["Id"], "Name": f"Semente {mascarado}",
+                     "StageName": "Prospecting", "Ranking__c": ranking},
+                )
+            return conta["Id"]
+
+    def _agendar_ranking(self, account_id: str) -> None:
+        conta = self._dados["Account"].get(account_id)
+        if conta is None or conta.get("Ranking__c") or conta.get("_ranking_em"):
+            return
+        conta["_ranking_em"] = time.monotonic() + self.config.atraso_ranking_s
+        conta["_ranking_valor"] = ranking_para_cpf(conta.get("CPF__c") or account_id)
+
+    def _materializar(self) -> None:
+        """Aplica rankings cujo atraso já passou (avaliação preguiçosa, sem timers)."""
+        agora = time.monotonic()
+        for conta in self._dados["Account"].values():
+            em = conta.get("_ranking_em")
+            if em is None or em > agora:
+                continue
+            valor = conta.pop("_ranking_valor")
+            conta.pop("_ranking_em")
+            conta["Ranking__c"] = valor
+            conta["UltimaConsultaCPF__c"] = conta["SystemModstamp"] = _agora_iso()
+            for opp in self._dados["Opportunity"].values():
+                if opp.get("AccountId") == conta["Id"]:
+                    opp["Ranking__c"] = valor
+                    opp["SystemModstamp"] = conta["SystemModstamp"]
+
+    def _publico(self, sobject: str, rec: Mapping[str, Any]) -> dict[str, Any]:
+        out = {k: v for k, v in rec.items() if not k.startswith("_")}
+        out["attributes"] = {
+            "type": sobject,
+            "url": f"/services/data/v59.0/sobjects/{sobject}/{rec['Id']}",
+        }
+        return out
+
+    # --- SOQL -------------------------------------------------------------
+    def _valor_campo(self, sobject: str, rec: Mapping[str, Any], campo: str) -> Any:
+        if "." not in campo:
+            if campo not in rec:
+                raise ErroFake(400, "INVALID_FIELD", f"No such column '{campo}' on entity '{sobject}'")
+            return rec.get(campo)
+        rel, resto = campo.split(".", 1)
+        pai = _RELACOES_PAI.get((sobject, rel))
+        if pai is None:
+            raise ErroFake(400, "INVALID_FIELD", f"Didn't understand relationship '{rel}'")
+        pai_obj, ligacao = pai
+        registro_pai = self._dados[pai_obj].get(rec.get(ligacao) or "")
+        return self._valor_campo(pai_obj, registro_pai, resto) if registro_pai else None
+
+    def _avaliar(self, sobject: str, rec: Mapping[str, Any], expr: Any) -> bool:
+        if expr is None:
+            return True
+        tipo = expr[0]
+        if tipo == "and":
+            return all(self._avaliar(sobject, rec, e) for e in expr[1])
+        if tipo == "or":
+            return any(self._avaliar(sobject, rec, e) for e in expr[1])
+        if tipo == "not":
+            return not self._avaliar(sobject, rec, expr[1])
+        valor = self._valor_campo(sobject, rec, expr[1])
+        if tipo == "in":
+            return valor in expr[2]
+        if tipo == "like":
+            padrao = "^" + re.escape(str(expr[2])).replace("%", ".*").replace("_", ".") + "$"
+            return valor is not None and re.match(padrao, str(valor), re.I) is not None
+        return _comparar(valor, expr[2], expr[3])
+
+    def _executar(self, q: _Consulta, registros: Iterable[Mapping[str, Any]]) -> list[dict[str, Any]]:
+        achados = [r for r in registros if self._avaliar(q.sobject, r, q.onde)]
+        for campo, desc in reversed(q.ordem):
+            # Padrão do SOQL: ASC NULLS FIRST, DESC NULLS LAST.
+            nulos = [r for r in achados if self._valor_campo(q.sobject, r, campo) is None]
+            valores = [r for r in achados if self._valor_campo(q.sobject, r, campo) is not None]
+            valores.sort(key=lambda r: self._valor_campo(q.sobject, r, campo), reverse=desc)
+            achados = valores + nulos if desc else nulos + valores
+        if q.limite is not None:
+            achados = achados[: q.limite]
+        out: list[dict[str, Any]] = []
+        for rec in achados:
+            linha: dict[str, Any] = {
+                "attributes": {"type": q.sobject, "url": f"/services/data/v59.0/sobjects/{q.sobject}/{rec['Id']}"}
+            }
+            for campo in q.campos:
+                valor = self._valor_campo(q.sobject, rec, campo)
+                if "." in campo:
+                    rel, resto = campo.split(".", 1)
+                    bloco = linha.setdefault(rel, {"attributes": {"type": _RELACOES_PAI[(q.sobject, rel)][0]}})
+                    if bloco is not None:
+                        bloco[resto] = valor
+                else:
+                    linha[campo] = valor
+            for sub in q.subconsultas:
+                filho = _RELACOES_FILHAS.get((q.sobject, sub.sobject))
+                if filho is None:
+                    raise ErroFake(400, "INVALID_TYPE", f"Didn't understand relationship '{sub.sobject}'")
+                filho_obj, ligacao = filho
+                sub_q = _Consulta(sub.campos, [], filho_obj, sub.onde, sub.ordem, sub.limite)
+                filhos = self._executar(
+                    sub_q,
+                    [r for r in self._dados[filho_obj].values() if r.get(ligacao) == rec["Id"]],
+                )
+                linha[sub.sobject] = (
+                    {"totalSize": len(filhos), "done": True, "records": filhos} if filhos else None
+                )
+            out.append(linha)
+        return out
+
+    def consultar(self, soql: str) -> dict[str, Any]:
+        q = _ParserSOQL(_tokenizar(soql)).consulta()
+        if q.sobject not in self._dados:
+            raise ErroFake(400, "INVALID_TYPE", f"sObject type '{q.sobject}' is not supported.")
+        with self._lock:
+            self._materializar()
+            recs = self._executar(q, list(self._dados[q.sobject].values()))
+        return {"totalSize": len(recs), "done": True, "records": recs}
+
+    # --- describe / CRUD / ações ------------------------------------------
+    def descrever(self, sobject: str) -> dict[str, Any]:
+        if sobject not in _CAMPOS:
+            raise ErroFake(404, "NOT_FOUND", f"The requested resource does not exist: {sobject}")
+        campos = []
+        for nome in _CAMPOS[sobject]:
+            item: dict[str, Any] = {
+                "name": nome,
+                "type": "id" if nome == "Id" else "string",
+                "externalId": (sobject, nome) in _EXTERNOS,
+            }
+            if sobject == "Opportunity" and nome == "StageName":
+                item["type"] = "picklist"
+                item["picklistValues"] = [{"value": v, "active": True} for v in _ESTAGIOS]
+            campos.append(item)
+        return {"name": sobject, "fields": campos}
+
+    def criar(self, sobject: str, valores: Mapping[str, Any]) -> dict[str, Any]:
+        if sobject not in _CAMPOS:
+            raise ErroFake(404, "NOT_FOUND", f"The requested resource does not exist: {sobject}")
+        invalidos = [k for k in valores if k not in _CAMPOS[sobject]]
+        if invalidos:
+            raise ErroFake(400, "INVALID_FIELD", f"No such column '{invalidos[0]}' on sobject of type {sobject}")
+        with self._lock:
+            if sobject == "Account" and valores.get("CPF__c"):
+                dup = next(
+                    (c for c in self._dados["Account"].values() if c.get("CPF__c") == valores["CPF__c"]),
+                    None,
+                )
+                if dup is not None:
+                    raise ErroFake(
+                        400,
+                        "DUPLICATES_DETECTED",
+                        "Use one of these records?",
+                        {"duplicateResult": {"matchResults": [{"matchRecords": [{"record": {"Id": dup["Id"]}}]}]}},
+                    )
+            rec = self._inserir(sobject, valores)
+        return {"id": rec["Id"], "success": True, "errors": []}
+
+    def upsert(self, sobject: str, campo: str, valor: str, valores: Mapping[str, Any]) -> tuple[int, dict[str, Any]]:
+        """PATCH /sobjects/X/Campo/valor: atualiza o registo com esse External ID ou cria."""
+        if (sobject, campo) not in _EXTERNOS:
+            raise ErroFake(400, "NOT_FOUND", f"Provided external ID field does not exist or is not accessible: {campo}")
+        with self._lock:
+            achados = [r for r in self._dados[sobject].values() if r.get(campo) == valor]
+            if len(achados) > 1:
+                raise ErroFake(300, "MULTIPLE_CHOICES", f"Mais de um {sobject} com {campo}={valor}")
+            if achados:
+                self.atualizar(sobject, achados[0]["Id"], valores)
+                return 200, {"id": achados[0]["Id"], "success": True, "errors": [], "created": False}
+            criado = self.criar(sobject, {**valores, campo: valor})
+        return 201, {**criado, "created": True}
+
+    def grafo(self, dados: Mapping[str, Any]) -> dict[str, Any]:
+        """Composite Graph: cada grafo é tudo ou nada; «@{ref.campo}» resolve respostas anteriores."""
+        saida = []
+        for g in dados.get("graphs") or []:
+            refs: dict[str, Mapping[str, Any]] = {}
+            respostas: list[dict[str, Any]] = []
+            criados: list[tuple[str, str]] = []
+            ok = True
+
+            def _resolver(valor: Any) -> Any:
+                if isinstance(valor, str):
+                    return re.sub(
+                        r"@\{(\w+)\.(\w+)\}",
+                        lambda m: str((refs.get(m.group(1)) or {}).get(m.group(2)) or ""),
+                        valor,
+                    )
+                if isinstance(valor, dict):
+                    return {k: _resolver(v) for k, v in valor.items()}
+                return valor
+
+            with self._lock:
+                for no in g.get("compositeRequest") or []:
+                    ref = str(no.get("referenceId") or "")
+                    if not ok:
+                        respostas.append({
+                            "body": [{"errorCode": "PROCESSING_HALTED",
+                                      "message": "Grafo interrompido por falha anterior."}],
+                            "httpHeaders": {}, "httpStatusCode": 400, "referenceId": ref,
+                        })
+                        continue
+                    url = re.sub(r"^/services/data/v[\d.]+/", "", _resolver(no.get("url") or ""))
+                    try:
+                        status, corpo = self._rotear(
+                            str(no.get("method") or "GET").upper(),
+                            [unquote(p) for p in url.split("/") if p],
+                            {},
+                            _resolver(no.get("body")),
+                        )
+                    except ErroFake as exc:
+                        status, corpo = exc.status, exc.corpo
+                    respostas.append({"body": corpo, "httpHeaders": {}, "httpStatusCode": status, "referenceId": ref})
+                    if status >= 400:
+                        ok = False
+                        continue
+                    refs[ref] = corpo or {}
+                    if (corpo or {}).get("created", str(no.get("method")).upper() == "POST") and (corpo or {}).get("id"):
+                        sobj = [p for p in str(no.get("url")).split("/") if p][4]
+                        criados.append((sobj, corpo["id"]))
+                if not ok:
+                    # Tudo ou nada: desfaz as criações deste grafo.
+                    for sobj, rid in reversed(criados):
+                        self._dados.get(sobj, {}).pop(rid, None)
+            saida.append({
+                "graphId": g.get("graphId"),
+                "graphResponse": {"compositeResponse": respostas},
+                "isSuccessful": ok,
+            })
+        return {"graphs": saida}
+
+    def _registro(self, sobject: str, rid: str) -> dict[str, Any]:
+        rec = self._dados.get(sobject, {}).get(rid)
+        if rec is None:
+            raise ErroFake(404, "NOT_FOUND", "The requested resource does not exist")
+        return rec
+
+    def ler(self, sobject: str, rid: str) -> dict[str, Any]:
+        with self._lock:
+            self._materializar()
+            return self._publico(sobject, self._registro(sobject, rid))
+
+    def atualizar(self, sobject: str, rid: str, valores: Mapping[str, Any]) -> None:
+        with self._lock:
+            rec = self._registro(sobject, rid)
+            rec.update(valores)
+            rec["SystemModstamp"] = _agora_iso()
+
+    def apagar_colecao(self, ids: list[str], all_or_none: bool) -> list[dict[str, Any]]:
+        """DELETE composite/sobjects?ids=...: até 200 Ids, na ordem; allOrNone desfaz tudo se um falhar."""
+        if not ids or len(ids) > 200:
+            raise ErroFake(400, "INVALID_FIELD", "ids deve ter entre 1 e 200 Ids")
+        por_prefixo = {v: k for k, v in _PREFIXOS_ID.items()}
+        with self._lock:
+            copia = {s: dict(r) for s, r in self._dados.items()}
+            copia_lixeira = {s: dict(r) for s, r in self._lixeira.items()}
+            saida = []
+            for rid in ids:
+                sobject = por_prefixo.get(rid[:3])
+                try:
+                    if sobject is None:
+                        raise ErroFake(400, "MALFORMED_ID", f"Id inválido: {rid}")
+                    self.apagar(sobject, rid)
+                    saida.append({"id": rid, "success": True, "errors": []})
+                except ErroFake as exc:
+                    saida.append({"id": rid, "success": False, "errors": exc.corpo})
+            if all_or_none and not all(r["success"] for r in saida):
+                self._dados = copia
+                self._lixeira = copia_lixeira
+                saida = [
+                    r if not r["success"] else {
+                        "id": r["id"], "success": False,
+                        "errors": [{"statusCode": "ALL_OR_NONE_OPERATION_ROLLED_BACK",
+                                    "message": "Record rolled back because not all records were valid."}],
+                    }
+                    for r in saida
+                ]
+        return saida
+
+    # --- Bulk API 2.0 (jobs de query) ---------------------------------------
+    def criar_job_consulta(self, dados: Mapping[str, Any]) -> dict[str, Any]:
+        """POST jobs/query: valida a SOQL (sem subconsultas) e guarda o resultado do instante."""
+        if dados.get("operation") not in ("query", "queryAll"):
+            raise ErroFake(400, "INVALIDJOB", "operation deve ser query ou queryAll")
+        q = _ParserSOQL(_tokenizar(str(dados.get("query") or ""))).consulta()
+        if q.subconsultas:
+            raise ErroFake(400, "INVALIDJOB", "Subconsultas não são suportadas na Bulk API 2.0")
+        if q.sobject not in self._dados:
+            raise ErroFake(400, "INVALIDJOB", f"sObject type '{q.sobject}' is not supported.")
+        with self._lock:
+            self._materializar()
+            base = list(self._dados[q.sobject].values())
+            if dados["operation"] == "queryAll":
+                base += list(self._lixeira[q.sobject].values())
+            registros = self._executar(q, base)
+            job = {
+                "id": f"750FAKE{next(self._seq):011d}",
+                "operation": dados["operation"],
+                "object": q.sobject,
+                "campos": q.campos,
+                "registros": registros,
+                "pronto_em": time.monotonic() + _ATRASO_JOB_BULK_S,
+            }
+            self._jobs[job["id"]] = job
+        return self.estado_job(job["id"])
+
+    def _job(self, job_id: str) -> dict[str, Any]:
+        job = self._jobs.get(job_id)
+        if job is None:
+            raise ErroFake(404, "NOT_FOUND", f"Job {job_id} inexistente")
+        return job
+
+    def estado_job(self, job_id: str) -> dict[str, Any]:
+        with self._lock:
+            job = self._job(job_id)
+            pronto = time.monotonic() >= job["pronto_em"]
+            return {
+                "id": job["id"],
+                "operation": job["operation"],
+                "object": job["object"],
+                "state": "JobComplete" if pronto else "InProgress",
+                "contentType": "CSV",
+                "numberRecordsProcessed": len(job["registros"]) if pronto else 0,
+            }
+
+    def resultados_job(self, job_id: str, locator: str | None, max_records: int | None) -> RespostaBruta:
+        """GET jobs/query/{id}/results: página CSV; Sforce-Locator aponta a próxima (ou «null»)."""
+        with self._lock:
+            job = self._job(job_id)
+            if time.monotonic() < job["pronto_em"]:
+                raise ErroFake(400, "INVALIDJOB", "Job ainda não concluído")
+            inicio = int(locator or 0)
+            fim = len(job["registros"]) if not max_records else inicio + int(max_records)
+            pagina = job["registros"][inicio:fim]
+            total = len(job["registros"])
+        saida = io.StringIO()
+        w = csv.writer(saida, quoting=csv.QUOTE_ALL, lineterminator="\n")
+        w.writerow(job["campos"])
+        for rec in pagina:
+            linha = []
+            for campo in job["campos"]:
+                valor: Any = rec
+                for parte in campo.split("."):
+                    valor = (valor or {}).get(parte)
+                linha.append("" if valor is None else str(valor).lower() if isinstance(valor, bool) else valor)
+            w.writerow(linha)
+        return RespostaBruta(
+            saida.getvalue(),
+            cabecalhos={
+                "Sforce-Locator": str(fim) if fim < total else "null",
+                "Sforce-NumberOfRecords": str(len(pagina)),
+            },
+        )
+
+    def apagar(self, sobject: str, rid: str) -> None:
+        with self._lock:
+            self._registro(sobject, rid)
+            rec = dict(self._dados[sobject].pop(rid))
+            if "IsDeleted" in rec:
+                rec["IsDeleted"] = True
+                rec["SystemModstamp"] = _agora_iso()
+                self._lixeira[sobject][rid] = rec
+
+    def acionar_risk3(self, rota: str, account_id: str | None) -> None:
+        if rota in self.config.rotas_indisponiveis:
+            raise ErroFake(400, "INSUFFICIENT_ACCESS", f"Rota {rota} indisponível (fake).")
+        with self._lock:
+            if account_id and account_id.startswith(_PREFIXOS_ID["Opportunity"]):
+                account_id = (self._dados["Opportunity"].get(account_id) or {}).get("AccountId")
+            if not account_id or account_id not in self._dados["Account"]:
+                raise ErroFake(404, "NOT_FOUND", "contextId inexistente")
+            self._agendar_ranking(account_id)
+
+    # --- despacho HTTP ------------------------------------------------------
+    def _contar(self, rota: str) -> None:
+        with self._lock:
+            self.chamadas[rota] = self.chamadas.get(rota, 0) + 1
+
+    def latencia_s(self) -> float:
+        lo, hi = self.config.latencia_ms
+        return self._rng.uniform(lo, hi) / 1000.0
+
+    def atender(self, metodo: str, url: str, corpo: bytes | str | None) -> tuple[int, Any]:
+        """Despacha um pedido REST; devolve (status, corpo JSON ou None)."""
+        partes = urlsplit(url)
+        m = re.match(r"^/services/data/v[\d.]+/(.*?)/?$", partes.path)
+        if not m:
+            return 404, [{"errorCode": "NOT_FOUND", "message": partes.path}]
+        caminho = [unquote(p) for p in m.group(1).split("/") if p]
+        try:
+            dados = json.loads(corpo) if corpo else None
+        except ValueError:
+            return 400, [{"errorCode": "JSON_PARSER_ERROR", "message": "corpo inválido"}]
+        if self.config.taxa_erro and self._rng.random() < self.config.taxa_erro:
+            self._contar("erro_injetado")
+            return 503, [{"errorCode": "SERVER_UNAVAILABLE", "message": "Erro injetado (fake)."}]
+        try:
+            return self._rotear(metodo.upper(), caminho, parse_qs(partes.query), dados)
+        except ErroFake as exc:
+            return exc.status, exc.corpo
+
+    def _rotear(
+        self, metodo: str, caminho: list[str], qs: Mapping[str, list[str]], dados: Any
+    ) -> tuple[int, Any]:
+        if caminho == ["composite", "graph"] and metodo == "POST":
+            self._contar("composite_graph")
+            return 200, self.grafo(dados or {})
+        if caminho == ["composite", "sobjects"] and metodo == "DELETE":
+            self._contar("collections_delete")
+            ids = [i for i in ",".join(qs.get("ids") or []).split(",") if i]
+            tudo = ((qs.get("allOrNone") or ["false"])[0]).lower() == "true"
+            return 200, self.apagar_colecao(ids, tudo)
+        if caminho[:2] == ["jobs", "query"]:
+            if len(caminho) == 2 and metodo == "POST":
+                self._contar("bulk_job")
+                return 200, self.criar_job_consulta(dados or {})
+            if len(caminho) == 3 and metodo == "GET":
+                self._contar("bulk_estado")
+                return 200, self.estado_job(caminho[2])
+            if len(caminho) == 4 and caminho[3] == "results" and metodo == "GET":
+                self._contar("bulk_resultados")
+                maximo = (qs.get("maxRecords") or [None])[0]
+                return 200, self.resultados_job(
+                    caminho[2], (qs.get("locator") or [None])[0], int(maximo) if maximo else None
+                )
+        if caminho and caminho[0] in ("query", "queryAll") and metodo == "GET":
+            self._contar("query")
+            return 200, self.consultar((qs.get("q") or [""])[0])
+        if len(caminho) >= 2 and caminho[0] == "sobjects":
+            sobject = caminho[1]
+            if len(caminho) == 2 and metodo == "POST":
+                self._contar("create")
+                return 201, self.criar(sobject, dados or {})
+            if len(caminho) == 3 and caminho[2] == "describe" and metodo == "GET":
+                self._contar("describe")
+                return 200, self.descrever(sobject)
+            if len(caminho) == 4 and metodo == "PATCH":
+                self._contar("upsert")
+                return self.upsert(sobject, caminho[2], caminho[3], dados or {})
+            if len(caminho) == 4 and caminho[2] == "quickActions" and metodo == "POST":
+                self._contar("quick_action")
+                self.acionar_risk3("quick_action", str((dados or {}).get("contextId") or ""))
+                return 200, {"success": True, "contextId": (dados or {}).get("contextId")}
+            if len(caminho) == 3:
+                rid = caminho[2]
+                if metodo == "GET":
+                    self._contar("retrieve")
+                    return 200, self.ler(sobject, rid)
+                if metodo == "PATCH":
+                    self._contar("update")
+                    self.atualizar(sobject, rid, dados or {})
+                    return 204, None
+                if metodo == "DELETE":
+                    self._contar("delete")
+                    self.apagar(sobject, rid)
+                    return 204, None
+        if caminho[:2] == ["actions", "custom"] and len(caminho) == 4 and metodo == "POST":
+            self._contar(f"acao_{caminho[2]}")
+            entradas = (dados or {}).get("inputs") or [{}]
+            conta = (entradas[0] or {}).get("Account") or {}
+            self.acionar_risk3(caminho[2], str(conta.get("Id") or entradas[0].get("recordId") or ""))
+            return 200, [{"actionName": caminho[3], "isSuccess": True, "outputValues": {}}]
+        return 404, [{"errorCode": "NOT_FOUND", "message": "/".join(caminho)}]
+
+
+def _serializar(corpo: Any) -> tuple[str, bytes, dict[str, str]]:
+    """(Content-Type, bytes, cabeçalhos extra) de uma resposta de FakeSalesforce.atender."""
+    if isinstance(corpo, RespostaBruta):
+        return f"{corpo.tipo};charset=UTF-8", corpo.texto.encode("utf-8"), dict(corpo.cabecalhos)
+    dados = b"" if corpo is None else json.dumps(corpo, ensure_ascii=False).encode("utf-8")
+    return "application/json;charset=UTF-8", dados, {}
+
+
+class TransporteFake(BaseAdapter):
+    """Adaptador requests que responde em processo, com a latência configurada do fake."""
+
+    def __init__(self, fake: FakeSalesforce):
+        super().__init__()
+        self.fake = fake
+
+    def send(self, request, stream=False, timeout=None, verify=True, cert=None, proxies=None):  # noqa: D401
+        espera = self.fake.latencia_s()
+        limite = timeout[1] if isinstance(timeout, tuple) else timeout
+        if limite is not None and espera > float(limite):
+            time.sleep(float(limite))
+            raise requests.exceptions.ReadTimeout(f"fake: {espera:.3f}s > timeout {limite}s", request=request)
+        time.sleep(espera)
+        status, corpo = self.fake.atender(request.method, request.url, request.body)
+        resp = requests.Response()
+        resp.status_code = status
+        resp.reason = "OK" if status < 400 else "Error"
+        tipo, dados, cabecalhos = _serializar(corpo)
+        resp._content = dados
+        resp.headers = CaseInsensitiveDict({"Content-Type": tipo, **cabecalhos})
+        resp.encoding = "utf-8"
+        resp.url = request.url
+        resp.request = request
+        return resp
+
+    def close(self) -> None:
+        pass
+
+
+_FAKE_ATIVO: dict[str, Any] = {"fake": None}
+_FAKE_LOCK = threading.Lock()
+
+
+def fake_ativo() -> FakeSalesforce:
+    """Instância do processo (criada com ConfigFake.do_ambiente() na primeira chamada)."""
+    with _FAKE_LOCK:
+        if _FAKE_ATIVO["fake"] is None:
+            _FAKE_ATIVO["fake"] = FakeSalesforce(ConfigFake.do_ambiente())
+        return _FAKE_ATIVO["fake"]
+
+
+def instalar_fake(fake: FakeSalesforce) -> FakeSalesforce:
+    """Substitui a instância do processo (usada pelo pool quando SALESFORCE_FAKE=1)."""
+    with _FAKE_LOCK:
+        _FAKE_ATIVO["fake"] = fake
+    return fake
+
+
+def montar_transporte(sessao: Any, fake: FakeSalesforce | None = None) -> Any:
+    """Monta o TransporteFake em URL_BASE numa requests.Session."""
+    sessao.mount(URL_BASE, TransporteFake(fake or fake_ativo()))
+    return sessao
+
+
+def servir(host: str = "127.0.0.1", porta: int = 8787, fake: FakeSalesforce | None = None) -> ThreadingHTTPServer:
+    """Servidor HTTP (thread por pedido) com a mesma API; bloqueia em serve_forever()."""
+    org = fake or fake_ativo()
+
+    class _Handler(BaseHTTPRequestHandler):
+        def _tratar(self) -> None:
+            tamanho = int(self.headers.get("Content-Length") or 0)
+            corpo = self.rfile.read(tamanho) if tamanho else None
+            time.sleep(org.latencia_s())
+            status, resposta = org.atender(self.command, f"http://{host}{self.path}", corpo)
+            tipo, dados, cabecalhos = _serializar(resposta)
+            self.send_response(status)
+            self.send_header("Content-Type", tipo)
+            for nome, valor in cabecalhos.items():
+                self.send_header(nome, valor)
+            self.send_header("Content-Length", str(len(dados)))
+            self.end_headers()
+            self.wfile.write(dados)
+
+        do_GET = do_POST = do_PATCH = do_DELETE = _tratar
+
+        def log_message(self, *args: Any) -> None:
+            pass
+
+    return ThreadingHTTPServer((host, porta), _Handler)
+
+
+# ---------------------------------------------------------------------------
+# Benchmark
+# ---------------------------------------------------------------------------
+def gerar_cpf(rng: random.Random) -> str:
+    """CPF aleatório com dígitos verificadores válidos."""
+    base = [rng.randint(0, 9) for _ in range(9)]
+    for n in (10, 11):
+        dv = sum(d * p for d, p in zip(base, range(n, 1, -1))) * 10 % 11
+        base.append(0 if dv == 10 else dv)
+    return "".join(map(str, base))
+
+
+def _percentil(valores: list[float], p: float) -> float | None:
+    if not valores:
+        return None
+    ordenados = sorted(valores)
+    k = min(len(ordenados) - 1, max(0, int(round(p / 100.0 * (len(ordenados) - 1)))))
+    return round(ordenados[k], 1)
+
+
+def benchmark(
+    *,
+    n_cpfs: int = 100,
+    concorrencia: int = 8,
+    config: ConfigFake | None = None,
+    fracao_com_ranking: float = 0.3,
+    fracao_sem_ranking: float = 0.3,
+    esperar_poller_s: float = 60.0,
+) -> dict[str, Any]:
+    """
+    Executa o pipeline de ranking do diresimulator contra o fake e mede:
+    vazão, p50/p99 do pipeline, chamadas à API (fake e contador do pipeline) e,
+    para os pendentes, tempo até o poller em lote entregar o ranking.
+    """
+    import tempfile
+    from concurrent.futures import ThreadPoolExecutor
+
+    tmp = tempfile.mkdtemp(prefix="dv-bench-")
+    for k, v in {
+        "SALESFORCE_FAKE": "1",
+        "SALESFORCE_USER": "bench@fake.local",
+        "SALESFORCE_PASSWORD": "fake",
+        "DV_STORAGE_BACKEND": "sqlite",
+        "DV_SQLITE_PATH": os.path.join(tmp, "dv_local.sqlite3"),
+        "DV_RANKING_SQLITE_PATH": "off",
+        "SALESFORCE_META_CACHE_PATH": os.path.join(tmp, "sf_meta.json"),
+    }.items():
+        os.environ[k] = v
+    fake = instalar_fake(FakeSalesforce(config or ConfigFake.do_ambiente()))
+    import diresimulator as dv
+
+    rng = random.Random(fake.config.semente)
+    cpfs = [gerar_cpf(rng) for _ in range(n_cpfs)]
+    n_com = int(n_cpfs * fracao_com_ranking)
+    n_sem = int(n_cpfs * fracao_sem_ranking)
+    for cpf in cpfs[:n_com]:
+        fake.semear_conta(cpf, ranking=ranking_para_cpf(cpf))
+    for cpf in cpfs[n_com:n_com + n_sem]:
+        fake.semear_conta(cpf)
+    rng.shuffle(cpfs)
+    dv._sf_warmup_meta()
+    fake.chamadas.clear()
+
+    def _um(cpf: str) -> tuple[float, dict[str, Any]]:
+        t = time.perf_counter()
+        res = dv.classificar_ranking_cpf_pipeline(cpf, bypass_cache=True, create_if_missing=True)
+        return (time.perf_counter() - t) * 1000.0, res
+
+    t0 = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=max(1, concorrencia)) as pool:
+        resultados = list(pool.map(_um, cpfs))
+    duracao = time.perf_counter() - t0
+    latencias = [ms for ms, _ in resultados]
+    status: dict[str, int] = {}
+    for _, res in resultados:
+        status[str(res.get("status"))] = status.get(str(res.get("status")), 0) + 1
+    chamadas_cpf = [int(res.get("sf_api_calls") or 0) for _, res in resultados]
+    chamadas_pipeline = dict(fake.chamadas)
+
+    # Pendentes: acompanha pelo poller único do processo (uma SOQL em lote por ciclo).
+    pendentes = [res for _, res in resultados if res.get("status") == "pending" and res.get("account_id")]
+    poller = dv._ranking_poller()
+    notificador = dv._ranking_notificador()
+    desde = time.time()
+    t_poll = time.perf_counter()
+    for res in pendentes:
+        poller.registrar(res["account_id"], cpf=res.get("cpf"), opportunity_id=res.get("opportunity_id"))
+
+    def _esperar(res: Mapping[str, Any]) -> float | None:
+        ev = notificador.aguardar(res["account_id"], timeout=esperar_poller_s, desde=desde)
+        return (time.perf_counter() - t_poll) * 1000.0 if ev else None
+
+    with ThreadPoolExecutor(max_workers=max(1, min(64, len(pendentes) or 1))) as pool:
+        ate_ranking = list(pool.map(_esperar, pendentes))
+    resolvidos = [ms for ms in ate_ranking if ms is not None]
+
+    return {
+        "cpfs": n_cpfs,
+        "concorrencia": concorrencia,
+        "duracao_s": round(duracao, 3),
+        "vazao_cpf_s": round(n_cpfs / duracao, 2) if duracao else None,
+        "pipeline_ms": {"p50": _percentil(latencias, 50), "p99": _percentil(latencias, 99),
+                        "max": _percentil(latencias, 100)},
+        "status": status,
+        "api_por_cpf": {"media": round(sum(chamadas_cpf) / max(1, len(chamadas_cpf)), 2),
+                        "p99": _percentil([float(c) for c in chamadas_cpf], 99)},
+        "api_fake_pipeline": chamadas_pipeline,
+        "poller": {
+            "pendentes": len(pendentes),
+            "resolvidos": len(resolvidos),
+            "ate_ranking_ms": {"p50": _percentil(resolvidos, 50), "p99": _percentil(resolvidos, 99)},
+            "ciclos": poller.ciclos,
+            "consultas": poller.consultas,
+        },
+        "api_fake_total": dict(fake.chamadas),
+        "etapas": dv._RANKING_METRICAS.resumo(),
+    }
+
+
+def _main(argv: list[str] | None = None) -> int:
+    ap = argparse.ArgumentParser(description=__doc__.split("\n\n")[0].strip())
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    for nome in ("bench", "servir"):
+        p = sub.add_parser(nome)
+        p.add_argument("--latencia-ms", default="20,60", help="min,max por pedido")
+        p.add_argument("--taxa-erro", type=float, default=0.0)
+        p.add_argument("--atraso-ranking-s", type=float, default=3.0)
+        p.add_argument("--semente", type=int, default=None)
+        p.add_argument("--rotas-indisponiveis", default="", help="ex.: apex,quick_action")
+        if nome == "bench":
+            p.add_argument("--cpfs", type=int, default=100)
+            p.add_argument("--concorrencia", type=int, default=8)
+            p.add_argument("--fracao-com-ranking", type=float, default=0.3)
+            p.add_argument("--fracao-sem-ranking", type=float, default=0.3)
+            p.add_argument("--esperar-poller-s", type=float, default=60.0)
+        else:
+            p.add_argument("--host", default="127.0.0.1")
+            p.add_argument("--porta", type=int, default=8787)
+    args = ap.parse_args(argv)
+    lat = [float(x) for x in str(args.latencia_ms).split(",")]
+    config = ConfigFake(
+        latencia_ms=(lat[0], lat[-1]),
+        taxa_erro=args.taxa_erro,
+        atraso_ranking_s=args.atraso_ranking_s,
+        rotas_indisponiveis=frozenset(r for r in args.rotas_indisponiveis.split(",") if r),
+        semente=args.semente,
+    )
+    if args.cmd == "servir":
+        servidor = servir(args.host, args.porta, instalar_fake(FakeSalesforce(config)))
+        print(f"Salesforce fake em http://{args.host}:{args.porta}/services/data/v59.0/")
+        try:
+            servidor.serve_forever()
+        except KeyboardInterrupt:
+            servidor.shutdown()
+        return 0
+    relatorio = benchmark(
+        n_cpfs=args.cpfs,
+        concorrencia=args.concorrencia,
+        config=config,
+        fracao_com_ranking=args.fracao_com_ranking,
+        fracao_sem_ranking=args.fracao_sem_ranking,
+        esperar_poller_s=args.esperar_poller_s,
+    )
+    print(json.dumps(relatorio, ensure_ascii=False, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    # Corre pelo módulo importável: o pool do diresimulator faz «from salesforce_fake
+    # import …» e tem de ver o fake instalado pelo CLI, não uma segunda cópia em __main__.
+    import salesforce_fake
+
+    raise SystemExit(salesforce_fake._main())
@@ -907,10 +907,17 @@ from streamlit_gsheets import GSheetsConnection
 import base64
 from datetime import datetime, date, timedelta, timezone
 import time
+import threading
+import importlib.util
+import io
+from collections import OrderedDict, deque
 import secrets
 import string
 import locale
+import heapq
+import queue
 import smtplib
+import uuid
 from email.mime.multipart import MIMEMultipart
 from email.mime.text import MIMEText
 from email.mime.application import MIMEApplication
@@ -924,7 +931,10 @@ import altair as alt
 import urllib.parse
 import html as html_std
 import jwt as jwt_lib
-from typing import Callable
+from ranking_eventos import RankingNotificador, notificador_do_ambiente
+from typing import Callable, Iterable
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FuturesTimeoutError
 
 # Bloco [salesforce] no secrets.toml: USER / PASSWORD / TOKEN → variáveis SALESFORCE_* (mesma pasta, sem import circular)
 _SF_SECRETS_TOML_ALIAS: dict[str, str] = {
@@ -1009,11 +1019,24 @@ def _injetar_secrets_salesforce_no_env() -> None:
 # ---------------------------------------------------------------------------
 try:
     from simple_salesforce import Salesforce, SalesforceAuthenticationFailed
+    from simple_salesforce.api import SFType
 except ImportError:  # pragma: no cover
     Salesforce = None  # type: ignore[misc, assignment]
     SalesforceAuthenticationFailed = Exception  # type: ignore[misc, assignment]
+    SFType = None  # type: ignore[misc, assignment]
+
+try:
+    import requests as _sf_requests
+    from requests.adapters import HTTPAdapter as _SfHTTPAdapter
+except ImportError:  # pragma: no cover
+    _sf_requests = None  # type: ignore[assignment]
+    _SfHTTPAdapter = None  # type: ignore[misc, assignment]
 
 _sf_logger = logging.getLogger(__name__)
+# Pool de clientes (espelho de salesforce_api): um login por credencial e processo,
+# sessão HTTP keep-alive partilhada entre threads, renovação única em INVALID_SESSION_ID.
+_SF_POOL_LOCK = threading.Lock()
+_SF_POOL: dict[str, dict[str, Any]] = {}
 
 _DV_SF_RANK_MEMO_TTL_SEC = 300.0
 _DV_SF_RANK_MEMO_KEY = "_dv_sf_rank_memo_v1"
@@ -1145,6 +1168,98 @@ def _dv_sf_rank_debug_status_snapshot(
     }
 
 
+# Metadados do org (campos válidos, RecordType PF, estágios ativos) persistidos em
+# disco com TTL: describe uma vez; arranques seguintes (novo deploy/processo) não
+# repetem describe. SALESFORCE_META_CACHE_PATH / SALESFORCE_META_CACHE_TTL_S.
+_SF_META_DISCO_LOCK = threading.Lock()
+_SF_META_DISCO: dict[str, Any] = {"carregado": False, "dados": {}}
+
+
+def _sf_meta_arquivo() -> Path:
+    bruto = (os.environ.get("SALESFORCE_META_CACHE_PATH") or "").strip()
+    return Path(bruto) if bruto else Path(__file__).resolve().parent / ".sf_meta_cache.json"
+
+
+def _sf_meta_ttl_s() -> float:
+    try:
+        return max(60.0, float(os.environ.get("SALESFORCE_META_CACHE_TTL_S") or 86400))
+    except ValueError:
+        return 86400.0
+
+
+def _sf_meta_org() -> str:
+    """Metadados variam por org: chave = usuário + domínio."""
+    return "|".join(
+        (os.environ.get(k) or "").strip().lower()
+        for k in ("SALESFORCE_USER", "SALESFORCE_DOMAIN")
+    )
+
+
+def _sf_meta_disco_get(nome: str) -> Any | None:
+    with _SF_META_DISCO_LOCK:
+        if not _SF_META_DISCO["carregado"]:
+            try:
+                _SF_META_DISCO["dados"] = json.loads(_sf_meta_arquivo().read_text("utf-8"))
+            except (OSError, ValueError):
+                _SF_META_DISCO["dados"] = {}
+            _SF_META_DISCO["carregado"] = True
+        item = (_SF_META_DISCO["dados"].get(_sf_meta_org()) or {}).get(nome)
+    if not isinstance(item, dict) or time.time() - float(item.get("em") or 0) > _sf_meta_ttl_s():
+        return None
+    return item.get("valor")
+
+
+def _sf_meta_disco_put(nome: str, valor: Any) -> None:
+    with _SF_META_DISCO_LOCK:
+        org = _SF_META_DISCO["dados"].setdefault(_sf_meta_org(), {})
+        org[nome] = {"valor": valor, "em": time.time()}
+        arquivo = _sf_meta_arquivo()
+        try:
+            tmp = arquivo.with_suffix(arquivo.suffix + ".tmp")
+            tmp.write_text(json.dumps(_SF_META_DISCO["dados"], ensure_ascii=False), "utf-8")
+            os.replace(tmp, arquivo)
+        except OSError:
+            _sf_logger.warning("Metadados Salesforce: não foi possível gravar %s", arquivo)
+
+
+def _sf_meta_campos(sf: Any, sobject: str, *, forcar: bool = False) -> set[str]:
+    """Nomes de campos do sObject (describe uma vez por TTL, persistido em disco)."""
+    nome = f"campos:{sobject}"
+    cached = None if forcar else _sf_meta_disco_get(nome)
+    if cached is not None:
+        return set(cached)
+    desc = getattr(sf, sobject).describe()
+    campos = sorted(str(f.get("name")) for f in (desc.get("fields") or []) if f.get("name"))
+    _sf_meta_disco_put(nome, campos)
+    if sobject == "Opportunity":
+        stage = next((f for f in desc.get("fields") or [] if f.get("name") == "StageName"), None)
+        ativos = [
+            str(item.get("value"))
+            for item in ((stage or {}).get("picklistValues") or [])
+            if item.get("active", True) and item.get("value")
+        ]
+        _sf_meta_disco_put("estagios_ativos", ativos)
+    return set(campos)
+
+
+def _sf_meta_campos_conhecidos(sobject: str) -> set[str] | None:
+    """Campos do describe já persistido (sem rede); None se ainda não houve describe."""
+    cached = _sf_meta_disco_get(f"campos:{sobject}")
+    return set(cached) if cached is not None else None
+
+
+def _sf_meta_filtrar_campos(sobject: str, candidatos: Iterable[str]) -> list[str]:
+    """
+    Mantém só os candidatos que existem no org (todos, se o describe ainda não é
+    conhecido). Nomes de campo da API não diferenciam maiúsculas: compara casefold.
+    """
+    conhecidos = _sf_meta_campos_conhecidos(sobject)
+    if conhecidos is None:
+        return list(candidatos)
+    nomes = {c.casefold() for c in conhecidos}
+    return [c for c in candidatos if str(c).casefold() in nomes]
+
+
 _SF_RANKING_FIELDS_INVALIDOS: set[str] = set()
 
 
@@ -1158,9 +1273,11 @@ def _sf_marcar_ranking_field_invalido(field_name: str | None) -> None:
     if not fld:
         return
     _SF_RANKING_FIELDS_INVALIDOS.add(fld)
+    _sf_meta_disco_put("campos_invalidos:Account", sorted(_SF_RANKING_FIELDS_INVALIDOS))
 
 
 def _sf_ranking_field_candidates() -> list[str]:
+    _SF_RANKING_FIELDS_INVALIDOS.update(_sf_meta_disco_get("campos_invalidos:Account") or ())
     seen: set[str] = set()
     out: list[str] = []
     for raw in (
@@ -1183,6 +1300,14 @@ _DV_SF_RANK_CLASSIF_OK_CPF_KEY = "_sf_rank_classificacao_exibir_somente_cpf"
 _DV_SF_CPF11_ANTERIOR_CAMPO_KEY = "_dv_sf_cpf11_anterior_no_campo"
 # Pedido de consulta CPF→Salesforce: processado no corpo do script (para permitir barra de progresso).
 _DV_SF_CPF_RANK_LOOKUP_PENDING_KEY = "_dv_sf_cpf_rank_lookup_pending"
+# Pré-busca especulativa disparada no on_change do CPF (sem criar registos): validade do
+# resultado, threads dedicadas e espera máxima da consulta explícita por uma pré-busca em voo.
+_SF_RANK_PREFETCH_TTL_S = 120.0
+_SF_RANK_PREFETCH_MAX_WORKERS = 4
+_SF_RANK_PREFETCH_ESPERA_S = 1.5
+_SF_RANK_PREFETCH: dict[str, tuple[Future, float]] = {}
+_SF_RANK_PREFETCH_LOCK = threading.Lock()
+_SF_RANK_PREFETCH_EXECUTOR: dict[str, Any] = {"e": None}
 
 
 def _sf_ranking_progress_markup(
@@ -1219,6 +1344,109 @@ def _sf_normalizar_cpf(cpf: str | None) -> str:
     return re.sub(r"\D", "", str(cpf).strip())
 
 
+def _sf_pool_ttl_sessao_s() -> float:
+    try:
+        return max(60.0, float(os.environ.get("SALESFORCE_SESSION_TTL_S") or 6600))
+    except ValueError:
+        return 6600.0
+
+
+def _sf_pool_sessao_http() -> Any | None:
+    """requests.Session com pool de conexões dimensionado para chamadas concorrentes."""
+    if _sf_requests is None:
+        return None
+    try:
+        maxsize = max(1, int(os.environ.get("SALESFORCE_POOL_MAXSIZE") or 16))
+    except ValueError:
+        maxsize = 16
+    sessao = _sf_requests.Session()
+    adapter = _SfHTTPAdapter(pool_connections=4, pool_maxsize=maxsize)
+    sessao.mount("https://", adapter)
+    sessao.mount("http://", adapter)
+    return sessao
+
+
+def _sf_pool_login(entrada: dict[str, Any]) -> None:
+    username, password, token, domain = entrada["credenciais"]
+    kw: dict[str, Any] = {"username": username, "password": password, "domain": domain}
+    if token:
+        kw["security_token"] = token
+    if entrada.get("sessao_http") is not None:
+        kw["session"] = entrada["sessao_http"]
+    t0 = time.monotonic()
+    entrada["sf"] = Salesforce(**kw)
+    entrada["expira_em"] = time.time() + _sf_pool_ttl_sessao_s()
+    entrada["logins"] = int(entrada.get("logins") or 0) + 1
+    _sf_logger.info(
+        "Salesforce: sessão obtida para %s em %.0f ms", username, (time.monotonic() - t0) * 1000
+    )
+
+
+def _sf_pool_cliente(chave: str) -> Any:
+    """Cliente simple_salesforce atual da entrada; renova antes de expirar."""
+    entrada = _SF_POOL[chave]
+    if entrada.get("sf") is not None and time.time() < float(entrada.get("expira_em") or 0):
+        return entrada["sf"]
+    with entrada["lock"]:
+        if entrada.get("sf") is None or time.time() >= float(entrada.get("expira_em") or 0):
+            _sf_pool_login(entrada)
+        return entrada["sf"]
+
+
+def _sf_pool_renovar(chave: str, session_id_falho: str | None) -> None:
+    """Novo login só se ninguém renovou ainda (evita várias threads a logar em simultâneo)."""
+    entrada = _SF_POOL[chave]
+    with entrada["lock"]:
+        atual = getattr(entrada.get("sf"), "session_id", None)
+        if atual is None or atual == session_id_falho:
+            _sf_pool_login(entrada)
+
+
+def _sf_sessao_expirada(exc: BaseException) -> bool:
+    return type(exc).__name__ == "SalesforceExpiredSession" or "INVALID_SESSION_ID" in str(exc)
+
+
+class _SfClientePool:
+    """
+    Proxy sobre o cliente do pool: métodos que falham por sessão expirada renovam o
+    login e são repetidos uma vez; atributos simples vêm do cliente atual.
+    """
+
+    def __init__(self, chave: str, caminho: tuple[str, ...] = ()):
+        self._chave = chave
+        self._caminho = caminho
+
+    def _resolver(self) -> Any:
+        obj = _sf_pool_cliente(self._chave)
+        for nome in self._caminho:
+            obj = getattr(obj, nome)
+        return obj
+
+    def __getattr__(self, nome: str) -> Any:
+        if nome.startswith("__"):
+            raise AttributeError(nome)
+        alvo = getattr(self._resolver(), nome)
+        if SFType is not None and isinstance(alvo, SFType):
+            return _SfClientePool(self._chave, self._caminho + (nome,))
+        if not callable(alvo):
+            return alvo
+        chave = self._chave
+        pai = _SfClientePool(chave, self._caminho)
+
+        def _chamar(*args: Any, **kwargs: Any) -> Any:
+            session_id = getattr(_SF_POOL[chave].get("sf"), "session_id", None)
+            try:
+                return alvo(*args, **kwargs)
+            except Exception as exc:
+                if not _sf_sessao_expirada(exc):
+                    raise
+                _sf_logger.info("Salesforce: sessão expirada; renovando e repetindo %s.", nome)
+                _sf_pool_renovar(chave, session_id)
+                return getattr(pai._resolver(), nome)(*args, **kwargs)
+
+        return _chamar
+
+
 def _sf_conectar_salesforce(verbose: bool = False) -> Any | None:
     _injetar_secrets_salesforce_no_env()
     _sf_logger.debug("Salesforce: iniciando tentativa de conexão.")
@@ -1248,19 +1476,24 @@ def _sf_conectar_salesforce(verbose: bool = False) -> Any | None:
             _sf_logger.info("Salesforce: SALESFORCE_USER ou SALESFORCE_PASSWORD ausentes.")
         return None
 
+    cache_key = f"{username}|{domain}|{bool(token)}"
+    with _SF_POOL_LOCK:
+        entrada = _SF_POOL.get(cache_key)
+        if entrada is None or entrada["credenciais"] != (username, password, token, domain):
+            entrada = {
+                "credenciais": (username, password, token, domain),
+                "lock": threading.Lock(),
+                "sessao_http": _sf_pool_sessao_http(),
+                "sf": None,
+                "expira_em": 0.0,
+                "logins": 0,
+            }
+            _SF_POOL[cache_key] = entrada
     try:
-        if token:
-            sf = Salesforce(
-                username=username,
-                password=password,
-                security_token=token,
-                domain=domain,
-            )
-        else:
-            sf = Salesforce(username=username, password=password, domain=domain)
+        _sf_pool_cliente(cache_key)
         if verbose:
             _sf_logger.info("Salesforce: conectado como %s", username)
-        return sf
+        return _SfClientePool(cache_key)
     except SalesforceAuthenticationFailed as e:
         _sf_logger.warning("Salesforce: falha de autenticação: %s", e)
         return None
@@ -1269,6 +1502,33 @@ def _sf_conectar_salesforce(verbose: bool = False) -> Any | None:
         return None
 
 
+# ---------------------------------------------------------------------------
+# Eventos de ranking (Change Data Capture / PushTopic) — acordam quem espera
+# ---------------------------------------------------------------------------
+# Notificador, transportes CometD / fake e variáveis DV_RANKING_EVENTOS* em
+# ranking_eventos.py (partilhado pelos dois simuladores); aqui só o do processo.
+_RANKING_NOTIFICADOR: dict[str, Any] = {"n": None}
+_RANKING_NOTIFICADOR_LOCK = threading.Lock()
+
+
+def _sf_renovar_sessao(sf: Any, session_id_falho: str | None) -> None:
+    """401 em chamadas HTTP diretas (CometD, Bulk): novo login no pool por trás de ``sf``."""
+    if isinstance(sf, _SfClientePool):
+        _sf_pool_renovar(sf._chave, session_id_falho)
+
+
+def _ranking_notificador() -> RankingNotificador:
+    """Notificador do processo; liga o transporte escolhido em DV_RANKING_EVENTOS na 1.ª chamada."""
+    with _RANKING_NOTIFICADOR_LOCK:
+        if _RANKING_NOTIFICADOR["n"] is None:
+            _RANKING_NOTIFICADOR["n"] = notificador_do_ambiente(
+                mapear_ranking=_sf_mapear_ranking_para_ui,
+                conectar=lambda: _sf_conectar_salesforce(verbose=False),
+                renovar=_sf_renovar_sessao,
+            )
+        return _RANKING_NOTIFICADOR["n"]
+
+
 def _sf_mapear_ranking_para_ui(valor: Any) -> str | None:
     if valor is None:
         return None
@@ -1409,7 +1669,9 @@ def _sf_montar_payload_conta_pf_ranking(cpf_digitos: str) -> dict[str, Any]:
     email_val = f"diresimulator+{email_tag}@gmail.com"
     telefone = "219" + _sf_rand_digits_sf(8)
     record_type = (
-        os.environ.get("SALESFORCE_RECORD_TYPE_CLIENTE_PF") or _SF_RECORD_TYPE_CLIENTE_PF_PADRAO
+        os.environ.get("SALESFORCE_RECORD_TYPE_CLIENTE_PF")
+        or _sf_meta_disco_get("record_type_id")
+        or _SF_RECORD_TYPE_CLIENTE_PF_PADRAO
     ).strip()
     return {
         "RecordTypeId": record_type,
@@ -1501,15 +1763,48 @@ def _sf_criar_conta_pf_ranking(sf: Any, cpf_digitos: str) -> tuple[str | None, s
         return (None, str(e))
 
 
+# Ids por chamada do sObject Collections DELETE (limite da API).
+_SF_COLLECTIONS_MAX = 200
+
+
+def _sf_excluir_ids_em_lote(
+    sf: Any, ids: list[str], http_timeout: float, *, rotulo: str = "registos"
+) -> dict[str, bool]:
+    """
+    Apaga via sObject Collections (composite/sobjects?ids=...), até 200 Ids por chamada,
+    na ordem dada (passar filhos antes dos pais). Devolve {Id: sucesso}; falhas só logam.
+    """
+    ids = [i for i in dict.fromkeys(str(x or "").strip() for x in ids) if i]
+    out: dict[str, bool] = {}
+    for n in range(0, len(ids), _SF_COLLECTIONS_MAX):
+        fatia = ids[n : n + _SF_COLLECTIONS_MAX]
+        try:
+            resp = sf.restful(
+                "composite/sobjects",
+                params={"ids": ",".join(fatia), "allOrNone": "false"},
+                method="DELETE",
+                timeout=http_timeout,
+            )
+        except Exception as ex:
+            _sf_logger.warning("Salesforce: exclusão em lote de %s falhou: %s", rotulo, ex)
+            out.update({i: False for i in fatia})
+            continue
+        for item in resp if isinstance(resp, list) else []:
+            rid = str(item.get("id") or "").strip()
+            out[rid] = bool(item.get("success"))
+            if not item.get("success"):
+                _sf_logger.warning(
+                    "Salesforce: exclusão de %s %s falhou: %s", rotulo, rid, item.get("errors")
+                )
+    return out
+
+
 def _sf_excluir_account_criada_simulacao(sf: Any, account_id: str, http_timeout: float) -> None:
     """Remove Account criada só para leitura do ranking neste fluxo (loga falhas)."""
     aid = (account_id or "").strip()
     if not aid or not aid.startswith("001"):
         return
-    try:
-        sf.restful(f"sobjects/Account/{aid}", method="DELETE", timeout=http_timeout)
-    except Exception as ex:
-        _sf_logger.warning("Salesforce: exclusão da Account %s após simulação falhou: %s", aid, ex)
+    _sf_excluir_ids_em_lote(sf, [aid], http_timeout, rotulo="Account")
 
 
 def _sf_buscar_oportunidade_recente_da_conta(
@@ -1535,13 +1830,13 @@ def _sf_buscar_oportunidade_recente_da_conta(
     return None
 
 
-def _sf_excluir_relacionamento_comprador_da_oportunidade(
+def _sf_ids_relacionamento_comprador_da_oportunidade(
     sf: Any, opportunity_id: str, http_timeout: float
-) -> None:
-    """Remove RelacionamentoComprador__c vinculados à Opportunity (se existirem)."""
+) -> list[str]:
+    """Ids de RelacionamentoComprador__c vinculados à Opportunity (campo conforme o org)."""
     oid = (opportunity_id or "").strip()
     if not oid or not oid.startswith("006"):
-        return
+        return []
     campos_oportunidade = ("Oportunidade__c", "Opportunity__c")
     rel_ids: list[str] = []
     for campo in campos_oportunidade:
@@ -1560,29 +1855,37 @@ def _sf_excluir_relacionamento_comprador_da_oportunidade(
             break
         except Exception:
             continue
-    for rid in rel_ids:
-        try:
-            sf.restful(f"sobjects/RelacionamentoComprador__c/{rid}", method="DELETE", timeout=http_timeout)
-        except Exception as ex:
-            _sf_logger.warning(
-                "Salesforce: exclusão do RelacionamentoComprador__c %s falhou: %s",
-                rid,
-                ex,
-            )
+    return rel_ids
+
+
+def _sf_excluir_relacionamento_comprador_da_oportunidade(
+    sf: Any, opportunity_id: str, http_timeout: float
+) -> None:
+    """Remove RelacionamentoComprador__c vinculados à Opportunity (se existirem)."""
+    rel_ids = _sf_ids_relacionamento_comprador_da_oportunidade(sf, opportunity_id, http_timeout)
+    _sf_excluir_ids_em_lote(sf, rel_ids, http_timeout, rotulo="RelacionamentoComprador__c")
 
 
 def _sf_excluir_oportunidade_por_id(sf: Any, opportunity_id: str, http_timeout: float) -> None:
     oid = (opportunity_id or "").strip()
     if not oid:
         return
-    try:
-        sf.restful(f"sobjects/Opportunity/{oid}", method="DELETE", timeout=http_timeout)
-    except Exception as ex:
-        _sf_logger.warning(
-            "Salesforce: exclusão da Opportunity %s após simulação falhou: %s",
-            oid,
-            ex,
-        )
+    _sf_excluir_ids_em_lote(sf, [oid], http_timeout, rotulo="Opportunity")
+
+
+def _sf_excluir_registros_simulacao(
+    sf: Any, account_id: str, opportunity_id: str | None, http_timeout: float
+) -> dict[str, bool]:
+    """
+    Limpeza do fluxo numa só chamada de Collections, filhos primeiro:
+    RelacionamentoComprador__c → Opportunity → Account.
+    """
+    aid = (account_id or "").strip()
+    oid = (opportunity_id or "").strip()
+    ids = _sf_ids_relacionamento_comprador_da_oportunidade(sf, oid, http_timeout)
+    ids += [oid] if oid else []
+    ids += [aid] if aid.startswith("001") else []
+    return _sf_excluir_ids_em_lote(sf, ids, http_timeout, rotulo="registos da simulação")
 
 
 def _sf_excluir_oportunidade_criada_simulacao(
@@ -1612,31 +1915,60 @@ def _sf_get_ranking_account_rest(
         )
     if not campos_rank:
         campos_rank = _sf_ranking_field_candidates()
+    try:
+        _sf_meta_campos(sf, "Account")
+    except Exception:
+        pass
+    campos_rank = _sf_meta_filtrar_campos("Account", campos_rank)
     _sf_logger.debug(
         "Salesforce Account REST: lendo campo(s) de ranking. account_id=%s campos=%s timeout=%s",
         aid,
         campos_rank,
         http_timeout,
     )
-    for campo in campos_rank:
+    if not campos_rank:
+        return None
+    # Uma só SOQL com todos os candidatos válidos; o primeiro preenchido (pela ordem) vence.
+    lotes: list[list[str]] = [campos_rank]
+    while lotes:
+        campos = lotes.pop(0)
         soql = (
-            "SELECT Id, "
-            f"{campo} "
+            f"SELECT Id, {', '.join(campos)} "
             "FROM Account "
             f"WHERE Id = '{_sf_soql_escape_literal(aid)}' "
             "LIMIT 1"
         )
         try:
             rec = sf.query(soql, timeout=http_timeout)
-            recs = (rec or {}).get("records") or []
-            if not recs:
-                _sf_logger.debug(
-                    "Salesforce Account REST: query sem registros para account_id=%s campo=%s",
+        except Exception as ex:
+            if not _sf_excecao_campo_invalido_salesforce(ex):
+                _sf_logger.warning(
+                    "Salesforce Account REST: falha ao consultar account_id=%s campos=%s erro=%s",
                     aid,
-                    campo,
+                    campos,
+                    ex,
                 )
                 continue
-            row = recs[0] or {}
+            if len(campos) > 1:
+                # Sem describe disponível: descobre o campo inexistente consultando um a um.
+                lotes.extend([c] for c in campos)
+                continue
+            _sf_marcar_ranking_field_invalido(campos[0])
+            _sf_logger.warning(
+                "Salesforce Account REST: campo de ranking ignorado por inexistir no org. campo=%s",
+                campos[0],
+            )
+            continue
+        recs = (rec or {}).get("records") or []
+        if not recs:
+            _sf_logger.debug(
+                "Salesforce Account REST: query sem registros para account_id=%s campos=%s",
+                aid,
+                campos,
+            )
+            continue
+        row = recs[0] or {}
+        for campo in campos:
             val = row.get(campo)
             if val is not None and str(val).strip() != "":
                 _sf_logger.info(
@@ -1646,26 +1978,12 @@ def _sf_get_ranking_account_rest(
                     str(val).strip(),
                 )
                 return str(val).strip()
-            _sf_logger.debug(
-                "Salesforce Account REST: resposta sem ranking preenchido. account_id=%s campo=%s chaves=%s",
-                aid,
-                campo,
-                list(row.keys())[:20],
-            )
-        except Exception as ex:
-            if _sf_excecao_campo_invalido_salesforce(ex):
-                _sf_marcar_ranking_field_invalido(campo)
-                _sf_logger.warning(
-                    "Salesforce Account REST: campo de ranking ignorado por inexistir no org. campo=%s",
-                    campo,
-                )
-                continue
-            _sf_logger.warning(
-                "Salesforce Account REST: falha ao consultar account_id=%s campo=%s erro=%s",
-                aid,
-                campo,
-                ex,
-            )
+        _sf_logger.debug(
+            "Salesforce Account REST: resposta sem ranking preenchido. account_id=%s campos=%s chaves=%s",
+            aid,
+            campos,
+            list(row.keys())[:20],
+        )
     return None
 
 
@@ -1680,9 +1998,17 @@ def _sf_poll_ranking_na_account(
     progress_p: Callable[[float, str], None] | None = None,
     prog_lo: float = 0.42,
     prog_hi: float = 0.92,
+    opportunity_id: str | None = None,
+    cpf: str | None = None,
 ) -> str | None:
-    """GET sobjects/Account/<Id> em loop até rfield vir preenchido ou timeout."""
+    """
+    Espera rfield preenchido na Account até timeout. Entre consultas aguarda o
+    evento de ranking (CDC/PushTopic) em vez de dormir: acorda assim que ele chega.
+    Eventos CDC de Opportunity não trazem AccountId: a espera também casa pela
+    Opportunity (a informada ou a mais recente da conta) e pelo CPF.
+    """
     aid = account_id.strip()
+    opp_id = str(opportunity_id or "").strip() or None
     _campos_rank = (
         [
             str(x).strip()
@@ -1709,6 +2035,8 @@ def _sf_poll_ranking_na_account(
     ps = max(1.0, float(poll_sec))
     span = max(float(prog_hi) - float(prog_lo), 1e-6)
     tentativa = 0
+    notificador = _ranking_notificador()
+    t0_epoch = time.time()
     while time.monotonic() < deadline:
         tentativa += 1
         rank = _sf_get_ranking_account_rest(sf, aid, rfield, http_timeout)
@@ -1722,6 +2050,8 @@ def _sf_poll_ranking_na_account(
             if progress_p:
                 progress_p(1.0, _SF_RANK_PROGRESS_MSG_SUCESSO)
             return rank
+        if opp_id is None and notificador.ativo:
+            opp_id = _sf_buscar_oportunidade_recente_da_conta(sf, aid, http_timeout)
         elapsed = time.monotonic() - t0
         _sf_logger.debug(
             "Salesforce Poll: ranking ainda não disponível. account_id=%s tentativa=%s elapsed=%.1fs",
@@ -1739,7 +2069,27 @@ def _sf_poll_ranking_na_account(
         if now - last_log >= 15.0:
             _sf_logger.info("Salesforce: aguardando %s na Account %s…", _campos_rank, aid)
             last_log = now
-        time.sleep(max(0.5, float(poll_iv)))
+        # Com transporte de eventos ligado, a consulta REST vira rede de segurança (30 s).
+        espera = max(0.5, float(poll_iv))
+        if notificador.ativo:
+            espera = max(espera, 30.0)
+        evento = notificador.aguardar(
+            aid,
+            opp_id,
+            cpf,
+            timeout=min(espera, max(0.0, deadline - time.monotonic())),
+            desde=t0_epoch,
+        )
+        if evento and str(evento.get("ranking_raw") or "").strip():
+            _sf_logger.info(
+                "Salesforce Poll: ranking recebido por evento. account_id=%s origem=%s valor=%s",
+                aid,
+                evento.get("origem"),
+                evento.get("ranking_raw"),
+            )
+            if progress_p:
+                progress_p(1.0, _SF_RANK_PROGRESS_MSG_SUCESSO)
+            return str(evento["ranking_raw"]).strip()
     _sf_logger.warning(
         "Salesforce Poll: tempo esgotado sem ranking. account_id=%s campos=%s timeout_total=%ss tentativas=%s",
         aid,
@@ -1929,7 +2279,7 @@ def _sf_classificar_ranking_cpf_11(
         "sim" if _sf_autocriar_pf_account() else "nao",
     )
 
-    def _ranking_conta(account_id: str) -> str | None:
+    def _ranking_conta(account_id: str, opportunity_id: str | None = None) -> str | None:
         _sf_logger.info(
             "Fluxo Ranking: tentando obter ranking direto/poll na conta. account_id=%s",
             account_id,
@@ -1963,6 +2313,8 @@ def _sf_classificar_ranking_cpf_11(
             progress_p=_pp_sub,
             prog_lo=0.35,
             prog_hi=0.94,
+            opportunity_id=opportunity_id,
+            cpf=cpf,
         )
 
     opp, err = _sf_consultar_por_cpf(sf, cpf)
@@ -2014,7 +2366,9 @@ def _sf_classificar_ranking_cpf_11(
             "Fluxo Ranking: conta localizada para continuar consulta. account_id=%s",
             aid,
         )
-        bruto = _ranking_conta(aid)
+        bruto = _ranking_conta(
+            aid, str(opp.get("Id") or "").strip() or None if opp is not None else None
+        )
         if bruto:
             _sf_logger.info(
                 "Fluxo Ranking: ranking final obtido via conta existente. valor=%s",
@@ -2065,9 +2419,7 @@ def _sf_classificar_ranking_cpf_11(
                 new_aid,
             )
             opp_id_limpeza = _sf_buscar_oportunidade_recente_da_conta(sf, new_aid, http_timeout)
-            _sf_excluir_relacionamento_comprador_da_oportunidade(sf, opp_id_limpeza, http_timeout)
-            _sf_excluir_oportunidade_por_id(sf, opp_id_limpeza, http_timeout)
-            _sf_excluir_account_criada_simulacao(sf, new_aid, http_timeout)
+            _sf_excluir_registros_simulacao(sf, new_aid, opp_id_limpeza, http_timeout)
             _sf_logger.info(
                 "Fluxo Ranking: limpeza concluída para registros temporários. account_id=%s",
                 new_aid,
@@ -2105,7 +2457,12 @@ def _dv_sf_classificar_ranking_cpf_com_barra_progresso(
     _rs: str | None = None
     _code: str | None = "sem_registo"
     try:
-        _rs, _code = _sf_classificar_ranking_cpf_11(cpf11, progress=_sf_prog_cb)
+        _pre = _sf_rank_prefetch_resultado(cpf11, espera_s=_SF_RANK_PREFETCH_ESPERA_S)
+        if _pre is not None and _pre[0]:
+            _sf_logger.info("UI Ranking: resultado servido pela pré-busca. ranking=%s", _pre[0])
+            _rs, _code = _pre
+        else:
+            _rs, _code = _sf_classificar_ranking_cpf_11(cpf11, progress=_sf_prog_cb)
     except Exception as _ex:
         _sf_logger.exception("Classificação ranking Salesforce: %s", _ex)
         _rs, _code = None, "sem_registo"
@@ -2131,8 +2488,116 @@ def _dv_sf_classificar_ranking_cpf_com_barra_progresso(
     return _rs, _code
 
 
+def _sf_cpf_valido(digitos: str) -> bool:
+    if len(digitos) != 11 or not digitos.isdigit() or len(set(digitos)) == 1:
+        return False
+    soma1 = sum(int(digitos[i]) * (10 - i) for i in range(9))
+    dv1 = (soma1 * 10) % 11
+    dv1 = 0 if dv1 == 10 else dv1
+    soma2 = sum(int(digitos[i]) * (11 - i) for i in range(10))
+    dv2 = (soma2 * 10) % 11
+    dv2 = 0 if dv2 == 10 else dv2
+    return dv1 == int(digitos[9]) and dv2 == int(digitos[10])
+
+
+def _sf_consultar_ranking_existente(cpf_11: str) -> tuple[str | None, str | None]:
+    """
+    Ranking só do que já existe no Salesforce: Opportunity + Account aninhada e, sem
+    ranking aí, uma leitura da Account por CPF. Sem poll, sem criar conta (pré-busca).
+    """
+    cpf = _sf_normalizar_cpf(cpf_11)
+    if len(cpf) != 11:
+        return None, "cpf_incompleto"
+    if Salesforce is None:
+        return None, "pacote_ausente"
+    sf = _sf_conectar_salesforce(verbose=False)
+    if sf is None:
+        return None, "sem_registo"
+    opp, _err = _sf_consultar_por_cpf(sf, cpf)
+    if opp is not None:
+        texto = _sf_extrair_ranking_ui_de_opportunity(opp).get("ranking_exibir")
+        if texto:
+            return _sf_ranking_bruto_para_ui(str(texto)), None
+    aid = str((opp or {}).get("AccountId") or "").strip() or _sf_buscar_account_id_por_cpf(sf, cpf)
+    if not aid:
+        return None, "sem_registo"
+    http_timeout = max(5.0, _sf_float_env_ranking("SALESFORCE_REST_TIMEOUT", 45.0))
+    bruto = _sf_get_ranking_account_rest(sf, aid, _sf_ranking_field_candidates(), http_timeout)
+    if bruto:
+        return _sf_ranking_bruto_para_ui(bruto), None
+    return None, "sem_registo"
+
+
+def _sf_rank_prefetch_iniciar(cpf_11: str) -> tuple[Future, float] | None:
+    """Agenda a pré-busca do CPF num worker (uma viva por CPF no processo); devolve o voo."""
+    cpf = _sf_normalizar_cpf(cpf_11)
+    if not _sf_cpf_valido(cpf):
+        return None
+    agora = time.monotonic()
+    with _SF_RANK_PREFETCH_LOCK:
+        for chave, (fut, t0) in list(_SF_RANK_PREFETCH.items()):
+            if fut.done() and agora - t0 > _SF_RANK_PREFETCH_TTL_S:
+                del _SF_RANK_PREFETCH[chave]
+        if cpf in _SF_RANK_PREFETCH:
+            return _SF_RANK_PREFETCH[cpf]
+        if _SF_RANK_PREFETCH_EXECUTOR["e"] is None:
+            _SF_RANK_PREFETCH_EXECUTOR["e"] = ThreadPoolExecutor(
+                max_workers=_SF_RANK_PREFETCH_MAX_WORKERS,
+                thread_name_prefix="dv-sf-rank-prefetch",
+            )
+        try:
+            fut = _SF_RANK_PREFETCH_EXECUTOR["e"].submit(_sf_consultar_ranking_existente, cpf)
+        except RuntimeError:
+            _sf_logger.warning("Pré-busca de ranking: executor indisponível", exc_info=True)
+            return None
+        _SF_RANK_PREFETCH[cpf] = (fut, agora)
+    _sf_logger.info("Pré-busca de ranking iniciada. cpf=%s", _sf_cpf_mascarado_br(cpf))
+    return fut, agora
+
+
+def _sf_rank_prefetch_resultado(
+    cpf_11: str, *, espera_s: float = 0.0
+) -> tuple[str | None, str | None] | None:
+    """
+    (ranking, código) da pré-busca guardada na sessão, aguardando até espera_s; None se
+    não houver. O resultado é consumido: o clique seguinte volta a ler o Salesforce.
+    """
+    cpf = _sf_normalizar_cpf(cpf_11)
+    try:
+        pre = st.session_state.get("_dv_sf_prefetch_cpf")
+    except Exception:
+        pre = None
+    if not isinstance(pre, dict) or pre.get("cpf") != cpf:
+        return None
+    if time.monotonic() - float(pre.get("t0") or 0) > _SF_RANK_PREFETCH_TTL_S:
+        st.session_state.pop("_dv_sf_prefetch_cpf", None)
+        return None
+    # O worker não tem contexto de script: a sessão guarda o Future do voo e lê-o aqui.
+    try:
+        res = pre["futuro"].result(timeout=max(0.0, float(espera_s)))
+    except FuturesTimeoutError:
+        return None
+    except Exception:
+        _sf_logger.warning("Pré-busca de ranking: falha na consulta", exc_info=True)
+        res = None
+    st.session_state.pop("_dv_sf_prefetch_cpf", None)
+    return res
+
+
+def _dv_sf_cpf_prefetch_on_change() -> None:
+    """Enter/blur no CPF: com dígitos verificadores válidos, dispara a pré-busca do ranking."""
+    cpf_d = re.sub(r"\D", "", str(st.session_state.get("cpf_classificar_clientes_sf") or ""))
+    if not _sf_cpf_valido(cpf_d):
+        return
+    _injetar_secrets_salesforce_no_env()
+    voo = _sf_rank_prefetch_iniciar(cpf_d)
+    if voo is not None:
+        st.session_state["_dv_sf_prefetch_cpf"] = {"cpf": cpf_d, "t0": voo[1], "futuro": voo[0]}
+
+
 def _dv_sf_cpf_classificar_clientes_on_change() -> None:
     """Enter/blur no CPF: agenda consulta no próximo run (on_change não atualiza st.empty durante a chamada)."""
+    _dv_sf_cpf_prefetch_on_change()
     cpf_raw = st.session_state.get("cpf_classificar_clientes_sf") or ""
     cpf_d = re.sub(r"\D", "", str(cpf_raw))
     if len(cpf_d) != 11:
@@ -4044,18 +4509,80 @@ def _resolver_imagem_fundo_local(nome: str) -> Path | None:
     return None
 
 
+# Pipeline de imagens estáticas: caixa máxima em px de cada uso (2x o tamanho exibido,
+# para ecrãs densos) e qualidade WebP das fotografias.
+ASSET_LOGO_TOPO_PX = (600, 144)
+ASSET_FUNDO_PX = (1920, 1280)
+ASSET_FAVICON_PX = (64, 64)
+ASSET_PDF_LOGO_PX = (256, 256)
+ASSET_WEBP_QUALIDADE = 80
+
+
+def _asset_mime(p: Path) -> str:
+    return "image/jpeg" if p.suffix.lower() in (".jpg", ".jpeg") else "image/png"
+
+
+def _asset_reduzido(p: Path, caixa: tuple[int, int], formato: str = "webp") -> tuple[bytes, str]:
+    """
+    Redimensiona (sem ampliar) para caber em ``caixa`` e recodifica: WebP (sem perdas se a
+    origem for PNG, para o logo manter as arestas) ou PNG otimizado. Sem Pillow/WebP, ou se o
+    resultado não ficar menor, devolve o ficheiro original.
+    """
+    raw = p.read_bytes()
+    if Image is None:
+        return raw, _asset_mime(p)
+    try:
+        with Image.open(io.BytesIO(raw)) as im:
+            im.load()
+            im.thumbnail(caixa, Image.LANCZOS)
+            if im.mode not in ("RGB", "RGBA", "L", "LA"):
+                im = im.convert("RGBA")
+            out, mime = io.BytesIO(), "image/webp"
+            try:
+                if formato != "webp":
+                    raise KeyError(formato)
+                if _asset_mime(p) == "image/png":
+                    im.save(out, "WEBP", lossless=True, quality=100, method=4)
+                else:
+                    im.save(out, "WEBP", quality=ASSET_WEBP_QUALIDADE, method=6)
+            except (KeyError, OSError):
+                # Pillow compilado sem libwebp (ou PNG pedido): PNG otimizado.
+                out, mime = io.BytesIO(), "image/png"
+                im.save(out, "PNG", optimize=True)
+    except Exception:
+        _sf_logger.warning("Assets: falha ao reduzir %s; usa o original", p, exc_info=True)
+        return raw, _asset_mime(p)
+    dados = out.getvalue()
+    if len(dados) >= len(raw):
+        return raw, _asset_mime(p)
+    return dados, mime
+
+
+@st.cache_resource(max_entries=16, show_spinner=False)
+def _asset_versao(caminho: str, versao: tuple[int, int], caixa: tuple[int, int], formato: str) -> tuple[bytes, str]:
+    """
+    Bytes reduzidos e data-URL base64, codificados uma vez por processo e versão do
+    ficheiro (mtime, tamanho); os reruns só reutilizam a string.
+    """
+    dados, mime = _asset_reduzido(Path(caminho), caixa, formato)
+    return dados, f"data:{mime};base64,{base64.b64encode(dados).decode('ascii')}"
+
+
+def _asset(p: Path | None, caixa: tuple[int, int], formato: str = "webp") -> tuple[bytes, str] | None:
+    if p is None:
+        return None
+    try:
+        info = p.stat()
+        return _asset_versao(str(p), (info.st_mtime_ns, info.st_size), caixa, formato)
+    except OSError:
+        return None
+
+
 def _css_url_fundo_simulador() -> str:
-    """Imagem local (ficha Vendas RJ); senão fallback neutro."""
-    p = _resolver_imagem_fundo_local(FUNDO_CADASTRO_ARQUIVO)
-    if p and p.is_file():
-        try:
-            raw = p.read_bytes()
-            suf = p.suffix.lower()
-            mime = "image/jpeg" if suf in (".jpg", ".jpeg") else "image/png"
-            b64 = base64.b64encode(raw).decode("ascii")
-            return f"data:{mime};base64,{b64}"
-        except OSError:
-            pass
+    """Imagem local (ficha Vendas RJ) reduzida em data-URL; senão fallback neutro."""
+    asset = _asset(_resolver_imagem_fundo_local(FUNDO_CADASTRO_ARQUIVO), ASSET_FUNDO_PX)
+    if asset:
+        return asset[1]
     return (
         "https://images.unsplash.com/photo-1486406146926-c627a92ad1ab"
         "?auto=format&fit=crop&w=1920&q=80"
@@ -4076,45 +4603,26 @@ def _resolver_png_raiz(nome: str) -> Path | None:
 def _page_icon_streamlit():
     """Ícone da aba: 502.57_LOGO D_COR_V3F.png (ficha), senão favicon.png legado, senão URL."""
     p = _resolver_png_raiz(FAVICON_ARQUIVO)
-    if p is not None and Image:
+    if p is None and os.path.exists("favicon.png"):
+        p = Path("favicon.png")
+    if p is None:
+        return URL_FAVICON_RESERVA
+    asset = _asset(p, ASSET_FAVICON_PX, "png")
+    if asset and Image:
         try:
-            return Image.open(p)
-        except Exception:
-            return str(p)
-    if p is not None:
-        return str(p)
-    if os.path.exists("favicon.png") and Image:
-        try:
-            return Image.open("favicon.png")
+            return Image.open(io.BytesIO(asset[0]))
         except Exception:
             pass
-    return URL_FAVICON_RESERVA
+    return str(p)
 
 
 def _src_logo_topo_header() -> str:
-    """Logo do cabeçalho: 502.57_LOGO DIRECIONAL_V2F-01.png em data-URL; senão legado; senão URL."""
+    """Logo do cabeçalho: 502.57_LOGO DIRECIONAL_V2F-01.png reduzido em data-URL; senão legado; senão URL."""
     p = _resolver_png_raiz(LOGO_TOPO_ARQUIVO)
-    if p and p.is_file():
-        try:
-            suf = p.suffix.lower()
-            mime = (
-                "image/png"
-                if suf == ".png"
-                else "image/jpeg"
-                if suf in (".jpg", ".jpeg")
-                else "image/png"
-            )
-            b64 = base64.b64encode(p.read_bytes()).decode("ascii")
-            return f"data:{mime};base64,{b64}"
-        except OSError:
-            pass
-    if os.path.exists("favicon.png"):
-        try:
-            with open("favicon.png", "rb") as f:
-                return f"data:image/png;base64,{base64.b64encode(f.read()).decode()}"
-        except OSError:
-            pass
-    return URL_LOGO_DIRECIONAL_BIG
+    if p is None and os.path.exists("favicon.png"):
+        p = Path("favicon.png")
+    asset = _asset(p, ASSET_LOGO_TOPO_PX)
+    return asset[1] if asset else URL_LOGO_DIRECIONAL_BIG
 
 
 def configurar_layout():
@@ -6631,226 +7139,436 @@ def _html_cartao_resumo_secao(titulo: str, corpo_html: str) -> str:
     )
 
 
+# Cache dos bytes do PDF de resumo: o mesmo resumo sai para download, e-mail do cliente e
+# e-mail do corretor. Chave = sha256 dos campos de «d» que o PDF lê + volta ao caixa +
+# versão do modelo + data do dia (usada quando d não traz data_simulacao).
+# Subir _PDF_RESUMO_VERSAO sempre que o layout ou os textos do PDF mudarem.
+_PDF_RESUMO_VERSAO = "resumo-v2"
+_PDF_RESUMO_CAMPOS = (
+    "nome", "cpf", "renda", "ranking", "politica", "imovel_valor", "outros_descontos",
+    "outros_descontos_motivo", "empreendimento_nome", "unidade_id", "unid_entrega", "unid_area",
+    "unid_tipo", "unid_endereco", "unid_bairro", "finan_usado", "prazo_financiamento",
+    "sistema_amortizacao", "parcela_financiamento", "fgts_sub_usado", "ps_usado", "ps_parcelas",
+    "ps_mensal", "ato_final", "ato_30", "ato_60", "ato_90", "entrada_total", "corretor_nome",
+    "data_simulacao",
+)
+_PDF_CACHE_MAX_BYTES = 32 * 1024 * 1024
+
+
+class _CacheBytesLRU:
+    """LRU em processo limitado pelo total de bytes guardados (não pelo número de entradas)."""
+
+    def __init__(self, max_bytes: int) -> None:
+        self.max_bytes = max(1, int(max_bytes))
+        self._itens: "OrderedDict[str, bytes]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, chave: str) -> bytes | None:
+        with self._lock:
+            valor = self._itens.get(chave)
+            if valor is None:
+                self.misses += 1
+                return None
+            self._itens.move_to_end(chave)
+            self.hits += 1
+            return valor
+
+    def put(self, chave: str, valor: bytes) -> None:
+        if len(valor) > self.max_bytes:
+            return
+        with self._lock:
+            antigo = self._itens.pop(chave, None)
+            if antigo is not None:
+                self.bytes -= len(antigo)
+            self._itens[chave] = valor
+            self.bytes += len(valor)
+            while self.bytes > self.max_bytes:
+                _, saiu = self._itens.popitem(last=False)
+                self.bytes -= len(saiu)
+
+
+_PDF_RESUMO_CACHE = _CacheBytesLRU(_PDF_CACHE_MAX_BYTES)
+
+
+def _pdf_resumo_chave(d, volta_caixa_val) -> str:
+    try:
+        vc = round(max(0.0, float(volta_caixa_val or 0)), 2)
+    except (TypeError, ValueError):
+        vc = 0.0
+    base = {
+        "campos": {k: d.get(k) for k in _PDF_RESUMO_CAMPOS},
+        "vc": vc,
+        "versao": _PDF_RESUMO_VERSAO,
+        "dia": date.today().isoformat(),
+    }
+    bruto = json.dumps(base, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(bruto.encode("utf-8")).hexdigest()
+
+
 def gerar_resumo_pdf(d, volta_caixa_val: float = 0.0):
+    """Bytes do PDF de resumo, servidos do cache quando o mesmo resumo já foi gerado."""
     if not PDF_ENABLED:
         return None
+    chave = _pdf_resumo_chave(d, volta_caixa_val)
+    pdf_bytes = _PDF_RESUMO_CACHE.get(chave)
+    if pdf_bytes is None:
+        pdf_bytes = _gerar_resumo_pdf_fpdf(d, volta_caixa_val)
+        if pdf_bytes:
+            _PDF_RESUMO_CACHE.put(chave, pdf_bytes)
+    return pdf_bytes
+
+
+# Recursos estáticos do resumo (cores convertidas, bytes do logo), montados uma vez por
+# processo: gerar um resumo só preenche o texto variável sobre esse «molde».
+_PDF_RECURSOS: dict[str, Any] = {}
+_PDF_RECURSOS_LOCK = threading.Lock()
+# Reemissão em lote: resumos por tarefa enviada ao pool de processos.
+_PDF_LOTE_BLOCO = 64
+
+
+def _pdf_recursos() -> dict[str, Any]:
+    with _PDF_RECURSOS_LOCK:
+        if not _PDF_RECURSOS:
+            caminho = None
+            _p_fav = _resolver_png_raiz(FAVICON_ARQUIVO)
+            if _p_fav and _p_fav.is_file():
+                caminho = str(_p_fav)
+            elif os.path.exists("favicon.png"):
+                caminho = "favicon.png"
+            logo = None
+            if caminho:
+                try:
+                    logo = _asset_reduzido(Path(caminho), ASSET_PDF_LOGO_PX, "png")[0]
+                except OSError:
+                    logo = None
+            _PDF_RECURSOS.update(
+                {
+                    "azul": _hex_para_rgb_uint8(COR_AZUL_ESC),
+                    "vermelho": (227, 6, 19),
+                    "branco": (255, 255, 255),
+                    "logo_caminho": caminho,
+                    "logo_bytes": logo,
+                }
+            )
+        return _PDF_RECURSOS
 
-    try:
+
+def _pdf_logo(pdf, rec: dict[str, Any]) -> None:
+    """Logo a partir dos bytes em memória (fpdf2); PyFPDF 1.x só aceita caminho e cai para ele."""
+    if rec.get("logo_bytes"):
         try:
-            vc_apl = max(0.0, float(volta_caixa_val or 0))
-        except (TypeError, ValueError):
-            vc_apl = 0.0
-        v_total = max(0.0, float(d.get("imovel_valor", 0) or 0))
+            pdf.image(io.BytesIO(rec["logo_bytes"]), pdf.l_margin, 8, 10)
+            return
+        except Exception:
+            rec["logo_bytes"] = None
+    if rec.get("logo_caminho"):
         try:
-            outros_pdf = max(0.0, float(d.get("outros_descontos", 0) or 0))
-        except (TypeError, ValueError):
-            outros_pdf = 0.0
-        v_prop = max(0.0, v_total - vc_apl - outros_pdf)
-        _pol_pdf = str(d.get("politica", "Direcional") or "Direcional").strip()
-        _pol_pdf_label = "Emcash" if _politica_emcash(_pol_pdf) else "Direcional"
-
-        pdf = FPDF()
-        pdf.add_page()
+            pdf.image(rec["logo_caminho"], pdf.l_margin, 8, 10)
+        except Exception:
+            pass
 
-        # Margens
-        pdf.set_margins(12, 12, 12)
-        pdf.set_auto_page_break(auto=True, margin=12)
 
-        largura_util = pdf.w - pdf.l_margin - pdf.r_margin
+def _pdf_novo_documento():
+    pdf = FPDF()
+    pdf.set_margins(12, 12, 12)
+    pdf.set_auto_page_break(auto=True, margin=12)
+    return pdf
 
-        AZUL = _hex_para_rgb_uint8(COR_AZUL_ESC)
-        VERMELHO = (227, 6, 19)
-        BRANCO = (255, 255, 255)
-        FUNDO_SECAO = (248, 250, 252)
 
-        # Barra superior
-        pdf.set_fill_color(*AZUL)
-        pdf.rect(0, 0, pdf.w, 3, 'F')
-
-        # Logo (mesmo ficheiro do favicon da página)
-        _ico_pdf = None
-        _p_fav = _resolver_png_raiz(FAVICON_ARQUIVO)
-        if _p_fav and _p_fav.is_file():
-            _ico_pdf = str(_p_fav)
-        elif os.path.exists("favicon.png"):
-            _ico_pdf = "favicon.png"
-        if _ico_pdf:
-            try:
-                pdf.image(_ico_pdf, pdf.l_margin, 8, 10)
-            except Exception:
-                pass
+def _pdf_bytes(pdf) -> bytes:
+    # PyFPDF: output(dest="S") devolve str; fpdf2 pode devolver bytes. Latin-1 é o esperado pelo PDF bruto.
+    out = pdf.output(dest="S")
+    if isinstance(out, (bytes, bytearray)):
+        return bytes(out)
+    return out.encode("latin-1", errors="replace")
 
-        # Título
-        pdf.ln(8)
-        pdf.set_text_color(*AZUL)
-        _nome_topo_pdf = (d.get("nome") or "").strip()
-        if _nome_topo_pdf:
-            pdf.set_font("Helvetica", 'B', 12)
-            pdf.cell(0, 6, _pdf_text_seguro(_nome_topo_pdf), ln=True, align='C')
-            pdf.ln(2)
-        pdf.set_font("Helvetica", 'B', 20)
-        pdf.cell(0, 10, _pdf_text_seguro("Resumo da simulação - Direcional"), ln=True, align='C')
-
-        pdf.set_font("Helvetica", '', 9)
-        pdf.cell(0, 5, _pdf_text_seguro("Simulador imobiliário Direcional"), ln=True, align='C')
-        pdf.ln(6)
-
-        # Helpers
-        def secao(titulo):
-            pdf.set_fill_color(*AZUL)
-            pdf.set_text_color(*BRANCO)
-            pdf.set_font("Helvetica", 'B', 10)
-            pdf.cell(largura_util, 7, _pdf_text_seguro(f"  {titulo}"), ln=True, fill=True)
-            pdf.ln(2)
-
-        def linha(label, valor, destaque=False):
-            label = _pdf_text_seguro(label)
-            valor = _pdf_text_seguro(valor)
-            pdf.set_text_color(*AZUL)
-            pdf.set_font("Helvetica", '', 10)
-            pdf.cell(largura_util * 0.6, 6, label)
-
-            if destaque:
-                pdf.set_text_color(*VERMELHO)
-                pdf.set_font("Helvetica", 'B', 10)
-            else:
-                pdf.set_font("Helvetica", 'B', 10)
-
-            pdf.cell(largura_util * 0.4, 6, valor, ln=True, align='R')
-            pdf.set_draw_color(235, 238, 242)
-            pdf.line(pdf.l_margin, pdf.get_y(), pdf.l_margin + largura_util, pdf.get_y())
-
-        # ===============================
-        # CONTEÚDO (alinhado ao texto WhatsApp / resumo na tela)
-        # ===============================
-        secao("Renda")
-        linha("Renda familiar total", f"R$ {fmt_br(d.get('renda', 0))}")
-        _cpf_pdf_d = re.sub(r"\D", "", str(d.get("cpf") or ""))
-        if len(_cpf_pdf_d) == 11:
-            linha("CPF", _sf_cpf_mascarado_br(_cpf_pdf_d))
-        elif str(d.get("cpf") or "").strip():
-            linha("CPF", _pdf_text_seguro(str(d.get("cpf") or "").strip()))
-        _rank_pdf_s = str(d.get("ranking") or "").strip()
-        if _rank_pdf_s:
-            linha("Ranking do cliente", _pdf_text_seguro(_rank_pdf_s))
 
+def _pdf_desenhar_resumo(pdf, d, volta_caixa_val: float = 0.0) -> None:
+    """Desenha um resumo a partir da página corrente de «pdf» (pode haver vários por documento)."""
+    rec = _pdf_recursos()
+    try:
+        vc_apl = max(0.0, float(volta_caixa_val or 0))
+    except (TypeError, ValueError):
+        vc_apl = 0.0
+    v_total = max(0.0, float(d.get("imovel_valor", 0) or 0))
+    try:
+        outros_pdf = max(0.0, float(d.get("outros_descontos", 0) or 0))
+    except (TypeError, ValueError):
+        outros_pdf = 0.0
+    v_prop = max(0.0, v_total - vc_apl - outros_pdf)
+    _pol_pdf = str(d.get("politica", "Direcional") or "Direcional").strip()
+    _pol_pdf_label = "Emcash" if _politica_emcash(_pol_pdf) else "Direcional"
+
+    largura_util = pdf.w - pdf.l_margin - pdf.r_margin
+
+    AZUL = rec["azul"]
+    VERMELHO = rec["vermelho"]
+    BRANCO = rec["branco"]
+
+    # Barra superior; o título começa na margem superior em todas as páginas do documento.
+    pdf.set_y(pdf.t_margin)
+    pdf.set_fill_color(*AZUL)
+    pdf.rect(0, 0, pdf.w, 3, 'F')
+
+    # Logo (mesmo ficheiro do favicon da página)
+    _pdf_logo(pdf, rec)
+
+    # Título
+    pdf.ln(8)
+    pdf.set_text_color(*AZUL)
+    _nome_topo_pdf = (d.get("nome") or "").strip()
+    if _nome_topo_pdf:
+        pdf.set_font("Helvetica", 'B', 12)
+        pdf.cell(0, 6, _pdf_text_seguro(_nome_topo_pdf), ln=True, align='C')
         pdf.ln(2)
-        secao("Dados do imóvel")
-        linha("Empreendimento", _pdf_text_seguro(d.get("empreendimento_nome")))
-        linha("Unidade", _pdf_text_seguro(d.get("unidade_id")))
-        linha("Valor de venda (lista)", f"R$ {fmt_br(v_total)}", True)
-        _desc_pdf = vc_apl + outros_pdf
-        if _desc_pdf > 0.009:
-            linha("Descontos Concedidos", f"R$ {fmt_br(_desc_pdf)}")
-        _mot_pdf = str(d.get("outros_descontos_motivo") or "").strip()
-        if outros_pdf > 0.009 and _mot_pdf:
-            pdf.set_font("Helvetica", "", 9)
-            pdf.set_text_color(70, 80, 95)
-            pdf.multi_cell(
-                largura_util,
-                4,
-                _pdf_text_seguro(f"Origem dos outros descontos: {_mot_pdf}"),
-                ln=True,
-            )
-            pdf.ln(1)
-            pdf.set_text_color(*AZUL)
-        linha("Valor final da unidade", f"R$ {fmt_br(v_prop)}", True)
-        if d.get("unid_entrega"):
-            linha("Previsão de entrega", _pdf_text_seguro(d.get("unid_entrega")))
-        if d.get("unid_area"):
-            linha("Área privativa", _pdf_text_seguro(f"{d.get('unid_area')} m²"))
-        if d.get("unid_tipo"):
-            linha("Tipologia", _pdf_text_seguro(d.get("unid_tipo")))
-        if d.get("unid_endereco") and d.get("unid_bairro"):
-            linha(
-                "Localização",
-                _pdf_text_seguro(f"{d.get('unid_endereco')} - {d.get('unid_bairro')}"),
-            )
+    pdf.set_font("Helvetica", 'B', 20)
+    pdf.cell(0, 10, _pdf_text_seguro("Resumo da simulação - Direcional"), ln=True, align='C')
 
-        pdf.ln(2)
-        secao("Financiamento")
-        linha("Financiamento utilizado", f"R$ {fmt_br(d.get('finan_usado', 0))}")
-        prazo = d.get('prazo_financiamento', 420)
-        linha(
-            "Sistema de amortização e prazo",
-            f"{nome_sistema_amortizacao_completo(str(d.get('sistema_amortizacao', 'SAC')))} - {prazo} meses",
-        )
-        linha("Parcela estimada do financiamento", f"R$ {fmt_br(d.get('parcela_financiamento', 0))}")
-        linha("FGTS + subsídio", f"R$ {fmt_br(d.get('fgts_sub_usado', 0))}")
+    pdf.set_font("Helvetica", '', 9)
+    pdf.cell(0, 5, _pdf_text_seguro("Simulador imobiliário Direcional"), ln=True, align='C')
+    pdf.ln(6)
 
+    # Helpers
+    def secao(titulo):
+        pdf.set_fill_color(*AZUL)
+        pdf.set_text_color(*BRANCO)
+        pdf.set_font("Helvetica", 'B', 10)
+        pdf.cell(largura_util, 7, _pdf_text_seguro(f"  {titulo}"), ln=True, fill=True)
         pdf.ln(2)
-        secao("Entrada e Pro Soluto")
-        if _politica_emcash(d.get("politica")):
-            linha(
-                "Política de Pro Soluto",
-                _pdf_text_seguro(f"{_pol_pdf_label} ({_EMCASH_NOTA_PARCELAS})"),
-            )
-        else:
-            linha("Política de Pro Soluto", _pdf_text_seguro(_pol_pdf_label))
-        linha("Pro Soluto (valor)", f"R$ {fmt_br(d.get('ps_usado', 0))}")
-        linha("Número de parcelas do Pro Soluto", _pdf_text_seguro(d.get("ps_parcelas")))
-        linha("Mensalidade do Pro Soluto", f"R$ {fmt_br(d.get('ps_mensal', 0))}")
-        linha("Ato 1 (Entrada Imediata)", f"R$ {fmt_br(d.get('ato_final', 0))}")
-        if _politica_emcash(d.get("politica")):
-            linha("Ato 30", f"R$ {fmt_br(d.get('ato_30', 0))}")
-            linha("Ato 60", f"R$ {fmt_br(d.get('ato_60', 0))}")
+
+    def linha(label, valor, destaque=False):
+        label = _pdf_text_seguro(label)
+        valor = _pdf_text_seguro(valor)
+        pdf.set_text_color(*AZUL)
+        pdf.set_font("Helvetica", '', 10)
+        pdf.cell(largura_util * 0.6, 6, label)
+
+        if destaque:
+            pdf.set_text_color(*VERMELHO)
+            pdf.set_font("Helvetica", 'B', 10)
         else:
-            linha("Ato 30", f"R$ {fmt_br(d.get('ato_30', 0))}")
-            linha("Ato 60", f"R$ {fmt_br(d.get('ato_60', 0))}")
-            linha("Ato 90", f"R$ {fmt_br(d.get('ato_90', 0))}")
-        _ent_ps = float(d.get('entrada_total', 0) or 0) + float(d.get('ps_usado', 0) or 0)
-        linha("Entrada total (atos e Pro Soluto)", f"R$ {fmt_br(_ent_ps)}", True)
-
-        # ===============================
-        # RODAPÉ (DADOS CORRETOR)
-        # ===============================
-        pdf.ln(4)
-
-        cn = (d.get("corretor_nome") or "").strip()
-        if cn:
-            pdf.set_font("Helvetica", 'B', 9)
-            pdf.set_text_color(*AZUL)
-            pdf.cell(0, 5, _pdf_text_seguro("Consultor"), ln=True, align='L')
             pdf.set_font("Helvetica", 'B', 10)
-            pdf.cell(0, 6, _pdf_text_seguro(cn), ln=True)
 
-        pdf.ln(2)
-
-        # Aviso Legal e Data
-        pdf.set_font("Helvetica", 'I', 7)
-        pdf.set_text_color(100, 100, 100)
-        pdf.cell(
-            0,
+        pdf.cell(largura_util * 0.4, 6, valor, ln=True, align='R')
+        pdf.set_draw_color(235, 238, 242)
+        pdf.line(pdf.l_margin, pdf.get_y(), pdf.l_margin + largura_util, pdf.get_y())
+
+    # ===============================
+    # CONTEÚDO (alinhado ao texto WhatsApp / resumo na tela)
+    # ===============================
+    secao("Renda")
+    linha("Renda familiar total", f"R$ {fmt_br(d.get('renda', 0))}")
+    _cpf_pdf_d = re.sub(r"\D", "", str(d.get("cpf") or ""))
+    if len(_cpf_pdf_d) == 11:
+        linha("CPF", _sf_cpf_mascarado_br(_cpf_pdf_d))
+    elif str(d.get("cpf") or "").strip():
+        linha("CPF", _pdf_text_seguro(str(d.get("cpf") or "").strip()))
+    _rank_pdf_s = str(d.get("ranking") or "").strip()
+    if _rank_pdf_s:
+        linha("Ranking do cliente", _pdf_text_seguro(_rank_pdf_s))
+
+    pdf.ln(2)
+    secao("Dados do imóvel")
+    linha("Empreendimento", _pdf_text_seguro(d.get("empreendimento_nome")))
+    linha("Unidade", _pdf_text_seguro(d.get("unidade_id")))
+    linha("Valor de venda (lista)", f"R$ {fmt_br(v_total)}", True)
+    _desc_pdf = vc_apl + outros_pdf
+    if _desc_pdf > 0.009:
+        linha("Descontos Concedidos", f"R$ {fmt_br(_desc_pdf)}")
+    _mot_pdf = str(d.get("outros_descontos_motivo") or "").strip()
+    if outros_pdf > 0.009 and _mot_pdf:
+        pdf.set_font("Helvetica", "", 9)
+        pdf.set_text_color(70, 80, 95)
+        pdf.multi_cell(
+            largura_util,
             4,
-            _pdf_text_seguro(
-                f"Simulação em {d.get('data_simulacao', date.today().strftime('%d/%m/%Y'))}. "
-                "Sujeito a análise de crédito e alteração de tabela sem aviso prévio."
-            ),
+            _pdf_text_seguro(f"Origem dos outros descontos: {_mot_pdf}"),
             ln=True,
-            align='C'
         )
-        pdf.cell(0, 4, _pdf_text_seguro("Direcional Engenharia - Rio de Janeiro"), ln=True, align='C')
+        pdf.ln(1)
+        pdf.set_text_color(*AZUL)
+    linha("Valor final da unidade", f"R$ {fmt_br(v_prop)}", True)
+    if d.get("unid_entrega"):
+        linha("Previsão de entrega", _pdf_text_seguro(d.get("unid_entrega")))
+    if d.get("unid_area"):
+        linha("Área privativa", _pdf_text_seguro(f"{d.get('unid_area')} m²"))
+    if d.get("unid_tipo"):
+        linha("Tipologia", _pdf_text_seguro(d.get("unid_tipo")))
+    if d.get("unid_endereco") and d.get("unid_bairro"):
+        linha(
+            "Localização",
+            _pdf_text_seguro(f"{d.get('unid_endereco')} - {d.get('unid_bairro')}"),
+        )
 
-        # PyFPDF: output(dest="S") devolve str; fpdf2 pode devolver bytes. Latin-1 é o esperado pelo PDF bruto.
-        out = pdf.output(dest="S")
-        if isinstance(out, (bytes, bytearray)):
-            return bytes(out)
-        return out.encode("latin-1", errors="replace")
+    pdf.ln(2)
+    secao("Financiamento")
+    linha("Financiamento utilizado", f"R$ {fmt_br(d.get('finan_usado', 0))}")
+    prazo = d.get('prazo_financiamento', 420)
+    linha(
+        "Sistema de amortização e prazo",
+        f"{nome_sistema_amortizacao_completo(str(d.get('sistema_amortizacao', 'SAC')))} - {prazo} meses",
+    )
+    linha("Parcela estimada do financiamento", f"R$ {fmt_br(d.get('parcela_financiamento', 0))}")
+    linha("FGTS + subsídio", f"R$ {fmt_br(d.get('fgts_sub_usado', 0))}")
 
+    pdf.ln(2)
+    secao("Entrada e Pro Soluto")
+    if _politica_emcash(d.get("politica")):
+        linha(
+            "Política de Pro Soluto",
+            _pdf_text_seguro(f"{_pol_pdf_label} ({_EMCASH_NOTA_PARCELAS})"),
+        )
+    else:
+        linha("Política de Pro Soluto", _pdf_text_seguro(_pol_pdf_label))
+    linha("Pro Soluto (valor)", f"R$ {fmt_br(d.get('ps_usado', 0))}")
+    linha("Número de parcelas do Pro Soluto", _pdf_text_seguro(d.get("ps_parcelas")))
+    linha("Mensalidade do Pro Soluto", f"R$ {fmt_br(d.get('ps_mensal', 0))}")
+    linha("Ato 1 (Entrada Imediata)", f"R$ {fmt_br(d.get('ato_final', 0))}")
+    if _politica_emcash(d.get("politica")):
+        linha("Ato 30", f"R$ {fmt_br(d.get('ato_30', 0))}")
+        linha("Ato 60", f"R$ {fmt_br(d.get('ato_60', 0))}")
+    else:
+        linha("Ato 30", f"R$ {fmt_br(d.get('ato_30', 0))}")
+        linha("Ato 60", f"R$ {fmt_br(d.get('ato_60', 0))}")
+        linha("Ato 90", f"R$ {fmt_br(d.get('ato_90', 0))}")
+    _ent_ps = float(d.get('entrada_total', 0) or 0) + float(d.get('ps_usado', 0) or 0)
+    linha("Entrada total (atos e Pro Soluto)", f"R$ {fmt_br(_ent_ps)}", True)
+
+    # ===============================
+    # RODAPÉ (DADOS CORRETOR)
+    # ===============================
+    pdf.ln(4)
+
+    cn = (d.get("corretor_nome") or "").strip()
+    if cn:
+        pdf.set_font("Helvetica", 'B', 9)
+        pdf.set_text_color(*AZUL)
+        pdf.cell(0, 5, _pdf_text_seguro("Consultor"), ln=True, align='L')
+        pdf.set_font("Helvetica", 'B', 10)
+        pdf.cell(0, 6, _pdf_text_seguro(cn), ln=True)
+
+    pdf.ln(2)
+
+    # Aviso Legal e Data
+    pdf.set_font("Helvetica", 'I', 7)
+    pdf.set_text_color(100, 100, 100)
+    pdf.cell(
+        0,
+        4,
+        _pdf_text_seguro(
+            f"Simulação em {d.get('data_simulacao', date.today().strftime('%d/%m/%Y'))}. "
+            "Sujeito a análise de crédito e alteração de tabela sem aviso prévio."
+        ),
+        ln=True,
+        align='C'
+    )
+    pdf.cell(0, 4, _pdf_text_seguro("Direcional Engenharia - Rio de Janeiro"), ln=True, align='C')
+
+
+def _gerar_resumo_pdf_fpdf(d, volta_caixa_val: float = 0.0):
+    try:
+        pdf = _pdf_novo_documento()
+        pdf.add_page()
+        _pdf_desenhar_resumo(pdf, d, volta_caixa_val)
+        return _pdf_bytes(pdf)
     except Exception:
         logging.getLogger(__name__).exception("Falha em gerar_resumo_pdf")
         return None
 
-def enviar_email_smtp(destinatario, nome_cliente, pdf_bytes, dados_cliente, tipo='cliente'):
-    if "email" not in st.secrets: return False, "Configuracoes de e-mail nao encontradas."
-    import urllib.parse
-    
+
+def _pdf_lote_renderizar(itens: list[tuple[dict, float]], mesclar: bool):
+    """Tarefa do lote (roda no processo filho): PDFs separados ou um documento com todos."""
+    if not mesclar:
+        return [_gerar_resumo_pdf_fpdf(d, vc) for d, vc in itens]
+    pdf = _pdf_novo_documento()
+    for d, vc in itens:
+        pdf.add_page()
+        _pdf_desenhar_resumo(pdf, d, vc)
+    return _pdf_bytes(pdf)
+
+
+def _pdf_concatenar(partes: list[bytes]) -> bytes:
+    from pypdf import PdfReader, PdfWriter
+
+    escritor = PdfWriter()
+    for parte in partes:
+        escritor.append(PdfReader(io.BytesIO(parte)))
+    buf = io.BytesIO()
+    escritor.write(buf)
+    return buf.getvalue()
+
+
+def gerar_resumos_pdf_lote(
+    simulacoes: list,
+    *,
+    mesclar: bool = False,
+    processos: int | None = None,
+    tamanho_bloco: int = _PDF_LOTE_BLOCO,
+):
+    """
+    Reemissão em massa de resumos. Cada item é «d» (volta ao caixa lida de
+    volta_caixa_aplicado) ou (d, volta_caixa_val). Sem mesclar devolve a lista de bytes
+    (None nos que falharem); com mesclar, um único PDF com todos os resumos, em ordem.
+
+    Blocos de tamanho_bloco vão para um ProcessPoolExecutor com contexto «spawn»
+    (processos=1 roda no próprio processo): os filhos importam este módulo pelo nome
+    (pdf_lote.renderizar) em vez de herdar por fork as threads do servidor. O PDF mesclado
+    em paralelo junta os blocos com pypdf; sem pypdf instalado, é desenhado num só
+    documento neste processo.
+
+    Ponto de entrada para scripts e jobs de reemissão (ex.: python -c "import
+    diresimulator as dv; dv.gerar_resumos_pdf_lote(...)"); não chamar a partir de uma
+    sessão Streamlit, onde cada filho teria de reimportar o app inteiro.
+    """
+    itens: list[tuple[dict, float]] = []
+    for item in simulacoes:
+        d, vc = item if isinstance(item, tuple) else (item, item.get("volta_caixa_aplicado"))
+        try:
+            vc = float(vc or 0)
+        except (TypeError, ValueError):
+            vc = 0.0
+        itens.append((dict(d), vc))
+    if not PDF_ENABLED or not itens:
+        return None if mesclar else [None] * len(itens)
+    bloco = max(1, int(tamanho_bloco))
+    if mesclar and importlib.util.find_spec("pypdf") is None:
+        bloco = len(itens)
+    blocos = [itens[i : i + bloco] for i in range(0, len(itens), bloco)]
     try:
-        smtp_server = st.secrets["email"]["smtp_server"].strip()
-        smtp_port = int(st.secrets["email"]["smtp_port"])
-        sender_email = st.secrets["email"]["sender_email"].strip()
-        sender_password = st.secrets["email"]["sender_password"].strip().replace(" ", "")
-    except Exception as e: return False, f"Erro config: {e}"
+        if len(blocos) == 1 or processos == 1:
+            partes = [_pdf_lote_renderizar(b, mesclar) for b in blocos]
+        else:
+            import multiprocessing
+
+            from pdf_lote import renderizar
+
+            # __name__ é «__main__» quando o app corre como script; os filhos importam pelo ficheiro.
+            modulo = Path(__file__).stem
+            with ProcessPoolExecutor(
+                max_workers=processos or os.cpu_count(),
+                mp_context=multiprocessing.get_context("spawn"),
+            ) as pool:
+                partes = list(
+                    pool.map(
+                        renderizar,
+                        [modulo] * len(blocos),
+                        blocos,
+                        [mesclar] * len(blocos),
+                    )
+                )
+    except Exception:
+        logging.getLogger(__name__).exception("Falha na geração de resumos PDF em lote")
+        return None if mesclar else [None] * len(itens)
+    if not mesclar:
+        return [pdf for parte in partes for pdf in parte]
+    return partes[0] if len(partes) == 1 else _pdf_concatenar(partes)
+
+
+def _email_montar_mensagem(destinatario, nome_cliente, pdf_bytes, dados_cliente, tipo, sender_email):
+    import urllib.parse
 
     msg = MIMEMultipart('alternative')
     msg['From'] = sender_email; msg['To'] = destinatario
@@ -7128,13 +7846,326 @@ def enviar_email_smtp(destinatario, nome_cliente, pdf_bytes, dados_cliente, tipo
         part = MIMEApplication(pdf_bytes, Name=_pdf_name)
         part['Content-Disposition'] = f'attachment; filename="{_pdf_name}"'
         msg.attach(part)
+    return msg
+
+
+# Fila de e-mail SMTP (thread dedicado): tentativas por mensagem, backoff base entre elas,
+# timeout de socket, sessão ociosa antes de fechar e estados/dead letter mantidos em memória.
+EMAIL_OUTBOX_TENTATIVAS = 4
+EMAIL_OUTBOX_BACKOFF_S = 2.0
+EMAIL_OUTBOX_TIMEOUT_S = 30.0
+EMAIL_OUTBOX_SESSAO_OCIOSA_S = 120.0
+EMAIL_OUTBOX_ESTADOS_MAX = 500
+EMAIL_OUTBOX_DEAD_LETTER_MAX = 100
+
+
+def _email_config_smtp() -> tuple[dict[str, Any] | None, str]:
+    """Lê ``[email]`` dos secrets no thread do script; o worker da fila recebe uma cópia."""
+    if "email" not in st.secrets:
+        return None, "Configuracoes de e-mail nao encontradas."
     try:
-        server = smtplib.SMTP(smtp_server, smtp_port); server.ehlo(); server.starttls(); server.ehlo()
-        server.login(sender_email, sender_password); server.sendmail(sender_email, destinatario, msg.as_string()); server.quit()
+        sec = st.secrets["email"]
+        cfg = {
+            "servidor": str(sec["smtp_server"]).strip(),
+            "porta": int(sec["smtp_port"]),
+            "remetente": str(sec["sender_email"]).strip(),
+            # Sem senha não há LOGIN e starttls = false dispensa TLS (ex.: sink SMTP local).
+            "senha": str(sec.get("sender_password", "") or "").strip().replace(" ", ""),
+            "starttls": str(sec.get("starttls", True)).strip().lower() not in ("0", "false", "nao", "não", "off"),
+        }
+    except Exception as e:
+        return None, f"Erro config: {e}"
+    return cfg, ""
+
+
+def _email_mascarado(endereco: Any) -> str:
+    """``fulano@dominio.com`` → ``fu***@dominio.com`` (logs e dead letter em disco)."""
+    local, arroba, dominio = str(endereco or "").strip().partition("@")
+    return f"{local[:2]}***{arroba}{dominio}" if local else ""
+
+
+class _EmailOutbox:
+    """
+    Fila de envio SMTP servida por um thread daemon com uma sessão autenticada reutilizada
+    entre mensagens (NOOP antes de reaproveitar; fecha após EMAIL_OUTBOX_SESSAO_OCIOSA_S sem
+    tráfego). Falhas transitórias voltam à fila com um "não antes de" (backoff exponencial),
+    sem parar as outras mensagens; autenticação recusada, respostas 5xx ou tentativas
+    esgotadas levam a mensagem para a dead letter (memória e, se configurado, um ficheiro
+    JSON Lines sem o corpo, sem o anexo e com o destinatário mascarado).
+    """
+
+    def __init__(self, caminho_dead_letter: str | None) -> None:
+        self.caminho_dead_letter = caminho_dead_letter
+        self._fila: queue.Queue[str] = queue.Queue()
+        self._lock = threading.Lock()
+        self._mensagens: OrderedDict[str, dict[str, Any]] = OrderedDict()
+        self._conteudos: dict[str, tuple[dict[str, Any], str]] = {}
+        self._concluidas: dict[str, threading.Event] = {}
+        # (instante monotónico a partir do qual repetir, id); só o thread da fila mexe aqui.
+        self._adiadas: list[tuple[float, str]] = []
+        self._thread: threading.Thread | None = None
+        self._smtp: smtplib.SMTP | None = None
+        self._smtp_chave: tuple[Any, ...] | None = None
+        self.dead_letter: deque[dict[str, Any]] = deque(maxlen=EMAIL_OUTBOX_DEAD_LETTER_MAX)
+        self.enviados = 0
+        self.conexoes = 0
+
+    def iniciar(self) -> None:
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._loop, name="dv-email-outbox", daemon=True)
+                self._thread.start()
+
+    def enfileirar(self, cfg: Mapping[str, Any], destinatario: str, msg: MIMEMultipart) -> str:
+        mid = uuid.uuid4().hex
+        agora = time.time()
+        with self._lock:
+            self._mensagens[mid] = {
+                "id": mid,
+                "destinatario": destinatario,
+                "assunto": str(msg["Subject"] or ""),
+                "estado": "na_fila",
+                "tentativas": 0,
+                "erro": None,
+                "criado_em": agora,
+                "atualizado_em": agora,
+            }
+            self._conteudos[mid] = (dict(cfg), msg.as_string())
+            self._concluidas[mid] = threading.Event()
+            self._podar()
+        self._fila.put(mid)
+        self.iniciar()
+        return mid
+
+    def estado(self, mid: str | None) -> dict[str, Any] | None:
+        with self._lock:
+            reg = self._mensagens.get(mid or "")
+            return dict(reg) if reg else None
+
+    def aguardar(self, mid: str, timeout_s: float | None = None) -> dict[str, Any] | None:
+        with self._lock:
+            evt = self._concluidas.get(mid)
+        if evt is not None:
+            evt.wait(timeout_s)
+        return self.estado(mid)
+
+    def resumo(self) -> dict[str, Any]:
+        with self._lock:
+            return {
+                "na_fila": self._fila.qsize() + len(self._adiadas),
+                "adiadas": len(self._adiadas),
+                "enviados": self.enviados,
+                "dead_letter": len(self.dead_letter),
+                "conexoes": self.conexoes,
+                "sessao_aberta": self._smtp is not None,
+            }
+
+    def _podar(self) -> None:
+        """Descarta estados antigos já concluídos (chamar com o lock)."""
+        excesso = len(self._mensagens) - EMAIL_OUTBOX_ESTADOS_MAX
+        for mid in list(self._mensagens):
+            if excesso <= 0:
+                break
+            if mid not in self._conteudos:
+                del self._mensagens[mid]
+                self._concluidas.pop(mid, None)
+                excesso -= 1
+
+    def _atualizar(self, mid: str, **campos: Any) -> None:
+        with self._lock:
+            reg = self._mensagens.get(mid)
+            if reg is not None:
+                reg.update(campos, atualizado_em=time.time())
+
+    def _loop(self) -> None:
+        while True:
+            agora = time.monotonic()
+            while self._adiadas and self._adiadas[0][0] <= agora:
+                self._fila.put(heapq.heappop(self._adiadas)[1])
+            espera = EMAIL_OUTBOX_SESSAO_OCIOSA_S
+            if self._adiadas:
+                espera = min(espera, self._adiadas[0][0] - agora)
+            try:
+                mid = self._fila.get(timeout=espera)
+            except queue.Empty:
+                if not self._adiadas:
+                    self._fechar()
+                continue
+            try:
+                self._processar(mid)
+            except Exception:
+                _sf_logger.exception("Fila de e-mail: falha inesperada ao processar %s", mid)
+                self._concluir(mid, "Erro envio: falha interna da fila de e-mail.")
+
+    def _sessao(self, cfg: Mapping[str, Any]) -> smtplib.SMTP:
+        chave = (cfg["servidor"], cfg["porta"], cfg["remetente"], cfg["senha"], cfg["starttls"])
+        if self._smtp is not None and self._smtp_chave == chave:
+            try:
+                if self._smtp.noop()[0] == 250:
+                    return self._smtp
+            except (smtplib.SMTPException, OSError):
+                pass
+        self._fechar()
+        smtp = smtplib.SMTP(cfg["servidor"], cfg["porta"], timeout=EMAIL_OUTBOX_TIMEOUT_S)
+        try:
+            smtp.ehlo()
+            if cfg["starttls"]:
+                smtp.starttls()
+                smtp.ehlo()
+            if cfg["senha"]:
+                smtp.login(cfg["remetente"], cfg["senha"])
+        except BaseException:
+            smtp.close()
+            raise
+        self._smtp, self._smtp_chave = smtp, chave
+        self.conexoes += 1
+        return smtp
+
+    def _fechar(self) -> None:
+        smtp, self._smtp, self._smtp_chave = self._smtp, None, None
+        if smtp is None:
+            return
+        try:
+            smtp.quit()
+        except (smtplib.SMTPException, OSError):
+            smtp.close()
+
+    def _processar(self, mid: str) -> None:
+        """Uma tentativa; falha transitória reagenda a mensagem em vez de dormir no thread."""
+        with self._lock:
+            cfg, texto = self._conteudos[mid]
+            destinatario = self._mensagens[mid]["destinatario"]
+            tentativa = int(self._mensagens[mid]["tentativas"]) + 1
+        self._atualizar(mid, estado="enviando", tentativas=tentativa)
+        try:
+            self._sessao(cfg).sendmail(cfg["remetente"], [destinatario], texto)
+            self._concluir(mid, None)
+            return
+        except smtplib.SMTPAuthenticationError:
+            self._fechar()
+            self._concluir(mid, "Erro de Autenticacao (535). Verifique Senha de App.")
+            return
+        except smtplib.SMTPRecipientsRefused as e:
+            self._concluir(mid, f"Erro envio: destinatário recusado ({', '.join(e.recipients)})")
+            return
+        except smtplib.SMTPResponseException as e:
+            erro = f"Erro envio: {e}"
+            if 500 <= int(e.smtp_code or 0) < 600:
+                self._concluir(mid, erro)
+                return
+        except (smtplib.SMTPException, OSError) as e:
+            self._fechar()
+            erro = f"Erro envio: {e}"
+        if tentativa >= EMAIL_OUTBOX_TENTATIVAS:
+            self._concluir(mid, erro)
+            return
+        self._atualizar(mid, estado="na_fila", erro=erro)
+        quando = time.monotonic() + EMAIL_OUTBOX_BACKOFF_S * (2 ** (tentativa - 1))
+        heapq.heappush(self._adiadas, (quando, mid))
+
+    def _concluir(self, mid: str, erro: str | None) -> None:
+        with self._lock:
+            self._conteudos.pop(mid, None)
+            reg = self._mensagens.get(mid)
+            if reg is not None:
+                reg.update(estado="falhou" if erro else "enviado", erro=erro, atualizado_em=time.time())
+            if erro is None:
+                self.enviados += 1
+            elif reg is not None:
+                self.dead_letter.append(dict(reg))
+            evt = self._concluidas.get(mid)
+        if evt is not None:
+            evt.set()
+        if erro is None or reg is None:
+            return
+        registro = dict(reg, destinatario=_email_mascarado(reg.get("destinatario")))
+        _sf_logger.warning(
+            "Fila de e-mail: %s para %s foi para a dead letter após %s tentativa(s): %s",
+            mid,
+            registro["destinatario"],
+            registro.get("tentativas"),
+            erro,
+        )
+        if self.caminho_dead_letter:
+            try:
+                with open(self.caminho_dead_letter, "a", encoding="utf-8") as f:
+                    f.write(json.dumps(registro, ensure_ascii=False) + "\n")
+            except OSError:
+                _sf_logger.warning("Fila de e-mail: dead letter não gravada em %s", self.caminho_dead_letter)
+
+
+_EMAIL_OUTBOX: _EmailOutbox | None = None
+_EMAIL_OUTBOX_LOCK = threading.Lock()
+
+
+def _email_outbox() -> _EmailOutbox:
+    global _EMAIL_OUTBOX
+    with _EMAIL_OUTBOX_LOCK:
+        if _EMAIL_OUTBOX is None:
+            caminho = (os.environ.get("DV_EMAIL_DEAD_LETTER_PATH") or "").strip() or str(
+                Path(__file__).resolve().parent / "dv_email_dead_letter.jsonl"
+            )
+            _EMAIL_OUTBOX = _EmailOutbox(None if caminho.lower() in ("0", "off", "false") else caminho)
+        return _EMAIL_OUTBOX
+
+
+def _email_resultado(reg: Mapping[str, Any] | None) -> tuple[bool | None, str]:
+    """(True/False, texto) para envio concluído; (None, texto) enquanto a mensagem está na fila."""
+    estado = (reg or {}).get("estado")
+    if estado == "enviado":
         return True, "E-mail enviado com sucesso!"
-    except smtplib.SMTPAuthenticationError:
-        return False, "Erro de Autenticacao (535). Verifique Senha de App."
-    except Exception as e: return False, f"Erro envio: {e}"
+    if estado == "falhou":
+        return False, str(reg.get("erro") or "Erro envio.")
+    if reg and int(reg.get("tentativas") or 0) > 1:
+        return None, f"E-mail na fila de envio (tentativa {reg['tentativas']} de {EMAIL_OUTBOX_TENTATIVAS})."
+    return None, "E-mail na fila de envio."
+
+
+def enfileirar_email_smtp(destinatario, nome_cliente, pdf_bytes, dados_cliente, tipo='cliente'):
+    """Monta a mensagem no thread do script e entrega-a à fila; devolve (ok, texto, id da mensagem)."""
+    cfg, erro = _email_config_smtp()
+    if cfg is None:
+        return False, erro, None
+    msg = _email_montar_mensagem(destinatario, nome_cliente, pdf_bytes, dados_cliente, tipo, cfg["remetente"])
+    mid = _email_outbox().enfileirar(cfg, destinatario, msg)
+    return True, "E-mail na fila de envio.", mid
+
+
+def enviar_email_smtp(destinatario, nome_cliente, pdf_bytes, dados_cliente, tipo='cliente', espera_s=None):
+    """Envio síncrono sobre a fila: espera o resultado final (ou ``espera_s``) e devolve (ok, texto)."""
+    ok, texto, mid = enfileirar_email_smtp(destinatario, nome_cliente, pdf_bytes, dados_cliente, tipo=tipo)
+    if not ok:
+        return False, texto
+    ok, texto = _email_resultado(_email_outbox().aguardar(mid, espera_s))
+    return bool(ok), texto
+
+
+def _dv_email_estado_render(mid: str) -> None:
+    ok, texto = _email_resultado(_email_outbox().estado(mid))
+    if ok:
+        st.success(texto)
+    elif ok is False:
+        _dv_alerta_vermelho_texto(texto)
+    else:
+        st.info(texto)
+        st.button("Atualizar estado do envio", key=f"dv_email_estado_{mid}")
+
+
+def _dv_email_notificar_pendentes() -> None:
+    """Toast para envios em segundo plano (cópia do corretor) concluídos desde a última execução."""
+    pendentes = st.session_state.get("_dv_email_pendentes") or []
+    if not pendentes:
+        return
+    restantes = []
+    for mid in pendentes:
+        ok, texto = _email_resultado(_email_outbox().estado(mid))
+        if ok:
+            st.toast("Documento PDF enviado para o seu e-mail com sucesso.", icon="📧")
+        elif ok is False:
+            st.toast(f"Falha no envio automático: {texto}", icon="⚠️")
+        elif _email_outbox().estado(mid) is not None:
+            restantes.append(mid)
+    st.session_state["_dv_email_pendentes"] = restantes
 
 
 try:
@@ -7180,7 +8211,7 @@ def show_export_dialog(d):
     )
     if st.button("Enviar e-mail para o cliente", use_container_width=True, key="export_dialog_btn_email"):
         if email and "@" in email:
-            sucesso, msg = enviar_email_smtp(
+            sucesso, msg, _mid_email = enfileirar_email_smtp(
                 email,
                 d.get("nome", "Cliente"),
                 pdf_data,
@@ -7188,11 +8219,14 @@ def show_export_dialog(d):
                 tipo="cliente",
             )
             if sucesso:
-                st.success(msg)
+                st.session_state["_dv_email_cliente_id"] = _mid_email
             else:
                 _dv_alerta_vermelho_texto(str(msg))
         else:
             _dv_alerta_vermelho_texto("E-mail inválido")
+    _mid_email_cli = st.session_state.get("_dv_email_cliente_id")
+    if _mid_email_cli and (_email_outbox().estado(_mid_email_cli) or {}).get("destinatario") == email:
+        _dv_email_estado_render(_mid_email_cli)
 
     st.markdown("---")
     st.markdown("**3. WhatsApp**")
@@ -7539,6 +8573,7 @@ def aba_simulador_automacao(
             "CPF - Classificar Clientes (opcional) (CPF)",
             key="cpf_classificar_clientes_sf",
             placeholder="000.000.000-00",
+            on_change=_dv_sf_cpf_prefetch_on_change,
             help="Informe o CPF com 11 dígitos e clique no botão abaixo para consultar a classificação no Salesforce.",
         )
         cpf_digits = re.sub(r"\D", "", st.session_state.get("cpf_classificar_clientes_sf") or "")
@@ -9286,18 +10321,20 @@ def aba_simulador_automacao(
         if st.button("Concluir e salvar simulação", type="primary", use_container_width=True):
             broker_email = st.session_state.get('user_email')
             if broker_email:
-                with st.spinner("Gerando documento PDF e enviando para o seu e-mail..."):
+                with st.spinner("Gerando documento PDF para o seu e-mail..."):
                     _vc_save = texto_moeda_para_float(st.session_state.get("volta_caixa_key"))
                     pdf_bytes_auto = gerar_resumo_pdf(d, volta_caixa_val=_vc_save)
                     if pdf_bytes_auto:
-                        sucesso_email, msg_email = enviar_email_smtp(
+                        sucesso_email, msg_email, _mid_email = enfileirar_email_smtp(
                             broker_email,
                             d.get("nome", "Cliente"),
                             pdf_bytes_auto,
                             {**d, "volta_caixa_aplicado": _vc_save},
                             tipo="corretor",
                         )
-                        if sucesso_email: st.toast("Documento PDF enviado para o seu e-mail com sucesso.", icon="📧")
+                        if sucesso_email:
+                            st.session_state.setdefault("_dv_email_pendentes", []).append(_mid_email)
+                            st.toast("Documento PDF na fila de envio para o seu e-mail.", icon="📧")
                         else: st.toast(f"Falha no envio automático: {msg_email}", icon="⚠️")
             try:
                 conn_save = st.connection("gsheets", type=GSheetsConnection)
@@ -9570,6 +10607,13 @@ def main():
             _dv_clear_auth_cookies()
             st.rerun()
 
+    # Cópias de e-mail enviadas em segundo plano: avisa quando a fila conclui.
+    _frag_email = getattr(st, "fragment", None)
+    if callable(_frag_email) and st.session_state.get("_dv_email_pendentes"):
+        _frag_email(run_every=timedelta(seconds=2))(_dv_email_notificar_pendentes)()
+    else:
+        _dv_email_notificar_pendentes()
+
     logo_src = html_std.escape(_src_logo_topo_header(), quote=True)
     st.markdown(
         f'''<header class="header-container" role="banner">
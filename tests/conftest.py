@@ -0,0 +1,7 @@
+# -*- coding: utf-8 -*-
+"""Os módulos do app ficam na raiz do repositório (sem pacote instalável)."""
+
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
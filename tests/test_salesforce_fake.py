@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+"""Pipeline de ranking do diresimulator contra o Salesforce falso (sem rede)."""
+
+from __future__ import annotations
+
+import random
+
+import pytest
+
+pytest.importorskip("streamlit")
+pytest.importorskip("simple_salesforce")
+
+import salesforce_fake as sff
+
+_VARIAVEIS = (
+    "SALESFORCE_FAKE",
+    "SALESFORCE_USER",
+    "SALESFORCE_PASSWORD",
+    "DV_STORAGE_BACKEND",
+    "DV_SQLITE_PATH",
+    "DV_RANKING_SQLITE_PATH",
+    "SALESFORCE_META_CACHE_PATH",
+)
+
+
+@pytest.fixture
+def config_rapida(monkeypatch: pytest.MonkeyPatch) -> sff.ConfigFake:
+    # benchmark() grava estas variáveis em os.environ; o monkeypatch repõe-nas no fim.
+    for nome in _VARIAVEIS:
+        monkeypatch.setenv(nome, "")
+    return sff.ConfigFake(latencia_ms=(0.0, 1.0), atraso_ranking_s=0.2, semente=7)
+
+
+def test_benchmark_resolve_todos_os_cpfs(config_rapida: sff.ConfigFake) -> None:
+    rel = sff.benchmark(n_cpfs=6, concorrencia=3, config=config_rapida, esperar_poller_s=15.0)
+    assert sum(rel["status"].values()) == 6
+    assert "error" not in rel["status"]
+    assert rel["poller"]["resolvidos"] == rel["poller"]["pendentes"]
+
+
+def test_pipeline_le_ranking_ja_presente(config_rapida: sff.ConfigFake) -> None:
+    sff.benchmark(n_cpfs=1, concorrencia=1, config=config_rapida, esperar_poller_s=5.0)
+    import diresimulator as dv
+
+    rng = random.Random(11)
+    cpf = next(
+        c
+        for c in (sff.gerar_cpf(rng) for _ in range(100))
+        if sff.ranking_para_cpf(c) in ("DIAMANTE", "OURO", "PRATA")
+    )
+    sff.fake_ativo().semear_conta(cpf, ranking=sff.ranking_para_cpf(cpf))
+    res = dv.classificar_ranking_cpf_pipeline(cpf, bypass_cache=True, create_if_missing=False)
+    assert res["status"] == "ok"
+    assert res["ranking"] == sff.ranking_para_cpf(cpf)
+    assert res["account_id"]